@@ -0,0 +1,110 @@
+"""
+Benchmark per-session history memory.
+
+Builds N live sessions the way the webhook records them and measures the
+heap they hold with tracemalloc:
+
+- before: list of {"role", "content"} dicts per session, a trailing
+  WAITING_FOR_CALLBACK_DETAILS system message on every 10th session, and an
+  unbounded state_history list of transition dicts
+- after:  ConversationHistory (slotted turns + flags) and state_history
+  capped at STATE_HISTORY_MAX_TRANSITIONS
+
+Message strings are shared between both runs so only the container
+overhead is compared (content is the same size either way).
+
+Usage:
+    python benchmark_history_memory.py
+    python benchmark_history_memory.py --sessions 50000 --turns 8 --transitions 30
+"""
+
+import gc
+import logging
+import argparse
+import tracemalloc
+from datetime import datetime
+
+from services.conversation_history import ConversationHistory, HistoryFlag
+from services.state_manager import ConversationSession, ConversationState, TransitionTrigger, MAX_STATE_HISTORY
+
+MESSAGES = [
+    "My QuickBooks keeps freezing when I open the company file",
+    "Please try restarting the QuickBooks Database Server Manager from the server.",
+    "I did that and it's still slow",
+    "Let's check your disk space: open This PC and look at the C: drive.",
+]
+
+
+def transition() -> dict:
+    return {"timestamp": datetime.now().isoformat(), "from": "troubleshooting", "to": "troubleshooting",
+            "trigger": "step_acknowledged"}
+
+
+def build_before(session: int, turns: int, transitions: int):
+    history = []
+    for n in range(turns):
+        history.append({"role": "user", "content": MESSAGES[(2 * n) % len(MESSAGES)]})
+        history.append({"role": "assistant", "content": MESSAGES[(2 * n + 1) % len(MESSAGES)]})
+    if session % 10 == 0:
+        history.append({"role": "system", "content": "WAITING_FOR_CALLBACK_DETAILS"})
+    state_history = [transition() for _ in range(transitions)]
+    return history, state_history
+
+
+def build_after(session: int, turns: int, transitions: int):
+    history = ConversationHistory()
+    for n in range(turns):
+        history.add("user", MESSAGES[(2 * n) % len(MESSAGES)])
+        history.add("assistant", MESSAGES[(2 * n + 1) % len(MESSAGES)])
+    if session % 10 == 0:
+        history.set_flag(HistoryFlag.AWAITING_CALLBACK_DETAILS)
+    session = ConversationSession(f"session-{session:06d}")
+    for _ in range(transitions):
+        session.add_state_transition(
+            ConversationState.TROUBLESHOOTING, ConversationState.TROUBLESHOOTING, TransitionTrigger.STEP_ACKNOWLEDGED
+        )
+    return history, session.state_history
+
+
+def measure(build, sessions: int, turns: int, transitions: int):
+    """Heap bytes per session for the history and for the state_history"""
+    gc.collect()
+    tracemalloc.start()
+    histories = {}
+    for session in range(sessions):
+        histories[f"session-{session:06d}"] = build(session, turns, 0)[0]
+    history_bytes = tracemalloc.get_traced_memory()[0]
+    state = [build(session, 0, transitions)[1] for session in range(sessions)]
+    total_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del histories, state
+    return history_bytes / sessions, (total_bytes - history_bytes) / sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-session history memory")
+    parser.add_argument("--sessions", type=int, default=50_000)
+    parser.add_argument("--turns", type=int, default=8, help="Visitor/bot exchanges per session")
+    parser.add_argument("--transitions", type=int, default=30, help="State transitions per session")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)  # add_state_transition logs every transition
+
+    before = measure(build_before, args.sessions, args.turns, args.transitions)
+    after = measure(build_after, args.sessions, args.turns, args.transitions)
+
+    print("=" * 60)
+    print("HISTORY MEMORY BENCHMARK")
+    print("=" * 60)
+    print(f"\n  Sessions:       {args.sessions:,} ({args.turns} exchanges, {args.transitions} transitions each)")
+    print(f"  {'':16}{'before':>10}{'after':>10}")
+    print(f"  {'history':16}{before[0]:>9.0f}B{after[0]:>9.0f}B  per session")
+    print(f"  {'state_history':16}{before[1]:>9.0f}B{after[1]:>9.0f}B  per session "
+          f"(capped at {MAX_STATE_HISTORY})")
+    total_before, total_after = sum(before), sum(after)
+    print(f"  {'total':16}{total_before:>9.0f}B{total_after:>9.0f}B  "
+          f"({(1 - total_after / total_before) * 100:.0f}% less, "
+          f"{(total_before - total_after) * args.sessions / 1e6:.0f} MB saved at {args.sessions:,} sessions)")
+
+
+if __name__ == "__main__":
+    main()
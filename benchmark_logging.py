@@ -0,0 +1,114 @@
+"""
+Benchmark per-request logging overhead on the event loop.
+
+Replays the log calls one SalesIQ webhook turn makes (INFO lines, DEBUG
+dumps of the payload) against two setups and times the calling thread,
+which in production is the event loop:
+
+- before: root StreamHandler + ContextualFormatter, f-string messages
+  (DEBUG dumps are built even though DEBUG is off), formatted and written
+  synchronously
+- after:  log_pipeline (ContextQueueHandler + listener thread, JSON lines),
+  %-style arguments for the DEBUG dumps
+
+Output goes to /dev/null so only formatting and handler overhead is
+measured. "drain" is the listener thread's time to write everything queued.
+
+Usage:
+    python benchmark_logging.py
+    python benchmark_logging.py --requests 5000 --info-lines 40
+"""
+
+import os
+import time
+import logging
+import argparse
+
+from services.log_pipeline import TEXT_FORMAT, ContextualFormatter, log_pipeline
+from services.tracing import bind_session, request_id_var
+
+PAYLOAD = {
+    "visitor": {"name": "Jordan", "email": "jordan@example.com", "phone": "+1 555 0100",
+                "active_conversation_id": "2782000012345678", "info": {"browser": "Chrome", "os": "Windows"}},
+    "chat": {"id": "2782000012345678", "channel": "website", "department": "Support"},
+    "conversation": {"id": "2782000012345678", "created_time": "1718000000000"},
+    "message": {"text": "My QuickBooks keeps freezing when I open the company file"},
+    "payload": "",
+}
+
+
+def turn_before(logger: logging.Logger, request: dict, info_lines: int):
+    logger.info(f"[SalesIQ] Webhook received")
+    logger.info(f"[SalesIQ] Request keys: {list(request.keys())}")
+    logger.debug(f"[SalesIQ] Full request payload: {request}")
+    logger.debug(f"[SalesIQ] Visitor data: {request['visitor']}")
+    logger.debug(f"[SalesIQ] Chat data: {request['chat']}")
+    logger.debug(f"[SalesIQ] Conversation data: {request['conversation']}")
+    for n in range(info_lines):
+        logger.info(f"[SalesIQ] Step {n}: message={request['message']['text'][:100]}")
+
+
+def turn_after(logger: logging.Logger, request: dict, info_lines: int):
+    logger.info("[SalesIQ] Webhook received")
+    logger.info("[SalesIQ] Request keys: %s", list(request))
+    logger.debug("[SalesIQ] Full request payload: %s", request)
+    logger.debug("[SalesIQ] Visitor data: %s", request["visitor"])
+    logger.debug("[SalesIQ] Chat data: %s", request["chat"])
+    logger.debug("[SalesIQ] Conversation data: %s", request["conversation"])
+    for n in range(info_lines):
+        logger.info(f"[SalesIQ] Step {n}: message={request['message']['text'][:100]}")
+
+
+def run(turn, logger: logging.Logger, requests: int, info_lines: int):
+    """(CPU seconds of the calling thread, wall seconds) spent logging, per request
+
+    CPU time excludes the listener thread; wall time includes waiting for the
+    GIL while the listener formats, which an idle event loop would not see.
+    """
+    started, cpu_started = time.perf_counter(), time.thread_time()
+    for n in range(requests):
+        request_id_var.set(f"req-{n}")
+        bind_session(f"session-{n % 500}")
+        turn(logger, PAYLOAD, info_lines)
+    return (time.thread_time() - cpu_started) / requests, (time.perf_counter() - started) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-request logging overhead")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--info-lines", type=int, default=30, help="INFO lines per webhook turn")
+    args = parser.parse_args()
+    devnull = open(os.devnull, "w")
+    root = logging.getLogger()
+    logger = logging.getLogger("llm_chatbot")
+
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(ContextualFormatter(TEXT_FORMAT))
+    root.handlers = [handler]
+    root.setLevel(logging.INFO)
+    before = run(turn_before, logger, args.requests, args.info_lines)
+
+    # Room for every record, so none are dropped and the comparison is like for like
+    os.environ["LOG_QUEUE_SIZE"] = str(args.requests * (args.info_lines + 2) + 1)
+    os.environ["LOG_FORMAT"] = "json"
+    log_pipeline.configure(stream=devnull)
+    after = run(turn_after, logger, args.requests, args.info_lines)
+    drain_started = time.perf_counter()
+    log_pipeline.stop()
+    drain = time.perf_counter() - drain_started
+
+    lines = args.info_lines + 2
+    print("=" * 60)
+    print("LOGGING OVERHEAD BENCHMARK")
+    print("=" * 60)
+    print(f"\n  Requests:   {args.requests:,} ({lines} INFO + 4 DEBUG calls each, DEBUG disabled)")
+    print(f"  {'':12}{'loop CPU':>12}{'wall':>12}")
+    print(f"  {'before':12}{before[0] * 1e6:>9.1f} µs{before[1] * 1e6:>9.1f} µs  per request (sync text formatter)")
+    print(f"  {'after':12}{after[0] * 1e6:>9.1f} µs{after[1] * 1e6:>9.1f} µs  per request (queue handler)")
+    print(f"  drain:      {drain * 1e3:8.1f} ms for the listener thread to write the remaining queue")
+    print(f"  dropped:    {log_pipeline.handler.dropped:,} records (queue full)")
+    print(f"\n  {(1 - after[0] / before[0]) * 100:.0f}% less logging CPU per request on the event loop")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Benchmark session rehydration after a restart.
+
+Builds N synthetic in-flight sessions (history, SalesIQ conversation ID,
+state machine session, conversation metric and token budget entry), writes
+them through the write-behind log, compacts them into a snapshot plus a
+tail of newer log records, then times a fresh process rehydrating them:
+
+- ready: index built, turns can be served (sessions decode on first use)
+- first-use decode: cost of ensure_loaded() for one session
+- full decode: every session decoded (done by the background loader)
+
+Also reports how long each write-behind flush held the event loop.
+
+Usage:
+    python benchmark_session_persistence.py
+    python benchmark_session_persistence.py --sessions 10000 100000 --turns 6
+"""
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import OrderedDict
+
+from services.session_store import Codec, SessionStore, JSON_CODEC
+from services.conversation_history import ConversationHistory
+from services.session_persistence import LOAD_BATCH_SIZE, SessionPersistence, compact
+from services.state_manager import ConversationSession, ConversationState
+from services.metrics import ConversationMetric
+from services.token_budget import SessionBudget
+
+MESSAGES = [
+    "My QuickBooks keeps freezing when I open the company file",
+    "Please try restarting the QuickBooks Database Server Manager from the server.",
+    "I did that and it's still slow",
+    "Let's check your disk space: open This PC and look at the C: drive.",
+    "It says 2 GB free",
+    "That's low - please delete temporary files from C:\\Windows\\Temp and try again.",
+]
+
+
+def build_store() -> SessionStore:
+    """Fresh in-memory store with the same namespaces and codecs as the app"""
+    store = SessionStore()
+    store.mapping("conversations", Codec(ConversationHistory.to_dict, ConversationHistory.from_dict))
+    store.mapping("conversation_ids", JSON_CODEC)
+    store.mapping("state_sessions", Codec(ConversationSession.to_dict, ConversationSession.from_dict))
+    store.mapping("metrics_conversations", Codec(ConversationMetric.to_dict, ConversationMetric.from_dict))
+    store.mapping("token_budget", Codec(SessionBudget.to_dict, SessionBudget.from_dict), factory=OrderedDict)
+    return store
+
+
+def populate(store: SessionStore, sessions: int, turns: int):
+    mappings = {namespace: mapping for namespace, (mapping, _) in store.mappings.items()}
+    for i in range(sessions):
+        session_id = f"session-{i:07d}"
+        history = mappings["conversations"][session_id] = ConversationHistory()
+        for n in range(turns * 2):
+            history.add("user" if n % 2 == 0 else "assistant", MESSAGES[n % len(MESSAGES)])
+        mappings["conversation_ids"][session_id] = f"conv-{random.getrandbits(48):012x}"
+        mappings["state_sessions"][session_id] = ConversationSession(
+            session_id, state=ConversationState.TROUBLESHOOTING, category="quickbooks", message_count=turns
+        )
+        mappings["metrics_conversations"][session_id] = ConversationMetric(
+            session_id, "quickbooks", started_at=mappings["state_sessions"][session_id].created_at,
+            message_count=turns, llm_calls=turns, llm_tokens_used=turns * 1500
+        )
+        mappings["token_budget"][session_id] = SessionBudget(used=turns * 1500)
+
+
+async def write_log(persistence: SessionPersistence, session_ids, batch: int):
+    """Push sessions through the write-behind path in flush-sized batches"""
+    persistence._write_lock = asyncio.Lock()
+    flush_ms = []
+    for start in range(0, len(session_ids), batch):
+        persistence.dirty.update(session_ids[start:start + batch])
+        await persistence.flush()
+        flush_ms.append(persistence.stats["last_flush_ms"])
+    return flush_ms
+
+
+def run(sessions: int, turns: int, tail_share: float):
+    with tempfile.TemporaryDirectory() as directory:
+        source = build_store()
+        populate(source, sessions, turns)
+        persistence = SessionPersistence(source, directory)
+        persistence.enabled = True
+        session_ids = sorted(source.mappings["conversations"][0])
+
+        # Everything goes through the log, most of it then compacted into the snapshot
+        persistence.segment = 1
+        flush_ms = asyncio.run(write_log(persistence, session_ids, batch=50))
+        started = time.perf_counter()
+        compact(directory, up_to_segment=1)
+        compact_seconds = time.perf_counter() - started
+
+        # Sessions updated since the last snapshot are replayed from the log tail
+        tail = session_ids[:int(len(session_ids) * tail_share)]
+        persistence.segment = 2
+        asyncio.run(write_log(persistence, tail, batch=50))
+
+        snapshot_mb = os.path.getsize(os.path.join(directory, "snapshot.jsonl")) / 1e6
+        restored = SessionPersistence(build_store(), directory)
+        restored.enabled = True
+        count = restored.rehydrate()
+        assert count == sessions, (count, sessions)
+
+        sample = random.sample(session_ids, 100)
+        started = time.perf_counter()
+        for session_id in sample:
+            restored.ensure_loaded(session_id)
+        first_use_us = (time.perf_counter() - started) / len(sample) * 1e6
+
+        started = time.perf_counter()
+        restored.load_all()
+        full_decode_seconds = time.perf_counter() - started
+        conversations = restored.store.mappings["conversations"][0]
+        assert len(conversations) == sessions
+        assert conversations[session_ids[0]] == source.mappings["conversations"][0][session_ids[0]]
+
+        flush_ms.sort()
+        print(f"\n  Sessions:            {sessions:,} ({turns} turns each)")
+        print(f"  Snapshot size:       {snapshot_mb:.1f} MB (+ {len(tail):,} sessions in log tail)")
+        print(f"  Compaction:          {compact_seconds:.2f}s (runs in a subprocess)")
+        print(f"  Flush (50 sessions): p50 {flush_ms[len(flush_ms) // 2]:.2f}ms, "
+              f"max {flush_ms[-1]:.2f}ms of event loop time")
+        print(f"  Ready to serve:      {restored.stats['rehydrate_ready_ms']:.0f}ms (index only)")
+        print(f"  First-use decode:    {first_use_us:.0f}µs per session")
+        print(f"  Full decode:         {full_decode_seconds * 1000:.0f}ms (background loader, yields every "
+              f"{LOAD_BATCH_SIZE} sessions)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark session rehydration time")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--turns", type=int, default=4, help="Visitor/bot exchanges per session")
+    parser.add_argument("--tail-share", type=float, default=0.1,
+                        help="Share of sessions updated since the last snapshot")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("SESSION REHYDRATION BENCHMARK")
+    print("=" * 60)
+    for sessions in args.sessions:
+        run(sessions, args.turns, args.tail_share)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Rebuild the local KB retrieval index.
+
+Run this whenever config/prompts/expert_system_prompt.txt changes:
+
+    python build_kb_index.py            # rebuild config/prompts/kb_index.json
+    python build_kb_index.py --check    # exit 1 if the saved index is stale
+    python build_kb_index.py --query "quickbooks error 6177"
+"""
+
+import os
+import sys
+import argparse
+
+from services.kb_index import (
+    PROMPT_PATH,
+    INDEX_PATH,
+    KBIndex,
+    split_prompt,
+    prompt_hash
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the KB retrieval index from the expert prompt")
+    parser.add_argument("--prompt", default=PROMPT_PATH, help="Path to expert_system_prompt.txt")
+    parser.add_argument("--output", default=INDEX_PATH, help="Path to write kb_index.json")
+    parser.add_argument("--check", action="store_true", help="Only check whether the saved index is current")
+    parser.add_argument("--query", help="Run a test query against the rebuilt index")
+    args = parser.parse_args()
+
+    with open(args.prompt, "r", encoding="utf-8") as f:
+        prompt_text = f.read()
+    current_hash = prompt_hash(prompt_text)
+
+    if args.check:
+        if not os.path.exists(args.output):
+            print(f"[STALE] {args.output} does not exist")
+            sys.exit(1)
+        saved = KBIndex.load(args.output)
+        if saved.source_hash != current_hash:
+            print(f"[STALE] {args.output} was built from a different prompt - run: python build_kb_index.py")
+            sys.exit(1)
+        print(f"[OK] {args.output} is current ({len(saved.articles)} articles)")
+        return
+
+    core_prompt, articles = split_prompt(prompt_text)
+    index = KBIndex.build(articles, current_hash)
+    index.save(args.output)
+
+    print("=" * 60)
+    print("KB INDEX REBUILT")
+    print("=" * 60)
+    print(f"  Articles:    {len(articles)}")
+    print(f"  Vocabulary:  {len(index.vocabulary)} terms")
+    print(f"  Full prompt: {len(prompt_text):,} chars")
+    print(f"  Core prompt: {len(core_prompt):,} chars")
+    print(f"  Output:      {args.output}")
+
+    if args.query:
+        print(f"\nQuery: {args.query}")
+        for article, score in index.search([(args.query, 1.0)], top_k=5):
+            print(f"  {score:6.2f}  {article.title}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,12 @@ Ace Cloud Hosting LLM Chatbot v3.0 - OpenRouter Edition
 """
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 import os
+import time
 import asyncio
 from dotenv import load_dotenv
 import urllib3
@@ -17,7 +18,7 @@ import logging
 import traceback
 import uuid
 import json
-from contextvars import ContextVar
+import hashlib
 
 # Import IssueRouter for category classification
 from services.router import IssueRouter
@@ -45,93 +46,95 @@ from services.gemini_classifier import (
     classify_resolution,
     classify_escalation,
     classify_intent,
-    ClassificationResult
+    ClassificationResult,
+    TurnClassification
 )
 from services.gemini_generator import gemini_generator
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# Speculative generation: overlap response generation with classification
+from services.speculation import speculation_tracker
 
-load_dotenv()
+# Rolling summaries keep long conversations within the history token budget
+from services.history_compactor import history_compactor
 
-# Context variable for request ID tracking
-request_id_var: ContextVar[str] = ContextVar('request_id', default='no-request-id')
-session_id_var: ContextVar[str] = ContextVar('session_id', default='no-session-id')
+# Local KB retrieval: send only the relevant KB articles each turn
+from services.kb_index import kb_retriever
 
-# Custom log formatter with request ID and session ID
-class ContextualFormatter(logging.Formatter):
-    """Custom formatter that includes request_id and session_id in logs"""
-    
-    def format(self, record):
-        # Add contextual information to log record
-        record.request_id = request_id_var.get()
-        record.session_id = session_id_var.get()
-        return super().format(record)
-
-# Configure enhanced logging with request tracking
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] [req:%(request_id)s] [session:%(session_id)s] %(name)s - %(message)s',
-    handlers=[
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
+# Local fast-path classifier (answers confident turns without an LLM call)
+from services.fast_classifier import fast_classifier
+
+# Shared per-session token budget (degrades to cheaper paths as it is spent)
+from services.token_budget import token_budget
+
+# Durable SQLite outbox for post-reply Zoho side effects
+from services.outbox import outbox
+
+# Per-session turn ordering and redelivered-webhook de-duplication
+from services.session_coordinator import session_locks, reply_cache
+
+# End-to-end request deadlines with canned fallback replies
+from services.deadline import deadline_tracker, DeadlineExceeded, canned_reply
+
+# Session state backend (memory, or SQLite/Redis shared by several workers)
+from services.session_store import Codec, session_store
+
+# Compact per-session history (slotted turns, flags instead of marker messages)
+from services.conversation_history import ConversationHistory, HistoryFlag, salesiq_past_messages
+
+# Write-behind log + snapshots so in-memory sessions survive restarts
+from services.session_persistence import session_persistence
+
+# Idle sessions expire in deadline order, tearing down all per-session state
+from services.session_expiry import session_expiry
+
+# Prometheus exposition: request/stage latency histograms, LLM usage counters
+from services.prometheus_exporter import prometheus_exporter
+from services.llm_client import llm_limiter
 
-# Apply custom formatter to all handlers
-for handler in logging.getLogger().handlers:
-    handler.setFormatter(ContextualFormatter(
-        '%(asctime)s [%(levelname)s] [req:%(request_id)s] [session:%(session_id)s] %(name)s - %(message)s'
-    ))
+# Per-request trace spans, correlated with the request ID in every log line
+from services.tracing import tracer, request_id_var, bind_session
 
-# Error alerting configuration
-ERROR_ALERT_WEBHOOK = os.getenv("ERROR_ALERT_WEBHOOK", None)
-ERROR_ALERT_THRESHOLD = 3  # Alert after 3 errors in a window
-error_counts: Dict[str, int] = {}
+# Per-call LLM token and cost ledger (input/cached/output, priced per model)
+from services.usage_ledger import usage_ledger
+
+# Guarded on-demand sampling / cProfile profiler
+from services.profiler import profiler, ProfilerBusy, SORT_KEYS as PROFILE_SORT_KEYS
+
+# Event-loop lag heartbeat + stack capture for blocking calls
+from services.loop_watchdog import loop_watchdog
+
+# Queue-backed structured logging (QueueHandler + listener thread)
+from services.log_pipeline import log_pipeline
+
+# Error alerts buffered by type and sent as rate-limited summaries in the background
+from services.alerting import alert_aggregator
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+load_dotenv()
+
+# Configure logging with request tracking: records carry request_id/session_id and are
+# formatted (JSON lines by default) and written by a listener thread, off the event loop
+log_pipeline.configure()
+logger = logging.getLogger(__name__)
 
 def send_critical_alert(error_type: str, error_message: str, context: dict = None):
-    """Send critical error alert to monitoring service"""
-    try:
-        alert_data = {
-            "timestamp": datetime.now().isoformat(),
-            "severity": "CRITICAL",
-            "error_type": error_type,
-            "message": error_message,
-            "context": context or {},
-            "service": "llm-chatbot",
-            "request_id": request_id_var.get()
-        }
-        
-        # Log structured alert
-        logger.critical(f"ALERT: {error_type} - {error_message}", extra={"alert_data": json.dumps(alert_data)})
-        
-        # Send to external webhook if configured
-        if ERROR_ALERT_WEBHOOK:
-            import requests
-            requests.post(
-                ERROR_ALERT_WEBHOOK,
-                json=alert_data,
-                timeout=5,
-                verify=False
-            )
-            logger.info(f"Alert sent to webhook for {error_type}")
-    except Exception as e:
-        logger.error(f"Failed to send alert: {e}")
+    """Log a critical error and queue it for the next alert summary (sent in the background)"""
+    alert_data = {
+        "timestamp": datetime.now().isoformat(),
+        "severity": "CRITICAL",
+        "error_type": error_type,
+        "message": error_message,
+        "context": context or {},
+        "service": "llm-chatbot",
+        "request_id": request_id_var.get()
+    }
+    logger.critical(f"ALERT: {error_type} - {error_message}", extra={"alert_data": json.dumps(alert_data)})
+    alert_aggregator.record(error_type, error_message, context, critical=True)
 
 def track_error(error_type: str, error_message: str, context: dict = None):
-    """Track errors and send alerts when threshold is exceeded"""
-    global error_counts
-    
-    # Increment error count
-    error_counts[error_type] = error_counts.get(error_type, 0) + 1
-    
-    # Send alert if threshold exceeded
-    if error_counts[error_type] >= ERROR_ALERT_THRESHOLD:
-        send_critical_alert(
-            error_type,
-            f"{error_message} (occurred {error_counts[error_type]} times)",
-            context
-        )
-        error_counts[error_type] = 0  # Reset counter
+    """Buffer an error; types past ALERT_THRESHOLD are alerted in the next deduplicated summary"""
+    alert_aggregator.record(error_type, error_message, context)
 
 app = FastAPI(title="Ace Cloud Hosting Support Bot - Gemini", version="3.0.0")
 
@@ -163,17 +166,38 @@ logger.info("StateManager ready for conversation tracking")
 # HandlerRegistry is already initialized as a global singleton
 logger.info(f"HandlerRegistry ready with {len(handler_registry.handlers)} handlers")
 
-conversations: Dict[str, List[Dict]] = {}
+# Conversation history per session (shared across workers with an external session store)
+conversations: Dict[str, ConversationHistory] = session_store.mapping(
+    "conversations", Codec(ConversationHistory.to_dict, ConversationHistory.from_dict)
+)
 
 # Store SalesIQ conversation IDs for API operations (close, transfer, etc.)
 # Maps internal session_id -> salesiq_conversation_id
-conversation_id_map: Dict[str, str] = {}
+conversation_id_map: Dict[str, str] = session_store.mapping("conversation_ids")
+
+# Gauges are read from their owners at scrape time
+prometheus_exporter.register_gauge("chatbot_live_sessions", "Sessions with history in memory",
+                                   lambda: len(conversations))
+prometheus_exporter.register_gauge("chatbot_active_session_locks", "Sessions with a turn in flight or queued",
+                                   lambda: session_locks.get_stats()["active_sessions"])
+prometheus_exporter.register_gauge("chatbot_llm_in_flight", "LLM calls holding a concurrency slot",
+                                   lambda: llm_limiter.in_flight)
+prometheus_exporter.register_gauge("chatbot_llm_waiting", "LLM calls waiting for a concurrency slot",
+                                   lambda: llm_limiter.waiting)
+prometheus_exporter.register_gauge("chatbot_outbox_jobs", "Outbox jobs by status",
+                                   lambda: {(status,): count for status, count in
+                                            outbox.get_stats().get("jobs_by_status", {}).items()},
+                                   ("status",))
+prometheus_exporter.register_gauge("chatbot_persistence_dirty_sessions", "Sessions changed since the last flush",
+                                   lambda: len(session_persistence.dirty))
+prometheus_exporter.register_gauge("chatbot_expiry_scheduled_sessions", "Sessions scheduled for idle expiry",
+                                   lambda: session_expiry.get_stats()["scheduled_sessions"])
 
 # Fallback API class for when real API is not available
 class FallbackAPI:
     def __init__(self):
         self.enabled = False
-    def create_chat_session(self, visitor_id, conversation_history=None, past_messages=None):
+    def create_chat_session(self, visitor_id, conversation_history=None, past_messages=None, **kwargs):
         logger.info(f"[API] Fallback: Simulating chat transfer for {visitor_id}")
         if past_messages:
             logger.info(f"[API] Fallback: Would transfer {len(past_messages)} messages")
@@ -187,6 +211,15 @@ class FallbackAPI:
     def create_support_ticket(self, *args, **kwargs):
         logger.info("[API] Fallback: Simulating support ticket creation")
         return {"success": True, "simulated": True, "ticket_number": "TK-SIM-001"}
+    # Async variants (same contract as zoho_api_simple)
+    async def create_chat_session_async(self, *args, **kwargs):
+        return self.create_chat_session(*args, **kwargs)
+    async def close_chat_async(self, *args, **kwargs):
+        return self.close_chat(*args, **kwargs)
+    async def create_callback_ticket_async(self, *args, **kwargs):
+        return self.create_callback_ticket(*args, **kwargs)
+    async def create_support_ticket_async(self, *args, **kwargs):
+        return self.create_support_ticket(*args, **kwargs)
 
 # Load Zoho API integration with proper error handling
 try:
@@ -204,51 +237,123 @@ except Exception as e:
     desk_api = FallbackAPI()
 
 
-# Background cleanup job
-async def cleanup_stale_sessions():
-    """Background task to cleanup stale conversations every 15 minutes"""
-    while True:
+async def run_callback_job(session_id: str, close_reason: str = "callback_scheduled", **ticket) -> Dict:
+    """Create a callback ticket, then close the chat once the ticket exists"""
+    api_result = await desk_api.create_callback_ticket_async(**ticket)
+    logger.info(f"[Desk] Callback call result: {api_result}")
+    if api_result.get("success"):
+        close_result = await salesiq_api.close_chat_async(session_id, close_reason)
+        logger.info(f"[SalesIQ] Chat closure result: {close_result}")
+    return api_result
+
+async def run_ticket_job(session_id: str, close_reason: str = "ticket_created", **ticket) -> Dict:
+    """Create a support ticket, then close the chat once the ticket exists"""
+    api_result = await desk_api.create_support_ticket_async(**ticket)
+    logger.info(f"[Desk] Ticket call result: {api_result}")
+    if api_result.get("success"):
+        close_result = await salesiq_api.close_chat_async(session_id, close_reason)
+        logger.info(f"[SalesIQ] Chat closure result: {close_result}")
+    return api_result
+
+# Post-reply Zoho side effects, run by the outbox worker
+SIDE_EFFECT_HANDLERS = {
+    "salesiq.transfer": lambda **payload: salesiq_api.create_chat_session_async(**payload),
+    "salesiq.close_chat": lambda session_id, reason="resolved": salesiq_api.close_chat_async(session_id, reason),
+    "desk.callback": run_callback_job,
+    "desk.support_ticket": run_ticket_job,
+}
+for _job_type, _handler in SIDE_EFFECT_HANDLERS.items():
+    outbox.register(_job_type, _handler)
+
+# Replies for callbacks that were queued (not yet created) or could not be created
+CALLBACK_RECEIVED_REPLY = (
+    "Thank you! I've received your callback request and passed it to our team. "
+    "You'll get a confirmation email once it's scheduled - if you don't hear from us, "
+    "please call 1-888-415-5240."
+)
+CALLBACK_FAILED_REPLY = (
+    "I got your details, but I couldn't create the callback in our system right now. "
+    "Please call our support team at 1-888-415-5240 for immediate help."
+)
+
+def side_effect_key(kind: str, session_id: str, message_text: str) -> str:
+    """Idempotency key for a side effect triggered by one visitor message
+
+    A redelivered webhook carries the same session and text, so it maps to
+    the same key and the outbox drops the duplicate.
+    """
+    digest = hashlib.sha1(message_text.encode("utf-8")).hexdigest()[:16]
+    return f"{kind}:{session_id}:{digest}"
+
+async def dispatch_side_effect(job_type: str, idempotency_key: str, **payload) -> Dict:
+    """Queue a Zoho side effect so the reply can be returned immediately
+
+    Falls back to running the side effect inline when the outbox is
+    disabled or the job cannot be persisted.
+
+    Returns:
+        Zoho result dict, or {"success": True, "queued": True, ...} once queued
+        (or already queued). A queued side effect has not happened yet - replies
+        should say the request was received, not that it was done.
+    """
+    if outbox.enabled:
         try:
-            await asyncio.sleep(15 * 60)  # Run every 15 minutes
-            
-            logger.info("[Cleanup] Starting stale session cleanup...")
-            
-            # Cleanup state manager sessions
-            state_manager.cleanup_stale_sessions(timeout_minutes=30)
-            
-            # Cleanup in-memory conversations that match stale sessions
-            stale_count = 0
-            sessions_to_remove = []
-            
-            for session_id in list(conversations.keys()):
-                session = state_manager.get_session(session_id)
-                if not session or session.is_stale(timeout_minutes=30):
-                    sessions_to_remove.append(session_id)
-            
-            for session_id in sessions_to_remove:
-                if session_id in conversations:
-                    metrics_collector.end_conversation(session_id, "abandoned")
-                    del conversations[session_id]
-                    stale_count += 1
-            
-            if stale_count > 0:
-                logger.info(f"[Cleanup] Removed {stale_count} stale conversations")
-            else:
-                logger.debug("[Cleanup] No stale conversations found")
-                
+            job_id = outbox.enqueue(job_type, payload, idempotency_key)
+            return {"success": True, "queued": True, "job_id": job_id, "duplicate": job_id is None}
         except Exception as e:
-            logger.error(f"[Cleanup] Error in cleanup job: {e}", exc_info=True)
+            logger.error(f"[Outbox] Could not queue {job_type} - running inline: {e}")
+    return await deadline_tracker.run("zoho", SIDE_EFFECT_HANDLERS[job_type](**payload))
+
+def side_effect_failed(job: Dict):
+    """Alert on a queued side effect the outbox gave up on (the visitor was told it was received)"""
+    # Contact details and IDs only - the conversation history stays in the outbox row
+    context = {
+        key: value for key, value in job["payload"].items()
+        if key not in ("conversation_history", "past_messages", "description")
+    }
+    context.update(job_id=job["id"], idempotency_key=job["idempotency_key"])
+    send_critical_alert(
+        "outbox_job_failed",
+        f"{job['job_type']} failed after {job['attempts']} attempt(s) - follow up with the visitor: {job['error']}",
+        context
+    )
 
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize background tasks on startup"""
+    # Index sessions saved before the last restart before serving any turn
+    # (each is decoded on first use or by the background loader)
+    session_persistence.rehydrate()
+    session_persistence.start()
+    
     logger.info("Starting background tasks...")
-    asyncio.create_task(cleanup_stale_sessions())
-    logger.info("✓ Cleanup job started (runs every 15 minutes)")
+    session_expiry.schedule_existing(set(session_persistence.pending) | set(session_expiry.last_activity))
+    session_expiry.start(expire_session, is_busy=session_locks.is_active)
+    outbox.start(on_failure=side_effect_failed)
+    tracer.start()
+    loop_watchdog.start()
+    alert_aggregator.start()
     salesiq_api = FallbackAPI()
     desk_api = FallbackAPI()
 
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the outbox worker, flush persisted sessions and logs, and close pooled Zoho connections"""
+    await outbox.stop()
+    await tracer.stop()
+    fast_classifier.close_decision_log()
+    await loop_watchdog.stop()
+    await alert_aggregator.stop()
+    await session_expiry.stop()
+    await session_persistence.stop()
+    try:
+        from zoho_api_simple import zoho_http_pool
+        await zoho_http_pool.aclose()
+    except Exception as e:
+        logger.warning(f"[Shutdown] Could not close Zoho connection pools: {e}")
+
 class Message(BaseModel):
     role: str
     content: str
@@ -278,55 +383,63 @@ def build_past_messages(history: List[Dict]) -> List[Dict]:
     """Build past_messages array for SalesIQ API according to their format
     
     Args:
-        history: Conversation history in OpenAI format [{"role": "user/assistant", "content": "..."}]
+        history: Conversation history (ConversationHistory or [{"role": "user/assistant", "content": "..."}])
     
     Returns:
         List of message dicts in SalesIQ format:
         [{"sender_type": "visitor/bot", "sender_name": "...", "time": timestamp, "text": "..."}]
     """
-    from datetime import datetime, timezone
-    import time
-    
-    past_messages = []
-    
-    for idx, msg in enumerate(history):
-        role = msg.get('role', 'user')
-        content = msg.get('content', '')
-        
-        # Skip system messages
-        if role == 'system':
-            continue
-        
-        # Map role to SalesIQ sender_type
-        if role == 'user':
-            sender_type = "visitor"
-            sender_name = "Customer"
-        elif role == 'assistant':
-            sender_type = "bot"
-            sender_name = "AceBuddy"
-        else:
-            continue
-        
-        # Generate timestamp (current time minus message age for sequential ordering)
-        # More recent messages = higher timestamp
-        timestamp_ms = int((time.time() - (len(history) - idx) * 5) * 1000)
-        
-        message_obj = {
-            "sender_type": sender_type,
-            "sender_name": sender_name,
-            "time": timestamp_ms,
-            "text": content
-        }
-        
-        past_messages.append(message_obj)
-    
-    return past_messages
+    return list(salesiq_past_messages(history))
 
 # Load prompt on startup
 EXPERT_PROMPT = load_expert_prompt()
 logger.info(f"Expert prompt loaded successfully ({len(EXPERT_PROMPT)} characters)")
 
-def generate_response(message: str, history: List[Dict], category: str = "other") -> str:
+# Canned reply once a session has spent its whole LLM token budget
+BUDGET_EXHAUSTED_RESPONSE = (
+    "To make sure you get the best help with this, I'd like to bring in our support team. "
+    "You can reach them directly:\n\n"
+    "📞 Phone: 1-888-415-5240 (24/7)\n"
+    "📧 Email: support@acecloudhosting.com"
+)
+
+def release_session_resources(session_id: str):
+    """Drop per-session LLM state (history summary, token budget) when a conversation ends"""
+    history_compactor.clear(session_id)
+    token_budget.release(session_id)
+    session_persistence.mark_dirty(session_id)
+
+def expire_session(session_id: str):
+    """Tear down every per-session structure of an idle session
+    
+    Runs without awaiting, so no turn for the session can interleave. The
+    SalesIQ conversation ID is only dropped here (not when a conversation
+    ends) because queued close/transfer jobs still look it up.
+    """
+    session_persistence.ensure_loaded(session_id)
+    with session_store.unit_of_work():
+        metrics_collector.end_conversation(session_id, "abandoned")  # No-op if it already ended
+        conversations.pop(session_id, None)
+        conversation_id_map.pop(session_id, None)
+        state_manager.remove_session(session_id)
+        release_session_resources(session_id)
+
+def build_generation_prompt(message: str, history: List[Dict], category: str = "other") -> Tuple[str, Optional[str]]:
+    """Get the system prompt and per-turn KB context for a generation call
+    
+    With KB retrieval enabled, the core rules (expert prompt minus the KB
+    block) stay the cacheable system prompt and only the top-k relevant KB
+    articles are sent alongside it. Otherwise the full expert prompt is sent.
+    
+    Returns:
+        Tuple of (system_prompt, kb_context or None)
+    """
+    if kb_retriever.enabled:
+        return kb_retriever.core_prompt, kb_retriever.build_context(message, history, category)
+    return EXPERT_PROMPT, None
+
+async def generate_response(message: str, history: List[Dict], category: str = "other",
+                            session_id: Optional[str] = None) -> str:
     """Generate response using Gemini with FULL conversation context
     
     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -343,18 +456,28 @@ def generate_response(message: str, history: List[Dict], category: str = "other"
         message: User message text
         history: FULL conversation history (no truncation!)
         category: Issue category from IssueRouter
+        session_id: Session identifier (enables history compaction past the token budget)
     
     Returns:
         Tuple of (response_text, tokens_used)
     """
     
-    # Use Gemini generator with full history
+    # Session spent its whole token budget - no more LLM calls
+    if token_budget.is_exhausted(session_id):
+        token_budget.record_degraded_turn(token_budget.level(session_id))
+        logger.warning(f"[Token Budget] Budget exhausted - returning canned escalation")
+        return BUDGET_EXHAUSTED_RESPONSE, 0
+    
+    # Use Gemini generator with full history (non-blocking - keeps the event loop free)
     if gemini_generator:
-        response_text, tokens_used = gemini_generator.generate_response(
+        system_prompt, kb_context = build_generation_prompt(message, history, category)
+        response_text, tokens_used = await gemini_generator.generate_response_async(
             message=message,
             history=history,  # FULL history - no truncation!
-            system_prompt=EXPERT_PROMPT,
-            category=category
+            system_prompt=system_prompt,
+            category=category,
+            session_id=session_id,
+            kb_context=kb_context
         )
         
         logger.info(f"[Gemini] Response generated: {len(response_text)} chars, ~{tokens_used} tokens")
@@ -377,7 +500,8 @@ async def add_request_id(request: Request, call_next):
     request_id_var.set(req_id)
     
     # Add request ID to response headers
-    response = await call_next(request)
+    with tracer.trace(f"{request.method} {request.url.path}"):
+        response = await call_next(request)
     response.headers["X-Request-ID"] = req_id
     
     return response
@@ -400,6 +524,7 @@ async def root():
         "endpoints": {
             "salesiq_webhook": "/webhook/salesiq",
             "chat": "/chat",
+            "chat_stream": "/chat/stream",
             "reset": "/reset/{session_id}",
             "health": "/health",
             "stats": "/stats"
@@ -543,6 +668,47 @@ async def get_conversation_ids():
         "note": "Use close_api_url with POST request and Bearer token to close chat"
     }
 
+@app.get("/debug/traces")
+async def get_debug_traces(limit: int = 20):
+    """Span breakdown of the most recent slow requests (slower than TRACE_SLOW_MS)"""
+    return {
+        "tracing": tracer.get_stats(),
+        "traces": tracer.get_slow_traces(limit)
+    }
+
+@app.get("/debug/profile")
+async def debug_profile(request: Request, seconds: float = 10):
+    """Sample all thread and asyncio task stacks for `seconds` (collapsed stacks for a flamegraph)
+    
+    Requires the X-Profiler-Token header to match PROFILER_TOKEN.
+    """
+    if not profiler.authorize(request.headers.get("X-Profiler-Token")):
+        raise HTTPException(status_code=403, detail="Profiler disabled or invalid token")
+    try:
+        collapsed = await profiler.sample(seconds)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(content=collapsed, media_type="text/plain")
+
+@app.post("/debug/profile/webhook")
+async def debug_profile_webhook(request: Request, sort: str = "cumulative", limit: int = 60):
+    """Replay one SalesIQ webhook payload (the request body) under cProfile
+    
+    Returns per-function totals sorted by `sort` (any pstats key: cumulative, tottime, calls...).
+    The replay is a real turn - use a test session. Requires the X-Profiler-Token header.
+    """
+    if not profiler.authorize(request.headers.get("X-Profiler-Token")):
+        raise HTTPException(status_code=403, detail="Profiler disabled or invalid token")
+    if sort not in PROFILE_SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"Unknown sort key: {sort}")
+    payload = await request.json()
+    try:
+        response, report = await profiler.profile_call(lambda: salesiq_webhook(payload), sort, limit)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info(f"[Profiler] Replayed webhook under cProfile (status {response.status_code})")
+    return Response(content=report, media_type="text/plain")
+
 @app.get("/test/widget", response_class=HTMLResponse)
 async def test_widget():
     """Public test page to load SalesIQ widget for real visitor testing.
@@ -565,6 +731,56 @@ async def test_widget():
     )
     return html
 
+def webhook_identity(request: dict) -> Tuple[str, Optional[str]]:
+    """Session ID and message fingerprint of a SalesIQ webhook (same sources as the handler)
+    
+    The fingerprint is None when the payload has no message ID or timestamp - such
+    messages are never treated as redeliveries.
+    """
+    if not isinstance(request, dict):
+        return "unknown", None
+    
+    visitor = request.get('visitor') or {}
+    chat = request.get('chat') or {}
+    conversation = request.get('conversation') or {}
+    session_id = (
+        visitor.get('active_conversation_id') or
+        chat.get('id') or
+        conversation.get('id') or
+        request.get('session_id') or
+        visitor.get('id') or
+        'unknown'
+    )
+    
+    message_obj = request.get('message', {})
+    if isinstance(message_obj, dict):
+        delivery_id = (
+            message_obj.get('id') or
+            message_obj.get('message_id') or
+            message_obj.get('time') or
+            message_obj.get('timestamp')
+        )
+        message_text = str(message_obj.get('text', '')).strip()
+    else:
+        delivery_id = None
+        message_text = str(message_obj).strip()
+    delivery_id = delivery_id or request.get('message_id') or request.get('request_id')
+    
+    return str(session_id), reply_cache.fingerprint(delivery_id, message_text, request.get('payload', ''))
+
+def fallback_reply(text: str, session_id: Optional[str]) -> JSONResponse:
+    """Canned/error reply for SalesIQ - never cached, so a retry runs the turn again"""
+    response = JSONResponse(
+        status_code=200,
+        content={
+            "action": "reply",
+            "replies": [text],
+            "session_id": session_id or 'unknown'
+        }
+    )
+    response.cacheable = False
+    return response
+
 @app.post("/webhook/salesiq")
 async def salesiq_webhook(request: dict):
     """
@@ -574,10 +790,35 @@ async def salesiq_webhook(request: dict):
     If ANY exception occurs, we return a fallback response to prevent SalesIQ errors.
     """
     session_id = None
+    started = time.perf_counter()
     
     # OUTER TRY-CATCH: Catches absolutely everything including JSON encoding errors
     try:
-        return await _salesiq_webhook_inner(request)
+        session_id, fingerprint = webhook_identity(request)
+        
+        # One turn per session at a time; retries of an answered message get the same reply
+        with deadline_tracker.start("webhook"):
+            async with session_locks.hold(session_id):
+                cached = reply_cache.get(session_id, fingerprint)
+                if cached is not None:
+                    return Response(content=cached, status_code=200, media_type="application/json")
+                
+                # Session state is written back before the next turn can take the lock
+                session_persistence.ensure_loaded(session_id)
+                try:
+                    with session_store.unit_of_work():
+                        response = await _salesiq_webhook_inner(request)
+                finally:
+                    session_expiry.touch(session_id)
+                    session_persistence.mark_dirty(session_id)
+                if (isinstance(response, JSONResponse) and response.status_code == 200
+                        and getattr(response, "cacheable", True)):
+                    reply_cache.store(session_id, fingerprint, response.body)
+                return response
+    except DeadlineExceeded as e:
+        # Another worker's turn held the session past our deadline (category not classified yet)
+        logger.warning("[SalesIQ] %s - sending canned reply", e)
+        return fallback_reply(canned_reply("other"), session_id)
     except Exception as outer_e:
         logger.critical(f"[CRITICAL] Outer exception in webhook: {outer_e}")
         logger.critical(f"[CRITICAL] Traceback: {traceback.format_exc()}")
@@ -591,44 +832,42 @@ async def salesiq_webhook(request: dict):
                 "session_id": "error"
             }
         )
+    finally:
+        prometheus_exporter.observe_request("webhook", time.perf_counter() - started)
 
 async def _salesiq_webhook_inner(request: dict):
     """Inner webhook handler with normal exception handling"""
     session_id = None
+    message_text = ""
+    speculation = None
+    turn_started_at = time.perf_counter()
     try:
         # Set session context for logging (will be updated once extracted)
-        session_id_var.set("extracting")
+        bind_session("extracting")
         
-        logger.info(f"[SalesIQ] Webhook received")
+        logger.info("[SalesIQ] Webhook received")
         
         # Validate request structure
         if not isinstance(request, dict):
-            logger.error(f"[SalesIQ] Invalid request format: {type(request)}")
+            logger.error("[SalesIQ] Invalid request format: %s", type(request))
             track_error(
                 "invalid_webhook_format",
                 f"Received non-dict webhook: {type(request)}",
                 {"request_type": str(type(request))}
             )
-            return JSONResponse(
-                status_code=200,
-                content={
-                    "action": "reply",
-                    "replies": ["I'm having technical difficulties. Please call 1-888-415-5240."],
-                    "session_id": "unknown"
-                }
-            )
+            return fallback_reply("I'm having technical difficulties. Please call 1-888-415-5240.", "unknown")
         
-        logger.info(f"[SalesIQ] Request keys: {list(request.keys())}")
-        logger.debug(f"[SalesIQ] Full request payload: {request}")
+        logger.info("[SalesIQ] Request keys: %s", list(request))
+        logger.debug("[SalesIQ] Full request payload: %s", request)
         
         # Log all possible IDs for transfer debugging
         visitor = request.get('visitor', {})
         chat = request.get('chat', {})
         conversation = request.get('conversation', {})
         
-        logger.debug(f"[SalesIQ] Visitor data: {visitor}")
-        logger.debug(f"[SalesIQ] Chat data: {chat}")
-        logger.debug(f"[SalesIQ] Conversation data: {conversation}")
+        logger.debug("[SalesIQ] Visitor data: %s", visitor)
+        logger.debug("[SalesIQ] Chat data: %s", chat)
+        logger.debug("[SalesIQ] Conversation data: %s", conversation)
         
         # ============================================================
         # SALESIQ API CONVERSATION ID EXTRACTION
@@ -655,13 +894,13 @@ async def _salesiq_webhook_inner(request: dict):
         visitor_phone = visitor.get('phone', 'No phone')
         
         # Simple logging for debugging
-        logger.info(f"[SalesIQ] Message: {message_text_preview[:100] if message_text_preview else '(empty)'}")
-        logger.debug(f"[SalesIQ] Visitor: {visitor_email}, Active Conv: {salesiq_active_conversation}")
+        logger.info("[SalesIQ] Message: %s", message_text_preview[:100] if message_text_preview else '(empty)')
+        logger.debug("[SalesIQ] Visitor: %s, Active Conv: %s", visitor_email, salesiq_active_conversation)
         
         # Extract payload (from quick reply buttons)
         payload = request.get('payload', '')
         if payload:
-            logger.info(f"  - Payload: {payload}")
+            logger.info("  - Payload: %s", payload)
         
         # Determine the correct conversation_id for API calls
         api_conversation_id = (
@@ -672,7 +911,7 @@ async def _salesiq_webhook_inner(request: dict):
         
         # Store conversation ID for potential API operations
         if not api_conversation_id:
-            logger.warning(f"[SalesIQ] No conversation ID found for API operations")
+            logger.warning("[SalesIQ] No conversation ID found for API operations")
         
         # Extract session ID (try multiple sources)
         session_id = (
@@ -685,12 +924,12 @@ async def _salesiq_webhook_inner(request: dict):
         )
         
         # Update session context for logging
-        session_id_var.set(session_id)
+        bind_session(session_id)
         
         # Store conversation ID mapping for later API operations (close, transfer)
         if api_conversation_id and session_id != 'unknown':
             conversation_id_map[session_id] = api_conversation_id
-            logger.info(f"[ID Mapping] Stored: session_id={session_id} -> conversation_id={api_conversation_id}")
+            logger.info("[ID Mapping] Stored: session_id=%s -> conversation_id=%s", session_id, api_conversation_id)
         
         # Extract message text - handle multiple formats (already extracted above for logging)
         if isinstance(message_obj, dict):
@@ -700,8 +939,8 @@ async def _salesiq_webhook_inner(request: dict):
         
         # Handle empty message
         if not message_text:
-            logger.info(f"[Session] 👋 INITIAL CONTACT - Sending greeting")
-            logger.info(f"[Session] New visitor from: {visitor.get('email', 'unknown')}")
+            logger.info("[Session] 👋 INITIAL CONTACT - Sending greeting")
+            logger.info("[Session] New visitor from: %s", visitor.get('email', 'unknown'))
             return JSONResponse(
                 status_code=200,
                 content={
@@ -713,8 +952,9 @@ async def _salesiq_webhook_inner(request: dict):
         
         # Initialize conversation history
         if session_id not in conversations:
-            conversations[session_id] = []
-            logger.info(f"[Session] ✓ NEW CONVERSATION STARTED | Category: {issue_router.classify(message_text)}")
+            conversations[session_id] = ConversationHistory()
+            # Category is logged once the router classifies the message below
+            logger.info("[Session] ✓ NEW CONVERSATION STARTED")
         
         history = conversations[session_id]
         message_lower = message_text.lower().strip()
@@ -727,7 +967,7 @@ async def _salesiq_webhook_inner(request: dict):
         )
         
         if is_greeting and len(history) == 0:
-            logger.info(f"[SalesIQ] Simple greeting detected - first message")
+            logger.info("[SalesIQ] Simple greeting detected - first message")
             return JSONResponse(
                 status_code=200,
                 content={
@@ -740,7 +980,7 @@ async def _salesiq_webhook_inner(request: dict):
         # Handle contact requests
         contact_request_phrases = ['support email', 'support number', 'contact support', 'phone number', 'email address']
         if any(phrase in message_lower for phrase in contact_request_phrases):
-            logger.info(f"[SalesIQ] Contact request detected")
+            logger.info("[SalesIQ] Contact request detected")
             return JSONResponse(
                 status_code=200,
                 content={
@@ -754,7 +994,7 @@ async def _salesiq_webhook_inner(request: dict):
         if len(history) > 0 and ('yes' in message_lower or 'ok' in message_lower or 'connect' in message_lower):
             last_bot_message = history[-1].get('content', '') if history[-1].get('role') == 'assistant' else ''
             if 'human agent' in last_bot_message.lower():
-                logger.info(f"[SalesIQ] User requested human agent - initiating transfer")
+                logger.info("[SalesIQ] User requested human agent - initiating transfer")
                 
                 # Build past_messages in SalesIQ format (message-by-message)
                 past_messages = build_past_messages(history)
@@ -766,19 +1006,22 @@ async def _salesiq_webhook_inner(request: dict):
                     conversation_text += f"{role}: {msg.get('content', '')}\n"
                 
                 # Call SalesIQ API with structured message history
-                logger.info(f"[SalesIQ] Transferring {len(past_messages)} messages to agent")
-                api_result = salesiq_api.create_chat_session(
-                    session_id, 
+                logger.info("[SalesIQ] Transferring %s messages to agent", len(past_messages))
+                api_result = await dispatch_side_effect(
+                    "salesiq.transfer",
+                    side_effect_key("transfer", session_id, message_text),
+                    visitor_id=session_id,
                     conversation_history=conversation_text,
                     past_messages=past_messages
                 )
-                logger.info(f"[SalesIQ] API result: {api_result}")
+                logger.info("[SalesIQ] API result: %s", api_result)
                 
                 # SalesIQ only supports "action": "reply" - transfer happens via API
                 # Clear conversation after transfer
                 if session_id in conversations:
                     metrics_collector.end_conversation(session_id, "escalated")
                     del conversations[session_id]
+                    release_session_resources(session_id)
                 
                 return JSONResponse(
                     status_code=200,
@@ -830,16 +1073,16 @@ async def _salesiq_webhook_inner(request: dict):
                 ) and len(message_text) < 20  # Short closure confirmation
                 
                 if user_wants_to_continue:
-                    logger.info(f"[Conversation] User has NEW question after resolution - restarting conversation")
+                    logger.info("[Conversation] User has NEW question after resolution - restarting conversation")
                     conversation_should_restart = True
                     # Reset state to active
                     state_manager.create_session(session_id, category="other")
                     
                 elif user_wants_to_close:
-                    logger.info(f"[Conversation] User confirmed chat closure")
+                    logger.info("[Conversation] User confirmed chat closure")
                     response_text = "You're welcome! Feel free to reach out anytime. Goodbye! 👋"
-                    conversations[session_id].append({"role": "user", "content": message_text})
-                    conversations[session_id].append({"role": "assistant", "content": response_text})
+                    conversations[session_id].add("user", message_text)
+                    conversations[session_id].add("assistant", response_text)
                     
                     # Mark as resolved and let idle timeout handle closure
                     if session_id in conversations:
@@ -863,9 +1106,9 @@ async def _salesiq_webhook_inner(request: dict):
         
         # Check for option selections - INSTANT CHAT (with emoji matching)
         if ("instant chat" in message_lower or "option 1" in message_lower or message_lower == "1" or "chat/transfer" in message_lower or "📞" in message_text or payload == "option_1"):
-            logger.info(f"[Action] ✅ BUTTON CLICKED: Instant Chat (Option 1)")
-            logger.info(f"[Action] 🔄 CHAT TRANSFER INITIATED")
-            logger.info(f"[Action] Status: Connecting visitor to live agent...")
+            logger.info("[Action] ✅ BUTTON CLICKED: Instant Chat (Option 1)")
+            logger.info("[Action] 🔄 CHAT TRANSFER INITIATED")
+            logger.info("[Action] Status: Connecting visitor to live agent...")
             
             try:
                 # Build past_messages in SalesIQ format (message-by-message)
@@ -886,31 +1129,34 @@ async def _salesiq_webhook_inner(request: dict):
                 visitor_email = visitor.get('email', 'support@acecloudhosting.com') if isinstance(visitor, dict) else 'support@acecloudhosting.com'
                 
                 # Call SalesIQ API (Visitor API) to create conversation and route to agent
-                logger.info(f"[SalesIQ] Calling create_chat_session API with overrides app_id={override_app_id}, dept={override_department_id}, visitor_email={visitor_email}")
-                logger.info(f"[SalesIQ] Transferring {len(past_messages)} messages to agent (message-by-message)")
+                logger.info("[SalesIQ] Calling create_chat_session API with overrides app_id=%s, dept=%s, visitor_email=%s", override_app_id, override_department_id, visitor_email)
+                logger.info("[SalesIQ] Transferring %s messages to agent (message-by-message)", len(past_messages))
                 
                 # Pass visitor email as user_id (most reliable unique identifier per API docs)
-                api_result = salesiq_api.create_chat_session(
-                    visitor_email,  # Use email as unique user_id per API documentation
+                api_result = await dispatch_side_effect(
+                    "salesiq.transfer",
+                    side_effect_key("transfer", session_id, message_text),
+                    visitor_id=visitor_email,  # Use email as unique user_id per API documentation
                     conversation_history=conversation_text,
                     past_messages=past_messages
                 )
-                logger.info(f"[SalesIQ] API result: {api_result}")
+                logger.info("[SalesIQ] API result: %s", api_result)
             except Exception as api_error:
-                logger.error(f"[SalesIQ] API call failed: {str(api_error)}")
-                logger.error(f"[SalesIQ] Traceback: {traceback.format_exc()}")
+                logger.error("[SalesIQ] API call failed: %s", api_error)
+                logger.error("[SalesIQ] Traceback: %s", traceback.format_exc())
             
             # SalesIQ webhooks only support "reply" action, not "transfer"
             # The transfer happens through the SalesIQ API call above
             # Send confirmation message to user
             response_text = "I'm connecting you with our support team. If the transfer doesn't happen automatically, please call 1-888-415-5240 or email support@acecloudhosting.com for immediate assistance."
             
-            logger.info(f"[Action] ✓ TRANSFER CONFIRMATION SENT")
+            logger.info("[Action] ✓ TRANSFER CONFIRMATION SENT")
             
             # Clear conversation after transfer
             if session_id in conversations:
                 metrics_collector.end_conversation(session_id, "escalated")
                 del conversations[session_id]
+                release_session_resources(session_id)
             
             return JSONResponse(
                 status_code=200,
@@ -923,8 +1169,8 @@ async def _salesiq_webhook_inner(request: dict):
         
         # Check for option selections - SCHEDULE CALLBACK (with emoji matching)
         if ("callback" in message_lower or "option 2" in message_lower or message_lower == "2" or "schedule" in message_lower or "📅" in message_text or payload == "option_2"):
-            logger.info(f"[Action] ✅ BUTTON CLICKED: Schedule Callback (Option 2)")
-            logger.info(f"[Action] 📞 CALLBACK SCHEDULED - Waiting for time & phone details")
+            logger.info("[Action] ✅ BUTTON CLICKED: Schedule Callback (Option 2)")
+            logger.info("[Action] 📞 CALLBACK SCHEDULED - Waiting for time & phone details")
             
             # Transition to callback collection state
             state_manager.transition(session_id, TransitionTrigger.CALLBACK_REQUESTED)
@@ -941,11 +1187,11 @@ async def _salesiq_webhook_inner(request: dict):
                 "Our support team will call you back at that time. A callback has been scheduled and you'll receive a confirmation email shortly.\n\n"
                 "Thank you for contacting Ace Cloud Hosting!"
             )
-            conversations[session_id].append({"role": "user", "content": message_text})
-            conversations[session_id].append({"role": "assistant", "content": response_text})
+            conversations[session_id].add("user", message_text)
+            conversations[session_id].add("assistant", response_text)
             
             # Mark session as waiting for callback details
-            conversations[session_id].append({"role": "system", "content": "WAITING_FOR_CALLBACK_DETAILS"})
+            conversations[session_id].set_flag(HistoryFlag.AWAITING_CALLBACK_DETAILS)
 
             return JSONResponse(
                 status_code=200,
@@ -957,11 +1203,11 @@ async def _salesiq_webhook_inner(request: dict):
             )
             
         # Check if we are waiting for callback details
-        if len(history) > 0 and history[-1].get("content") == "WAITING_FOR_CALLBACK_DETAILS":
-            logger.info(f"[SalesIQ] Received callback details: {message_text}")
+        if history.has_flag(HistoryFlag.AWAITING_CALLBACK_DETAILS):
+            logger.info("[SalesIQ] Received callback details: %s", message_text)
             
-            # Remove the system marker
-            history.pop()
+            # Clear the marker
+            history.clear_flag(HistoryFlag.AWAITING_CALLBACK_DETAILS)
             
             # Extract visitor info
             visitor_email = visitor.get("email", "support@acecloudhosting.com")
@@ -976,7 +1222,7 @@ async def _salesiq_webhook_inner(request: dict):
             preferred_time = time_match.group(1).strip() if time_match else None
             
             # Add user's details to history
-            conversations[session_id].append({"role": "user", "content": message_text})
+            conversations[session_id].add("user", message_text)
             
             # Create the callback ticket NOW with the details
             try:
@@ -986,44 +1232,42 @@ async def _salesiq_webhook_inner(request: dict):
                 # Append the specific details to the description
                 full_description = f"{conv_history}\n\nUSER PROVIDED DETAILS:\n{message_text}"
                 
-                api_result = desk_api.create_callback_ticket(
+                # Ticket creation and chat closure run from the outbox (with retries)
+                api_result = await dispatch_side_effect(
+                    "desk.callback",
+                    side_effect_key("callback", session_id, message_text),
+                    session_id=session_id,
                     visitor_email=visitor_email,
                     visitor_name=visitor_name,
                     conversation_history=full_description,
                     preferred_time=preferred_time,
                     phone=phone,
                 )
-                logger.info(f"[Desk] Callback call result: {api_result}")
+                logger.info("[Desk] Callback dispatch result: %s", api_result)
             except Exception as e:
-                logger.error(f"[Desk] Callback call error: {str(e)}")
+                logger.error("[Desk] Callback call error: %s", e)
                 api_result = {"success": False, "error": "exception", "details": str(e)}
 
-            if api_result.get("success"):
-                logger.info(f"[Action] ✓ CALLBACK TICKET CREATED SUCCESSFULLY")
-                logger.info(f"[Action] 📞 Callback scheduled for visitor: {visitor.get('name', 'Unknown')}")
-                logger.info(f"[Action] Email: {visitor.get('email', 'Not provided')}")
+            if api_result.get("queued"):
+                logger.info("[Action] ✓ CALLBACK REQUEST QUEUED")
+                logger.info("[Action] 📞 Callback requested for visitor: %s", visitor.get('name', 'Unknown'))
+                response_text = CALLBACK_RECEIVED_REPLY
+            elif api_result.get("success"):
+                logger.info("[Action] ✓ CALLBACK TICKET CREATED SUCCESSFULLY")
+                logger.info("[Action] 📞 Callback scheduled for visitor: %s", visitor.get('name', 'Unknown'))
+                logger.info("[Action] Email: %s", visitor.get('email', 'Not provided'))
                 response_text = "Thank you! I've received your details and scheduled the callback. Our team will contact you shortly. Have a great day!"
             else:
-                logger.warning(f"[Action] ✗ CALLBACK TICKET CREATION FAILED")
-                logger.warning(f"[Action] Error: {api_result.get('error', 'Unknown error')}")
-                response_text = (
-                    "I got your details, but I couldn't create the callback in our system right now. "
-                    "Please call our support team at 1-888-415-5240 for immediate help."
-                )
+                logger.warning("[Action] ✗ CALLBACK TICKET CREATION FAILED")
+                logger.warning("[Action] Error: %s", api_result.get('error', 'Unknown error'))
+                response_text = CALLBACK_FAILED_REPLY
             
-            # Only close the chat if callback creation succeeded
-            if api_result.get("success"):
-                try:
-                    close_result = salesiq_api.close_chat(session_id, "callback_scheduled")
-                    logger.info(f"[SalesIQ] Chat closure result: {close_result}")
-                except Exception as e:
-                    logger.error(f"[SalesIQ] Chat closure error: {str(e)}")
-
             # Clear conversation only after success
             if api_result.get("success") and session_id in conversations:
-                logger.info(f"[Metrics] 📊 CONVERSATION ENDED - Reason: Callback Scheduled")
+                logger.info("[Metrics] 📊 CONVERSATION ENDED - Reason: Callback Scheduled")
                 metrics_collector.end_conversation(session_id, "resolved")
                 del conversations[session_id]
+                release_session_resources(session_id)
 
             return JSONResponse(
                 status_code=200,
@@ -1042,37 +1286,54 @@ async def _salesiq_webhook_inner(request: dict):
         # Includes token tracking and hallucination prevention
         # SKIP classification if conversation just restarted (new question after resolution)
         
+        # Per-turn classification: computed once here, reused by handlers via handler_context
+        turn_classification = TurnClassification(
+            message_text,
+            conversations[session_id],
+            session_id=session_id,  # Track token usage per session
+            classifier=llm_classifier
+        )
+        
         if conversation_should_restart:
-            logger.info(f"[LLM Classifier] Skipping classification - conversation restarted with new question")
+            logger.info("[LLM Classifier] Skipping classification - conversation restarted with new question")
             # Force uncertain classification to let main LLM handle the new question
-            classifications = {
+            turn_classification.set_results({
                 "resolution": ClassificationResult("UNCERTAIN", 0, "New question after resolution", ""),
                 "escalation": ClassificationResult("BOT_CAN_HANDLE", 100, "New conversation", ""),
                 "intent": ClassificationResult("QUESTION", 100, "User has new question", "")
-            }
+            })
         else:
-            logger.info(f"[LLM Classifier] Running unified classification (1 API call)...")
+            # Speculative mode: start generating the reply while classification runs
+            if speculation_tracker.enabled and gemini_generator and not token_budget.is_exhausted(session_id):
+                speculative_category = issue_router.classify(message_text)
+                speculation = speculation_tracker.start(
+                    generate_response(message_text, list(history), category=speculative_category, session_id=session_id),
+                    category=speculative_category
+                )
+                logger.info("[Speculation] Started response generation in parallel with classification")
+            
+            logger.info("[LLM Classifier] Running unified classification (1 API call)...")
             
             try:
-                classifications = llm_classifier.classify_unified(
-                    message_text, 
-                    conversations[session_id],
-                    session_id=session_id  # Track token usage per session
-                )
+                await deadline_tracker.run("classification", turn_classification.ensure_async())
+            except DeadlineExceeded:
+                raise
             except Exception as e:
-                logger.error(f"[LLM Classifier] Classification failed: {e}")
+                logger.error("[LLM Classifier] Classification failed: %s", e)
                 # Fallback: Continue without classification (let main LLM handle it)
-                classifications = {
+                turn_classification.set_results({
                     "resolution": ClassificationResult("UNCERTAIN", 0, "Classification error", ""),
                     "escalation": ClassificationResult("UNCERTAIN", 0, "Classification error", ""),
                     "intent": ClassificationResult("OTHER", 0, "Classification error", "")
-                }
+                })
         
+        classifications = turn_classification.ensure()
         resolution_classification = classifications["resolution"]
         escalation_classification = classifications["escalation"]
         
-        logger.info(f"[LLM Classifier] Resolution: {resolution_classification.decision} ({resolution_classification.confidence}%) - {resolution_classification.reasoning}")
-        logger.info(f"[LLM Classifier] Escalation: {escalation_classification.decision} ({escalation_classification.confidence}%) - {escalation_classification.reasoning}")
+        logger.info("[LLM Classifier] Source: %s", turn_classification.source or 'forced')
+        logger.info("[LLM Classifier] Resolution: %s (%s%%) - %s", resolution_classification.decision, resolution_classification.confidence, resolution_classification.reasoning)
+        logger.info("[LLM Classifier] Escalation: %s (%s%%) - %s", escalation_classification.decision, escalation_classification.confidence, escalation_classification.reasoning)
         
         # ============================================================
         # RESOLUTION CHECK (Smart Satisfaction Confirmation)
@@ -1082,10 +1343,13 @@ async def _salesiq_webhook_inner(request: dict):
         # Main value: Prevents unnecessary escalations by detecting true resolution
         
         if llm_classifier.should_close_chat(resolution_classification):
-            logger.info(f"[Resolution] ✓ ISSUE RESOLVED (LLM-confirmed)")
-            logger.info(f"[Resolution] User message: '{message_text[:100]}'")
-            logger.info(f"[Resolution] Confidence: {resolution_classification.confidence}% (threshold: {llm_classifier.resolution_threshold}%)")
-            logger.info(f"[Resolution] Action: Send satisfaction confirmation (auto-close via idle timeout)")
+            logger.info("[Resolution] ✓ ISSUE RESOLVED (LLM-confirmed)")
+            logger.info("[Resolution] User message: '%s'", message_text[:100])
+            logger.info("[Resolution] Confidence: %s%% (threshold: %s%%)", resolution_classification.confidence, llm_classifier.resolution_threshold)
+            logger.info("[Resolution] Action: Send satisfaction confirmation (auto-close via idle timeout)")
+            
+            if speculation:
+                speculation.discard("resolved")
             
             # Transition to resolved state
             state_manager.end_session(session_id, ConversationState.RESOLVED)
@@ -1096,13 +1360,13 @@ async def _salesiq_webhook_inner(request: dict):
                 "If you need anything else, just let me know!"
             )
             
-            conversations[session_id].append({"role": "user", "content": message_text})
-            conversations[session_id].append({"role": "assistant", "content": response_text})
+            conversations[session_id].add("user", message_text)
+            conversations[session_id].add("assistant", response_text)
             
             # Track resolution (important for metrics)
             if session_id in conversations:
                 metrics_collector.end_conversation(session_id, "resolved")
-                logger.info(f"[Metrics] 📊 Issue resolved by bot - prevented escalation")
+                logger.info("[Metrics] 📊 Issue resolved by bot - prevented escalation")
                 # Keep conversation in memory for idle timeout period
                 # Will be cleaned up by Zoho's idle timeout (not us)
             
@@ -1120,10 +1384,13 @@ async def _salesiq_webhook_inner(request: dict):
         # ============================================================
         # Offer escalation if LLM detects user needs human help
         if llm_classifier.should_escalate(escalation_classification):
-            logger.info(f"[Escalation] 🆙 USER NEEDS HUMAN ASSISTANCE (LLM-detected)")
-            logger.info(f"[Escalation] User message: '{message_text[:100]}'")
-            logger.info(f"[Escalation] Confidence: {escalation_classification.confidence}% (threshold: {llm_classifier.escalation_threshold}%)")
-            logger.info(f"[Escalation] Options: ① Instant Chat | ② Schedule Callback")
+            logger.info("[Escalation] 🆙 USER NEEDS HUMAN ASSISTANCE (LLM-detected)")
+            logger.info("[Escalation] User message: '%s'", message_text[:100])
+            logger.info("[Escalation] Confidence: %s%% (threshold: %s%%)", escalation_classification.confidence, llm_classifier.escalation_threshold)
+            logger.info("[Escalation] Options: ① Instant Chat | ② Schedule Callback")
+            
+            if speculation:
+                speculation.discard("escalated")
             
             # Transition to escalation options state
             state_manager.transition(session_id, TransitionTrigger.SOLUTION_FAILED)
@@ -1131,8 +1398,8 @@ async def _salesiq_webhook_inner(request: dict):
             response_text = "I understand this needs immediate attention. Let me connect you with the right support:"
             
             # Add to history so next response can find it
-            conversations[session_id].append({"role": "user", "content": message_text})
-            conversations[session_id].append({"role": "assistant", "content": response_text})
+            conversations[session_id].add("user", message_text)
+            conversations[session_id].add("assistant", response_text)
             
             return JSONResponse(
                 status_code=200,
@@ -1158,7 +1425,7 @@ async def _salesiq_webhook_inner(request: dict):
         # Check for password reset - improved flow with multiple options
         password_keywords = ["password", "reset", "forgot", "locked out", "can't login", "cannot login"]
         if any(keyword in message_lower for keyword in password_keywords):
-            logger.info(f"[SalesIQ] Password reset detected")
+            logger.info("[SalesIQ] Password reset detected")
             # Check if user already answered about SelfCare registration
             if len(history) > 0:
                 last_bot_message = history[-1].get('content', '') if history[-1].get('role') == 'assistant' else ''
@@ -1166,10 +1433,10 @@ async def _salesiq_webhook_inner(request: dict):
                 if 'registered on the selfcare portal' in last_bot_message.lower():
                     # User is responding to that question
                     if 'yes' in message_lower or 'registered' in message_lower:
-                        logger.info(f"[SalesIQ] User is registered on SelfCare")
+                        logger.info("[SalesIQ] User is registered on SelfCare")
                         response_text = "Great! Visit https://selfcare.acecloudhosting.com and click 'Forgot your password'. Let me know when you're there!"
-                        conversations[session_id].append({"role": "user", "content": message_text})
-                        conversations[session_id].append({"role": "assistant", "content": response_text})
+                        conversations[session_id].add("user", message_text)
+                        conversations[session_id].add("assistant", response_text)
                         return JSONResponse(
                             status_code=200,
                             content={
@@ -1179,15 +1446,15 @@ async def _salesiq_webhook_inner(request: dict):
                             }
                         )
                     elif 'no' in message_lower or 'not registered' in message_lower:
-                        logger.info(f"[SalesIQ] User is NOT registered on SelfCare - providing POC option")
+                        logger.info("[SalesIQ] User is NOT registered on SelfCare - providing POC option")
                         response_text = (
                             "No problem! For server/user account password reset, you have two options:\n\n"
                             "1. Contact your account's POC (Point of Contact) or admin - they can reset your password through MyPortal\n"
                             "2. Call our support team at 1-888-415-5240 (24/7)\n\n"
                             "Which option works better for you?"
                         )
-                        conversations[session_id].append({"role": "user", "content": message_text})
-                        conversations[session_id].append({"role": "assistant", "content": response_text})
+                        conversations[session_id].add("user", message_text)
+                        conversations[session_id].add("assistant", response_text)
                         return JSONResponse(
                             status_code=200,
                             content={
@@ -1198,10 +1465,10 @@ async def _salesiq_webhook_inner(request: dict):
                         )
             else:
                 # First time asking about password reset
-                logger.info(f"[SalesIQ] First password reset question - asking about SelfCare registration")
+                logger.info("[SalesIQ] First password reset question - asking about SelfCare registration")
                 response_text = "I can help! Are you registered on the SelfCare portal?"
-                conversations[session_id].append({"role": "user", "content": message_text})
-                conversations[session_id].append({"role": "assistant", "content": response_text})
+                conversations[session_id].add("user", message_text)
+                conversations[session_id].add("assistant", response_text)
                 return JSONResponse(
                     status_code=200,
                     content={
@@ -1220,10 +1487,10 @@ async def _salesiq_webhook_inner(request: dict):
                 is_app_update = True
         
         if is_app_update:
-            logger.info(f"[SalesIQ] Application update request detected")
+            logger.info("[SalesIQ] Application update request detected")
             response_text = "Application updates need to be handled by our support team to avoid downtime. Please contact support at:\n\nPhone: 1-888-415-5240 (24/7)\nEmail: support@acecloudhosting.com\n\nThey'll schedule the update for you!"
-            conversations[session_id].append({"role": "user", "content": message_text})
-            conversations[session_id].append({"role": "assistant", "content": response_text})
+            conversations[session_id].add("user", message_text)
+            conversations[session_id].add("assistant", response_text)
             return JSONResponse(
                 status_code=200,
                 content={
@@ -1257,17 +1524,17 @@ async def _salesiq_webhook_inner(request: dict):
             "let me talk", "let me speak", "connect me", "transfer call"
         ]
         if any(phrase in message_lower for phrase in agent_request_phrases):
-            logger.info(f"[Escalation] 🆙 ESCALATION REQUESTED - User wants human agent")
-            logger.info(f"[Escalation] Detected phrase in: {message_text[:100]}")
-            logger.info(f"[Escalation] Showing 2 options: ① Instant Chat | ② Schedule Callback")
+            logger.info("[Escalation] 🆙 ESCALATION REQUESTED - User wants human agent")
+            logger.info("[Escalation] Detected phrase in: %s", message_text[:100])
+            logger.info("[Escalation] Showing 2 options: ① Instant Chat | ② Schedule Callback")
             
             # Transition to escalation options
             state_manager.transition(session_id, TransitionTrigger.ESCALATION_REQUESTED)
             
             response_text = "Absolutely, I'll connect you with our support team. Please choose your preferred option:"
             
-            conversations[session_id].append({"role": "user", "content": message_text})
-            conversations[session_id].append({"role": "assistant", "content": response_text})
+            conversations[session_id].add("user", message_text)
+            conversations[session_id].add("assistant", response_text)
             
             return JSONResponse(
                 status_code=200,
@@ -1341,9 +1608,9 @@ async def _salesiq_webhook_inner(request: dict):
         is_final_goodbye = any(keyword in message_lower for keyword in final_goodbye_keywords)
         
         if is_acknowledgment and not is_in_troubleshooting:
-            logger.info(f"[SalesIQ] Acknowledgment detected (not in troubleshooting)")
+            logger.info("[SalesIQ] Acknowledgment detected (not in troubleshooting)")
             if message_lower in ["ok", "okay"]:
-                logger.info(f"[SalesIQ] 'Ok/Okay' alone, asking if need more help")
+                logger.info("[SalesIQ] 'Ok/Okay' alone, asking if need more help")
                 return JSONResponse(
                     status_code=200,
                     content={
@@ -1354,22 +1621,26 @@ async def _salesiq_webhook_inner(request: dict):
                 )
             elif is_final_goodbye:
                 # User is done - auto-close chat
-                logger.info(f"[Resolution] ✓ User signaled conversation complete")
-                logger.info(f"[Resolution] Action: Auto-closing chat session")
+                logger.info("[Resolution] ✓ User signaled conversation complete")
+                logger.info("[Resolution] Action: Auto-closing chat session")
                 
                 response_text = "You're welcome! Have a great day!"
-                conversations[session_id].append({"role": "user", "content": message_text})
-                conversations[session_id].append({"role": "assistant", "content": response_text})
+                conversations[session_id].add("user", message_text)
+                conversations[session_id].add("assistant", response_text)
                 
                 # Auto-close chat
-                close_result = salesiq_api.close_chat(session_id, "completed")
+                close_result = await dispatch_side_effect(
+                    "salesiq.close_chat", side_effect_key("close", session_id, message_text),
+                    session_id=session_id, reason="completed"
+                )
                 if close_result.get('success'):
-                    logger.info(f"[Action] ✓ CHAT AUTO-CLOSED SUCCESSFULLY")
-                ṇ
+                    logger.info("[Action] ✓ CHAT AUTO-CLOSE DISPATCHED")
+                
                 if session_id in conversations:
                     metrics_collector.end_conversation(session_id, "resolved")
                     state_manager.end_session(session_id, ConversationState.RESOLVED)
                     del conversations[session_id]
+                    release_session_resources(session_id)
                 
                 return JSONResponse(
                     status_code=200,
@@ -1380,7 +1651,7 @@ async def _salesiq_webhook_inner(request: dict):
                     }
                 )
             else:
-                logger.info(f"[SalesIQ] Acknowledgment with thanks detected")
+                logger.info("[SalesIQ] Acknowledgment with thanks detected")
                 return JSONResponse(
                     status_code=200,
                     content={
@@ -1390,7 +1661,7 @@ async def _salesiq_webhook_inner(request: dict):
                     }
                 )
         elif is_acknowledgment and is_in_troubleshooting:
-            logger.info(f"[SalesIQ] Acknowledgment during troubleshooting - continuing with LLM")
+            logger.info("[SalesIQ] Acknowledgment during troubleshooting - continuing with LLM")
             # Fall through to LLM to continue with next step
         
         # Check if user said "no" to our "anything else" question
@@ -1400,22 +1671,26 @@ async def _salesiq_webhook_inner(request: dict):
                 # Bot asked if they need more help
                 negative_responses = ["no", "nope", "no thanks", "no thank you", "nah", "i'm good", "im good", "that's all", "thats all"]
                 if message_lower in negative_responses or any(neg in message_lower for neg in ["no", "nope", "nah"]):
-                    logger.info(f"[Resolution] ✓ User declined further assistance")
-                    logger.info(f"[Resolution] Action: Auto-closing chat session")
+                    logger.info("[Resolution] ✓ User declined further assistance")
+                    logger.info("[Resolution] Action: Auto-closing chat session")
                     
                     response_text = "Perfect! Thank you for chatting. This chat will close now. Have a great day!"
-                    conversations[session_id].append({"role": "user", "content": message_text})
-                    conversations[session_id].append({"role": "assistant", "content": response_text})
+                    conversations[session_id].add("user", message_text)
+                    conversations[session_id].add("assistant", response_text)
                     
                     # Auto-close chat
-                    close_result = salesiq_api.close_chat(session_id, "completed")
+                    close_result = await dispatch_side_effect(
+                        "salesiq.close_chat", side_effect_key("close", session_id, message_text),
+                        session_id=session_id, reason="completed"
+                    )
                     if close_result.get('success'):
-                        logger.info(f"[Action] ✓ CHAT AUTO-CLOSED SUCCESSFULLY")
+                        logger.info("[Action] ✓ CHAT AUTO-CLOSE DISPATCHED")
                     
                     if session_id in conversations:
                         metrics_collector.end_conversation(session_id, "resolved")
                         state_manager.end_session(session_id, ConversationState.RESOLVED)
                         del conversations[session_id]
+                        release_session_resources(session_id)
                     
                     return JSONResponse(
                         status_code=200,
@@ -1427,19 +1702,21 @@ async def _salesiq_webhook_inner(request: dict):
                     )
         
         # Classify message category using IssueRouter (saves 60% of LLM tokens)
-        category = issue_router.classify(message_text)
-        logger.info(f"[SalesIQ] Message classified as: {category}")
+        with prometheus_exporter.time_stage("router"), tracer.span("router.classify") as span:
+            category = issue_router.classify(message_text)
+            span.set("category", category)
+        logger.info("[SalesIQ] Message classified as: %s", category)
         
         # Initialize state tracking for new conversations
         if session_id not in conversations or len(conversations[session_id]) == 0:
             router_matched = category != "other"
-            logger.info(f"[Metrics] 📊 NEW CONVERSATION STARTED")
-            logger.info(f"[Metrics] Category: {category}, Router Matched: {router_matched}")
+            logger.info("[Metrics] 📊 NEW CONVERSATION STARTED")
+            logger.info("[Metrics] Category: %s, Router Matched: %s", category, router_matched)
             metrics_collector.start_conversation(session_id, category, router_matched)
             
             # Create state management session
             state_session = state_manager.create_session(session_id, category)
-            logger.info(f"[State] Session {session_id} created in state: {state_session.state.value}")
+            logger.info("[State] Session %s created in state: %s", session_id, state_session.state.value)
         
         # Detect state transition from user message
         current_session = state_manager.get_session(session_id)
@@ -1447,7 +1724,7 @@ async def _salesiq_webhook_inner(request: dict):
             trigger = detect_trigger_from_message(message_text, current_session.state)
             if trigger:
                 state_manager.transition(session_id, trigger)
-                logger.info(f"[State] Triggered: {trigger.value}, New state: {current_session.state.value}")
+                logger.info("[State] Triggered: %s, New state: %s", trigger.value, current_session.state.value)
         
         # Update activity timestamp
         state_manager.update_activity(session_id)
@@ -1459,15 +1736,17 @@ async def _salesiq_webhook_inner(request: dict):
             "history": history,
             "category": category,
             "visitor": visitor,
-            "payload": payload
+            "payload": payload,
+            "classification": turn_classification
         }
         
-        handler_response = handler_registry.handle_message(message_text, handler_context)
+        with prometheus_exporter.time_stage("handlers"), tracer.span("handler_registry.handle_message"):
+            handler_response = handler_registry.handle_message(message_text, handler_context)
         
         # If handler matched and returned response, use it
         if handler_response and handler_response.text:
-            logger.info(f"[Handler] ✅ HANDLER MATCHED - Processing response")
-            logger.info(f"[Handler] Response text: {handler_response.text[:150]}...")
+            logger.info("[Handler] ✅ HANDLER MATCHED - Processing response")
+            logger.info("[Handler] Response text: %s...", handler_response.text[:150])
             response_text = handler_response.text
             
             # Update state if handler requested it
@@ -1477,29 +1756,33 @@ async def _salesiq_webhook_inner(request: dict):
                     try:
                         new_state = ConversationState(handler_response.new_state)
                         current_session.state = new_state
-                        logger.info(f"[Handler] Updated state to: {new_state.value}")
+                        logger.info("[Handler] Updated state to: %s", new_state.value)
                     except ValueError:
-                        logger.warning(f"[Handler] Invalid state: {handler_response.new_state}")
+                        logger.warning("[Handler] Invalid state: %s", handler_response.new_state)
             
             # Handle metadata actions (transfer, close, suggestions)
             metadata = handler_response.metadata or {}
             
             # Check if we need to close chat
             if metadata.get("action") == "close_chat":
-                close_result = salesiq_api.close_chat(session_id, metadata.get("reason", "resolved"))
-                logger.info(f"[Handler] Chat closure result: {close_result}")
+                close_result = await dispatch_side_effect(
+                    "salesiq.close_chat", side_effect_key("close", session_id, message_text),
+                    session_id=session_id, reason=metadata.get("reason", "resolved")
+                )
+                logger.info("[Handler] Chat closure result: %s", close_result)
                 
                 if session_id in conversations:
                     reason = metadata.get("reason", "resolved")
-                    logger.info(f"[Metrics] 📊 CONVERSATION ENDED - Reason: {reason.upper()}")
+                    logger.info("[Metrics] 📊 CONVERSATION ENDED - Reason: %s", reason.upper())
                     metrics_collector.end_conversation(session_id, "resolved")
                     state_manager.end_session(session_id, ConversationState.RESOLVED)
                     del conversations[session_id]
+                    release_session_resources(session_id)
             
             # Check if we need to show suggestions/buttons
             if metadata.get("action") == "show_suggestions":
-                conversations[session_id].append({"role": "user", "content": message_text})
-                conversations[session_id].append({"role": "assistant", "content": response_text})
+                conversations[session_id].add("user", message_text)
+                conversations[session_id].add("assistant", response_text)
                 
                 return JSONResponse(
                     status_code=200,
@@ -1523,19 +1806,22 @@ async def _salesiq_webhook_inner(request: dict):
                     conversation_text += f"{role}: {msg.get('content', '')}\n"
                 
                 # Call SalesIQ API with structured history
-                logger.info(f"[Handler] Transferring {len(past_messages)} messages to agent")
-                api_result = salesiq_api.create_chat_session(
-                    session_id, 
+                logger.info("[Handler] Transferring %s messages to agent", len(past_messages))
+                api_result = await dispatch_side_effect(
+                    "salesiq.transfer",
+                    side_effect_key("transfer", session_id, message_text),
+                    visitor_id=session_id,
                     conversation_history=conversation_text,
                     past_messages=past_messages
                 )
-                logger.info(f"[Handler] Transfer API result: {api_result}")
+                logger.info("[Handler] Transfer API result: %s", api_result)
                 
                 if session_id in conversations:
-                    logger.info(f"[Metrics] 📊 CONVERSATION ENDED - Reason: Agent Transfer")
+                    logger.info("[Metrics] 📊 CONVERSATION ENDED - Reason: Agent Transfer")
                     metrics_collector.end_conversation(session_id, "escalated")
                     state_manager.end_session(session_id, ConversationState.ESCALATED)
                     del conversations[session_id]
+                    release_session_resources(session_id)
             
             # Check for callback scheduling
             if metadata.get("action") == "schedule_callback":
@@ -1547,30 +1833,39 @@ async def _salesiq_webhook_inner(request: dict):
                 # Build conversation history text
                 conversation_text = "\n".join([f"{msg.get('role')}: {msg.get('content')}" for msg in history])
                 
-                logger.info(f"[Callback] Creating callback: phone={phone}, time={preferred_time}")
+                logger.info("[Callback] Creating callback: phone=%s, time=%s", phone, preferred_time)
                 
-                api_result = desk_api.create_callback_ticket(
+                api_result = await dispatch_side_effect(
+                    "desk.callback",
+                    side_effect_key("callback", session_id, message_text),
+                    session_id=session_id,
                     visitor_email=visitor_email,
                     visitor_name=visitor_name,
                     conversation_history=conversation_text,
                     preferred_time=preferred_time,
                     phone=phone
                 )
-                logger.info(f"[Handler] Callback API result: {api_result}")
+                logger.info("[Handler] Callback API result: %s", api_result)
+                if api_result.get("queued"):
+                    response_text = CALLBACK_RECEIVED_REPLY
+                elif not api_result.get("success"):
+                    response_text = CALLBACK_FAILED_REPLY
                 
                 if api_result.get("success"):
-                    logger.info(f"[Metrics] 📊 CONVERSATION ENDED - Reason: Callback Scheduled")
-                    close_result = salesiq_api.close_chat(session_id, "callback_scheduled")
-                    logger.info(f"[Handler] Chat closure result: {close_result}")
+                    logger.info("[Metrics] 📊 CONVERSATION ENDED - Reason: Callback Scheduled")
                     
                     if session_id in conversations:
                         metrics_collector.end_conversation(session_id, "resolved")
                         state_manager.end_session(session_id, ConversationState.RESOLVED)
                         del conversations[session_id]
+                        release_session_resources(session_id)
             
             # Check for ticket creation
             if metadata.get("action") == "create_ticket":
-                api_result = desk_api.create_support_ticket(
+                api_result = await dispatch_side_effect(
+                    "desk.support_ticket",
+                    side_effect_key("ticket", session_id, message_text),
+                    session_id=session_id,
                     user_name="pending",
                     user_email="pending",
                     phone="pending",
@@ -1578,20 +1873,19 @@ async def _salesiq_webhook_inner(request: dict):
                     issue_type="general",
                     conversation_history="\n".join([f"{msg.get('role')}: {msg.get('content')}" for msg in history])
                 )
-                logger.info(f"[Handler] Ticket API result: {api_result}")
+                logger.info("[Handler] Ticket API result: %s", api_result)
                 
-                logger.info(f"[Metrics] 📊 CONVERSATION ENDED - Reason: Support Ticket Created")
-                close_result = salesiq_api.close_chat(session_id, "ticket_created")
-                logger.info(f"[Handler] Chat closure result: {close_result}")
+                logger.info("[Metrics] 📊 CONVERSATION ENDED - Reason: Support Ticket %s", 'Requested' if api_result.get('queued') else 'Created')
                 
                 if session_id in conversations:
                     metrics_collector.end_conversation(session_id, "escalated")
                     state_manager.end_session(session_id, ConversationState.ESCALATED)
                     del conversations[session_id]
+                    release_session_resources(session_id)
             
             # Standard response (no special action)
-            conversations[session_id].append({"role": "user", "content": message_text})
-            conversations[session_id].append({"role": "assistant", "content": response_text})
+            conversations[session_id].add("user", message_text)
+            conversations[session_id].add("assistant", response_text)
             
             return JSONResponse(
                 status_code=200,
@@ -1603,15 +1897,60 @@ async def _salesiq_webhook_inner(request: dict):
             )
         
         # No handler matched, continue with existing hardcoded logic or LLM
-        logger.info(f"[Handler] No handler matched, continuing with existing logic")
+        logger.info("[Handler] No handler matched, continuing with existing logic")
+        
+        # Token budget exhausted: canned escalation instead of another LLM call
+        if token_budget.is_exhausted(session_id):
+            logger.warning("[Token Budget] Session %s exhausted its token budget - offering escalation", session_id)
+            token_budget.record_degraded_turn(token_budget.level(session_id))
+            if speculation:
+                speculation.discard("budget_exhausted")
+            
+            state_manager.transition(session_id, TransitionTrigger.SOLUTION_FAILED)
+            response_text = "To make sure you get the best help with this, let me connect you with our support team:"
+            conversations[session_id].add("user", message_text)
+            conversations[session_id].add("assistant", response_text)
+            metrics_collector.record_message(session_id, is_llm_call=False)
+            
+            return JSONResponse(
+                status_code=200,
+                content={
+                    "action": "reply",
+                    "replies": [response_text],
+                    "suggestions": [
+                        {
+                            "text": "📞 Instant Chat",
+                            "action_type": "reply",
+                            "action_value": "1"
+                        },
+                        {
+                            "text": "📅 Schedule Callback",
+                            "action_type": "reply",
+                            "action_value": "2"
+                        }
+                    ],
+                    "session_id": session_id
+                }
+            )
         
         # Generate LLM response with embedded resolution steps
-        logger.info(f"[LLM] 🤖 CALLING Gemini 2.5 Flash for category: {category}")
-        response_text, tokens_used = generate_response(message_text, history, category=category)
-        logger.info(f"[LLM] ✓ Response generated | Tokens used: {tokens_used} | Category: {category}")
+        saved_seconds = None
+        if speculation and speculation.category == category:
+            logger.info("[LLM] 🤖 Using speculative Gemini 2.5 Flash response for category: %s", category)
+            response_text, tokens_used = await deadline_tracker.run("generation", speculation.result())
+            saved_seconds = speculation.saved_seconds
+        else:
+            if speculation:
+                speculation.discard("category_mismatch")
+            logger.info("[LLM] 🤖 CALLING Gemini 2.5 Flash for category: %s", category)
+            response_text, tokens_used = await deadline_tracker.run(
+                "generation",
+                generate_response(message_text, history, category=category, session_id=session_id)
+            )
+        logger.info("[LLM] ✓ Response generated | Tokens used: %s | Category: %s", tokens_used, category)
         
         # Record metrics
-        logger.info(f"[Metrics] 📊 Recording message: LLM=True, Tokens={tokens_used}, Category={category}")
+        logger.info("[Metrics] 📊 Recording message: LLM=True, Tokens=%s, Category=%s", tokens_used, category)
         metrics_collector.record_message(session_id, is_llm_call=True, tokens_used=tokens_used)
         
         # Clean response
@@ -1639,14 +1978,17 @@ async def _salesiq_webhook_inner(request: dict):
         
         # Only add escalation if response explicitly says it doesn't understand (not just because it's short)
         if response_seems_unclear:
-            logger.info(f"[Fallback] Response indicates unclear understanding - adding escalation option")
+            logger.info("[Fallback] Response indicates unclear understanding - adding escalation option")
             response_text += "\n\nIf I'm not understanding correctly, would you like to speak with our support team? I can connect you to an agent or schedule a callback." 
         
-        logger.info(f"[SalesIQ] Response generated: {response_text[:100]}...")
+        logger.info("[SalesIQ] Response generated: %s...", response_text[:100])
         
         # Update conversation history
-        conversations[session_id].append({"role": "user", "content": message_text})
-        conversations[session_id].append({"role": "assistant", "content": response_text})
+        conversations[session_id].add("user", message_text)
+        conversations[session_id].add("assistant", response_text)
+        
+        # Record LLM-path latency (speculative vs sequential) for /metrics
+        speculation_tracker.record_latency(time.perf_counter() - turn_started_at, saved_seconds)
         
         return JSONResponse(
             status_code=200,
@@ -1657,12 +1999,19 @@ async def _salesiq_webhook_inner(request: dict):
             }
         )
         
+    except DeadlineExceeded as e:
+        # Out of time - answer with a canned reply for the issue category instead of timing out
+        if speculation:
+            speculation.discard("deadline")
+        category = issue_router.classify(message_text) if message_text else "other"
+        logger.warning("[SalesIQ] %s - sending canned %s reply", e, category)
+        return fallback_reply(canned_reply(category), session_id)
     except Exception as e:
         error_msg = str(e)
         error_trace = traceback.format_exc()
         
-        logger.error(f"[SalesIQ] ERROR: {error_msg}")
-        logger.error(f"[SalesIQ] Traceback: {error_trace}")
+        logger.error("[SalesIQ] ERROR: %s", error_msg)
+        logger.error("[SalesIQ] Traceback: %s", error_trace)
         
         # Track critical error and send alert if threshold exceeded
         track_error(
@@ -1679,39 +2028,71 @@ async def _salesiq_webhook_inner(request: dict):
         if session_id:
             metrics_collector.record_error(session_id)
         
-        return JSONResponse(
-            status_code=200,
-            content={
-                "action": "reply",
-                "replies": ["I'm having technical difficulties. Please call our support team at 1-888-415-5240."],
-                "session_id": session_id or 'unknown'
-            }
-        )
+        return fallback_reply("I'm having technical difficulties. Please call our support team at 1-888-415-5240.", session_id)
+    finally:
+        # Any speculative generation not consumed by the LLM path is wasted work
+        if speculation:
+            speculation.discard("handled_without_llm")
 
 @app.post("/chat")
 async def chat(request: ChatRequest):
     """Main chat endpoint for n8n webhook"""
+    started = time.perf_counter()
+    try:
+        with deadline_tracker.start("chat"):
+            async with session_locks.hold(request.session_id):
+                session_persistence.ensure_loaded(request.session_id)
+                try:
+                    with session_store.unit_of_work():
+                        return await _chat_inner(request)
+                finally:
+                    session_expiry.touch(request.session_id)
+                    session_persistence.mark_dirty(request.session_id)
+    except DeadlineExceeded as e:
+        # The session's lease was held past the deadline - nothing ran, nothing to persist
+        logger.warning("[Chat] %s - sending canned reply", e)
+        return ChatResponse(
+            session_id=request.session_id,
+            response=canned_reply("other"),
+            timestamp=datetime.now().isoformat()
+        )
+    finally:
+        prometheus_exporter.observe_request("chat", time.perf_counter() - started)
+
+async def _chat_inner(request: ChatRequest):
+    """Chat turn body (runs under the session lock)"""
     try:
         session_id = request.session_id
         message = request.message
         
         # Set session context for logging
-        session_id_var.set(session_id)
-        logger.info(f"[Chat] New message received")
+        bind_session(session_id)
+        logger.info("[Chat] New message received")
         
         if session_id not in conversations:
-            conversations[session_id] = []
+            conversations[session_id] = ConversationHistory()
         
         history = conversations[session_id]
         
         # Classify message category
         category = issue_router.classify(message)
-        logger.info(f"[Chat] Message classified as: {category}")
+        logger.info("[Chat] Message classified as: %s", category)
         
-        response_text = generate_response(message, history, category=category)
+        try:
+            response_text, tokens_used = await deadline_tracker.run(
+                "generation",
+                generate_response(message, history, category=category, session_id=session_id)
+            )
+        except DeadlineExceeded as e:
+            logger.warning("[Chat] %s - sending canned %s reply", e, category)
+            return ChatResponse(
+                session_id=session_id,
+                response=canned_reply(category),
+                timestamp=datetime.now().isoformat()
+            )
         
-        conversations[session_id].append({"role": "user", "content": message})
-        conversations[session_id].append({"role": "assistant", "content": response_text})
+        conversations[session_id].add("user", message)
+        conversations[session_id].add("assistant", response_text)
         
         return ChatResponse(
             session_id=session_id,
@@ -1721,7 +2102,7 @@ async def chat(request: ChatRequest):
         
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"[Chat] Error processing message: {error_msg}")
+        logger.error("[Chat] Error processing message: %s", error_msg)
         
         # Track error with context
         track_error(
@@ -1735,18 +2116,192 @@ async def chat(request: ChatRequest):
         
         raise HTTPException(status_code=500, detail=error_msg)
 
+def format_sse(data: dict, event: Optional[str] = None) -> str:
+    """Format a Server-Sent-Events frame"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Streaming chat endpoint (Server-Sent Events)
+    
+    Emits one `data: {"delta": "..."}` frame per token chunk, then a final
+    `event: done` frame with the full response and token count, or an
+    `event: error` frame if the turn failed part-way. If the chat deadline
+    runs out, the `done` frame carries a canned reply instead.
+    """
+    bind_session(request.session_id)
+    logger.info("[Chat Stream] New message received")
+    
+    # The turn runs as its own task and reads the LLM stream as fast as it arrives, so the
+    # LLM slot is released when the upstream response ends, not when a slow client has read it
+    frames: asyncio.Queue = asyncio.Queue()
+    turn = asyncio.create_task(_chat_stream_turn(request, frames))
+    
+    async def event_stream():
+        try:
+            while True:
+                frame = await frames.get()
+                if frame is None:
+                    break
+                yield frame
+        finally:
+            if not turn.done():
+                # Client went away - stop generating; the turn persists what was streamed so far
+                logger.info("[Chat Stream] Client disconnected - cancelling turn")
+                turn.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _chat_stream_turn(request: ChatRequest, frames: asyncio.Queue):
+    """Streamed chat turn: puts SSE frames on `frames`, then None
+    
+    The request's own trace closes as soon as the StreamingResponse is
+    returned, so the turn records its spans in a trace of its own (same
+    request ID) that stays open until the stream is finished.
+    """
+    try:
+        with tracer.trace("POST /chat/stream turn"):
+            bind_session(request.session_id)
+            # Held until the turn is persisted, so webhook, /chat and stream turns never interleave
+            with deadline_tracker.start("chat"):
+                async with session_locks.hold(request.session_id):
+                    await _chat_stream_locked(request, frames)
+    except DeadlineExceeded as e:
+        # The session's lease was held past the deadline - answer like a deadline miss mid-turn
+        logger.warning("[Chat Stream] %s - sending canned reply", e)
+        frames.put_nowait(format_sse(
+            {
+                "session_id": request.session_id,
+                "response": canned_reply("other"),
+                "tokens_used": 0,
+                "timestamp": datetime.now().isoformat()
+            },
+            event="done"
+        ))
+    finally:
+        frames.put_nowait(None)
+
+async def _chat_stream_locked(request: ChatRequest, frames: asyncio.Queue):
+    """Stream turn body (runs under the session lock)"""
+    session_id = request.session_id
+    message = request.message
+    streamed: List[str] = []
+    tokens_used = 0
+    persisted = False
+    category = "other"
+    
+    def persist(response_text: str):
+        # Persist the turn exactly like /chat (the metrics entry is written back with it)
+        nonlocal persisted
+        persisted = True
+        with session_store.unit_of_work():
+            conversations.setdefault(session_id, ConversationHistory()).add("user", message)
+            conversations[session_id].add("assistant", response_text)
+            metrics_collector.record_message(session_id, is_llm_call=True, tokens_used=tokens_used)
+        session_expiry.touch(session_id)
+        session_persistence.mark_dirty(session_id)
+    
+    try:
+        session_persistence.ensure_loaded(session_id)
+        if session_id not in conversations:
+            conversations[session_id] = ConversationHistory()
+        history = conversations[session_id]
+        
+        # Classify message category
+        category = issue_router.classify(message)
+        logger.info("[Chat Stream] Message classified as: %s", category)
+        metrics_collector.start_conversation(session_id, category, category != "other")
+        
+        if not gemini_generator or token_budget.is_exhausted(session_id):
+            response_text, tokens_used = await deadline_tracker.run(
+                "generation",
+                generate_response(message, history, category=category, session_id=session_id)
+            )
+            streamed.append(response_text)
+            frames.put_nowait(format_sse({"delta": response_text}))
+        else:
+            system_prompt, kb_context = build_generation_prompt(message, history, category)
+            stream = gemini_generator.generate_response_stream(
+                message=message,
+                history=list(history),
+                system_prompt=system_prompt,
+                category=category,
+                session_id=session_id,
+                kb_context=kb_context
+            )
+            
+            async def relay():
+                async for delta in stream:
+                    streamed.append(delta)
+                    frames.put_nowait(format_sse({"delta": delta}))
+            
+            # The whole stream shares the request's deadline; running out cancels it mid-stream
+            await deadline_tracker.run("generation", relay())
+            tokens_used = stream.tokens_used
+            if stream.interrupted:
+                raise RuntimeError("LLM stream ended early")
+            response_text = stream.text
+        
+        persist(response_text)
+        frames.put_nowait(format_sse(
+            {
+                "session_id": session_id,
+                "response": response_text,
+                "tokens_used": tokens_used,
+                "timestamp": datetime.now().isoformat()
+            },
+            event="done"
+        ))
+    except DeadlineExceeded as e:
+        # Out of time - the canned reply replaces what was streamed, and like /chat nothing is persisted
+        logger.warning("[Chat Stream] %s - sending canned %s reply", e, category)
+        streamed.clear()
+        frames.put_nowait(format_sse(
+            {
+                "session_id": session_id,
+                "response": canned_reply(category),
+                "tokens_used": tokens_used,
+                "timestamp": datetime.now().isoformat()
+            },
+            event="done"
+        ))
+    except Exception as e:
+        logger.error("[Chat Stream] Error processing message: %s", e)
+        track_error("chat_stream_error", str(e), {"session_id": session_id, "error_type": type(e).__name__})
+        frames.put_nowait(format_sse(
+            {
+                "session_id": session_id,
+                "error": "I'm having technical difficulties. Please call our support team at 1-888-415-5240.",
+                "partial_response": "".join(streamed).strip()
+            },
+            event="error"
+        ))
+    finally:
+        # Keep whatever was streamed before an error or a client disconnect
+        partial = "".join(streamed).strip()
+        if not persisted and partial:
+            persist(partial)
+
 @app.post("/reset/{session_id}")
 async def reset_conversation(session_id: str):
     """Reset conversation for a session"""
     try:
-        session_id_var.set(session_id)
+        bind_session(session_id)
         logger.info(f"[Reset] Resetting conversation")
+        session_persistence.ensure_loaded(session_id)
         
-        if session_id in conversations:
-            metrics_collector.end_conversation(session_id, "abandoned")
-            state_manager.end_session(session_id, ConversationState.ABANDONED)
-            del conversations[session_id]
-            return {"status": "success", "message": f"Conversation {session_id} reset"}
+        with session_store.unit_of_work():
+            if session_id in conversations:
+                metrics_collector.end_conversation(session_id, "abandoned")
+                state_manager.end_session(session_id, ConversationState.ABANDONED)
+                del conversations[session_id]
+                release_session_resources(session_id)
+                return {"status": "success", "message": f"Conversation {session_id} reset"}
         return {"status": "not_found", "message": f"Session {session_id} not found"}
     
     except Exception as e:
@@ -1801,7 +2356,7 @@ async def test_salesiq_transfer_get():
         logger.info(f"[Test] Initiating SalesIQ Visitor API transfer (GET) with user_id={test_user_id}")
         logger.info(f"[Test] Including {len(past_messages)} sample messages")
         
-        result = salesiq_api.create_chat_session(
+        result = await salesiq_api.create_chat_session_async(
             test_user_id, 
             conversation_history=conversation_text,
             past_messages=past_messages
@@ -1854,7 +2409,7 @@ async def test_salesiq_transfer_post(payload: Dict):
         )
         logger.info(f"[Test] Including {len(past_messages)} messages in transfer")
         
-        result = salesiq_api.create_chat_session(
+        result = await salesiq_api.create_chat_session_async(
             visitor_user_id,
             conversation_history=conversation_text,
             past_messages=past_messages
@@ -1873,16 +2428,53 @@ async def get_metrics():
     """Get comprehensive chatbot performance metrics
     
     Returns:
-        JSON object with automation rate, category distribution, LLM usage, and more
+        JSON object with automation rate, category distribution, LLM usage, and more.
+        Conversation counters are for the worker that served the request
+        (overview.scope / overview.worker_pid).
     """
     try:
         summary = metrics_collector.get_summary()
+        summary["speculation"] = speculation_tracker.get_stats()
+        if gemini_generator:
+            summary["prompt_cache"] = gemini_generator.get_cache_stats()
+        summary["history_compaction"] = history_compactor.get_stats()
+        summary["token_budget"] = token_budget.get_stats()
+        summary["kb_retrieval"] = kb_retriever.get_stats()
+        summary["fast_classifier"] = fast_classifier.get_stats()
+        summary["outbox"] = outbox.get_stats()
+        summary["session_locks"] = session_locks.get_stats()
+        summary["webhook_dedup"] = reply_cache.get_stats()
+        summary["deadlines"] = deadline_tracker.get_stats()
+        summary["session_store"] = session_store.get_stats()
+        summary["session_persistence"] = session_persistence.get_stats()
+        summary["session_expiry"] = session_expiry.get_stats()
+        summary["event_loop"] = loop_watchdog.get_stats()
+        summary["logging"] = log_pipeline.get_stats()
+        summary["alerting"] = alert_aggregator.get_stats()
         logger.info(f"[Metrics] Metrics requested - {summary['overview']['total_conversations']} conversations tracked")
         return summary
     except Exception as e:
         logger.error(f"[Metrics] Error fetching metrics: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/outbox")
+async def get_outbox_status():
+    """Get outbox status for queued Zoho side effects
+    
+    Returns:
+        JSON object with queue depth, oldest pending job age, jobs by status and recent failures
+    """
+    try:
+        return outbox.get_stats()
+    except Exception as e:
+        logger.error(f"[Outbox] Error fetching status: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics/prometheus")
+async def get_prometheus_metrics():
+    """Prometheus scrape endpoint (text exposition format 0.0.4)"""
+    return Response(content=prometheus_exporter.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/metrics/report")
 async def get_metrics_report():
     """Get human-readable metrics report
@@ -1906,6 +2498,7 @@ async def reset_metrics():
     """
     try:
         metrics_collector.reset()
+        usage_ledger.reset()
         logger.warning("[Metrics] All metrics have been reset")
         return {"status": "success", "message": "All metrics have been reset"}
     except Exception as e:
@@ -1980,7 +2573,7 @@ async def get_statistics():
     - Category breakdown with percentages
     - Resolution type distribution
     - Average metrics
-    - Time-based analysis
+    - Rolling last-hour and last-24-hour windows
     """
     try:
         metrics_summary = metrics_collector.get_summary()
@@ -2040,6 +2633,8 @@ async def get_statistics():
                 "router_effectiveness": metrics_summary['performance']['router_effectiveness']
             },
             "llm_usage": metrics_summary['llm_usage'],
+            "llm_ledger": usage_ledger.get_stats(),
+            "rolling_windows": metrics_summary['windows'],
             "handlers": handler_stats,
             "timestamp": datetime.now().isoformat()
         }
@@ -2062,4 +2657,14 @@ if __name__ == "__main__":
     print("\n[READY] Ready to receive webhooks!")
     print("="*70 + "\n")
     
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Several workers need a session store they can share
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1 and not session_store.shared:
+        print(f"[WARNING] WEB_CONCURRENCY={workers} needs SESSION_STORE_BACKEND=sqlite or redis - running 1 worker")
+        workers = 1
+    
+    if workers > 1:
+        print(f"[WORKERS] {workers} worker processes sharing the {session_store.backend_name} session store")
+        uvicorn.run("llm_chatbot:app", host="0.0.0.0", port=port, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,245 @@
+"""
+Aggregated Alert Pipeline
+
+track_error()/send_critical_alert() used to POST to ERROR_ALERT_WEBHOOK
+synchronously from inside the failing request, so an upstream outage made
+every failing webhook also block on an outbound call. Errors are now only
+recorded in memory (O(1) per error) and a background task ships
+deduplicated summaries:
+
+- Errors are buffered by type: count, first/last seen, latest message and
+  up to ALERT_SAMPLE_CONTEXTS sample contexts (with request IDs).
+- Every ALERT_FLUSH_SECONDS, types that reached ALERT_THRESHOLD errors (or
+  had a critical alert) are sent together in one summary POST; the rest stay
+  buffered until they reach the threshold.
+- Outbound alerts are capped by a token bucket (ALERT_BURST alerts, refilled
+  at ALERT_RATE_PER_MINUTE). Without a token, or if the POST fails, the
+  summary stays buffered and is merged into the next flush.
+- At most ALERT_MAX_TYPES error types are buffered; errors of further types
+  are counted as overflow.
+
+Every error also increments chatbot_errors_total{error_type} (Prometheus).
+
+Configuration:
+- ERROR_ALERT_WEBHOOK: Where alert summaries are POSTed (default unset = log only)
+- ALERT_THRESHOLD: Errors of one type before it is alerted (default 3)
+- ALERT_FLUSH_SECONDS: How often summaries are sent (default 30)
+- ALERT_BURST: Alerts that can be sent back to back (default 5)
+- ALERT_RATE_PER_MINUTE: Sustained alert rate (default 2)
+- ALERT_SAMPLE_CONTEXTS: Sample contexts kept per error type (default 3)
+- ALERT_MAX_TYPES: Error types buffered at once (default 200)
+"""
+
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from services.prometheus_exporter import Counter, prometheus_exporter
+from services.tracing import request_id_var
+
+logger = logging.getLogger(__name__)
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class TokenBucket:
+    """Allows `capacity` events at once, refilled at `rate` events per second"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class ErrorAggregate:
+    """Buffered occurrences of one error type"""
+    __slots__ = ("error_type", "count", "first_seen", "last_seen", "message", "critical", "samples")
+
+    def __init__(self, error_type: str, now: float):
+        self.error_type = error_type
+        self.count = 0
+        self.first_seen = now
+        self.last_seen = now
+        self.message = ""
+        self.critical = False
+        self.samples: List[Dict] = []
+
+    def merge(self, other: "ErrorAggregate", max_samples: int):
+        """Fold a newer aggregate of the same type into this one"""
+        self.count += other.count
+        self.first_seen = min(self.first_seen, other.first_seen)
+        self.last_seen = max(self.last_seen, other.last_seen)
+        self.message = other.message or self.message
+        self.critical = self.critical or other.critical
+        self.samples = (self.samples + other.samples)[:max_samples]
+
+    def to_dict(self) -> Dict:
+        return {
+            "error_type": self.error_type,
+            "severity": "CRITICAL" if self.critical else "ERROR",
+            "count": self.count,
+            "first_seen": _iso(self.first_seen),
+            "last_seen": _iso(self.last_seen),
+            "message": self.message,
+            "samples": self.samples
+        }
+
+
+class AlertAggregator:
+    """Buffers errors by type and ships rate-limited summaries in the background"""
+
+    def __init__(self):
+        self.webhook = os.getenv("ERROR_ALERT_WEBHOOK") or None
+        self.threshold = int(os.getenv("ALERT_THRESHOLD", "3"))
+        self.flush_interval = float(os.getenv("ALERT_FLUSH_SECONDS", "30"))
+        self.max_samples = int(os.getenv("ALERT_SAMPLE_CONTEXTS", "3"))
+        self.max_types = int(os.getenv("ALERT_MAX_TYPES", "200"))
+        self.bucket = TokenBucket(float(os.getenv("ALERT_RATE_PER_MINUTE", "2")) / 60,
+                                  float(os.getenv("ALERT_BURST", "5")))
+        self.pending: Dict[str, ErrorAggregate] = {}
+        self.errors = Counter("chatbot_errors_total", "Errors tracked for alerting", ("error_type",))
+        prometheus_exporter.register_metric(self.errors)
+        self._worker: Optional[asyncio.Task] = None
+        self.stats = {"errors": 0, "overflow": 0, "alerts_sent": 0, "alerted_types": 0,
+                      "rate_limited": 0, "send_failures": 0, "last_sent_at": None}
+
+        logger.info(f"AlertAggregator initialized (webhook: {'set' if self.webhook else 'not set'}, "
+                    f"threshold: {self.threshold}, flush every {self.flush_interval:.0f}s)")
+
+    def record(self, error_type: str, message: str, context: Optional[Dict] = None, critical: bool = False):
+        """Buffer one error (no I/O - safe to call from any request)"""
+        now = time.time()
+        self.stats["errors"] += 1
+        self.errors.inc(1, error_type)
+        entry = self.pending.get(error_type)
+        if entry is None:
+            if len(self.pending) >= self.max_types:
+                self.stats["overflow"] += 1
+                return
+            entry = self.pending[error_type] = ErrorAggregate(error_type, now)
+        entry.count += 1
+        entry.last_seen = now
+        entry.message = message
+        entry.critical = entry.critical or critical
+        if len(entry.samples) < self.max_samples:
+            entry.samples.append({"at": _iso(now), "message": message, "context": context or {},
+                                  "request_id": request_id_var.get()})
+
+    def due(self) -> List[ErrorAggregate]:
+        """Buffered types that should be alerted now"""
+        return [entry for entry in self.pending.values() if entry.critical or entry.count >= self.threshold]
+
+    async def flush(self) -> int:
+        """Send one summary of every due error type
+
+        Returns:
+            Number of error types alerted (0 if nothing was due, rate-limited or the send failed)
+        """
+        due = self.due()
+        if not due:
+            return 0
+        if not self.bucket.take():
+            self.stats["rate_limited"] += 1
+            return 0
+
+        for entry in due:
+            del self.pending[entry.error_type]
+        summary = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "severity": "CRITICAL" if any(entry.critical for entry in due) else "ERROR",
+            "service": "llm-chatbot",
+            "total_errors": sum(entry.count for entry in due),
+            "alerts": [entry.to_dict() for entry in due]
+        }
+        for entry in due:
+            logger.warning(f"[Alerts] {entry.error_type}: {entry.count} errors - {entry.message}")
+
+        if self.webhook:
+            try:
+                await self._post(summary)
+            except Exception as e:
+                self.stats["send_failures"] += 1
+                logger.error(f"[Alerts] Failed to send alert summary: {e}")
+                self._restore(due)
+                return 0
+            logger.info(f"[Alerts] Sent summary of {len(due)} error types to webhook")
+        self.stats["alerts_sent"] += 1
+        self.stats["alerted_types"] += len(due)
+        self.stats["last_sent_at"] = summary["timestamp"]
+        return len(due)
+
+    def _restore(self, entries: List[ErrorAggregate]):
+        """Put unsent aggregates back, merging errors recorded meanwhile"""
+        for entry in entries:
+            newer = self.pending.get(entry.error_type)
+            if newer is not None:
+                entry.merge(newer, self.max_samples)
+            self.pending[entry.error_type] = entry
+
+    async def _post(self, summary: Dict):
+        if HTTPX_AVAILABLE:
+            async with httpx.AsyncClient(timeout=5, verify=False) as client:
+                response = await client.post(self.webhook, json=summary)
+                response.raise_for_status()
+        else:
+            import requests
+            response = await asyncio.to_thread(requests.post, self.webhook, json=summary, timeout=5, verify=False)
+            response.raise_for_status()
+
+    def start(self):
+        """Start the flush loop (call from the running event loop)"""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+            await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"[Alerts] Error flushing alerts: {e}", exc_info=True)
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "webhook_configured": self.webhook is not None,
+            "threshold": self.threshold,
+            "buffered_types": len(self.pending),
+            "due_types": len(self.due()),
+            "tokens_available": round(self.bucket.tokens, 2)
+        }
+
+
+# Global alert aggregator instance
+alert_aggregator = AlertAggregator()
@@ -0,0 +1,235 @@
+"""
+Compact Conversation History
+
+Each session's history used to be a list of {"role": ..., "content": ...}
+dicts, with state markers such as WAITING_FOR_CALLBACK_DETAILS injected as
+fake system messages. ConversationHistory stores the same turns compactly:
+
+- Turn: a __slots__ record holding an interned role code and the content
+  string (no per-turn dict). Turns are read-only Mappings, so existing
+  `msg.get("role")` / `msg["content"]` code keeps working.
+- flags: session markers kept beside the turns instead of as messages. Like
+  the sentinel messages they replace, flags describe the state after the
+  latest turn and are cleared when the next turn is recorded.
+- Optional cap: with CONVERSATION_HISTORY_MAX_MESSAGES set, the oldest
+  turns are dropped once the cap is reached (`dropped` counts them, so the
+  history compactor's summary positions stay valid).
+
+Slicing returns a HistoryView over the live turns instead of a copied list,
+and openai_messages()/salesiq_past_messages() produce the wire formats
+lazily from any history or view. Views are only valid until the history
+changes - copy with list() before handing one to a background task.
+
+Configuration:
+- CONVERSATION_HISTORY_MAX_MESSAGES: Messages kept per session, 0 = unbounded (default 0)
+"""
+
+import os
+import time
+from collections.abc import Mapping, Sequence
+from enum import IntFlag
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+# Role codes - index into ROLES
+ROLES = ("user", "assistant", "system")
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+USER, ASSISTANT, SYSTEM = range(len(ROLES))
+
+MAX_MESSAGES = int(os.getenv("CONVERSATION_HISTORY_MAX_MESSAGES", "0"))
+
+# Sentinel message that marked a pending callback before HistoryFlag
+LEGACY_CALLBACK_MARKER = "WAITING_FOR_CALLBACK_DETAILS"
+
+
+class HistoryFlag(IntFlag):
+    """Session markers stored beside the turns"""
+    NONE = 0
+    # Callback was offered - the next visitor message carries time/phone details
+    AWAITING_CALLBACK_DETAILS = 1
+
+
+class Turn(Mapping):
+    """One message: interned role code + content"""
+    __slots__ = ("role_code", "content")
+
+    def __init__(self, role_code: int, content: str):
+        self.role_code = role_code
+        self.content = content
+
+    @classmethod
+    def from_message(cls, message: Any) -> "Turn":
+        """Turn from an OpenAI-style {"role", "content"} dict (or another Turn)"""
+        if isinstance(message, Turn):
+            return message
+        return cls(ROLE_CODES.get(message.get("role"), USER), message.get("content", ""))
+
+    @property
+    def role(self) -> str:
+        return ROLES[self.role_code]
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "role":
+            return ROLES[self.role_code]
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(("role", "content"))
+
+    def __len__(self) -> int:
+        return 2
+
+    def __repr__(self) -> str:
+        return f"Turn({self.role!r}, {self.content!r})"
+
+
+class HistoryView(Sequence):
+    """Read-only window over a history's turns (no copy)"""
+    __slots__ = ("turns", "start", "stop")
+
+    def __init__(self, turns: List[Turn], start: int, stop: int):
+        self.turns = turns
+        self.start = start
+        self.stop = stop
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Turn, "HistoryView"]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            return HistoryView(self.turns, self.start + start, self.start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        return self.turns[self.start + index]
+
+    def __iter__(self) -> Iterator[Turn]:
+        return map(self.turns.__getitem__, range(self.start, self.stop))
+
+
+class ConversationHistory(Sequence):
+    """Compact per-session message history"""
+    __slots__ = ("turns", "flags", "dropped", "max_messages")
+
+    def __init__(self, messages: Iterable[Any] = (), flags: int = 0, dropped: int = 0,
+                 max_messages: Optional[int] = None):
+        self.turns: List[Turn] = [Turn.from_message(m) for m in messages]
+        self.flags = HistoryFlag(flags)
+        # Messages evicted from the front by the cap
+        self.dropped = dropped
+        self.max_messages = MAX_MESSAGES if max_messages is None else max_messages
+        self._trim()
+
+    def _trim(self):
+        excess = len(self.turns) - self.max_messages
+        if self.max_messages and excess > 0:
+            del self.turns[:excess]
+            self.dropped += excess
+
+    def add(self, role: str, content: str):
+        """Record a message (clears the flags, which describe the previous turn)"""
+        self.turns.append(Turn(ROLE_CODES[role], content))
+        self.flags = HistoryFlag.NONE
+        if self.max_messages:
+            self._trim()
+
+    def append(self, message: Any):
+        """Record an OpenAI-style {"role", "content"} message"""
+        turn = Turn.from_message(message)
+        self.add(ROLES[turn.role_code], turn.content)
+
+    def pop(self) -> Turn:
+        return self.turns.pop()
+
+    def clear(self):
+        self.turns.clear()
+        self.flags = HistoryFlag.NONE
+
+    def set_flag(self, flag: HistoryFlag):
+        self.flags |= flag
+
+    def has_flag(self, flag: HistoryFlag) -> bool:
+        return bool(self.flags & flag)
+
+    def clear_flag(self, flag: HistoryFlag):
+        self.flags &= ~flag
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Turn, HistoryView]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self.turns))
+            if step != 1:
+                return self.turns[index]
+            return HistoryView(self.turns, start, max(start, stop))
+        return self.turns[index]
+
+    def __iter__(self) -> Iterator[Turn]:
+        return iter(self.turns)
+
+    def __reversed__(self) -> Iterator[Turn]:
+        return reversed(self.turns)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ConversationHistory({list(self.turns)!r}, flags={self.flags!r})"
+
+    def to_dict(self) -> Dict:
+        """JSON-compatible form for session stores and persistence"""
+        return {
+            "turns": [[ROLES[turn.role_code], turn.content] for turn in self.turns],
+            "flags": int(self.flags),
+            "dropped": self.dropped
+        }
+
+    @classmethod
+    def from_dict(cls, data: Union[Dict, List]) -> "ConversationHistory":
+        if isinstance(data, list):
+            # Saved before the compact format: list of {"role", "content"} dicts
+            # with the callback marker as a trailing system message
+            if data and data[-1].get("content") == LEGACY_CALLBACK_MARKER:
+                return cls(data[:-1], flags=HistoryFlag.AWAITING_CALLBACK_DETAILS)
+            return cls(data)
+        history = cls(flags=data.get("flags", 0), dropped=data.get("dropped", 0))
+        history.turns = [Turn(ROLE_CODES[role], content) for role, content in data["turns"]]
+        history._trim()
+        return history
+
+
+def openai_messages(history: Iterable[Any]) -> Iterator[Dict[str, str]]:
+    """Chat-completion messages for a history or view (system turns are sent as assistant)"""
+    for msg in history:
+        yield {"role": "user" if msg.get("role") == "user" else "assistant", "content": msg.get("content", "")}
+
+
+def salesiq_past_messages(history: Sequence, now: Optional[float] = None) -> Iterator[Dict]:
+    """SalesIQ past_messages entries for a history or view
+
+    Timestamps are spaced 5s apart ending at `now`, so agents see the turns in order.
+    """
+    now = time.time() if now is None else now
+    total = len(history)
+    for idx, msg in enumerate(history):
+        role = msg.get("role", "user")
+        if role == "user":
+            sender_type, sender_name = "visitor", "Customer"
+        elif role == "assistant":
+            sender_type, sender_name = "bot", "AceBuddy"
+        else:
+            continue  # Skip system messages
+        yield {
+            "sender_type": sender_type,
+            "sender_name": sender_name,
+            "time": int((now - (total - idx) * 5) * 1000),
+            "text": msg.get("content", "")
+        }
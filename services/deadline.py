@@ -0,0 +1,187 @@
+"""
+End-to-End Request Deadlines
+
+SalesIQ only waits a limited time for the bot's reply. A deadline is started
+when a request arrives and carried to every downstream stage through a
+context variable, so classification, generation and Zoho calls all share one
+budget instead of each having its own timeout.
+
+Stages run through deadline_tracker.run(stage, awaitable): the awaitable is
+cancelled when the remaining budget runs out and DeadlineExceeded is raised,
+counted against that stage. Every run is also timed into the stage latency
+histogram and recorded as a trace span. The endpoint then answers with a canned reply
+for the issue category (canned_reply) instead of going silent.
+
+Configuration:
+- WEBHOOK_DEADLINE_SECONDS: Budget for /webhook/salesiq (default 10)
+- CHAT_DEADLINE_SECONDS: Budget for /chat and /chat/stream (default 30)
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Dict, Optional, TypeVar
+
+from services.prometheus_exporter import prometheus_exporter
+from services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Canned replies when the deadline runs out, by IssueRouter category
+CANNED_REPLIES = {
+    "login": (
+        "I'm sorry, this is taking longer than expected. For login or password issues, "
+        "you can reset your password at https://selfcare.acecloudhosting.com, or call our "
+        "support team at 1-888-415-5240 (24/7) for immediate help."
+    ),
+    "quickbooks": (
+        "I'm sorry, this is taking longer than expected. For QuickBooks issues, please call our "
+        "support team at 1-888-415-5240 (24/7) or email support@acecloudhosting.com and we'll help right away."
+    ),
+    "performance": (
+        "I'm sorry, this is taking longer than expected. For slow servers or disk space issues, "
+        "please call our support team at 1-888-415-5240 (24/7) so we can check your server right away."
+    ),
+    "printing": (
+        "I'm sorry, this is taking longer than expected. For printing issues, please call our "
+        "support team at 1-888-415-5240 (24/7) or email support@acecloudhosting.com."
+    ),
+    "office": (
+        "I'm sorry, this is taking longer than expected. For Microsoft Office issues, please call our "
+        "support team at 1-888-415-5240 (24/7) or email support@acecloudhosting.com."
+    ),
+    "other": (
+        "I'm sorry, this is taking longer than expected. Please send your message again, or contact "
+        "our support team at 1-888-415-5240 (24/7) or support@acecloudhosting.com."
+    ),
+}
+
+
+def canned_reply(category: Optional[str]) -> str:
+    """Fallback reply for a category when the deadline runs out"""
+    return CANNED_REPLIES.get(category or "other", CANNED_REPLIES["other"])
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline ran out during a stage"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """Absolute deadline for one request"""
+
+    def __init__(self, endpoint: str, budget_seconds: float):
+        self.endpoint = endpoint
+        self.budget_seconds = budget_seconds
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget_seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+
+class DeadlineTracker:
+    """Starts per-endpoint deadlines, enforces them per stage and counts misses"""
+
+    def __init__(self):
+        self.budgets = {
+            "webhook": float(os.getenv("WEBHOOK_DEADLINE_SECONDS", "10")),
+            "chat": float(os.getenv("CHAT_DEADLINE_SECONDS", "30")),
+        }
+        self.requests: Dict[str, int] = defaultdict(int)
+        self.misses_by_stage: Dict[str, int] = defaultdict(int)
+        self.misses_by_endpoint: Dict[str, int] = defaultdict(int)
+
+        logger.info(f"DeadlineTracker initialized (budgets: {self.budgets})")
+
+    @contextmanager
+    def start(self, endpoint: str):
+        """Run the enclosed request under the endpoint's deadline (no-op if its budget is <= 0)"""
+        budget = self.budgets.get(endpoint, 0)
+        deadline = Deadline(endpoint, budget) if budget > 0 else None
+        token = _current_deadline.set(deadline)
+        self.requests[endpoint] += 1
+        try:
+            yield deadline
+        finally:
+            _current_deadline.reset(token)
+
+    @staticmethod
+    def current() -> Optional[Deadline]:
+        return _current_deadline.get()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left for the current request (None if it has no deadline)"""
+        deadline = _current_deadline.get()
+        return deadline.remaining() if deadline else None
+
+    def _miss(self, deadline: Deadline, stage: str) -> DeadlineExceeded:
+        self.misses_by_stage[stage] += 1
+        self.misses_by_endpoint[deadline.endpoint] += 1
+        logger.warning(
+            f"[Deadline] {deadline.endpoint} exceeded its {deadline.budget_seconds:.1f}s budget during {stage}"
+        )
+        return DeadlineExceeded(stage)
+
+    def exceeded(self, stage: str) -> DeadlineExceeded:
+        """Count a miss for a stage that watches the deadline itself; returns the exception to raise"""
+        return self._miss(_current_deadline.get(), stage)
+
+    def check(self, stage: str):
+        """Raise DeadlineExceeded if the budget already ran out (for synchronous stages)"""
+        deadline = _current_deadline.get()
+        if deadline and deadline.expired():
+            raise self._miss(deadline, stage)
+
+    async def run(self, stage: str, awaitable: Awaitable[T]) -> T:
+        """Await a stage within the remaining budget, cancelling it if the budget runs out"""
+        started = time.perf_counter()
+        try:
+            with tracer.span(f"stage.{stage}"):
+                return await self._run(stage, awaitable)
+        finally:
+            prometheus_exporter.observe_stage(stage, time.perf_counter() - started)
+
+    async def _run(self, stage: str, awaitable: Awaitable[T]) -> T:
+        deadline = _current_deadline.get()
+        if deadline is None:
+            return await awaitable
+
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            # Close the never-awaited coroutine so it doesn't warn
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise self._miss(deadline, stage)
+
+        try:
+            return await asyncio.wait_for(awaitable, timeout=remaining)
+        except asyncio.TimeoutError:
+            raise self._miss(deadline, stage) from None
+
+    def get_stats(self) -> Dict:
+        return {
+            "budgets_seconds": self.budgets,
+            "requests": dict(self.requests),
+            "misses_by_endpoint": dict(self.misses_by_endpoint),
+            "misses_by_stage": dict(self.misses_by_stage),
+        }
+
+
+# Global deadline tracker instance
+deadline_tracker = DeadlineTracker()
@@ -0,0 +1,381 @@
+"""
+Local Fast-Path Turn Classifier
+
+Sits in front of classify_unified. A small hashed-feature logistic model
+(one softmax head per label set) predicts resolution / escalation / intent
+in microseconds; when every head is confident the turn skips the LLM
+round-trip entirely, otherwise the LLM classifies as before.
+
+The model is trained offline from the LLM's own decisions:
+1. Set FAST_CLASSIFIER_DECISION_LOG to a path - every LLM classification is
+   appended there as JSONL (message, last bot message, decisions, confidences)
+2. Run `python train_fast_classifier.py <decision_log.jsonl>`
+3. Restart - the model at FAST_CLASSIFIER_MODEL is loaded if present
+
+A fraction of confident turns (FAST_CLASSIFIER_SHADOW_RATE) still goes to the
+LLM so agreement with the LLM keeps being measured in production.
+
+Decision log lines go through a queue to a listener thread, so the file
+write never runs on the event loop.
+
+Configuration:
+- FAST_CLASSIFIER_ENABLED: Use the model when one is present (default true)
+- FAST_CLASSIFIER_MODEL: Model path (default config/models/fast_classifier.npz)
+- FAST_CLASSIFIER_THRESHOLD: Min probability on every head to skip the LLM (default 0.9)
+- FAST_CLASSIFIER_SHADOW_RATE: Share of confident turns also checked by the LLM (default 0.05)
+- FAST_CLASSIFIER_DECISION_LOG: JSONL path for LLM decisions (default off)
+"""
+
+import os
+import re
+import json
+import math
+import time
+import zlib
+import queue
+import atexit
+import random
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    logger.warning("numpy not installed - fast-path classifier disabled. Run: pip install numpy")
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config", "models", "fast_classifier.npz")
+
+# Label sets per head (same decisions classify_unified returns)
+HEADS = {
+    "resolution": ["RESOLVED", "UNRESOLVED", "UNCERTAIN"],
+    "escalation": ["NEEDS_HUMAN", "BOT_CAN_HANDLE", "UNCERTAIN"],
+    "intent": ["TRANSFER", "CALLBACK", "TICKET", "QUESTION", "OTHER"]
+}
+
+# Hashed feature space (2^14 buckets keeps the model ~1 MB)
+N_FEATURES = 2 ** 14
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def extract_features(message: str, last_bot_message: str = "") -> Tuple[List[int], List[float]]:
+    """
+    Hash a turn into sparse feature indices and values.
+
+    Features: message unigrams + bigrams, message length bucket, and the
+    last bot message's unigrams (prefixed, so "work" from the bot asking
+    "did that work?" differs from the user saying "work").
+
+    Returns:
+        Tuple of (indices, values), L2-normalized
+    """
+    tokens = TOKEN_PATTERN.findall(message.lower())
+    names = [f"u:{t}" for t in tokens]
+    names.extend(f"b:{a}_{b}" for a, b in zip(tokens, tokens[1:]))
+    names.append(f"len:{min(len(tokens), 12) // 3}")
+    if last_bot_message:
+        names.extend(f"bot:{t}" for t in set(TOKEN_PATTERN.findall(last_bot_message.lower())))
+        if "?" in last_bot_message:
+            names.append("bot_asked_question")
+
+    features: Dict[int, float] = defaultdict(float)
+    for name in names:
+        h = zlib.crc32(name.encode("utf-8"))  # Stable across processes (unlike hash())
+        features[h % N_FEATURES] += 1.0 if (h >> 31) & 1 else -1.0
+    indices = [i for i, v in features.items() if v]
+    values = [features[i] for i in indices]
+    norm = sum(v * v for v in values) ** 0.5 or 1.0
+    return indices, [v / norm for v in values]
+
+
+def last_bot_message(history: List[Dict]) -> str:
+    """Most recent assistant message in the history (empty if none)"""
+    for msg in reversed(history or []):
+        if msg.get("role") == "assistant":
+            return msg.get("content", "")
+    return ""
+
+
+def _softmax(logits):
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class FastClassifierModel:
+    """Hashed-feature multinomial logistic regression, one head per label set"""
+
+    def __init__(self, weights: Dict[str, "np.ndarray"], biases: Dict[str, "np.ndarray"],
+                 metadata: Optional[Dict] = None):
+        self.weights = weights  # head -> (N_FEATURES, n_labels)
+        self.biases = biases  # head -> (n_labels,)
+        self.metadata = metadata or {}
+        # All heads side by side so prediction is a single gather + matmul
+        self._stacked_weights = np.ascontiguousarray(np.concatenate([weights[h] for h in HEADS], axis=1))
+        self._stacked_bias = np.concatenate([biases[h] for h in HEADS])
+        self._head_slices = []
+        offset = 0
+        for head, labels in HEADS.items():
+            self._head_slices.append((head, labels, offset, offset + len(labels)))
+            offset += len(labels)
+
+    def predict(self, message: str, last_bot: str = "") -> Dict[str, Tuple[str, float]]:
+        """Predict (label, probability) for every head"""
+        indices, values = extract_features(message, last_bot)
+        logits = (np.asarray(values, dtype=np.float32) @ self._stacked_weights[indices] + self._stacked_bias).tolist()
+        results = {}
+        for head, labels, start, end in self._head_slices:
+            head_logits = logits[start:end]
+            top = max(head_logits)
+            exp = [math.exp(v - top) for v in head_logits]
+            best = exp.index(1.0)
+            results[head] = (labels[best], exp[best] / sum(exp))
+        return results
+
+    @classmethod
+    def train(cls, examples: List[Dict], epochs: int = 30, learning_rate: float = 2.0,
+              l2: float = 1e-4, batch_size: int = 128, seed: int = 13) -> "FastClassifierModel":
+        """
+        Train all heads with mini-batch gradient descent.
+
+        Args:
+            examples: Dicts with "message", optional "last_bot_message", and
+                      a decision string per head (see load_decision_log)
+        """
+        rng = np.random.default_rng(seed)
+        features = [extract_features(e["message"], e.get("last_bot_message", "")) for e in examples]
+        weights = {head: np.zeros((N_FEATURES, len(labels)), dtype=np.float32) for head, labels in HEADS.items()}
+        biases = {head: np.zeros(len(labels), dtype=np.float32) for head, labels in HEADS.items()}
+        targets = {
+            head: np.array([labels.index(e[head]) if e.get(head) in labels else -1 for e in examples])
+            for head, labels in HEADS.items()
+        }
+
+        order = np.arange(len(examples))
+        for _ in range(epochs):
+            rng.shuffle(order)
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                x = np.zeros((len(batch), N_FEATURES), dtype=np.float32)
+                for row, i in enumerate(batch):
+                    x[row, features[i][0]] = features[i][1]
+                for head, labels in HEADS.items():
+                    y_index = targets[head][batch]
+                    labelled = y_index >= 0
+                    if not labelled.any():
+                        continue
+                    xh, yh = x[labelled], y_index[labelled]
+                    probs = _softmax(xh @ weights[head] + biases[head])
+                    probs[np.arange(len(yh)), yh] -= 1.0
+                    probs /= len(yh)
+                    weights[head] -= learning_rate * (xh.T @ probs + l2 * weights[head])
+                    biases[head] -= learning_rate * probs.sum(axis=0)
+
+        metadata = {"trained_at": datetime.now().isoformat(), "examples": len(examples), "epochs": epochs}
+        return cls(weights, biases, metadata)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {}
+        for head in HEADS:
+            arrays[f"{head}_weights"] = self.weights[head]
+            arrays[f"{head}_bias"] = self.biases[head]
+        arrays["metadata"] = np.array(json.dumps({**self.metadata, "heads": HEADS, "n_features": N_FEATURES}))
+        np.savez_compressed(path, **arrays)
+        logger.info(f"[FastClassifier] Saved model to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> "FastClassifierModel":
+        with np.load(path) as data:
+            metadata = json.loads(str(data["metadata"]))
+            if metadata.get("heads") != HEADS or metadata.get("n_features") != N_FEATURES:
+                raise ValueError("Model was trained with different labels or feature size - retrain it")
+            weights = {head: data[f"{head}_weights"] for head in HEADS}
+            biases = {head: data[f"{head}_bias"] for head in HEADS}
+        return cls(weights, biases, metadata)
+
+
+def load_decision_log(paths: Iterable[str], min_confidence: float = 70) -> List[Dict]:
+    """
+    Read training examples from decision log / labelled transcript JSONL files.
+
+    Each line needs "message" and, per head, either a decision string or
+    {"decision": ..., "confidence": ...}. Decisions below min_confidence are
+    treated as unlabelled for that head (LLM guesses make noisy labels).
+    """
+    examples = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if not record.get("message"):
+                    continue
+                example = {"message": record["message"], "last_bot_message": record.get("last_bot_message", "")}
+                for head in HEADS:
+                    label = record.get(head)
+                    if isinstance(label, dict):
+                        if label.get("confidence", 100) < min_confidence:
+                            continue
+                        label = label.get("decision")
+                    if label:
+                        example[head] = label
+                examples.append(example)
+    return examples
+
+
+class FastPathClassifier:
+    """Runtime wrapper: confidence gating, shadow checks, decision log and metrics"""
+
+    def __init__(self):
+        self.threshold = float(os.getenv("FAST_CLASSIFIER_THRESHOLD", "0.9"))
+        self.shadow_rate = float(os.getenv("FAST_CLASSIFIER_SHADOW_RATE", "0.05"))
+        self.decision_log_path = os.getenv("FAST_CLASSIFIER_DECISION_LOG", "")
+        self.model_path = os.getenv("FAST_CLASSIFIER_MODEL", DEFAULT_MODEL_PATH)
+        self.model: Optional[FastClassifierModel] = None
+        self.stats = {
+            "predictions": 0,
+            "absorbed": 0,
+            "fell_back": 0,
+            "shadow_checks": 0,
+            "compared": 0,
+            "agreed": 0,
+            "total_predict_us": 0.0
+        }
+        self.head_agreement: Dict[str, int] = defaultdict(int)
+
+        self._decision_logger: Optional[logging.Logger] = None
+        self._decision_writer: Optional[QueueListener] = None
+        if self.decision_log_path:
+            try:
+                os.makedirs(os.path.dirname(self.decision_log_path) or ".", exist_ok=True)
+                handler = logging.FileHandler(self.decision_log_path, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                decision_queue: queue.SimpleQueue = queue.SimpleQueue()
+                self._decision_logger = logging.getLogger("chatbot.fast_classifier.decisions")
+                self._decision_logger.propagate = False
+                self._decision_logger.setLevel(logging.INFO)
+                self._decision_logger.handlers = [QueueHandler(decision_queue)]
+                self._decision_writer = QueueListener(decision_queue, handler)
+                self._decision_writer.start()
+                atexit.register(self.close_decision_log)
+            except OSError as e:
+                logger.warning(f"[FastClassifier] Could not open decision log {self.decision_log_path}: {e}")
+
+        enabled = os.getenv("FAST_CLASSIFIER_ENABLED", "true").lower() in ("1", "true", "yes")
+        if enabled and NUMPY_AVAILABLE and os.path.exists(self.model_path):
+            try:
+                self.model = FastClassifierModel.load(self.model_path)
+                logger.info(
+                    f"FastPathClassifier initialized (threshold: {self.threshold}, "
+                    f"trained on {self.model.metadata.get('examples', '?')} examples)"
+                )
+            except Exception as e:
+                logger.error(f"[FastClassifier] Failed to load model from {self.model_path}: {e}")
+        else:
+            logger.info("FastPathClassifier inactive (no trained model) - all turns use the LLM")
+
+    @property
+    def ready(self) -> bool:
+        return self.model is not None
+
+    def predict(self, message: str, history: List[Dict]) -> Optional[Dict[str, Tuple[str, float]]]:
+        """Predict all heads, or None if no model is loaded"""
+        if self.model is None:
+            return None
+        started = time.perf_counter()
+        prediction = self.model.predict(message, last_bot_message(history))
+        self.stats["predictions"] += 1
+        self.stats["total_predict_us"] += (time.perf_counter() - started) * 1_000_000
+        return prediction
+
+    def is_confident(self, prediction: Dict[str, Tuple[str, float]]) -> bool:
+        return all(prob >= self.threshold for _, prob in prediction.values())
+
+    def should_absorb(self, prediction: Optional[Dict[str, Tuple[str, float]]]) -> bool:
+        """Decide whether this turn skips the LLM (confident and not picked for a shadow check)"""
+        if prediction is None:
+            return False
+        if not self.is_confident(prediction):
+            self.stats["fell_back"] += 1
+            return False
+        if random.random() < self.shadow_rate:
+            self.stats["shadow_checks"] += 1
+            return False
+        self.stats["absorbed"] += 1
+        return True
+
+    def record_llm_decision(self, message: str, history: List[Dict], llm_decisions: Dict[str, Tuple[str, float]],
+                            prediction: Optional[Dict[str, Tuple[str, float]]] = None):
+        """
+        Compare the LLM's decisions with the fast-path prediction and
+        append them to the decision log (if configured).
+
+        Args:
+            llm_decisions: head -> (decision, confidence 0-100) from classify_unified
+            prediction: Fast-path prediction for the same turn, if one was made
+        """
+        if prediction is not None and self.is_confident(prediction):
+            # Agreement only matters where the fast path would have answered alone
+            self.stats["compared"] += 1
+            agreed_heads = [head for head in HEADS if prediction[head][0] == llm_decisions[head][0]]
+            for head in agreed_heads:
+                self.head_agreement[head] += 1
+            if len(agreed_heads) == len(HEADS):
+                self.stats["agreed"] += 1
+
+        if self._decision_logger is None:
+            return
+        record = {
+            "timestamp": datetime.now().isoformat(),
+            "message": message,
+            "last_bot_message": last_bot_message(history),
+            **{head: {"decision": d, "confidence": c} for head, (d, c) in llm_decisions.items()}
+        }
+        # Queued for the writer thread - no file I/O on the caller's thread
+        self._decision_logger.info(json.dumps(record))
+
+    def close_decision_log(self):
+        """Write out queued decisions and stop the writer thread"""
+        if self._decision_writer is not None:
+            self._decision_writer.stop()
+            for handler in self._decision_writer.handlers:
+                handler.close()
+            self._decision_writer = None
+            self._decision_logger.handlers = []
+            self._decision_logger = None
+
+    def get_stats(self) -> Dict:
+        """Get fast-path effectiveness metrics"""
+        decided = self.stats["absorbed"] + self.stats["fell_back"] + self.stats["shadow_checks"]
+        compared = self.stats["compared"]
+        return {
+            "active": self.ready,
+            "threshold": self.threshold,
+            "predictions": self.stats["predictions"],
+            "absorbed": self.stats["absorbed"],
+            "fell_back": self.stats["fell_back"],
+            "shadow_checks": self.stats["shadow_checks"],
+            "absorb_rate": round((self.stats["absorbed"] / decided * 100) if decided > 0 else 0.0, 2),
+            "llm_agreement_rate": round((self.stats["agreed"] / compared * 100) if compared > 0 else 0.0, 2),
+            "head_agreement_rate": {
+                head: round((self.head_agreement[head] / compared * 100) if compared > 0 else 0.0, 2)
+                for head in HEADS
+            },
+            "avg_predict_us": round(
+                (self.stats["total_predict_us"] / self.stats["predictions"]) if self.stats["predictions"] > 0 else 0.0, 1
+            ),
+            "decision_log": self._decision_logger is not None
+        }
+
+
+# Global fast-path classifier instance
+fast_classifier = FastPathClassifier()
@@ -18,15 +18,20 @@ import logging
 from typing import Dict, List, Optional, Literal
 from dataclasses import dataclass
 
-logger = logging.getLogger(__name__)
+from services.llm_client import (
+    OPENAI_AVAILABLE,
+    OPENROUTER_BASE_URL,
+    create_sync_client,
+    create_async_client,
+    llm_limiter
+)
+from services.history_compactor import history_compactor
+from services.usage_ledger import usage_ledger
+from services.tracing import tracer
+from services.fast_classifier import fast_classifier
+from services.token_budget import token_budget
 
-# Import OpenAI SDK for OpenRouter
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-    logger.warning("openai not installed. Run: pip install openai")
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -61,15 +66,10 @@ class GeminiClassifier:
         if not OPENAI_AVAILABLE:
             raise ImportError("openai package not installed")
         
-        api_key = os.getenv("OPENROUTER_API_KEY")
-        if not api_key:
-            raise ValueError("OPENROUTER_API_KEY not set in environment variables")
-        
         # Configure OpenRouter with OpenAI SDK
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=api_key,
-        )
+        # Sync client for legacy callers, async client for the webhook path
+        self.client = create_sync_client()
+        self.async_client = create_async_client()
         
         # Use Gemini 2.5 Flash Lite via OpenRouter (cheaper than Flash)
         self.model_name = "google/gemini-2.5-flash-lite"
@@ -82,8 +82,8 @@ class GeminiClassifier:
         self.max_output_tokens = 65_000  # 4x more than GPT!
         
         # Token budget per conversation (still reasonable for cost control)
-        # With cheaper Gemini, we can afford higher limits
-        self.max_tokens_per_conversation = int(os.getenv("LLM_MAX_TOKENS_PER_CHAT", "100000"))
+        # Enforced by the shared ledger in services/token_budget.py
+        self.max_tokens_per_conversation = token_budget.max_tokens_per_session
         
         # Configurable confidence thresholds (same as before)
         self.resolution_threshold = float(os.getenv("LLM_RESOLUTION_CONFIDENCE", "85"))
@@ -93,14 +93,12 @@ class GeminiClassifier:
         # Hallucination prevention: Require minimum confidence
         self.min_confidence_for_action = float(os.getenv("LLM_MIN_CONFIDENCE", "60"))
         
-        # Track token usage per session
-        self.session_token_usage: Dict[str, int] = {}
-        
         logger.info("=" * 60)
         logger.info("🚀 GEMINI CLASSIFIER INITIALIZED (via OpenRouter)")
         logger.info("=" * 60)
         logger.info(f"  Model: {self.model_name}")
-        logger.info(f"  Base URL: https://openrouter.ai/api/v1")
+        logger.info(f"  Base URL: {OPENROUTER_BASE_URL}")
+        logger.info(f"  Max Concurrency: {llm_limiter.max_concurrency}")
         logger.info(f"  Context Window: 1,000,000 tokens (NO TRUNCATION!)")
         logger.info(f"  Max Output: 65,000 tokens")
         logger.info(f"  Max per Conversation: {self.max_tokens_per_conversation:,} tokens")
@@ -108,20 +106,8 @@ class GeminiClassifier:
         logger.info(f"  Min Confidence: {self.min_confidence_for_action}%")
         logger.info("=" * 60)
     
-    def _track_token_usage(self, session_id: str, tokens: int) -> bool:
-        """Track token usage per session - now with higher limits!"""
-        if session_id not in self.session_token_usage:
-            self.session_token_usage[session_id] = 0
-        
-        self.session_token_usage[session_id] += tokens
-        
-        if self.session_token_usage[session_id] > self.max_tokens_per_conversation:
-            logger.warning(f"[Token Limit] Session {session_id} exceeded {self.max_tokens_per_conversation:,} tokens")
-            return False
-        
-        return True
-    
-    def _build_context(self, conversation_history: List[Dict], last_n: int = None) -> str:
+    def _build_context(self, conversation_history: List[Dict], last_n: int = None,
+                       session_id: str = None) -> str:
         """
         Build context from conversation history.
         
@@ -135,18 +121,26 @@ class GeminiClassifier:
         - No more "You mentioned earlier..." getting lost
         - Better continuity for complex troubleshooting
         - Higher resolution rates
+        
+        Once the history exceeds LLM_HISTORY_TOKEN_BUDGET, older turns are
+        replaced by the session's rolling summary (see HistoryCompactor).
         """
         if not conversation_history:
             return "(No previous messages)"
         
+        summary = None
         # With Gemini's 1M context, use ALL messages if last_n is None
         if last_n is None:
-            recent = conversation_history
-            logger.debug(f"[Gemini] Using FULL history: {len(conversation_history)} messages (no truncation)")
+            summary, recent = history_compactor.compact(
+                session_id, conversation_history, token_budget=token_budget.history_token_budget(session_id)
+            )
+            logger.debug(f"[Gemini] Using history: {len(recent)} of {len(conversation_history)} messages verbatim")
         else:
             recent = conversation_history[-last_n:] if len(conversation_history) > last_n else conversation_history
         
         context_lines = []
+        if summary:
+            context_lines.append(f"Summary of earlier conversation: {summary}")
         for msg in recent:
             role = "User" if msg.get("role") == "user" else "Bot"
             # Don't truncate individual messages either - Gemini can handle it!
@@ -162,6 +156,22 @@ class GeminiClassifier:
             return False
         return True
     
+    def _build_messages(self, prompt: str) -> List[Dict]:
+        """Build the chat messages for a JSON classification prompt"""
+        return [
+            {"role": "system", "content": "You are a helpful assistant that responds in JSON format."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _record_usage(self, session_id: str, usage) -> None:
+        """Charge token usage reported by OpenRouter to the session's budget"""
+        usage_ledger.record(self.model_name, "classifier", None, usage)
+        if usage:
+            input_tokens = usage.prompt_tokens
+            output_tokens = usage.completion_tokens
+            token_budget.record(session_id, input_tokens + output_tokens, "classifier")
+            logger.debug(f"[OpenRouter-Gemini] Tokens: {input_tokens} in, {output_tokens} out, Session total: {token_budget.used(session_id):,}")
+    
     def _call_gemini(self, prompt: str, session_id: str = "unknown", max_tokens: int = 1000) -> str:
         """
         Make Gemini API call with structured prompts.
@@ -170,26 +180,20 @@ class GeminiClassifier:
         - Native JSON mode with response_mime_type
         - Faster response times
         - Lower cost per token
+        
+        NOTE: Blocking call - use _call_gemini_async from async code.
         """
         try:
             response = self.client.chat.completions.create(
                 model=self.model_name,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that responds in JSON format."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._build_messages(prompt),
                 temperature=0.1,  # Low for consistent classification
                 max_tokens=max_tokens,
                 response_format={"type": "json_object"}  # Force JSON output
             )
             
             # Track token usage from OpenRouter
-            usage = response.usage
-            if usage:
-                input_tokens = usage.prompt_tokens
-                output_tokens = usage.completion_tokens
-                self._track_token_usage(session_id, input_tokens + output_tokens)
-                logger.debug(f"[OpenRouter-Gemini] Tokens: {input_tokens} in, {output_tokens} out, Session total: {self.session_token_usage.get(session_id, 0):,}")
+            self._record_usage(session_id, response.usage)
             
             response_text = response.choices[0].message.content.strip()
             return response_text
@@ -198,32 +202,40 @@ class GeminiClassifier:
             logger.error(f"[OpenRouter-Gemini] API call failed: {e}")
             raise
     
-    def classify_unified(self, message: str, conversation_history: List[Dict], 
-                        session_id: str = "unknown") -> Dict[str, ClassificationResult]:
+    async def _call_gemini_async(self, prompt: str, session_id: str = "unknown", max_tokens: int = 1000) -> str:
         """
-        Single Gemini call for all classifications: resolution, escalation, intent.
-        
-        ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-        🎯 KEY IMPROVEMENT: Uses FULL conversation history!
-        ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-        
-        With 1M context:
-        - No truncation needed
-        - Bot remembers everything
-        - Better classification accuracy
-        - Higher resolution rates
+        Non-blocking variant of _call_gemini.
         
-        Returns:
-            {
-                "resolution": ClassificationResult,
-                "escalation": ClassificationResult,
-                "intent": ClassificationResult
-            }
+        Uses AsyncOpenAI so the event loop keeps serving other sessions
+        while the completion is in flight. Bounded by the shared LLM limiter.
         """
+        try:
+            async with llm_limiter:
+                response = await self.async_client.chat.completions.create(
+                    model=self.model_name,
+                    messages=self._build_messages(prompt),
+                    temperature=0.1,  # Low for consistent classification
+                    max_tokens=max_tokens,
+                    response_format={"type": "json_object"}  # Force JSON output
+                )
+            
+            # Track token usage from OpenRouter
+            self._record_usage(session_id, response.usage)
+            
+            response_text = response.choices[0].message.content.strip()
+            return response_text
+            
+        except Exception as e:
+            logger.error(f"[OpenRouter-Gemini] Async API call failed: {e}")
+            raise
+    
+    def _build_unified_prompt(self, message: str, conversation_history: List[Dict],
+                              session_id: str = "unknown") -> str:
+        """Build the single prompt used for resolution + escalation + intent"""
         # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-        # Include ALL conversation history - no truncation!
+        # Include ALL conversation history (older turns summarized past the token budget)
         # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-        context = self._build_context(conversation_history, last_n=None)
+        context = self._build_context(conversation_history, last_n=None, session_id=session_id)
         
         prompt = f"""You are a conversation analyzer for Ace Cloud Hosting support chatbot. 
 
@@ -253,7 +265,7 @@ CRITICAL RULES:
 - Don't ask questions already answered in history
 
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-FULL CONVERSATION HISTORY (COMPLETE - NO TRUNCATION):
+FULL CONVERSATION HISTORY:
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 {context}
 
@@ -268,9 +280,19 @@ Respond with valid JSON only:
   "escalation": {{"decision": "NEEDS_HUMAN|BOT_CAN_HANDLE|UNCERTAIN", "confidence": 0-100, "reasoning": "brief"}},
   "intent": {{"decision": "TRANSFER|CALLBACK|TICKET|QUESTION|OTHER", "confidence": 0-100, "reasoning": "brief"}}
 }}"""
-
+        return prompt
+    
+    def _error_results(self, reason: str, raw_response: str = "") -> Dict[str, ClassificationResult]:
+        """Neutral results used when classification could not be completed"""
+        return {
+            "resolution": ClassificationResult("UNCERTAIN", 0, reason, raw_response),
+            "escalation": ClassificationResult("UNCERTAIN", 0, reason, raw_response),
+            "intent": ClassificationResult("OTHER", 0, reason, raw_response)
+        }
+    
+    def _parse_unified_response(self, raw_response: str) -> Dict[str, ClassificationResult]:
+        """Parse the unified JSON response and apply hallucination checks"""
         try:
-            raw_response = self._call_gemini(prompt, session_id, max_tokens=500)
             logger.debug(f"[Gemini] Unified raw response: {raw_response}")
             
             # Parse JSON response
@@ -317,18 +339,58 @@ Respond with valid JSON only:
             
         except json.JSONDecodeError as e:
             logger.error(f"[Gemini] JSON parse error: {raw_response} - {e}")
-            return {
-                "resolution": ClassificationResult("UNCERTAIN", 0, "JSON parse error", raw_response),
-                "escalation": ClassificationResult("UNCERTAIN", 0, "JSON parse error", raw_response),
-                "intent": ClassificationResult("OTHER", 0, "JSON parse error", raw_response)
-            }
+            return self._error_results("JSON parse error", raw_response)
         except Exception as e:
             logger.error(f"[Gemini] Classification failed: {e}")
-            return {
-                "resolution": ClassificationResult("UNCERTAIN", 0, f"Error: {str(e)}", ""),
-                "escalation": ClassificationResult("UNCERTAIN", 0, f"Error: {str(e)}", ""),
-                "intent": ClassificationResult("OTHER", 0, f"Error: {str(e)}", "")
+            return self._error_results(f"Error: {str(e)}")
+    
+    def classify_unified(self, message: str, conversation_history: List[Dict], 
+                        session_id: str = "unknown") -> Dict[str, ClassificationResult]:
+        """
+        Single Gemini call for all classifications: resolution, escalation, intent.
+        
+        ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+        🎯 KEY IMPROVEMENT: Uses FULL conversation history!
+        ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+        
+        With 1M context:
+        - No truncation needed
+        - Bot remembers everything
+        - Better classification accuracy
+        - Higher resolution rates
+        
+        NOTE: Blocking call - use classify_unified_async from async code.
+        
+        Returns:
+            {
+                "resolution": ClassificationResult,
+                "escalation": ClassificationResult,
+                "intent": ClassificationResult
             }
+        """
+        prompt = self._build_unified_prompt(message, conversation_history, session_id)
+        
+        try:
+            raw_response = self._call_gemini(prompt, session_id, max_tokens=500)
+        except Exception as e:
+            logger.error(f"[Gemini] Classification failed: {e}")
+            return self._error_results(f"Error: {str(e)}")
+        
+        return self._parse_unified_response(raw_response)
+    
+    async def classify_unified_async(self, message: str, conversation_history: List[Dict],
+                                     session_id: str = "unknown") -> Dict[str, ClassificationResult]:
+        """Non-blocking variant of classify_unified (same prompt and result shape)"""
+        with tracer.span("classify_unified", model=self.model_name):
+            prompt = self._build_unified_prompt(message, conversation_history, session_id)
+            
+            try:
+                raw_response = await self._call_gemini_async(prompt, session_id, max_tokens=500)
+            except Exception as e:
+                logger.error(f"[Gemini] Classification failed: {e}")
+                return self._error_results(f"Error: {str(e)}")
+            
+            return self._parse_unified_response(raw_response)
     
     def classify_resolution(self, message: str, conversation_history: List[Dict], 
                            session_id: str = "unknown") -> ClassificationResult:
@@ -401,9 +463,132 @@ Respond with valid JSON only:
     
     def clear_session_tokens(self, session_id: str):
         """Clear token usage tracking for a session."""
-        if session_id in self.session_token_usage:
-            del self.session_token_usage[session_id]
-            logger.debug(f"[Gemini] Cleared token tracking for session {session_id}")
+        token_budget.release(session_id)
+        history_compactor.clear(session_id)
+        logger.debug(f"[Gemini] Cleared token tracking for session {session_id}")
+
+
+class TurnClassification:
+    """
+    Classification results for a single user turn, computed at most once.
+    
+    The webhook creates one of these per message and passes it to the
+    handler registry via the handler context ("classification" key), so
+    handlers read resolution/escalation/intent from memory instead of
+    paying for a second classify_unified round-trip.
+    
+    Turns the local fast-path classifier is confident about never reach
+    the LLM at all.
+    """
+    
+    def __init__(self, message: str, conversation_history: List[Dict],
+                 session_id: str = "unknown", classifier: Optional["GeminiClassifier"] = None):
+        self.message = message
+        self.conversation_history = conversation_history
+        self.session_id = session_id
+        self.classifier = classifier
+        self.source: Optional[str] = None  # "fast_path", "llm" or "budget_skipped" once computed
+        self._results: Optional[Dict[str, ClassificationResult]] = None
+        self._fast_prediction = None
+    
+    @property
+    def is_computed(self) -> bool:
+        return self._results is not None
+    
+    def set_results(self, results: Dict[str, ClassificationResult]):
+        """Store results decided elsewhere (e.g. forced on conversation restart)"""
+        self._results = results
+    
+    def _try_fast_path(self) -> bool:
+        """Answer from the local fast-path classifier if it is confident enough"""
+        self._fast_prediction = fast_classifier.predict(self.message, self.conversation_history)
+        if not fast_classifier.should_absorb(self._fast_prediction):
+            return False
+        self._results = {
+            head: ClassificationResult(decision, round(prob * 100, 1), "Fast-path classifier", "")
+            for head, (decision, prob) in self._fast_prediction.items()
+        }
+        self.source = "fast_path"
+        logger.info(f"[FastClassifier] Turn classified locally: "
+                    f"{', '.join(f'{h}={r.decision}' for h, r in self._results.items())}")
+        return True
+    
+    def _skip_for_budget(self) -> bool:
+        """Skip the LLM call once the session has spent most of its token budget"""
+        if token_budget.allows_classification(self.session_id):
+            return False
+        level = token_budget.level(self.session_id)
+        token_budget.record_degraded_turn(level)
+        logger.warning(f"[Token Budget] Skipping LLM classification for {self.session_id} ({level.name})")
+        self._results = {
+            "resolution": ClassificationResult("UNCERTAIN", 0, "Token budget - classification skipped", ""),
+            "escalation": ClassificationResult("UNCERTAIN", 0, "Token budget - classification skipped", ""),
+            "intent": ClassificationResult("OTHER", 0, "Token budget - classification skipped", "")
+        }
+        self.source = "budget_skipped"
+        return True
+    
+    def _record_llm_results(self):
+        """Feed the LLM's decisions to fast-path agreement metrics and the decision log"""
+        self.source = "llm"
+        if all(result.confidence == 0 for result in self._results.values()):
+            return  # Classification failed - nothing to learn from
+        fast_classifier.record_llm_decision(
+            self.message,
+            self.conversation_history,
+            {head: (result.decision, result.confidence) for head, result in self._results.items()},
+            self._fast_prediction
+        )
+    
+    async def ensure_async(self) -> Dict[str, ClassificationResult]:
+        """Run classify_unified_async once; later calls return the cached results"""
+        if self._results is None:
+            if self._try_fast_path() or self._skip_for_budget():
+                return self._results
+            if self.classifier:
+                self._results = await self.classifier.classify_unified_async(
+                    self.message, self.conversation_history, self.session_id
+                )
+                self._record_llm_results()
+            else:
+                self._results = _unavailable_results()
+        return self._results
+    
+    def ensure(self) -> Dict[str, ClassificationResult]:
+        """Blocking variant for sync callers; only calls the LLM if nothing is cached yet"""
+        if self._results is None:
+            if self._try_fast_path() or self._skip_for_budget():
+                return self._results
+            if self.classifier:
+                logger.warning("[Gemini] TurnClassification computed synchronously - prefer ensure_async()")
+                self._results = self.classifier.classify_unified(
+                    self.message, self.conversation_history, self.session_id
+                )
+                self._record_llm_results()
+            else:
+                self._results = _unavailable_results()
+        return self._results
+    
+    @property
+    def resolution(self) -> ClassificationResult:
+        return self.ensure()["resolution"]
+    
+    @property
+    def escalation(self) -> ClassificationResult:
+        return self.ensure()["escalation"]
+    
+    @property
+    def intent(self) -> ClassificationResult:
+        return self.ensure()["intent"]
+
+
+def _unavailable_results() -> Dict[str, ClassificationResult]:
+    """Neutral results used when no classifier is configured"""
+    return {
+        "resolution": ClassificationResult("UNCERTAIN", 0, "Classifier not available", ""),
+        "escalation": ClassificationResult("UNCERTAIN", 0, "Classifier not available", ""),
+        "intent": ClassificationResult("OTHER", 0, "Classifier not available", "")
+    }
 
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
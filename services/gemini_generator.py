@@ -18,15 +18,111 @@ import os
 import logging
 from typing import List, Dict, Tuple, Optional
 
+from services.llm_client import (
+    OPENAI_AVAILABLE,
+    OPENROUTER_BASE_URL,
+    create_sync_client,
+    create_async_client,
+    llm_limiter
+)
+from services.history_compactor import history_compactor
+from services.token_budget import token_budget
+from services.conversation_history import openai_messages
+from services.usage_ledger import usage_ledger
+from services.tracing import tracer
+
 logger = logging.getLogger(__name__)
 
-# Import OpenAI SDK for OpenRouter
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-    logger.warning("openai not installed. Run: pip install openai")
+# Returned whenever the LLM call fails
+FALLBACK_RESPONSE = (
+    "I apologize, but I'm having trouble processing your request right now. "
+    "Please try again, or contact our support team directly:\n\n"
+    "📞 Phone: 1-888-415-5240 (24/7)\n"
+    "📧 Email: support@acecloudhosting.com"
+)
+
+# Category-specific focus hints appended to the system prompt
+CATEGORY_HINTS = {
+    "login": "Focus on RDP connection, login issues, password resets, and SelfCare portal guidance.",
+    "quickbooks": "Focus on QuickBooks errors, company file issues, freezing/hanging, and QB-specific troubleshooting.",
+    "performance": "Focus on server performance, disk space, RAM/CPU usage, and system slowness.",
+    "printing": "Focus on printer redirection, printing issues, and RDP printer settings.",
+    "office": "Focus on Microsoft Office applications, Outlook, Excel, and Office 365 activation."
+}
+
+
+class ResponseStream:
+    """
+    Async iterator over response token deltas.
+    
+    Iterate to receive text chunks as they arrive; once iteration finishes,
+    `text` holds the full response and `tokens_used` the reported usage.
+    If the upstream stream breaks after some text was yielded, `interrupted`
+    is set and `text` holds the partial response. Usage is recorded even when
+    the consumer stops iterating early (client disconnect, cancellation).
+    """
+    
+    def __init__(self, generator: "GeminiResponseGenerator", messages: List[Dict],
+                 temperature: float, max_tokens: int, session_id: str = None, category: str = "other"):
+        self.generator = generator
+        self.messages = messages
+        self.session_id = session_id
+        self.category = category
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.text = ""
+        self.tokens_used = 0
+        self.failed = False
+        self.interrupted = False
+    
+    def __aiter__(self):
+        return self._iterate()
+    
+    async def _iterate(self):
+        chunks: List[str] = []
+        usage = None
+        try:
+            async with llm_limiter:
+                stream = await self.generator.async_client.chat.completions.create(
+                    model=self.generator.model_name,
+                    messages=self.messages,
+                    temperature=self.temperature,
+                    max_tokens=self.max_tokens,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                async for chunk in stream:
+                    # Final chunk carries usage and no choices
+                    if getattr(chunk, "usage", None):
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        chunks.append(delta)
+                        yield delta
+        except Exception as e:
+            logger.error(f"[OpenRouter-Gemini] Streaming generation failed: {e}")
+            self.failed = True
+            self.interrupted = bool(chunks)
+            if not chunks:
+                chunks.append(FALLBACK_RESPONSE)
+                yield FALLBACK_RESPONSE
+        finally:
+            self._finish(chunks, usage)
+    
+    def _finish(self, chunks: List[str], usage):
+        self.text = "".join(chunks).strip()
+        if not self.failed:
+            usage_ledger.record(self.generator.model_name, "generator", self.category, usage)
+        if usage:
+            self.tokens_used = usage.prompt_tokens + usage.completion_tokens
+            logger.info(f"[OpenRouter-Gemini] Streamed response: {len(self.text)} chars, {self.tokens_used} tokens")
+        elif not self.failed:
+            # Fallback estimation if no usage data
+            self.tokens_used = self.generator._estimate_tokens(self.messages)
+            logger.info(f"[OpenRouter-Gemini] Streamed response: {len(self.text)} chars, ~{self.tokens_used} tokens (estimated)")
+        token_budget.record(self.session_id, self.tokens_used, "generator")
 
 
 class GeminiResponseGenerator:
@@ -50,15 +146,10 @@ class GeminiResponseGenerator:
         if not OPENAI_AVAILABLE:
             raise ImportError("openai package not installed")
         
-        api_key = os.getenv("OPENROUTER_API_KEY")
-        if not api_key:
-            raise ValueError("OPENROUTER_API_KEY not set in environment variables")
-        
         # Configure OpenRouter with OpenAI SDK
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=api_key,
-        )
+        # Sync client for legacy callers, async client for the webhook path
+        self.client = create_sync_client()
+        self.async_client = create_async_client()
         
         # Use Gemini 2.5 Flash Lite via OpenRouter (cheaper than Flash)
         self.model_name = "google/gemini-2.5-flash-lite"
@@ -67,72 +158,140 @@ class GeminiResponseGenerator:
         self.default_temperature = float(os.getenv("GEMINI_TEMPERATURE", "0.7"))
         self.default_max_tokens = int(os.getenv("GEMINI_MAX_TOKENS", "1000"))  # Was 400!
         
+        # Provider-side prompt-prefix caching for the (large, static) expert prompt
+        self.prompt_cache_enabled = os.getenv("GEMINI_PROMPT_CACHE", "true").lower() in ("1", "true", "yes")
+        
         # Safety settings (optional)
         
         logger.info("=" * 60)
         logger.info("🚀 GEMINI RESPONSE GENERATOR INITIALIZED (via OpenRouter)")
         logger.info("=" * 60)
         logger.info(f"  Model: {self.model_name}")
-        logger.info(f"  Base URL: https://openrouter.ai/api/v1")
+        logger.info(f"  Base URL: {OPENROUTER_BASE_URL}")
+        logger.info(f"  Max Concurrency: {llm_limiter.max_concurrency}")
         logger.info(f"  Temperature: {self.default_temperature}")
         logger.info(f"  Max Tokens: {self.default_max_tokens}")
+        logger.info(f"  Prompt Cache: {'enabled' if self.prompt_cache_enabled else 'disabled'}")
         logger.info(f"  Context: 1,000,000 tokens (NO TRUNCATION!)")
         logger.info("=" * 60)
     
+    def _build_messages(self,
+                        message: str,
+                        history: List[Dict],
+                        system_prompt: str,
+                        category: str = "other",
+                        session_id: str = None,
+                        kb_context: str = None) -> List[Dict]:
+        """Build the OpenAI-format messages array for a generation call
+        
+        With prompt caching enabled, the expert prompt is sent as its own
+        system message marked with cache_control so OpenRouter/Gemini can
+        reuse the processed prefix across turns. Retrieved KB articles and the
+        category hint go in separate system messages after it, outside the
+        cached block.
+        """
+        # Category hint (kept out of the cacheable prefix)
+        category_hint = None
+        if category != "other" and category in CATEGORY_HINTS:
+            category_hint = f"[CATEGORY: {category.upper()}] {CATEGORY_HINTS[category]}"
+            logger.info(f"[Gemini] Added category hint for: {category}")
+        
+        if self.prompt_cache_enabled:
+            messages = [
+                {
+                    "role": "system",
+                    "content": [
+                        {"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}
+                    ]
+                }
+            ]
+            if kb_context:
+                messages.append({"role": "system", "content": kb_context})
+            if category_hint:
+                messages.append({"role": "system", "content": category_hint})
+        else:
+            enhanced_prompt = "\n\n".join(part for part in (system_prompt, kb_context, category_hint) if part)
+            messages = [
+                {"role": "system", "content": enhanced_prompt}
+            ]
+        
+        # Build conversation - FULL history until it exceeds the token budget,
+        # then a rolling summary of older turns + the most recent turns verbatim
+        # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+        summary, recent_history = history_compactor.compact(
+            session_id, history, token_budget=token_budget.history_token_budget(session_id)
+        )
+        if summary:
+            messages.append({"role": "system", "content": f"Summary of earlier conversation: {summary}"})
+        
+        messages.extend(openai_messages(recent_history))
+        
+        # Add current message
+        messages.append({"role": "user", "content": message})
+        return messages
+    
+    def _estimate_tokens(self, messages: List[Dict]) -> int:
+        """Rough token estimate (chars / 4) of the system prompt and current message"""
+        system_content = messages[0]["content"]
+        if isinstance(system_content, list):
+            system_content = "".join(part.get("text", "") for part in system_content)
+        return (len(system_content) + len(messages[-1]["content"])) // 4
+    
+    def get_cache_stats(self) -> Dict:
+        """Get prompt-prefix cache effectiveness (cached tokens are recorded by the usage ledger)"""
+        return {**usage_ledger.get_cache_stats("generator"), "enabled": self.prompt_cache_enabled}
+    
+    def _extract_result(self, response, messages: List[Dict], session_id: str = None,
+                        category: str = "other") -> Tuple[str, int]:
+        """Extract response text and token count, charging the tokens to the session's budget"""
+        # Extract response text
+        response_text = response.choices[0].message.content.strip()
+        
+        # Get actual token usage from OpenRouter
+        usage = response.usage
+        usage_ledger.record(self.model_name, "generator", category, usage)
+        if usage:
+            total_tokens = usage.prompt_tokens + usage.completion_tokens
+            logger.info(f"[OpenRouter-Gemini] Response generated: {len(response_text)} chars, {total_tokens} tokens")
+            logger.debug(f"[OpenRouter-Gemini] Token breakdown: {usage.prompt_tokens} input, {usage.completion_tokens} output")
+        else:
+            # Fallback estimation if no usage data
+            total_tokens = self._estimate_tokens(messages)
+            logger.info(f"[OpenRouter-Gemini] Response generated: {len(response_text)} chars, ~{total_tokens} tokens (estimated)")
+        
+        token_budget.record(session_id, total_tokens, "generator")
+        return response_text, total_tokens
+    
     def generate_response(self, 
                          message: str, 
                          history: List[Dict], 
                          system_prompt: str,
                          category: str = "other",
                          temperature: float = None,
-                         max_tokens: int = None) -> Tuple[str, int]:
+                         max_tokens: int = None,
+                         session_id: str = None,
+                         kb_context: str = None) -> Tuple[str, int]:
         """
         Generate a response using Gemini.
         
+        NOTE: Blocking call - use generate_response_async from async code.
+        
         Args:
             message: User's current message
-            history: FULL conversation history (no truncation needed!)
+            history: FULL conversation history (compacted past the token budget)
             system_prompt: Expert prompt with instructions
             category: Issue category for hints
             temperature: Override default temperature
             max_tokens: Override default max tokens
+            session_id: Session identifier (enables history compaction)
+            kb_context: Retrieved KB articles, sent uncached after the system prompt
         
         Returns:
             Tuple of (response_text, tokens_used)
         """
         temp = temperature if temperature is not None else self.default_temperature
         max_tok = max_tokens if max_tokens is not None else self.default_max_tokens
-        
-        # Add category hint if applicable
-        category_hints = {
-            "login": "Focus on RDP connection, login issues, password resets, and SelfCare portal guidance.",
-            "quickbooks": "Focus on QuickBooks errors, company file issues, freezing/hanging, and QB-specific troubleshooting.",
-            "performance": "Focus on server performance, disk space, RAM/CPU usage, and system slowness.",
-            "printing": "Focus on printer redirection, printing issues, and RDP printer settings.",
-            "office": "Focus on Microsoft Office applications, Outlook, Excel, and Office 365 activation."
-        }
-        
-        enhanced_prompt = system_prompt
-        if category != "other" and category in category_hints:
-            enhanced_prompt = f"{system_prompt}\n\n[CATEGORY: {category.upper()}] {category_hints[category]}"
-            logger.info(f"[Gemini] Added category hint for: {category}")
-        
-        # Build conversation - Include FULL history (no truncation!)
-        # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-        
-        # Build messages array for OpenAI format
-        messages = [
-            {"role": "system", "content": enhanced_prompt}
-        ]
-        
-        # Add full conversation history
-        for msg in history:
-            role = "user" if msg.get("role") == "user" else "assistant"
-            content = msg.get("content", "")
-            messages.append({"role": role, "content": content})
-        
-        # Add current message
-        messages.append({"role": "user", "content": message})
+        messages = self._build_messages(message, history, system_prompt, category, session_id, kb_context)
         
         try:
             response = self.client.chat.completions.create(
@@ -141,34 +300,75 @@ class GeminiResponseGenerator:
                 temperature=temp,
                 max_tokens=max_tok,
             )
-            
-            # Extract response text
-            response_text = response.choices[0].message.content.strip()
-            
-            # Get actual token usage from OpenRouter
-            usage = response.usage
-            if usage:
-                total_tokens = usage.prompt_tokens + usage.completion_tokens
-                logger.info(f"[OpenRouter-Gemini] Response generated: {len(response_text)} chars, {total_tokens} tokens")
-                logger.debug(f"[OpenRouter-Gemini] Token breakdown: {usage.prompt_tokens} input, {usage.completion_tokens} output")
-            else:
-                # Fallback estimation if no usage data
-                total_tokens = (len(enhanced_prompt) + len(message)) // 4
-                logger.info(f"[OpenRouter-Gemini] Response generated: {len(response_text)} chars, ~{total_tokens} tokens (estimated)")
-            
-            return response_text, total_tokens
+            return self._extract_result(response, messages, session_id, category)
             
         except Exception as e:
             logger.error(f"[OpenRouter-Gemini] Response generation failed: {e}")
-            
-            # Fallback response
-            fallback = (
-                "I apologize, but I'm having trouble processing your request right now. "
-                "Please try again, or contact our support team directly:\n\n"
-                "📞 Phone: 1-888-415-5240 (24/7)\n"
-                "📧 Email: support@acecloudhosting.com"
-            )
-            return fallback, 0
+            return FALLBACK_RESPONSE, 0
+    
+    async def generate_response_async(self,
+                                      message: str,
+                                      history: List[Dict],
+                                      system_prompt: str,
+                                      category: str = "other",
+                                      temperature: float = None,
+                                      max_tokens: int = None,
+                                      session_id: str = None,
+                                      kb_context: str = None) -> Tuple[str, int]:
+        """
+        Non-blocking variant of generate_response.
+        
+        Awaits the completion on AsyncOpenAI so the event loop keeps serving
+        other sessions. Bounded by the shared LLM concurrency limiter.
+        
+        Returns:
+            Tuple of (response_text, tokens_used)
+        """
+        temp = temperature if temperature is not None else self.default_temperature
+        max_tok = max_tokens if max_tokens is not None else self.default_max_tokens
+        messages = self._build_messages(message, history, system_prompt, category, session_id, kb_context)
+        
+        with tracer.span("generate_response", model=self.model_name, category=category) as span:
+            try:
+                async with llm_limiter:
+                    response = await self.async_client.chat.completions.create(
+                        model=self.model_name,
+                        messages=messages,
+                        temperature=temp,
+                        max_tokens=max_tok,
+                    )
+                response_text, tokens_used = self._extract_result(response, messages, session_id, category)
+                span.set("tokens", tokens_used)
+                return response_text, tokens_used
+                
+            except Exception as e:
+                logger.error(f"[OpenRouter-Gemini] Async response generation failed: {e}")
+                span.set("fallback", True)
+                return FALLBACK_RESPONSE, 0
+    
+    def generate_response_stream(self,
+                                 message: str,
+                                 history: List[Dict],
+                                 system_prompt: str,
+                                 category: str = "other",
+                                 temperature: float = None,
+                                 max_tokens: int = None,
+                                 session_id: str = None,
+                                 kb_context: str = None) -> ResponseStream:
+        """
+        Stream a response token-by-token.
+        
+        Same prompt construction as generate_response, but returns a
+        ResponseStream that yields text deltas as OpenRouter produces them,
+        so callers can show output at time-to-first-token.
+        
+        Returns:
+            ResponseStream (async iterable of str deltas)
+        """
+        temp = temperature if temperature is not None else self.default_temperature
+        max_tok = max_tokens if max_tokens is not None else self.default_max_tokens
+        messages = self._build_messages(message, history, system_prompt, category, session_id, kb_context)
+        return ResponseStream(self, messages, temp, max_tok, session_id, category)
     
     def generate_quick_response(self, prompt: str, max_tokens: int = 500) -> str:
         """
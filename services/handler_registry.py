@@ -23,6 +23,8 @@ from services.handlers.issue_handlers import (
 from services.handlers.collection_handlers import (
     CallbackCollectionHandler
 )
+from services.tracing import tracer
+from services.usage_ledger import llm_handler_var
 import logging
 
 logger = logging.getLogger(__name__)
@@ -93,7 +95,9 @@ class HandlerRegistry:
         
         for handler in self.handlers:
             try:
-                if handler.can_handle(message_lower, context):
+                with tracer.span("can_handle", handler=handler.name):
+                    matched = handler.can_handle(message_lower, context)
+                if matched:
                     logger.info(f"[HandlerRegistry] Matched: {handler.name}")
                     return handler
             except Exception as e:
@@ -115,6 +119,7 @@ class HandlerRegistry:
                 - category: Issue category from router
                 - visitor: Visitor info dict
                 - payload: Button payload if any
+                - classification: TurnClassification for this turn (optional)
                 
         Returns:
             HandlerResponse if a handler matched, None to use LLM
@@ -125,8 +130,11 @@ class HandlerRegistry:
             logger.warning(f"[HandlerRegistry] No handler matched for message")
             return None
         
+        # LLM calls for the rest of this turn are charged to the handler
+        llm_handler_var.set(handler.name)
         try:
-            response = handler.handle(message, context)
+            with tracer.span("handle", handler=handler.name):
+                response = handler.handle(message, context)
             logger.info(f"[HandlerRegistry] {handler.name} processed message")
             
             # Check if this is a fallback to LLM
@@ -61,6 +61,7 @@ class BaseHandler(ABC):
                 - category: Issue category from router
                 - visitor: Visitor info dict
                 - payload: Button payload if any
+                - classification: TurnClassification for this turn (optional)
                 
         Returns:
             HandlerResponse with text and optional state change
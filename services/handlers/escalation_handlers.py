@@ -97,8 +97,13 @@ class AgentRequestHandler(BaseHandler):
             return False
         
         try:
-            history = context.get("history", [])
-            intent = classify_intent(message, history)
+            # Reuse this turn's classification instead of a second LLM round-trip
+            turn_classification = context.get("classification")
+            if turn_classification is not None:
+                intent = turn_classification.intent
+            else:
+                history = context.get("history", [])
+                intent = classify_intent(message, history, context.get("session_id", "unknown"))
             
             logger.info(f"[AgentRequestHandler] LLM Intent: {intent.decision} (confidence: {intent.confidence}%)")
             
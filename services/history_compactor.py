@@ -0,0 +1,228 @@
+"""
+Token-Budgeted History Compaction
+
+Keeps the per-turn prompt size bounded on long conversations. While a
+conversation fits in the token budget it is sent verbatim. Once it grows
+past the budget, the last N turns are kept verbatim and everything older
+is replaced by a rolling summary.
+
+The summary is cached per session and extended incrementally in the
+background (only newly aged-out messages are folded in), so summarization
+never sits on the reply path. Until a summary covers a message, that
+message is still sent verbatim - nothing is dropped.
+
+Configuration:
+- LLM_HISTORY_TOKEN_BUDGET: History tokens sent verbatim before compacting (default 4000)
+- LLM_HISTORY_KEEP_TURNS: Recent user/assistant turns always kept verbatim (default 4)
+- LLM_HISTORY_SUMMARY_MODEL: Model used for summaries (default google/gemini-2.5-flash-lite)
+"""
+
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from services.llm_client import OPENAI_AVAILABLE, create_async_client, llm_limiter
+from services.token_budget import token_budget
+from services.usage_ledger import usage_ledger
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # ImportError or missing encoding files
+    _ENCODING = None
+    logger.warning("tiktoken not available - estimating history tokens as chars/4")
+
+# Upper bound on cached session summaries (LRU eviction)
+MAX_CACHED_SUMMARIES = 10_000
+
+SUMMARY_PROMPT = """You maintain a running summary of an IT support chat between a customer and AceBuddy (the support bot).
+
+Update the summary with the new messages below. Keep every fact that matters for troubleshooting:
+the customer's issue, server type, applications, error codes, steps already tried and their results,
+and any details the customer provided (names, times, phone numbers). Be concise - at most 200 words.
+
+CURRENT SUMMARY:
+{summary}
+
+NEW MESSAGES:
+{messages}
+
+Respond with the updated summary only."""
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Count tokens in a string (tiktoken cl100k_base, or chars/4 fallback)"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return max(1, len(text) // 4)
+
+
+def count_history_tokens(history: List[Dict]) -> int:
+    """Count tokens across a conversation history"""
+    return sum(count_tokens(msg.get("content", "")) for msg in history)
+
+
+@dataclass
+class SessionSummary:
+    """Rolling summary of the oldest `covered` messages of a session"""
+    text: str = ""
+    covered: int = 0
+
+
+class HistoryCompactor:
+    """Replaces old conversation turns with a cached rolling summary"""
+
+    def __init__(self):
+        self.token_budget = int(os.getenv("LLM_HISTORY_TOKEN_BUDGET", "4000"))
+        self.keep_turns = int(os.getenv("LLM_HISTORY_KEEP_TURNS", "4"))
+        self.summary_model = os.getenv("LLM_HISTORY_SUMMARY_MODEL", "google/gemini-2.5-flash-lite")
+        self.summaries: "OrderedDict[str, SessionSummary]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._client = None
+        self.stats = {"compacted_turns": 0, "summaries_built": 0, "summary_failures": 0, "tokens_saved": 0}
+
+        logger.info(
+            f"HistoryCompactor initialized (budget: {self.token_budget} tokens, keep: {self.keep_turns} turns)"
+        )
+
+    def _get_client(self):
+        if self._client is None and OPENAI_AVAILABLE:
+            try:
+                self._client = create_async_client()
+            except Exception as e:
+                logger.warning(f"[History] Summary client unavailable: {e}")
+        return self._client
+
+    def compact(self, session_id: Optional[str], history: List[Dict],
+                token_budget: Optional[int] = None) -> Tuple[Optional[str], List[Dict]]:
+        """
+        Get the history to send for this turn.
+
+        Args:
+            session_id: Session identifier (no compaction without one)
+            history: Full conversation history
+            token_budget: Override the configured budget (e.g. for degraded sessions)
+
+        Returns:
+            Tuple of (summary_text or None, messages to send verbatim)
+        """
+        budget = self.token_budget if token_budget is None else token_budget
+        if not session_id or session_id == "unknown" or not history:
+            return None, history
+
+        total_tokens = count_history_tokens(history)
+        if total_tokens <= budget:
+            return None, history
+
+        # Summary positions count from the first message ever recorded; a capped
+        # ConversationHistory has dropped its oldest `dropped` messages
+        dropped = getattr(history, "dropped", 0)
+        keep_messages = self.keep_turns * 2
+        target_covered = max(dropped, dropped + len(history) - keep_messages)
+
+        summary = self.summaries.get(session_id)
+        if summary is not None and summary.covered > dropped + len(history):
+            # History was reset or restarted - the cached summary no longer applies
+            del self.summaries[session_id]
+            summary = None
+
+        if summary is None or summary.covered < target_covered:
+            self._schedule_update(session_id, history[:target_covered - dropped], dropped)
+
+        if summary is None or summary.covered == 0:
+            return None, history
+
+        self.summaries.move_to_end(session_id)
+        recent = history[max(0, summary.covered - dropped):]
+        self.stats["compacted_turns"] += 1
+        self.stats["tokens_saved"] += max(
+            0, total_tokens - count_history_tokens(recent) - count_tokens(summary.text)
+        )
+        return summary.text, recent
+
+    def _schedule_update(self, session_id: str, aged_messages: List[Dict], start: int = 0):
+        """Fold newly aged-out messages (from position `start`) into the summary in the background"""
+        if session_id in self._pending or not aged_messages:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # No event loop (sync caller) - summary will be built on a later async turn
+
+        task = loop.create_task(self._update_summary(session_id, list(aged_messages), start))
+        self._pending[session_id] = task
+        task.add_done_callback(lambda _: self._pending.pop(session_id, None))
+
+    async def _update_summary(self, session_id: str, aged_messages: List[Dict], start: int = 0):
+        client = self._get_client()
+        if client is None:
+            return
+
+        current = self.summaries.get(session_id) or SessionSummary()
+        new_messages = aged_messages[max(0, current.covered - start):]
+        if not new_messages:
+            return
+
+        transcript = "\n".join(
+            f"{'User' if msg.get('role') == 'user' else 'Bot'}: {msg.get('content', '')}"
+            for msg in new_messages
+            if msg.get("role") in ("user", "assistant")
+        )
+        prompt = SUMMARY_PROMPT.format(summary=current.text or "(none yet)", messages=transcript)
+
+        try:
+            async with llm_limiter:
+                response = await client.chat.completions.create(
+                    model=self.summary_model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.1,
+                    max_tokens=400,
+                )
+            text = response.choices[0].message.content.strip()
+            usage_ledger.record(self.summary_model, "summary", None, response.usage)
+            if response.usage:
+                token_budget.record(
+                    session_id, response.usage.prompt_tokens + response.usage.completion_tokens, "summary"
+                )
+        except Exception as e:
+            self.stats["summary_failures"] += 1
+            logger.warning(f"[History] Summary update failed for {session_id}: {e}")
+            return
+
+        self.summaries[session_id] = SessionSummary(text=text, covered=start + len(aged_messages))
+        self.summaries.move_to_end(session_id)
+        while len(self.summaries) > MAX_CACHED_SUMMARIES:
+            self.summaries.popitem(last=False)
+        self.stats["summaries_built"] += 1
+        logger.info(f"[History] Summary for {session_id} now covers {start + len(aged_messages)} messages")
+
+    def clear(self, session_id: str):
+        """Drop the cached summary for a session"""
+        self.summaries.pop(session_id, None)
+        task = self._pending.pop(session_id, None)
+        if task:
+            task.cancel()
+
+    def get_stats(self) -> Dict:
+        """Get compaction statistics"""
+        return {
+            **self.stats,
+            "token_budget": self.token_budget,
+            "keep_turns": self.keep_turns,
+            "cached_summaries": len(self.summaries),
+            "pending_updates": len(self._pending),
+            "tokenizer": "tiktoken" if _ENCODING is not None else "estimate"
+        }
+
+
+# Global history compactor instance
+history_compactor = HistoryCompactor()
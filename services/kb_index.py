@@ -0,0 +1,314 @@
+"""
+Local KB Retrieval Index
+
+The "COMPLETE KB KNOWLEDGE - TOP 30 ISSUES" block is most of the expert
+system prompt, and shipping all of it on every turn costs thousands of
+prompt tokens regardless of the issue. This module splits that block into
+addressable articles, indexes them locally with BM25 (NumPy, no external
+service) and returns only the top-k articles relevant to the current
+message, recent user messages and the IssueRouter category.
+
+The generator then sends:
+- the static core rules (everything outside the KB block) as the cached prefix
+- the retrieved articles in a separate, uncached system message
+
+The index is persisted to config/prompts/kb_index.json and rebuilt by
+`python build_kb_index.py` whenever the prompt file changes. If the saved
+index is missing or stale it is rebuilt in memory at startup.
+
+Configuration:
+- KB_RETRIEVAL_ENABLED: Inject retrieved articles instead of the full KB (default true)
+- KB_RETRIEVAL_TOP_K: Articles injected per turn (default 3)
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    logger.warning("numpy not installed - KB retrieval disabled. Run: pip install numpy")
+
+PROMPT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config", "prompts", "expert_system_prompt.txt")
+INDEX_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config", "prompts", "kb_index.json")
+
+KB_HEADING = "COMPLETE KB KNOWLEDGE - TOP 30 ISSUES"
+KB_END_HEADING = "CRITICAL RULES:"
+ARTICLE_TITLE_PATTERN = re.compile(r"^\*\*(.+?):?\*\*\s*$")
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Articles that stay in the core prompt on every turn
+ALWAYS_INCLUDE = {"support contacts", "get in touch"}
+
+# Category terms blended into the query (IssueRouter category -> extra terms)
+CATEGORY_QUERY_TERMS = {
+    "login": "login password reset selfcare rdp account locked mfa",
+    "quickbooks": "quickbooks qb company file error",
+    "performance": "server slowness disk space memory",
+    "printing": "printer redirection print",
+    "office": "outlook office 365 excel email"
+}
+
+CORE_KB_NOTE = (
+    "KB KNOWLEDGE (Use EXACT steps, deliver interactively):\n"
+    "The KB articles most relevant to this conversation are provided in a separate "
+    "system message. If none of them match the user's issue, ask clarifying questions "
+    "or offer to connect the user with the support team."
+)
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+TITLE_WEIGHT = 2  # Title tokens count this many times
+
+
+@dataclass
+class KBArticle:
+    """A single KB article from the expert prompt"""
+    article_id: str
+    title: str
+    body: str
+
+    def render(self) -> str:
+        return f"**{self.title}:**\n{self.body}"
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric tokens (error codes like -6177 become '6177')"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def _slugify(title: str) -> str:
+    return "-".join(tokenize(title)) or "article"
+
+
+def split_prompt(prompt_text: str) -> Tuple[str, List[KBArticle]]:
+    """
+    Split the expert prompt into core rules and KB articles.
+
+    Returns:
+        Tuple of (core_prompt, articles). The core prompt keeps everything
+        outside the KB block plus the ALWAYS_INCLUDE articles.
+    """
+    lines = prompt_text.splitlines()
+    start = next((i for i, line in enumerate(lines) if line.startswith(KB_HEADING)), None)
+    if start is None:
+        return prompt_text, []
+    end = next((i for i in range(start + 1, len(lines)) if lines[i].startswith(KB_END_HEADING)), len(lines))
+
+    articles: List[KBArticle] = []
+    always_included: List[str] = []
+    title: Optional[str] = None
+    body: List[str] = []
+    seen_ids: Dict[str, int] = {}
+
+    def flush():
+        if title is None:
+            return
+        text = "\n".join(body).strip()
+        if title.lower() in ALWAYS_INCLUDE:
+            always_included.append(f"**{title}:**\n{text}")
+            return
+        article_id = _slugify(title)
+        if article_id in seen_ids:
+            seen_ids[article_id] += 1
+            article_id = f"{article_id}-{seen_ids[article_id]}"
+        else:
+            seen_ids[article_id] = 1
+        articles.append(KBArticle(article_id=article_id, title=title, body=text))
+
+    for line in lines[start + 1:end]:
+        match = ARTICLE_TITLE_PATTERN.match(line.strip())
+        if match:
+            flush()
+            title = match.group(1).strip().rstrip(":")
+            body = []
+        elif title is not None:
+            body.append(line)
+    flush()
+
+    core_parts = ["\n".join(lines[:start]).rstrip(), CORE_KB_NOTE]
+    core_parts.extend(always_included)
+    core_parts.append("\n".join(lines[end:]))
+    return "\n\n".join(core_parts), articles
+
+
+def prompt_hash(prompt_text: str) -> str:
+    return hashlib.sha256(prompt_text.encode("utf-8")).hexdigest()
+
+
+class KBIndex:
+    """BM25 index over KB articles"""
+
+    def __init__(self, articles: List[KBArticle], vocabulary: Dict[str, int], weights, source_hash: str):
+        self.articles = articles
+        self.vocabulary = vocabulary
+        self.weights = weights  # (num_articles, vocab_size) BM25 term weights
+        self.source_hash = source_hash
+
+    @classmethod
+    def build(cls, articles: List[KBArticle], source_hash: str) -> "KBIndex":
+        """Compute BM25 term weights for every (article, term) pair"""
+        documents = [tokenize(a.title) * TITLE_WEIGHT + tokenize(a.body) for a in articles]
+        vocabulary: Dict[str, int] = {}
+        for doc in documents:
+            for token in doc:
+                vocabulary.setdefault(token, len(vocabulary))
+
+        tf = np.zeros((len(documents), len(vocabulary)), dtype=np.float32)
+        for row, doc in enumerate(documents):
+            for token in doc:
+                tf[row, vocabulary[token]] += 1
+
+        doc_lengths = tf.sum(axis=1, keepdims=True)
+        avg_length = float(doc_lengths.mean()) if len(documents) else 1.0
+        doc_freq = (tf > 0).sum(axis=0)
+        idf = np.log(1 + (len(documents) - doc_freq + 0.5) / (doc_freq + 0.5))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / avg_length)
+        weights = idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return cls(articles, vocabulary, weights.astype(np.float32), source_hash)
+
+    def search(self, weighted_queries: List[Tuple[str, float]], top_k: int = 3) -> List[Tuple[KBArticle, float]]:
+        """
+        Score articles against one or more weighted query strings.
+
+        Args:
+            weighted_queries: [(text, weight)] - e.g. current message at 1.0, history at 0.5
+            top_k: Max articles to return
+
+        Returns:
+            [(article, score)] with score > 0, best first
+        """
+        if not self.articles:
+            return []
+        query = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for text, weight in weighted_queries:
+            for token in set(tokenize(text)):
+                column = self.vocabulary.get(token)
+                if column is not None:
+                    query[column] += weight
+        scores = self.weights @ query
+        ranked = np.argsort(-scores)[:top_k]
+        return [(self.articles[i], float(scores[i])) for i in ranked if scores[i] > 0]
+
+    def save(self, path: str = INDEX_PATH):
+        """Persist the index as JSON (weights stored sparse - most terms are absent per article)"""
+        data = {
+            "source_hash": self.source_hash,
+            "articles": [asdict(a) for a in self.articles],
+            "vocabulary": self.vocabulary,
+            "weights": [
+                {str(col): round(float(row[col]), 5) for col in np.flatnonzero(row)}
+                for row in self.weights
+            ]
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        logger.info(f"[KB] Saved index with {len(self.articles)} articles to {path}")
+
+    @classmethod
+    def load(cls, path: str = INDEX_PATH) -> "KBIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        articles = [KBArticle(**a) for a in data["articles"]]
+        weights = np.zeros((len(articles), len(data["vocabulary"])), dtype=np.float32)
+        for row, entries in enumerate(data["weights"]):
+            for col, value in entries.items():
+                weights[row, int(col)] = value
+        return cls(articles, data["vocabulary"], weights, data["source_hash"])
+
+
+class KBRetriever:
+    """Builds the per-turn KB context from the index"""
+
+    def __init__(self, prompt_path: str = PROMPT_PATH, index_path: str = INDEX_PATH):
+        self.top_k = int(os.getenv("KB_RETRIEVAL_TOP_K", "3"))
+        self.enabled = os.getenv("KB_RETRIEVAL_ENABLED", "true").lower() in ("1", "true", "yes") and NUMPY_AVAILABLE
+        self.core_prompt: Optional[str] = None
+        self.index: Optional[KBIndex] = None
+        self.stats = {"retrievals": 0, "articles_injected": 0, "empty_retrievals": 0}
+
+        if not self.enabled:
+            logger.info("KBRetriever disabled - full expert prompt will be sent")
+            return
+
+        try:
+            with open(prompt_path, "r", encoding="utf-8") as f:
+                prompt_text = f.read()
+            self.core_prompt, articles = split_prompt(prompt_text)
+            if not articles:
+                raise ValueError(f"No KB articles found under '{KB_HEADING}'")
+
+            current_hash = prompt_hash(prompt_text)
+            self.index = self._load_or_build(index_path, articles, current_hash)
+            logger.info(
+                f"KBRetriever initialized ({len(self.index.articles)} articles, top_k={self.top_k}, "
+                f"core prompt {len(self.core_prompt)} chars vs full {len(prompt_text)} chars)"
+            )
+        except Exception as e:
+            logger.error(f"[KB] Failed to initialize retrieval - falling back to full prompt: {e}")
+            self.enabled = False
+            self.core_prompt = None
+            self.index = None
+
+    def _load_or_build(self, index_path: str, articles: List[KBArticle], current_hash: str) -> KBIndex:
+        if os.path.exists(index_path):
+            try:
+                index = KBIndex.load(index_path)
+                if index.source_hash == current_hash:
+                    return index
+                logger.warning("[KB] Saved index is stale (prompt changed) - rebuilding in memory. Run build_kb_index.py")
+            except Exception as e:
+                logger.warning(f"[KB] Could not load saved index ({e}) - rebuilding in memory")
+        return KBIndex.build(articles, current_hash)
+
+    def retrieve(self, message: str, history: Optional[List[Dict]] = None,
+                 category: str = "other") -> List[KBArticle]:
+        """Top-k articles for the current message, recent user turns and category"""
+        if not self.enabled or self.index is None:
+            return []
+
+        queries: List[Tuple[str, float]] = [(message, 1.0)]
+        # Short follow-ups ("done", "ok") still need the article being walked through
+        recent_user_messages = [m.get("content", "") for m in (history or []) if m.get("role") == "user"][-6:]
+        queries.extend((text, 0.5) for text in recent_user_messages)
+        if category in CATEGORY_QUERY_TERMS:
+            queries.append((CATEGORY_QUERY_TERMS[category], 0.3))
+
+        results = self.index.search(queries, self.top_k)
+        self.stats["retrievals"] += 1
+        self.stats["articles_injected"] += len(results)
+        if not results:
+            self.stats["empty_retrievals"] += 1
+        logger.debug(f"[KB] Retrieved: {[(a.article_id, round(score, 2)) for a, score in results]}")
+        return [article for article, _ in results]
+
+    def build_context(self, message: str, history: Optional[List[Dict]] = None,
+                      category: str = "other") -> Optional[str]:
+        """Render retrieved articles as a system message body (None if nothing relevant)"""
+        articles = self.retrieve(message, history, category)
+        if not articles:
+            return None
+        return "RELEVANT KB ARTICLES:\n\n" + "\n\n".join(article.render() for article in articles)
+
+    def get_stats(self) -> Dict:
+        """Get retrieval statistics"""
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "top_k": self.top_k,
+            "articles_indexed": len(self.index.articles) if self.index else 0
+        }
+
+
+# Global KB retriever instance
+kb_retriever = KBRetriever()
@@ -0,0 +1,101 @@
+"""
+Shared OpenRouter client factory for the Gemini services.
+
+Both GeminiClassifier and GeminiResponseGenerator talk to the same
+OpenRouter endpoint. This module owns the client construction so the
+sync and async paths stay configured identically, and provides a single
+concurrency limiter for all in-flight LLM calls.
+
+Configuration:
+- OPENROUTER_API_KEY: API key (required)
+- LLM_MAX_CONCURRENCY: Max simultaneous LLM requests per process (default 32)
+"""
+
+import os
+import asyncio
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# Import OpenAI SDK for OpenRouter
+try:
+    from openai import OpenAI, AsyncOpenAI
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+    logger.warning("openai not installed. Run: pip install openai")
+
+
+def get_api_key() -> str:
+    """Return the OpenRouter API key or raise if not configured"""
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        raise ValueError("OPENROUTER_API_KEY not set in environment variables")
+    return api_key
+
+
+def create_sync_client() -> "OpenAI":
+    """Create a blocking OpenAI SDK client pointed at OpenRouter"""
+    if not OPENAI_AVAILABLE:
+        raise ImportError("openai package not installed")
+    return OpenAI(base_url=OPENROUTER_BASE_URL, api_key=get_api_key())
+
+
+def create_async_client() -> "AsyncOpenAI":
+    """Create a non-blocking OpenAI SDK client pointed at OpenRouter"""
+    if not OPENAI_AVAILABLE:
+        raise ImportError("openai package not installed")
+    return AsyncOpenAI(base_url=OPENROUTER_BASE_URL, api_key=get_api_key())
+
+
+class LLMConcurrencyLimiter:
+    """
+    Caps the number of concurrent LLM requests made from the event loop.
+
+    The semaphore is created lazily so it binds to the running loop
+    (uvicorn creates its loop after this module is imported).
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        # Requests waiting for a slot
+        self.waiting = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def __aenter__(self):
+        self.waiting += 1
+        try:
+            await self._get_semaphore().acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        self._get_semaphore().release()
+        return False
+
+    def get_stats(self) -> dict:
+        """Get current limiter usage"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "peak_in_flight": self.peak_in_flight
+        }
+
+
+# Global limiter shared by classifier and generator
+llm_limiter = LLMConcurrencyLimiter(int(os.getenv("LLM_MAX_CONCURRENCY", "32")))
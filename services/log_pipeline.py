@@ -0,0 +1,218 @@
+"""
+Queue-Backed Structured Logging
+
+Log records used to be formatted and written synchronously on the event
+loop by the root StreamHandler. log_pipeline.configure() installs a
+pipeline that keeps the loop's share of each log call small:
+
+- ContextQueueHandler (root logger, caller thread): stamps the record with
+  request_id/session_id from the context variables, renders the message
+  and any traceback text, and drops it on a bounded queue - no formatter,
+  no I/O. A full queue drops the record (counted) rather than block a turn.
+- QueueListener (background thread): formats records as JSON lines (or the
+  classic text layout) and writes them to stdout.
+- Per-logger sampling for chatty DEBUG/INFO paths: LOG_SAMPLING keeps a
+  fraction of a logger's (and its children's) records; warnings and above
+  are never sampled out.
+- Process and multiprocessing info are not collected per record (neither
+  output format uses them).
+
+Formatting only happens for enabled levels, so expensive messages should use
+%-style arguments (`logger.debug("payload: %s", request)`) rather than
+f-strings, which are built even when the level is off. The listener is
+stopped (flushing queued records) at interpreter exit.
+
+Configuration:
+- LOG_LEVEL: Root log level (default INFO)
+- LOG_FORMAT: text | json (default text; json for log aggregators)
+- LOG_QUEUE_SIZE: Records buffered for the listener thread (default 10000)
+- LOG_SAMPLING: Comma-separated logger=rate pairs, e.g.
+  "services.handler_registry=0.1,llm_chatbot=0.5" (default none)
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional, Tuple
+
+from services.tracing import request_id_var, session_id_var
+
+logger = logging.getLogger(__name__)
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] [req:%(request_id)s] [session:%(session_id)s] %(name)s - %(message)s'
+
+
+class ContextualFormatter(logging.Formatter):
+    """Text formatter that includes request_id and session_id in logs"""
+
+    def format(self, record):
+        # Records from the queue already carry the context of the thread that logged them
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+            record.session_id = session_id_var.get()
+        return super().format(record)
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, message, request/session IDs"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", None) or request_id_var.get(),
+            "session_id": getattr(record, "session_id", None) or session_id_var.get()
+        }
+        alert_data = getattr(record, "alert_data", None)
+        if alert_data is not None:
+            entry["alert"] = alert_data
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of DEBUG/INFO records per logger (and its children)"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, Optional[float]] = {}
+        self.sampled_out = 0
+
+    def rate_for(self, name: str) -> Optional[float]:
+        """Rate of the closest configured ancestor logger (cached per logger name)"""
+        if name in self._resolved:
+            return self._resolved[name]
+        rate = None
+        prefix = name
+        while prefix:
+            if prefix in self.rates:
+                rate = self.rates[prefix]
+                break
+            prefix = prefix.rpartition(".")[0]
+        self._resolved[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rate_for(record.name)
+        if rate is None or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class ContextQueueHandler(QueueHandler):
+    """Enqueue records with their request context; the listener thread formats them"""
+
+    def __init__(self, log_queue: queue.SimpleQueue, max_size: int):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+        self._exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        # Context variables and mutable args only exist on the logging thread - resolve them here
+        record.request_id = request_id_var.get()
+        record.session_id = session_id_var.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        # SimpleQueue is unbounded (and lock-free in C) - bound it by size instead
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+class LogPipeline:
+    """Owns the queue handler and listener thread"""
+
+    def __init__(self):
+        self.handler: Optional[ContextQueueHandler] = None
+        self.listener: Optional[QueueListener] = None
+        self.sampling: Optional[SamplingFilter] = None
+        self.output_format = "text"
+
+    def configure(self, stream=None) -> logging.Logger:
+        """Route the root logger through the queue (idempotent)
+
+        Args:
+            stream: Output for the listener's handler (default stdout)
+        """
+        if self.listener is not None:
+            return logging.getLogger()
+        self.output_format = os.getenv("LOG_FORMAT", "text").lower()
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        # Neither format uses process info - skip collecting it per record
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JSONFormatter() if self.output_format == "json" else ContextualFormatter(TEXT_FORMAT))
+
+        self.handler = ContextQueueHandler(log_queue, int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+        rates, invalid = parse_sampling(os.getenv("LOG_SAMPLING", ""))
+        self.sampling = SamplingFilter(rates)
+        self.handler.addFilter(self.sampling)
+
+        root = logging.getLogger()
+        root.handlers = [self.handler]
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        self.listener = QueueListener(log_queue, output, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.stop)
+        if invalid:
+            logger.warning(f"[Logging] Ignoring invalid LOG_SAMPLING entries: {invalid}")
+        return root
+
+    def stop(self):
+        """Flush queued records and stop the listener thread"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def get_stats(self) -> Dict:
+        if self.handler is None:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "format": self.output_format,
+            "queued": self.handler.queue.qsize(),
+            "dropped": self.handler.dropped,
+            "sampled_out": self.sampling.sampled_out,
+            "sampling": self.sampling.rates
+        }
+
+
+def parse_sampling(spec: str) -> Tuple[Dict[str, float], List[str]]:
+    """"a.b=0.1,c=0.5" → ({"a.b": 0.1, "c": 0.5}, invalid pairs)"""
+    rates, invalid = {}, []
+    for pair in filter(None, (pair.strip() for pair in spec.split(","))):
+        name, _, rate = pair.partition("=")
+        try:
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            invalid.append(pair)
+    return rates, invalid
+
+
+# Global log pipeline instance
+log_pipeline = LogPipeline()
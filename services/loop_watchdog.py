@@ -0,0 +1,194 @@
+"""
+Event-Loop Stall Watchdog
+
+Blocking calls inside async handlers (sync OpenAI/requests clients,
+time.sleep retries, synchronous alert posts) freeze every session served by
+the worker. The watchdog measures event-loop lag continuously and catches
+the offending code in the act:
+
+- Heartbeat: a loop task sleeps LOOP_WATCHDOG_INTERVAL_MS at a time; how
+  late each wake-up is, is the loop's lag. Every lag goes into the
+  chatbot_event_loop_lag_seconds histogram (Prometheus) and the stall
+  histogram on /metrics.
+- Watchdog thread: when the heartbeat is overdue by LOOP_STALL_THRESHOLD_MS
+  it captures the loop thread's stack (sys._current_frames) while the loop
+  is still blocked. The innermost frame in this repo's code is the blocking
+  call site; sites are ranked by stall count and blocked time. A capture
+  is tagged with the heartbeat it was overdue for and discarded when that
+  heartbeat completes, so a stall is never blamed on an older stack.
+
+The heartbeat and a thread wake-up every half interval are the only
+steady-state cost.
+
+Configuration:
+- LOOP_WATCHDOG_ENABLED: Run the watchdog (default true)
+- LOOP_WATCHDOG_INTERVAL_MS: Heartbeat interval (default 100)
+- LOOP_STALL_THRESHOLD_MS: Lag that counts as a stall and captures a stack (default 100)
+- LOOP_STALL_KEEP: Recent stalls kept with full stacks (default 20)
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from services.prometheus_exporter import Histogram, prometheus_exporter
+
+logger = logging.getLogger(__name__)
+
+# Seconds - lag is usually well under a millisecond; stalls run from the threshold up
+LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Frames under this directory are "our" code when picking the blocking call site
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STACK_LIMIT = 40
+
+
+def blocking_site(stack: traceback.StackSummary) -> str:
+    """Innermost frame in repo code (outside it, the innermost frame)"""
+    for frame in reversed(stack):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(REPO_ROOT) and "site-packages" not in filename:
+            return f"{os.path.relpath(filename, REPO_ROOT)}:{frame.lineno} {frame.name}"
+    if stack:
+        frame = stack[-1]
+        return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}"
+    return "unknown"
+
+
+class LoopWatchdog:
+    """Heartbeat lag measurement plus stack capture for stalls"""
+
+    def __init__(self):
+        self.enabled = os.getenv("LOOP_WATCHDOG_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.interval = float(os.getenv("LOOP_WATCHDOG_INTERVAL_MS", "100")) / 1000
+        self.threshold = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "100")) / 1000
+        self.lag = Histogram("chatbot_event_loop_lag_seconds", "Event loop heartbeat lag", (), LAG_BUCKETS)
+        prometheus_exporter.register_metric(self.lag)
+        self.recent_stalls: Deque[Dict] = deque(maxlen=int(os.getenv("LOOP_STALL_KEEP", "20")))
+        # call site → {"stalls", "blocked_ms"}
+        self.call_sites: Dict[str, Dict[str, float]] = {}
+        self.stats = {"heartbeats": 0, "stalls": 0, "max_lag_ms": 0.0}
+
+        self._beat = time.monotonic()
+        # (heartbeat the stack was captured for, stall)
+        self._captured: Optional[Tuple[float, Dict]] = None
+        self._loop_thread: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        logger.info(f"LoopWatchdog initialized (enabled: {self.enabled}, "
+                    f"stall threshold: {self.threshold * 1000:.0f}ms)")
+
+    def start(self):
+        """Start the heartbeat and watchdog thread (call from the running event loop)"""
+        if not self.enabled or self._heartbeat is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._heartbeat = asyncio.create_task(self._run_heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"[Watchdog] Started (heartbeat every {self.interval * 1000:.0f}ms)")
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._stop.set()
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+            self._thread.join()
+
+    async def _run_heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            self._beat = expected
+            await asyncio.sleep(self.interval)
+            self.record_lag(max(0.0, time.monotonic() - expected))
+
+    def record_lag(self, lag: float):
+        """Account one heartbeat's lag, completing the stall captured for it (if any)"""
+        # Every heartbeat consumes the capture - only one taken for this beat belongs to its stall
+        captured, self._captured = self._captured, None
+        self.stats["heartbeats"] += 1
+        self.lag.observe(lag)
+        lag_ms = lag * 1000
+        if lag_ms > self.stats["max_lag_ms"]:
+            self.stats["max_lag_ms"] = round(lag_ms, 1)
+        if lag < self.threshold:
+            return
+
+        self.stats["stalls"] += 1
+        stall = captured[1] if captured is not None and captured[0] == self._beat else None
+        if stall is None:
+            # Stalled between watchdog checks - no stack for this one
+            stall = {"site": "unknown", "stack": [], "captured_at": time.time()}
+        stall["blocked_ms"] = round(lag_ms, 1)
+        site = self.call_sites.setdefault(stall["site"], {"stalls": 0, "blocked_ms": 0.0})
+        site["stalls"] += 1
+        site["blocked_ms"] = round(site["blocked_ms"] + lag_ms, 1)
+        self.recent_stalls.append(stall)
+        logger.warning(f"[Watchdog] Event loop blocked for {lag_ms:.0f}ms at {stall['site']}")
+
+    def _watch(self):
+        check_every = self.interval / 2
+        while not self._stop.wait(check_every):
+            beat = self._beat
+            overdue = time.monotonic() - beat
+            if overdue >= self.threshold and (self._captured is None or self._captured[0] != beat):
+                self.capture(beat)
+
+    def capture(self, beat: Optional[float] = None):
+        """Capture the loop thread's current stack as the pending stall for `beat` (watchdog thread)
+
+        Args:
+            beat: Heartbeat the loop is overdue for (default the current one)
+        """
+        beat = self._beat if beat is None else beat
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame, limit=STACK_LIMIT)
+        del frame
+        self._captured = (beat, {
+            "site": blocking_site(stack),
+            "stack": [f"{os.path.basename(f.filename)}:{f.lineno} {f.name}" for f in stack],
+            "captured_at": time.time()
+        })
+
+    def stall_histogram(self) -> Dict[str, int]:
+        """Heartbeats per lag bucket (non-cumulative)"""
+        series = self.lag.series.get(())
+        if series is None:
+            return {}
+        labels = [f"<={bound * 1000:g}ms" for bound in LAG_BUCKETS] + [f">{LAG_BUCKETS[-1] * 1000:g}ms"]
+        return {label: count for label, count in zip(labels, series) if count}
+
+    def top_call_sites(self, limit: int = 10) -> List[Dict]:
+        ranked = sorted(self.call_sites.items(), key=lambda item: item[1]["blocked_ms"], reverse=True)
+        return [{"site": site, **totals} for site, totals in ranked[:limit]]
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "running": self._heartbeat is not None,
+            "stall_threshold_ms": self.threshold * 1000,
+            "lag_histogram": self.stall_histogram(),
+            "top_call_sites": self.top_call_sites(),
+            "recent_stalls": list(self.recent_stalls)
+        }
+
+
+# Global watchdog instance
+loop_watchdog = LoopWatchdog()
@@ -5,17 +5,33 @@ Tracks chatbot performance metrics including:
 - Automation rate (resolved vs escalated)
 - Category distribution
 - Resolution times
-- LLM token usage
+- LLM token usage (cost and the input/cached/output split come from the usage ledger)
 - Error rates
+
+Summaries are O(1): counters and running sums are updated as conversations
+start and end, and a conversation's entry is dropped once it ends. Every
+event is also added to fixed-size per-minute (last hour) and per-hour (last
+24 hours) rollup buckets, which give the rolling 1h/24h windows.
+
+The counters and rollups are per worker process: with several workers each
+one reports only the conversations it started and ended (active
+conversations come from the shared session store). Each event is counted by
+exactly one worker, so fleet totals are the sum of every worker's summary,
+which is labelled with "scope": "worker" and the worker's PID.
 """
 
+import os
+import time
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, Optional, List
 from collections import defaultdict
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 import json
 
+from services.session_store import Codec, session_store
+from services.usage_ledger import usage_ledger
+
 logger = logging.getLogger(__name__)
 
 
@@ -32,23 +48,99 @@ class ConversationMetric:
     llm_tokens_used: int = 0
     router_matched: bool = False
     error_count: int = 0
+    
+    def to_dict(self) -> Dict:
+        """JSON-compatible form for shared session stores"""
+        data = asdict(self)
+        data["started_at"] = self.started_at.isoformat()
+        data["ended_at"] = self.ended_at.isoformat() if self.ended_at else None
+        return data
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ConversationMetric":
+        return cls(
+            **{
+                **data,
+                "started_at": datetime.fromisoformat(data["started_at"]),
+                "ended_at": datetime.fromisoformat(data["ended_at"]) if data.get("ended_at") else None
+            }
+        )
+
+
+@dataclass
+class RollupBucket:
+    """Aggregates for one minute or hour of activity"""
+    start: float = 0.0
+    started: int = 0
+    router_matches: int = 0
+    categories: Dict[str, int] = field(default_factory=dict)
+    resolutions: Dict[str, int] = field(default_factory=dict)
+    resolution_seconds: float = 0.0
+    llm_calls: int = 0
+    llm_tokens: int = 0
+
+    def add(self, other: "RollupBucket"):
+        self.started += other.started
+        self.router_matches += other.router_matches
+        for category, count in other.categories.items():
+            self.categories[category] = self.categories.get(category, 0) + count
+        for resolution, count in other.resolutions.items():
+            self.resolutions[resolution] = self.resolutions.get(resolution, 0) + count
+        self.resolution_seconds += other.resolution_seconds
+        self.llm_calls += other.llm_calls
+        self.llm_tokens += other.llm_tokens
+
+
+class RollupRing:
+    """Fixed ring of time buckets (e.g. 60 one-minute buckets)"""
+
+    def __init__(self, bucket_seconds: int, size: int):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = [RollupBucket(start=-1.0) for _ in range(size)]
+
+    def current(self, now: float) -> RollupBucket:
+        """Bucket for `now`, recycling the slot if it still holds an older period"""
+        start = now - now % self.bucket_seconds
+        index = int(start // self.bucket_seconds) % len(self.buckets)
+        if self.buckets[index].start != start:
+            self.buckets[index] = RollupBucket(start=start)
+        return self.buckets[index]
+
+    def window(self, now: float, seconds: int) -> RollupBucket:
+        """Sum of the buckets that started within the last `seconds`"""
+        total = RollupBucket(start=now - seconds)
+        for bucket in self.buckets:
+            if bucket.start > now - seconds:
+                total.add(bucket)
+        return total
 
 
 class MetricsCollector:
     """Collects and aggregates chatbot performance metrics"""
     
     def __init__(self):
-        self.conversations: Dict[str, ConversationMetric] = {}
+        self.conversations: Dict[str, ConversationMetric] = session_store.mapping(
+            "metrics_conversations",
+            Codec(ConversationMetric.to_dict, ConversationMetric.from_dict)
+        )
         self.category_counts: Dict[str, int] = defaultdict(int)
         self.resolution_counts: Dict[str, int] = defaultdict(int)
         self.total_llm_calls: int = 0
         self.total_llm_tokens: int = 0
         self.total_router_matches: int = 0
         self.total_conversations: int = 0
+        # Running totals, so ended conversations can be dropped from self.conversations
+        self.total_resolution_seconds: float = 0.0
+        self.minutes = RollupRing(60, 60)
+        self.hours = RollupRing(3600, 24)
         self.start_time: datetime = datetime.now()
         
         logger.info("MetricsCollector initialized")
     
+    def _rollups(self) -> List[RollupBucket]:
+        now = time.time()
+        return [self.minutes.current(now), self.hours.current(now)]
+    
     def start_conversation(self, session_id: str, category: str = "other", router_matched: bool = False):
         """Start tracking a new conversation"""
         if session_id not in self.conversations:
@@ -62,6 +154,10 @@ class MetricsCollector:
             self.category_counts[category] += 1
             if router_matched:
                 self.total_router_matches += 1
+            for bucket in self._rollups():
+                bucket.started += 1
+                bucket.categories[category] = bucket.categories.get(category, 0) + 1
+                bucket.router_matches += int(router_matched)
             
             logger.debug(f"Started tracking conversation {session_id} (category: {category})")
     
@@ -76,6 +172,9 @@ class MetricsCollector:
                 conv.llm_tokens_used += tokens_used
                 self.total_llm_calls += 1
                 self.total_llm_tokens += tokens_used
+                for bucket in self._rollups():
+                    bucket.llm_calls += 1
+                    bucket.llm_tokens += tokens_used
     
     def record_error(self, session_id: str):
         """Record an error in the conversation"""
@@ -85,17 +184,26 @@ class MetricsCollector:
     def end_conversation(self, session_id: str, resolution_type: str):
         """End tracking a conversation
         
+        The conversation is folded into the totals and rollups and its entry
+        dropped, so ending it again is a no-op.
+        
         Args:
             session_id: Conversation session ID
             resolution_type: 'resolved', 'escalated', or 'abandoned'
         """
-        if session_id in self.conversations:
-            conv = self.conversations[session_id]
+        conv = self.conversations.pop(session_id, None)
+        if conv is not None:
             conv.ended_at = datetime.now()
             conv.resolution_type = resolution_type
             self.resolution_counts[resolution_type] += 1
             
             duration = (conv.ended_at - conv.started_at).total_seconds()
+            if resolution_type == "resolved":
+                self.total_resolution_seconds += duration
+            for bucket in self._rollups():
+                bucket.resolutions[resolution_type] = bucket.resolutions.get(resolution_type, 0) + 1
+                if resolution_type == "resolved":
+                    bucket.resolution_seconds += duration
             logger.info(
                 f"Conversation {session_id} ended: {resolution_type} "
                 f"(duration: {duration:.1f}s, messages: {conv.message_count}, "
@@ -125,32 +233,53 @@ class MetricsCollector:
     
     def get_average_resolution_time(self) -> float:
         """Calculate average time to resolution (seconds)"""
-        completed_conversations = [
-            conv for conv in self.conversations.values()
-            if conv.ended_at and conv.resolution_type == "resolved"
-        ]
-        
-        if not completed_conversations:
-            return 0.0
-        
-        total_time = sum(
-            (conv.ended_at - conv.started_at).total_seconds()
-            for conv in completed_conversations
-        )
-        return total_time / len(completed_conversations)
+        resolved = self.resolution_counts.get("resolved", 0)
+        return (self.total_resolution_seconds / resolved) if resolved > 0 else 0.0
     
     def get_category_distribution(self) -> Dict[str, int]:
         """Get conversation count by category"""
         return dict(self.category_counts)
     
+    @staticmethod
+    def _window_summary(window: RollupBucket) -> Dict:
+        completed = sum(window.resolutions.values())
+        resolved = window.resolutions.get("resolved", 0)
+        escalated = window.resolutions.get("escalated", 0)
+        return {
+            "started_conversations": window.started,
+            "completed_conversations": completed,
+            "resolved": resolved,
+            "escalated": escalated,
+            "abandoned": window.resolutions.get("abandoned", 0),
+            "automation_rate": round(resolved / completed * 100, 2) if completed else 0.0,
+            "escalation_rate": round(escalated / completed * 100, 2) if completed else 0.0,
+            "avg_resolution_time_seconds": round(window.resolution_seconds / resolved, 2) if resolved else 0.0,
+            "router_matches": window.router_matches,
+            "llm_calls": window.llm_calls,
+            "llm_tokens": window.llm_tokens,
+            "categories": dict(window.categories)
+        }
+    
+    def get_windows(self) -> Dict[str, Dict]:
+        """Rolling last-hour (minute buckets) and last-24-hour (hour buckets) aggregates"""
+        now = time.time()
+        return {
+            "last_1h": self._window_summary(self.minutes.window(now, 3600)),
+            "last_24h": self._window_summary(self.hours.window(now, 24 * 3600))
+        }
+    
     def get_summary(self) -> Dict:
         """Get comprehensive metrics summary"""
         uptime = (datetime.now() - self.start_time).total_seconds()
+        ledger = usage_ledger.total()
         
         return {
             "overview": {
+                # Counters and windows below cover this worker only; sum workers for fleet totals
+                "scope": "worker",
+                "worker_pid": os.getpid(),
                 "total_conversations": self.total_conversations,
-                "active_conversations": len([c for c in self.conversations.values() if not c.ended_at]),
+                "active_conversations": len(self.conversations),
                 "completed_conversations": sum(self.resolution_counts.values()),
                 "uptime_seconds": uptime,
                 "uptime_hours": uptime / 3600
@@ -171,9 +300,14 @@ class MetricsCollector:
                 "total_calls": self.total_llm_calls,
                 "total_tokens": self.total_llm_tokens,
                 "avg_tokens_per_conversation": round(self.get_average_tokens_per_conversation(), 2),
-                "estimated_cost_usd": round(self.total_llm_tokens * 0.0000015, 4)  # GPT-4o-mini pricing
+                # Every LLM call (generator, classifier, summaries), priced per model
+                "input_tokens": ledger.input_tokens,
+                "cached_input_tokens": ledger.cached_input_tokens,
+                "output_tokens": ledger.output_tokens,
+                "cost_usd": round(ledger.cost_usd, 4)
             },
-            "categories": self.get_category_distribution()
+            "categories": self.get_category_distribution(),
+            "windows": self.get_windows()
         }
     
     def get_detailed_report(self) -> str:
@@ -182,7 +316,7 @@ class MetricsCollector:
         
         report = []
         report.append("=" * 70)
-        report.append("CHATBOT PERFORMANCE METRICS")
+        report.append(f"CHATBOT PERFORMANCE METRICS (this worker, pid {summary['overview']['worker_pid']})")
         report.append("=" * 70)
         report.append("")
         
@@ -203,6 +337,17 @@ class MetricsCollector:
         report.append(f"  📈 Escalation Rate: {summary['resolution']['escalation_rate']:.1f}%")
         report.append("")
         
+        # Rolling windows
+        report.append("ROLLING WINDOWS:")
+        for label, key in (("Last hour", "last_1h"), ("Last 24h", "last_24h")):
+            window = summary['windows'][key]
+            report.append(
+                f"  {label:9s}: {window['started_conversations']} started, "
+                f"{window['completed_conversations']} completed, "
+                f"{window['automation_rate']:.1f}% automated"
+            )
+        report.append("")
+        
         # Performance
         report.append("PERFORMANCE:")
         report.append(f"  ⏱️  Avg Resolution Time: {summary['performance']['avg_resolution_time_seconds']:.1f}s")
@@ -214,7 +359,9 @@ class MetricsCollector:
         report.append(f"  🤖 Total Calls: {summary['llm_usage']['total_calls']}")
         report.append(f"  🪙 Total Tokens: {summary['llm_usage']['total_tokens']:,}")
         report.append(f"  📊 Avg Tokens/Conv: {summary['llm_usage']['avg_tokens_per_conversation']:.0f}")
-        report.append(f"  💰 Estimated Cost: ${summary['llm_usage']['estimated_cost_usd']:.4f}")
+        report.append(f"  📥 Input/Cached/Output: {summary['llm_usage']['input_tokens']:,} / "
+                      f"{summary['llm_usage']['cached_input_tokens']:,} / {summary['llm_usage']['output_tokens']:,}")
+        report.append(f"  💰 Cost: ${summary['llm_usage']['cost_usd']:.4f}")
         report.append("")
         
         # Categories
@@ -246,6 +393,9 @@ class MetricsCollector:
         self.total_llm_tokens = 0
         self.total_router_matches = 0
         self.total_conversations = 0
+        self.total_resolution_seconds = 0.0
+        self.minutes = RollupRing(60, 60)
+        self.hours = RollupRing(3600, 24)
         self.start_time = datetime.now()
         
         logger.warning("Metrics reset - all data cleared")
@@ -0,0 +1,401 @@
+"""
+Durable Outbox for Post-Reply Side Effects
+
+Zoho side effects (chat transfer, chat closure, callback and support
+tickets) are enqueued into a local SQLite table instead of running inline,
+so the webhook can return its reply immediately. A background worker runs
+due jobs with retries (exponential backoff + jitter) and records the
+outcome.
+
+Jobs carry an idempotency key: enqueueing the same key again within
+OUTBOX_IDEMPOTENCY_WINDOW_SECONDS is a no-op, so a redelivered webhook
+cannot transfer a visitor or create a callback twice. A job that failed
+permanently does not block its key - a visitor retrying gets a new job. The
+on_failure callback passed to start() is called for every permanent failure
+so someone can follow up. Several worker
+processes can share one outbox file: jobs are claimed atomically, and jobs
+left "running" by a crashed worker are retried once their lease expires.
+
+Jobs remember the request ID of the webhook that queued them, and each
+attempt runs inside a trace ("outbox <job_type>") keyed by that ID, so the
+Zoho spans it records are kept and linked to the originating request.
+
+Job handlers are registered by name and called with the job payload as
+keyword arguments. They return the usual Zoho result dict:
+- {"success": True, ...}                      → done
+- {"success": False, "retryable": False, ...} → failed (no retry)
+- {"success": False, "status_code": 4xx, ...}  → failed (no retry, except 429)
+- anything else, or an exception              → retried until max attempts
+
+Configuration:
+- OUTBOX_ENABLED: Queue side effects instead of running them inline (default true)
+- OUTBOX_DB_PATH: SQLite file (default data/outbox.db)
+- OUTBOX_MAX_ATTEMPTS: Attempts before a job is marked failed (default 5)
+- OUTBOX_CONCURRENCY: Jobs run in parallel by the worker (default 4)
+- OUTBOX_IDEMPOTENCY_WINDOW_SECONDS: Dedup window for idempotency keys (default 3600)
+"""
+
+import os
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from services.prometheus_exporter import prometheus_exporter
+from services.tracing import request_id_var, tracer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "outbox.db")
+
+# Retry backoff (seconds)
+RETRY_BASE_DELAY = 5
+RETRY_MAX_DELAY = 300
+
+# Completed jobs kept for this long before cleanup
+DONE_RETENTION_SECONDS = 24 * 3600
+
+POLL_INTERVAL_SECONDS = 1.0
+
+# Jobs "running" for longer than this are assumed lost with their worker process
+JOB_LEASE_SECONDS = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    job_type TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    last_error TEXT,
+    result TEXT,
+    request_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox_jobs (status, next_attempt_at);
+"""
+
+JobHandler = Callable[..., Awaitable[Dict[str, Any]]]
+FailureCallback = Callable[[Dict[str, Any]], None]
+
+
+class Outbox:
+    """SQLite-backed job queue with a background worker"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.enabled = os.getenv("OUTBOX_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.db_path = db_path or os.getenv("OUTBOX_DB_PATH", DEFAULT_DB_PATH)
+        self.max_attempts = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+        self.concurrency = int(os.getenv("OUTBOX_CONCURRENCY", "4"))
+        self.idempotency_window = float(os.getenv("OUTBOX_IDEMPOTENCY_WINDOW_SECONDS", "3600"))
+        self.handlers: Dict[str, JobHandler] = {}
+        self.attempt_failures: Dict[str, int] = defaultdict(int)
+        self.stats = {"enqueued": 0, "duplicates": 0, "completed": 0, "failed": 0, "retried": 0}
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self.on_failure: Optional[FailureCallback] = None
+
+        if not self.enabled:
+            logger.info("Outbox disabled - Zoho side effects run inline")
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._migrate()
+            recovered = self._recover_stalled()
+            logger.info(f"Outbox initialized ({self.db_path}, recovered {recovered} interrupted jobs)")
+        except sqlite3.Error as e:
+            logger.error(f"[Outbox] Could not open {self.db_path} - side effects will run inline: {e}")
+            self.enabled = False
+            self._conn = None
+
+    def _migrate(self):
+        """Add columns introduced after an outbox file was created"""
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(outbox_jobs)")}
+        if "request_id" not in columns:
+            self._conn.execute("ALTER TABLE outbox_jobs ADD COLUMN request_id TEXT")
+
+    def register(self, job_type: str, handler: JobHandler):
+        """Register the coroutine function that runs jobs of this type"""
+        self.handlers[job_type] = handler
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def enqueue(self, job_type: str, payload: Dict[str, Any], idempotency_key: str) -> Optional[int]:
+        """
+        Queue a job.
+
+        Args:
+            job_type: Registered handler name
+            payload: JSON-serializable keyword arguments for the handler
+            idempotency_key: Jobs with the same key inside the dedup window are dropped
+                (unless the earlier job failed permanently)
+
+        Returns:
+            Job id, or None if an identical job was already queued
+        """
+        if job_type not in self.handlers:
+            raise ValueError(f"No outbox handler registered for '{job_type}'")
+
+        now = time.time()
+        encoded = json.dumps(payload)
+        with self._lock:
+            existing = self._conn.execute(
+                "SELECT id, created_at, status FROM outbox_jobs WHERE idempotency_key = ?", (idempotency_key,)
+            ).fetchone()
+            if existing is not None:
+                if existing["status"] != "failed" and now - existing["created_at"] < self.idempotency_window:
+                    self.stats["duplicates"] += 1
+                    logger.info(f"[Outbox] Duplicate job ignored: {idempotency_key}")
+                    return None
+                # Outside the window, or a retry of a failed job - the key may be reused
+                self._conn.execute("DELETE FROM outbox_jobs WHERE id = ?", (existing["id"],))
+            try:
+                job_id = self._conn.execute(
+                    "INSERT INTO outbox_jobs (idempotency_key, job_type, payload, next_attempt_at, created_at, "
+                    "updated_at, request_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (idempotency_key, job_type, encoded, now, now, now, request_id_var.get())
+                ).lastrowid
+            except sqlite3.IntegrityError:
+                # Another worker process queued the same key first
+                self.stats["duplicates"] += 1
+                logger.info(f"[Outbox] Duplicate job ignored: {idempotency_key}")
+                return None
+
+        self.stats["enqueued"] += 1
+        logger.info(f"[Outbox] Enqueued {job_type} job {job_id} ({idempotency_key})")
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    def start(self, on_failure: Optional[FailureCallback] = None):
+        """Start the background worker (call from the running event loop)
+
+        Args:
+            on_failure: Called with the job (id, job_type, idempotency_key, attempts,
+                error, payload) whenever a job fails permanently
+        """
+        if on_failure is not None:
+            self.on_failure = on_failure
+        if not self.enabled or self._worker is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+        logger.info(f"[Outbox] Worker started (concurrency: {self.concurrency})")
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def _recover_stalled(self) -> int:
+        """Make jobs interrupted by a crash/restart due again (other workers may share the file)"""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE outbox_jobs SET status = 'pending' WHERE status = 'running' AND updated_at < ?",
+                (time.time() - JOB_LEASE_SECONDS,)
+            ).rowcount
+
+    async def _run(self):
+        last_cleanup = 0.0
+        last_recovery = time.time()
+        while True:
+            try:
+                jobs = self._claim_due_jobs()
+                if jobs:
+                    await asyncio.gather(*(self._run_job(job) for job in jobs))
+                    continue
+
+                if time.time() - last_recovery > 60:
+                    self._recover_stalled()
+                    last_recovery = time.time()
+
+                if time.time() - last_cleanup > 3600:
+                    self._cleanup()
+                    last_cleanup = time.time()
+
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[Outbox] Worker error: {e}", exc_info=True)
+                await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+    def _claim_due_jobs(self) -> List[sqlite3.Row]:
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM outbox_jobs WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (now, self.concurrency)
+            ).fetchall()
+            # Another worker process may claim the same row first
+            return [
+                row for row in rows
+                if self._conn.execute(
+                    "UPDATE outbox_jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'pending'",
+                    (now, row["id"])
+                ).rowcount == 1
+            ]
+
+    async def _run_job(self, job: sqlite3.Row):
+        """Run one attempt in a trace keyed by the request that queued the job"""
+        # Each job runs in its own task (gather), so this only tags this job's logs and spans
+        request_id_var.set(job["request_id"] or f"outbox-job-{job['id']}")
+        with tracer.trace(f"outbox {job['job_type']}"):
+            await self._attempt(job)
+
+    async def _attempt(self, job: sqlite3.Row):
+        job_type = job["job_type"]
+        attempts = job["attempts"] + 1
+        handler = self.handlers.get(job_type)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler registered for '{job_type}'")
+            result = await handler(**json.loads(job["payload"]))
+        except Exception as e:
+            result = {"success": False, "error": "exception", "details": str(e), "retryable": True}
+            logger.error(f"[Outbox] Job {job['id']} ({job_type}) raised: {e}")
+        prometheus_exporter.outbox_job_latency.observe(time.perf_counter() - started, job_type)
+
+        if result.get("success"):
+            self._finish(job["id"], "done", attempts, result)
+            self.stats["completed"] += 1
+            logger.info(f"[Outbox] Job {job['id']} ({job_type}) done after {attempts} attempt(s)")
+            return
+
+        self.attempt_failures[job_type] += 1
+        error = f"{result.get('error', 'unknown')}: {str(result.get('details', ''))[:500]}"
+        if not self._is_retryable(result) or attempts >= self.max_attempts:
+            self._finish(job["id"], "failed", attempts, result, error)
+            self.stats["failed"] += 1
+            logger.error(f"[Outbox] Job {job['id']} ({job_type}) failed permanently after {attempts} attempt(s): {error}")
+            self._notify_failure(job, attempts, error)
+            return
+
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** (attempts - 1)))
+        delay = random.uniform(delay / 2, delay)
+        self._execute(
+            "UPDATE outbox_jobs SET status = 'pending', attempts = ?, next_attempt_at = ?, updated_at = ?, "
+            "last_error = ? WHERE id = ?",
+            (attempts, time.time() + delay, time.time(), error, job["id"])
+        )
+        self.stats["retried"] += 1
+        logger.warning(f"[Outbox] Job {job['id']} ({job_type}) attempt {attempts} failed, retrying in {delay:.0f}s: {error}")
+
+    def _notify_failure(self, job: sqlite3.Row, attempts: int, error: str):
+        if self.on_failure is None:
+            return
+        try:
+            self.on_failure({
+                "id": job["id"],
+                "job_type": job["job_type"],
+                "idempotency_key": job["idempotency_key"],
+                "attempts": attempts,
+                "error": error,
+                "payload": json.loads(job["payload"])
+            })
+        except Exception as e:
+            logger.error(f"[Outbox] Failure callback raised for job {job['id']}: {e}")
+
+    @staticmethod
+    def _is_retryable(result: Dict) -> bool:
+        if "retryable" in result:
+            return bool(result["retryable"])
+        status_code = result.get("status_code")
+        # Client errors will fail the same way again (rate limiting aside)
+        return not (isinstance(status_code, int) and 400 <= status_code < 500 and status_code != 429)
+
+    def _finish(self, job_id: int, status: str, attempts: int, result: Dict, error: Optional[str] = None):
+        self._execute(
+            "UPDATE outbox_jobs SET status = ?, attempts = ?, updated_at = ?, result = ?, last_error = ? WHERE id = ?",
+            (status, attempts, time.time(), json.dumps(result, default=str)[:2000], error, job_id)
+        )
+
+    def _cleanup(self):
+        """Drop completed jobs past the retention period (failed jobs are kept for inspection)"""
+        removed = self._execute(
+            "DELETE FROM outbox_jobs WHERE status = 'done' AND updated_at < ?",
+            (time.time() - DONE_RETENTION_SECONDS,)
+        ).rowcount
+        if removed:
+            logger.info(f"[Outbox] Cleaned up {removed} completed jobs")
+
+    def get_stats(self) -> Dict:
+        """Queue depth, age and failure counts for /outbox"""
+        if not self.enabled:
+            return {"enabled": False}
+
+        now = time.time()
+        with self._lock:
+            by_status = {
+                row["status"]: row["count"]
+                for row in self._conn.execute(
+                    "SELECT status, COUNT(*) AS count FROM outbox_jobs GROUP BY status"
+                ).fetchall()
+            }
+            oldest = self._conn.execute(
+                "SELECT MIN(created_at) AS oldest FROM outbox_jobs WHERE status IN ('pending', 'running')"
+            ).fetchone()["oldest"]
+            pending_by_type = {
+                row["job_type"]: row["count"]
+                for row in self._conn.execute(
+                    "SELECT job_type, COUNT(*) AS count FROM outbox_jobs "
+                    "WHERE status IN ('pending', 'running') GROUP BY job_type"
+                ).fetchall()
+            }
+            recent_failures = [
+                {
+                    "id": row["id"],
+                    "job_type": row["job_type"],
+                    "idempotency_key": row["idempotency_key"],
+                    "attempts": row["attempts"],
+                    "last_error": row["last_error"],
+                    "failed_at": row["updated_at"]
+                }
+                for row in self._conn.execute(
+                    "SELECT * FROM outbox_jobs WHERE status = 'failed' ORDER BY updated_at DESC LIMIT 10"
+                ).fetchall()
+            ]
+
+        return {
+            "enabled": True,
+            "worker_running": self._worker is not None and not self._worker.done(),
+            "queue_depth": by_status.get("pending", 0) + by_status.get("running", 0),
+            "oldest_pending_age_seconds": round(now - oldest, 1) if oldest else 0.0,
+            "jobs_by_status": by_status,
+            "pending_by_type": pending_by_type,
+            "attempt_failures_by_type": dict(self.attempt_failures),
+            "counters": dict(self.stats),
+            "recent_failures": recent_failures
+        }
+
+
+# Global outbox instance
+outbox = Outbox()
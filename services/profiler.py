@@ -0,0 +1,184 @@
+"""
+On-Demand Profiler
+
+Two ways to see where time goes inside the running process, both behind
+/debug/profile and both only active while a profile is being taken, so
+nothing is hooked or sampled otherwise:
+
+- Sampling: for `seconds`, a background thread records every thread's stack
+  (sys._current_frames) and an event-loop task records every asyncio task's
+  await chain, at PROFILER_SAMPLE_HZ. The result is collapsed-stack text
+  ("root;caller;callee count" lines) ready for flamegraph.pl or speedscope.
+  Thread stacks show where CPU/blocking time goes, including a stalled
+  event loop; task stacks show what in-flight requests are awaiting.
+- cProfile: one webhook payload is replayed under cProfile and the
+  per-function totals are returned (pstats text). Only the event loop
+  thread is profiled, and other requests served meanwhile are included, so
+  replay against a quiet instance with a test session - the replay is a real
+  turn (history, metrics and queued Zoho side effects included).
+
+Requests must carry PROFILER_TOKEN in the X-Profiler-Token header; without a
+configured token the endpoints are disabled. One profile runs at a time.
+
+Configuration:
+- PROFILER_TOKEN: Shared secret for /debug/profile (default unset = disabled)
+- PROFILER_SAMPLE_HZ: Stack samples per second (default 100)
+- PROFILER_MAX_SECONDS: Longest sampling run allowed (default 60)
+"""
+
+import io
+import os
+import sys
+import time
+import hmac
+import pstats
+import asyncio
+import cProfile
+import logging
+import threading
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Valid `sort` values for the cProfile report
+SORT_KEYS = tuple(pstats.Stats.sort_arg_dict_default)
+
+
+class ProfilerBusy(Exception):
+    """Another profile is already running"""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def thread_stack(frame) -> List[str]:
+    """Frame labels from the thread's outermost frame to the running one"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def task_stack(task: asyncio.Task) -> List[str]:
+    """Frame labels along a task's await chain, outermost coroutine first"""
+    labels = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        labels.append(_frame_label(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return labels
+
+
+class Profiler:
+    """Sampling and cProfile runs for /debug/profile"""
+
+    def __init__(self):
+        self.token = os.getenv("PROFILER_TOKEN", "")
+        self.sample_hz = float(os.getenv("PROFILER_SAMPLE_HZ", "100"))
+        self.max_seconds = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+        self._running = False
+        self.stats = {"sampling_runs": 0, "cprofile_runs": 0, "samples": 0, "last_run_at": None}
+
+        logger.info(f"Profiler initialized ({'enabled' if self.token else 'disabled - set PROFILER_TOKEN'})")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token)
+
+    def authorize(self, token: Optional[str]) -> bool:
+        return self.enabled and token is not None and hmac.compare_digest(token, self.token)
+
+    def _claim(self):
+        if self._running:
+            raise ProfilerBusy("A profile is already running")
+        self._running = True
+        self.stats["last_run_at"] = time.time()
+
+    def _sample_threads(self, counts: Counter, stop: threading.Event, interval: float):
+        own = threading.get_ident()
+        while not stop.wait(interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = thread_stack(frame)
+                counts["thread:" + names.get(ident, str(ident)) + ";" + ";".join(stack)] += 1
+
+    async def _sample_tasks(self, counts: Counter, seconds: float, interval: float):
+        current = asyncio.current_task()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            await asyncio.sleep(interval)
+            for task in asyncio.all_tasks():
+                if task is current or task.done():
+                    continue
+                stack = task_stack(task)
+                if stack:
+                    counts["task:" + ";".join(stack)] += 1
+
+    async def sample(self, seconds: float) -> str:
+        """Sample thread and task stacks for `seconds`
+
+        Returns:
+            Collapsed stacks, one "frame;frame;... count" line per distinct stack
+        """
+        seconds = min(max(seconds, 0.1), self.max_seconds)
+        interval = 1.0 / self.sample_hz
+        self._claim()
+        thread_counts: Counter = Counter()
+        task_counts: Counter = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample_threads, args=(thread_counts, stop, interval),
+                                   name="profiler-sampler", daemon=True)
+        try:
+            logger.info(f"[Profiler] Sampling for {seconds:.1f}s at {self.sample_hz:.0f}Hz")
+            sampler.start()
+            await self._sample_tasks(task_counts, seconds, interval)
+        finally:
+            stop.set()
+            sampler.join()  # Wakes within one interval
+            self._running = False
+
+        counts = thread_counts + task_counts
+        self.stats["sampling_runs"] += 1
+        self.stats["samples"] += sum(counts.values())
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+    async def profile_call(self, run: Callable[[], Awaitable[Any]], sort: str = "cumulative",
+                           limit: int = 60) -> Tuple[Any, str]:
+        """Await run() under cProfile
+
+        Returns:
+            (run()'s result, pstats report of the top `limit` functions by `sort`)
+        """
+        self._claim()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                result = await run()
+            finally:
+                profile.disable()
+        finally:
+            self._running = False
+
+        self.stats["cprofile_runs"] += 1
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).strip_dirs().sort_stats(sort).print_stats(limit)
+        return result, out.getvalue()
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, "enabled": self.enabled, "running": self._running, "sample_hz": self.sample_hz}
+
+
+# Global profiler instance
+profiler = Profiler()
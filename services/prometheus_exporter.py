@@ -0,0 +1,198 @@
+"""
+Prometheus Exposition
+
+Latency histograms and usage counters for /metrics/prometheus, in the
+Prometheus text format (0.0.4) - no client library needed.
+
+- Request latency: webhook and /chat end to end
+- Stage latency: router, handler registry, classification, generation and
+  Zoho calls (stages run through deadline_tracker.run are timed there)
+- Outbox job latency by job type
+- LLM calls, input/cached/output tokens and cost by model, kind
+  (generator, classifier, summary) and issue category, fed by the usage
+  ledger
+- Gauges (live sessions, lock and queue depths) are read from their owners
+  at scrape time, so they cost nothing on the hot path
+
+Histograms use fixed buckets: an observation is one bisect and two list
+increments on a series created once per label set. Everything runs on the
+event loop thread, so there are no locks.
+"""
+
+import time
+import logging
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Seconds - covers sub-millisecond routing up to LLM/Zoho calls near the deadline
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+GaugeValue = Union[float, Dict[Tuple[str, ...], float]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Fixed-bucket histogram with one series per label set"""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # label values → [count per bucket..., count above the last bucket, sum]
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter with one value per label set"""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float, *labels: str):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+class StageTimer:
+    """Context manager that observes the enclosed block into a stage histogram"""
+    __slots__ = ("histogram", "stage", "started")
+
+    def __init__(self, histogram: Histogram, stage: str):
+        self.histogram = histogram
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, self.stage)
+        return False
+
+
+class PrometheusExporter:
+    """Holds the chatbot's histograms/counters and renders the exposition text"""
+
+    def __init__(self):
+        self.request_latency = Histogram(
+            "chatbot_request_duration_seconds", "End-to-end request latency", ("endpoint",)
+        )
+        self.stage_latency = Histogram(
+            "chatbot_stage_duration_seconds", "Latency of one pipeline stage", ("stage",)
+        )
+        self.outbox_job_latency = Histogram(
+            "chatbot_outbox_job_duration_seconds", "Outbox job attempt latency", ("job_type",)
+        )
+        self.llm_calls = Counter(
+            "chatbot_llm_calls_total", "LLM completions", ("model", "kind", "category")
+        )
+        self.llm_tokens = Counter(
+            "chatbot_llm_tokens_total", "LLM tokens used", ("model", "kind", "category", "direction")
+        )
+        self.llm_cost = Counter(
+            "chatbot_llm_cost_usd_total", "LLM cost from the price table", ("model", "kind", "category")
+        )
+        # Histograms/counters owned by other services (e.g. the loop watchdog)
+        self.extra_metrics: List[Union[Histogram, Counter]] = []
+        # name → (help, label names, callback)
+        self.gauges: Dict[str, Tuple[str, Tuple[str, ...], Callable[[], GaugeValue]]] = {}
+
+    def observe_request(self, endpoint: str, seconds: float):
+        self.request_latency.observe(seconds, endpoint)
+
+    def observe_stage(self, stage: str, seconds: float):
+        self.stage_latency.observe(seconds, stage)
+
+    def time_stage(self, stage: str) -> StageTimer:
+        """`with prometheus_exporter.time_stage("router"):` for synchronous stages"""
+        return StageTimer(self.stage_latency, stage)
+
+    def record_llm_call(self, model: str, kind: str, category: str, input_tokens: int = 0,
+                        cached_input_tokens: int = 0, output_tokens: int = 0, cost_usd: float = 0.0):
+        """Count one completion, its tokens (input includes cached input) and its cost"""
+        category = category or "none"
+        self.llm_calls.inc(1, model, kind, category)
+        self.llm_tokens.inc(input_tokens, model, kind, category, "input")
+        self.llm_tokens.inc(cached_input_tokens, model, kind, category, "cached_input")
+        self.llm_tokens.inc(output_tokens, model, kind, category, "output")
+        self.llm_cost.inc(cost_usd, model, kind, category)
+
+    def register_metric(self, metric: Union[Histogram, Counter]):
+        """Render a histogram or counter another service owns and updates"""
+        self.extra_metrics.append(metric)
+
+    def register_gauge(self, name: str, help_text: str, callback: Callable[[], GaugeValue],
+                       label_names: Sequence[str] = ()):
+        """Gauge read at scrape time; the callback returns a value or {label values: value}"""
+        self.gauges[name] = (help_text, tuple(label_names), callback)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in (self.request_latency, self.stage_latency, self.outbox_job_latency,
+                       self.llm_calls, self.llm_tokens, self.llm_cost, *self.extra_metrics):
+            lines.extend(metric.render())
+        for name, (help_text, label_names, callback) in self.gauges.items():
+            try:
+                value = callback()
+            except Exception as e:
+                logger.warning(f"[Prometheus] Gauge {name} failed: {e}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for labels, sample in sorted(value.items()):
+                    lines.append(f"{name}{_labels(label_names, labels)} {_number(sample)}")
+            else:
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Global exporter instance
+prometheus_exporter = PrometheusExporter()
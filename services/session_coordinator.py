@@ -0,0 +1,232 @@
+"""
+Per-Session Coordination for Webhook Turns
+
+SalesIQ can deliver webhooks for the same visitor concurrently and retries
+deliveries that take too long. Two pieces keep one visitor's turns ordered
+and paid for once:
+
+- SessionLockMap: one asyncio.Lock per active session, so turns for the same
+  session run one at a time (different sessions still run concurrently).
+  Entries are reference-counted and dropped as soon as no request holds or
+  waits on them, so the map only ever contains in-flight sessions. With a
+  shared session store (WEB_CONCURRENCY > 1), the holder also takes a lease
+  on the session in the store, so turns are serialized across workers too;
+  a lease left by a crashed worker expires after SESSION_LOCK_LEASE_SECONDS.
+  Waiting for another worker's lease polls the store off the event loop with
+  backoff, and never past the request's deadline: a turn that cannot get
+  the lease in time raises DeadlineExceeded("session_lock") so the endpoint
+  sends its canned reply.
+- ReplyCache: replies keyed by (session_id, message fingerprint) for a short
+  TTL. A retry waits behind the original on the session lock, then gets the
+  cached reply instead of running classification/generation again. Only
+  messages that carry a delivery ID or timestamp are de-duplicated - without
+  one, a visitor repeating "yes" or the same button is a new turn, not a retry.
+  Replies are kept in the shared store when there is one, so a retry that
+  lands on another worker is answered too.
+
+Configuration:
+- SESSION_LOCK_LEASE_SECONDS: Cross-worker lease length; keep it above the turn deadlines (default 60)
+- WEBHOOK_DEDUP_ENABLED: Return cached replies for redelivered messages (default true)
+- WEBHOOK_DEDUP_TTL_SECONDS: How long a reply is kept for retries (default 120)
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from services.deadline import deadline_tracker
+from services.session_store import session_store
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on cached replies (LRU eviction)
+MAX_CACHED_REPLIES = 10_000
+
+# How often a turn waiting for another worker's lease checks again (seconds, doubling up to the max)
+LEASE_POLL_SECONDS = 0.05
+LEASE_POLL_MAX_SECONDS = 0.5
+
+
+class SessionLockMap:
+    """Reference-counted map of per-session asyncio locks (plus store leases across workers)"""
+
+    def __init__(self, backend=None):
+        """
+        Args:
+            backend: Shared session store backend providing leases (None = this process only)
+        """
+        self.backend = backend
+        self.lease_seconds = float(os.getenv("SESSION_LOCK_LEASE_SECONDS", "60"))
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+        self.stats = {"acquired": 0, "contended": 0, "lease_waits": 0, "lease_timeouts": 0,
+                      "max_wait_ms": 0.0}
+
+    @asynccontextmanager
+    async def hold(self, session_id: Optional[str]):
+        """Serialize work for one session
+
+        Unknown sessions are not serialized - they would all share one lock.
+        """
+        if not session_id or session_id == "unknown":
+            yield
+            return
+
+        lock, refs = self._locks.get(session_id, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[session_id] = (lock, refs + 1)
+
+        started = time.perf_counter()
+        if lock.locked():
+            self.stats["contended"] += 1
+            logger.info(f"[Session Lock] Waiting for in-flight turn of session {session_id}")
+        try:
+            async with lock:
+                owner = await self._acquire_lease(session_id)
+                try:
+                    waited_ms = (time.perf_counter() - started) * 1000
+                    self.stats["acquired"] += 1
+                    self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], round(waited_ms, 1))
+                    yield
+                finally:
+                    if owner is not None:
+                        self.backend.release_lease(f"session:{session_id}", owner)
+        finally:
+            lock, refs = self._locks[session_id]
+            if refs <= 1:
+                del self._locks[session_id]
+            else:
+                self._locks[session_id] = (lock, refs - 1)
+
+    async def _acquire_lease(self, session_id: str) -> Optional[str]:
+        """Wait for the session's lease in the shared store; returns the owner token
+
+        Raises:
+            DeadlineExceeded: The request's deadline ran out before the lease was free
+        """
+        if self.backend is None:
+            return None
+        owner = uuid.uuid4().hex
+        key = f"session:{session_id}"
+        if self.backend.acquire_lease(key, owner, self.lease_seconds):
+            return owner
+
+        self.stats["lease_waits"] += 1
+        logger.info("[Session Lock] Waiting for another worker's turn of session %s", session_id)
+        delay = LEASE_POLL_SECONDS
+        while True:
+            remaining = deadline_tracker.remaining()
+            if remaining is not None and remaining <= 0:
+                self.stats["lease_timeouts"] += 1
+                raise deadline_tracker.exceeded("session_lock")
+            await asyncio.sleep(delay if remaining is None else min(delay, remaining))
+            delay = min(delay * 2, LEASE_POLL_MAX_SECONDS)
+            # Store round-trips happen off the event loop
+            if await asyncio.to_thread(self.backend.acquire_lease, key, owner, self.lease_seconds):
+                return owner
+
+    def is_active(self, session_id: str) -> bool:
+        """Whether a turn for the session is running or waiting for its lock"""
+        return session_id in self._locks
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, "active_sessions": len(self._locks), "cross_worker": self.backend is not None}
+
+
+class ReplyCache:
+    """Short-lived cache of webhook replies for redelivered messages"""
+
+    def __init__(self, backend=None):
+        """
+        Args:
+            backend: Shared session store backend to keep replies in (None = this process only)
+        """
+        self.backend = backend
+        self.enabled = os.getenv("WEBHOOK_DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.ttl = float(os.getenv("WEBHOOK_DEDUP_TTL_SECONDS", "120"))
+        self._replies: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self.stats = {"stored": 0, "hits": 0, "expired": 0}
+
+    @staticmethod
+    def fingerprint(delivery_id: Any, message_text: str, payload: Any = "") -> Optional[str]:
+        """Identify one visitor message: delivery ID/time plus its text/button payload
+
+        Returns None (no de-duplication) when the message has no delivery ID or time.
+        """
+        if delivery_id in (None, ""):
+            return None
+        raw = f"{delivery_id}|{message_text}|{payload or ''}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+    def _applies(self, session_id: Optional[str], fingerprint: Optional[str]) -> bool:
+        return self.enabled and bool(fingerprint) and bool(session_id) and session_id != "unknown"
+
+    def get(self, session_id: Optional[str], fingerprint: Optional[str]) -> Optional[Any]:
+        """Cached reply for this message, if it was answered within the TTL"""
+        if not self._applies(session_id, fingerprint):
+            return None
+        if self.backend is not None:
+            return self._shared_get(session_id, fingerprint)
+
+        key = (session_id, fingerprint)
+        entry = self._replies.get(key)
+        if entry is None:
+            return None
+        stored_at, reply = entry
+        if time.time() - stored_at > self.ttl:
+            del self._replies[key]
+            self.stats["expired"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        logger.info(f"[Dedup] Duplicate delivery for session {session_id} - returning cached reply")
+        return reply
+
+    def store(self, session_id: Optional[str], fingerprint: Optional[str], reply: Any):
+        if not self._applies(session_id, fingerprint):
+            return
+        if self.backend is not None:
+            encoded = reply.decode("utf-8") if isinstance(reply, bytes) else reply
+            self.backend.cache_set(f"reply:{session_id}:{fingerprint}", encoded, self.ttl)
+            self.stats["stored"] += 1
+            return
+
+        self._replies[(session_id, fingerprint)] = (time.time(), reply)
+        self._replies.move_to_end((session_id, fingerprint))
+        self.stats["stored"] += 1
+        self._evict()
+
+    def _shared_get(self, session_id: str, fingerprint: str) -> Optional[bytes]:
+        # The backend drops expired entries itself
+        cached = self.backend.cache_get(f"reply:{session_id}:{fingerprint}")
+        if cached is None:
+            return None
+        self.stats["hits"] += 1
+        logger.info(f"[Dedup] Duplicate delivery for session {session_id} - returning cached reply")
+        return cached.encode("utf-8")
+
+    def _evict(self):
+        cutoff = time.time() - self.ttl
+        # Oldest entries are at the front
+        while self._replies:
+            key, (stored_at, _) = next(iter(self._replies.items()))
+            if stored_at >= cutoff and len(self._replies) <= MAX_CACHED_REPLIES:
+                break
+            del self._replies[key]
+            self.stats["expired"] += 1
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, "enabled": self.enabled, "ttl_seconds": self.ttl, "shared": self.backend is not None,
+                "cached_replies": len(self._replies)}
+
+
+# Global instances (cross-worker when the session store is shared)
+_shared_backend = session_store.backend if session_store.shared else None
+session_locks = SessionLockMap(_shared_backend)
+reply_cache = ReplyCache(_shared_backend)
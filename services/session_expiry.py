@@ -0,0 +1,160 @@
+"""
+Deadline-Ordered Session Expiry
+
+Every per-session structure (history, SalesIQ conversation ID, state
+machine session, conversation metric, token budget, history summary) is
+torn down together once a session has been idle for
+SESSION_IDLE_TIMEOUT_SECONDS. This replaces the 15-minute sweep that
+scanned every conversation and never touched the ID map or the metrics.
+
+- touch(session_id) records the session's last activity (in the session
+  store, so it is persisted and shared across workers like the rest of the
+  session state) and schedules it if it isn't already.
+- A min-heap holds one (deadline, session_id) entry per scheduled session.
+  Every SESSION_EXPIRY_CHECK_SECONDS the loop pops only the entries that are
+  due; a session touched since it was scheduled is pushed back with its new
+  deadline, so each check does O(due) work instead of scanning all sessions.
+- Sessions with a turn in flight are pushed back and retried on the next
+  check. The teardown callback runs synchronously on the event loop, so no
+  turn can interleave with it.
+
+Configuration:
+- SESSION_IDLE_TIMEOUT_SECONDS: Idle time before a session expires (default 1800)
+- SESSION_EXPIRY_CHECK_SECONDS: How often due sessions are expired (default 5)
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from services.session_store import session_store
+
+logger = logging.getLogger(__name__)
+
+
+class SessionExpiry:
+    """Min-heap of session idle deadlines"""
+
+    def __init__(self, store):
+        self.idle_timeout = float(os.getenv("SESSION_IDLE_TIMEOUT_SECONDS", "1800"))
+        self.check_interval = float(os.getenv("SESSION_EXPIRY_CHECK_SECONDS", "5"))
+        # session_id → last activity (epoch seconds)
+        self.last_activity: Dict[str, float] = store.mapping("session_activity")
+        self._heap: List[Tuple[float, str]] = []
+        self._scheduled: Set[str] = set()
+        self._teardown: Optional[Callable[[str], None]] = None
+        self._is_busy: Callable[[str], bool] = lambda session_id: False
+        self._worker: Optional[asyncio.Task] = None
+        self.stats = {"expired": 0, "rescheduled": 0, "deferred_busy": 0, "teardown_errors": 0,
+                      "max_lag_seconds": 0.0}
+
+        logger.info(f"SessionExpiry initialized (idle timeout: {self.idle_timeout:.0f}s)")
+
+    def _schedule(self, session_id: str, deadline: float):
+        heapq.heappush(self._heap, (deadline, session_id))
+        self._scheduled.add(session_id)
+
+    def touch(self, session_id: Optional[str]):
+        """Record activity for a session, pushing its expiry back by the idle timeout"""
+        if not session_id or session_id == "unknown":
+            return
+        now = time.time()
+        self.last_activity[session_id] = now
+        if session_id not in self._scheduled:
+            self._schedule(session_id, now + self.idle_timeout)
+
+    def schedule_existing(self, session_ids: Iterable[str]):
+        """Give sessions restored after a restart a full idle window"""
+        deadline = time.time() + self.idle_timeout
+        for session_id in session_ids:
+            if session_id not in self._scheduled:
+                self._heap.append((deadline, session_id))
+                self._scheduled.add(session_id)
+        heapq.heapify(self._heap)
+
+    def expire_due(self, now: Optional[float] = None) -> int:
+        """Tear down every session whose idle deadline has passed
+
+        Returns:
+            Number of sessions expired
+        """
+        now = time.time() if now is None else now
+        expired = 0
+        deferred = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, session_id = heapq.heappop(self._heap)
+            last = self.last_activity.get(session_id)
+            if last is not None and last + self.idle_timeout > now:
+                # Active since it was scheduled - move it to its current deadline
+                heapq.heappush(self._heap, (last + self.idle_timeout, session_id))
+                self.stats["rescheduled"] += 1
+                continue
+            if self._is_busy(session_id):
+                deferred.append((now + self.check_interval, session_id))
+                self.stats["deferred_busy"] += 1
+                continue
+
+            self._scheduled.discard(session_id)
+            try:
+                if self._teardown is not None:
+                    self._teardown(session_id)
+            except Exception as e:
+                self.stats["teardown_errors"] += 1
+                logger.error(f"[Expiry] Teardown failed for {session_id}: {e}", exc_info=True)
+            self.last_activity.pop(session_id, None)
+            expired += 1
+            self.stats["max_lag_seconds"] = max(self.stats["max_lag_seconds"], round(now - deadline, 1))
+
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+        if expired:
+            self.stats["expired"] += expired
+            logger.info(f"[Expiry] Expired {expired} idle sessions")
+        return expired
+
+    def start(self, teardown: Callable[[str], None], is_busy: Optional[Callable[[str], bool]] = None):
+        """Start the expiry loop (call from the running event loop)
+
+        Args:
+            teardown: Removes every per-session structure for a session ID
+            is_busy: Whether a turn for the session is in flight
+        """
+        self._teardown = teardown
+        if is_busy is not None:
+            self._is_busy = is_busy
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+            logger.info(f"[Expiry] Started (checks every {self.check_interval:.0f}s)")
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                self.expire_due()
+            except Exception as e:
+                logger.error(f"[Expiry] Error expiring sessions: {e}", exc_info=True)
+
+    def get_stats(self) -> Dict:
+        next_deadline = self._heap[0][0] - time.time() if self._heap else None
+        return {
+            **self.stats,
+            "idle_timeout_seconds": self.idle_timeout,
+            "scheduled_sessions": len(self._scheduled),
+            "next_expiry_in_seconds": round(next_deadline, 1) if next_deadline is not None else None
+        }
+
+
+# Global session expiry instance
+session_expiry = SessionExpiry(session_store)
@@ -0,0 +1,376 @@
+"""
+Crash-Safe Session Persistence (write-behind log + snapshots)
+
+With the in-memory session store, a restart used to lose every in-flight
+conversation. This module keeps a durable copy of the session state
+without touching the reply path:
+
+- Turns only mark their session dirty (a set insert).
+- A background task wakes every SESSION_PERSISTENCE_FLUSH_SECONDS, encodes
+  each dirty session's entries from every store namespace into one JSON line
+  and appends the batch to the active log segment (the file write and fsync
+  run in a thread).
+- Once the log grows past SESSION_SNAPSHOT_LOG_BYTES, the active segment is
+  sealed and a separate process (`python -m services.session_persistence
+  compact <dir> <segment>`) folds the previous snapshot and the sealed
+  segments into a new snapshot, keeping only the last line per session.
+- On startup, rehydrate() only indexes the snapshot and newer segments
+  (session ID → latest line), which takes a fraction of the full decode.
+  Sessions are decoded into the store on first use (ensure_loaded) or by a
+  background task that works through the rest in small batches.
+
+Every line is a session's complete state at flush time, so the last line
+for a session wins and a session with no entries left is deleted:
+
+    {"key": "<session_id>", "values": {"<namespace>": <encoded value>, ...}}
+
+Files in SESSION_PERSISTENCE_DIR:
+    snapshot.jsonl     header line {"segment": N}, then one line per session
+    segment-<n>.log    lines appended by the write-behind task
+
+Only used with the memory backend - the sqlite/redis stores are already
+durable.
+
+Configuration:
+- SESSION_PERSISTENCE_ENABLED: Persist in-memory sessions (default true)
+- SESSION_PERSISTENCE_DIR: Directory for the log and snapshot (default data/sessions)
+- SESSION_PERSISTENCE_FLUSH_SECONDS: Write-behind interval (default 1)
+- SESSION_SNAPSHOT_LOG_BYTES: Log size that triggers compaction (default 16MB)
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from services.session_store import session_store
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sessions")
+SNAPSHOT_FILE = "snapshot.jsonl"
+SEGMENT_PATTERN = re.compile(r"^segment-(\d+)\.log$")
+# Lines always start with the session key, so indexing never parses the values
+KEY_PREFIX = b'{"key":"'
+KEY_PATTERN = re.compile(rb'^\{"key":"((?:[^"\\]|\\.)*)"')
+EMPTY_SUFFIX = b'"values":{}}'
+
+# Sessions decoded per background batch before yielding to the event loop
+LOAD_BATCH_SIZE = 200
+
+
+def segment_name(number: int) -> str:
+    return f"segment-{number:08d}.log"
+
+
+def list_segments(directory: str) -> List[int]:
+    """Log segment numbers in the directory, oldest first"""
+    if not os.path.isdir(directory):
+        return []
+    numbers = []
+    for name in os.listdir(directory):
+        match = SEGMENT_PATTERN.match(name)
+        if match:
+            numbers.append(int(match.group(1)))
+    return sorted(numbers)
+
+
+def iter_keyed_lines(path: str) -> Iterator[Tuple[str, Optional[memoryview]]]:
+    """(session_id, line) for every session line in a snapshot or segment
+
+    Lines are zero-copy views into the file contents; None marks a deleted
+    session. A torn final write from a crash (no trailing newline) is skipped.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    view = memoryview(data)
+    key_start = len(KEY_PREFIX)
+    position = 0
+    while True:
+        newline = data.find(b"\n", position)
+        if newline < 0:
+            break
+        if data.startswith(KEY_PREFIX, position):  # Skips the header line
+            end = data.find(b'"', position + key_start, newline)
+            key = data[position + key_start:end]
+            if b"\\" in key:
+                # Escaped characters in the session ID - take the slow path
+                key = json.loads(b'"' + KEY_PATTERN.match(data, position).group(1) + b'"')
+            else:
+                key = key.decode("utf-8")
+            deleted = data.endswith(EMPTY_SUFFIX, position, newline)
+            yield key, None if deleted else view[position:newline]
+        position = newline + 1
+
+
+def snapshot_segment(directory: str) -> int:
+    """Last segment folded into the snapshot (0 if there is no snapshot)"""
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r", encoding="utf-8") as f:
+        return json.loads(f.readline())["segment"]
+
+
+def _latest_lines(directory: str, up_to_segment: Optional[int] = None) -> Tuple[int, Dict[str, memoryview]]:
+    segment = snapshot_segment(directory)
+    latest: Dict[str, Optional[memoryview]] = {}
+    if segment:
+        latest.update(iter_keyed_lines(os.path.join(directory, SNAPSHOT_FILE)))
+    for number in list_segments(directory):
+        if number > segment and (up_to_segment is None or number <= up_to_segment):
+            latest.update(iter_keyed_lines(os.path.join(directory, segment_name(number))))
+            segment = number
+    live = {key: line for key, line in latest.items() if line is not None}
+    return segment, live
+
+
+def index_state(directory: str) -> Tuple[int, Dict[str, memoryview]]:
+    """Latest line per live session from the snapshot and every newer segment
+
+    Returns:
+        Tuple of (last segment indexed, {session_id: line})
+    """
+    return _latest_lines(directory)
+
+
+def compact(directory: str, up_to_segment: int):
+    """Fold the snapshot and sealed segments (<= up_to_segment) into a new snapshot"""
+    segment, live = _latest_lines(directory, up_to_segment)
+
+    tmp_path = os.path.join(directory, SNAPSHOT_FILE + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(json.dumps({"segment": segment}).encode("utf-8") + b"\n")
+        for line in live.values():
+            f.write(line)
+            f.write(b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(directory, SNAPSHOT_FILE))
+
+    for number in list_segments(directory):
+        if number <= segment:
+            os.remove(os.path.join(directory, segment_name(number)))
+
+
+class SessionPersistence:
+    """Write-behind persistence of the in-memory session store"""
+
+    def __init__(self, store, directory: Optional[str] = None):
+        self.store = store
+        self.enabled = (
+            os.getenv("SESSION_PERSISTENCE_ENABLED", "true").lower() in ("1", "true", "yes")
+            and not store.shared
+        )
+        self.directory = directory or os.getenv("SESSION_PERSISTENCE_DIR", DEFAULT_DIR)
+        self.flush_interval = float(os.getenv("SESSION_PERSISTENCE_FLUSH_SECONDS", "1"))
+        self.snapshot_log_bytes = int(os.getenv("SESSION_SNAPSHOT_LOG_BYTES", str(16 * 1024 * 1024)))
+        self.dirty: Set[str] = set()
+        # Sessions indexed at startup but not decoded yet: session_id → line
+        self.pending: Dict[str, memoryview] = {}
+        self.segment = 0
+        self.segment_bytes = 0
+        # Segments left by a previous process are folded into the snapshot once started
+        self.pending_compaction = False
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loader: Optional[asyncio.Task] = None
+        self._compaction: Optional[asyncio.Task] = None
+        self._rehydrate_started = 0.0
+        self.stats = {
+            "flushes": 0, "sessions_written": 0, "bytes_written": 0, "snapshots": 0,
+            "sessions_rehydrated": 0, "rehydrate_ready_ms": 0.0, "rehydrate_complete_ms": 0.0,
+            "loaded_on_demand": 0, "last_flush_ms": 0.0
+        }
+
+    def mark_dirty(self, session_id: Optional[str]):
+        """Queue a session's state for the next write-behind flush"""
+        if self.enabled and session_id and session_id != "unknown":
+            self.dirty.add(session_id)
+
+    def rehydrate(self) -> int:
+        """Index saved sessions so turns can be served (call before serving)
+
+        Sessions are decoded lazily: ensure_loaded() on first use, the rest by
+        the background loader started in start().
+        """
+        if not self.enabled:
+            return 0
+
+        self._rehydrate_started = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            segment, self.pending = index_state(self.directory)
+        except (OSError, ValueError) as e:
+            logger.error(f"[Persistence] Could not read saved sessions - starting empty: {e}")
+            segment, self.pending = max(list_segments(self.directory), default=0), {}
+
+        # Never append to a segment written by a previous process
+        self.pending_compaction = bool(list_segments(self.directory))
+        self.segment = segment + 1
+        self.segment_bytes = 0
+        elapsed_ms = (time.perf_counter() - self._rehydrate_started) * 1000
+        self.stats["sessions_rehydrated"] = len(self.pending)
+        self.stats["rehydrate_ready_ms"] = round(elapsed_ms, 1)
+        logger.info(f"[Persistence] Indexed {len(self.pending)} saved sessions in {elapsed_ms:.0f}ms")
+        return len(self.pending)
+
+    def _decode(self, session_id: str, line: memoryview):
+        try:
+            values = json.loads(bytes(line))["values"]
+        except (ValueError, KeyError) as e:
+            logger.warning(f"[Persistence] Dropping unreadable saved session {session_id}: {e}")
+            return
+        for namespace, value in values.items():
+            if namespace in self.store.mappings:
+                mapping, codec = self.store.mappings[namespace]
+                mapping[session_id] = codec.decode(value)
+
+    def ensure_loaded(self, session_id: Optional[str]):
+        """Decode a saved session before a turn touches it (a no-op once everything is loaded)"""
+        if self.pending and session_id:
+            line = self.pending.pop(session_id, None)
+            if line is not None:
+                self._decode(session_id, line)
+                self.stats["loaded_on_demand"] += 1
+
+    def load_all(self):
+        """Decode every pending session synchronously"""
+        while self.pending:
+            self._decode(*self.pending.popitem())
+        self._finish_loading()
+
+    async def _load_remaining(self):
+        while self.pending:
+            for _ in range(min(LOAD_BATCH_SIZE, len(self.pending))):
+                self._decode(*self.pending.popitem())
+            await asyncio.sleep(0)
+        self._finish_loading()
+
+    def _finish_loading(self):
+        elapsed_ms = (time.perf_counter() - self._rehydrate_started) * 1000
+        self.stats["rehydrate_complete_ms"] = round(elapsed_ms, 1)
+        logger.info(f"[Persistence] All saved sessions loaded after {elapsed_ms:.0f}ms")
+
+    def start(self):
+        """Start the background loader and write-behind task (call from the running event loop)"""
+        if not self.enabled or self._worker is not None:
+            return
+        self._write_lock = asyncio.Lock()
+        if self.pending:
+            self._loader = asyncio.create_task(self._load_remaining())
+        self._worker = asyncio.create_task(self._run())
+        logger.info(f"[Persistence] Write-behind started (every {self.flush_interval}s → {self.directory})")
+
+    async def stop(self):
+        """Stop the background tasks and write out anything still dirty"""
+        if self._worker is None:
+            return
+        for task in (self._loader, self._worker):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._worker = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                due = self.pending_compaction or self.segment_bytes >= self.snapshot_log_bytes
+                if due and (self._compaction is None or self._compaction.done()):
+                    self.pending_compaction = False
+                    self._compaction = asyncio.create_task(self._snapshot())
+            except Exception as e:
+                logger.error(f"[Persistence] Flush failed: {e}", exc_info=True)
+
+    def _encode_dirty(self, session_ids: Iterable[str]) -> str:
+        lines = []
+        for session_id in session_ids:
+            values = {}
+            for namespace, (mapping, codec) in self.store.mappings.items():
+                value = mapping.get(session_id)
+                if value is not None:
+                    values[namespace] = codec.encode(value)
+            lines.append(json.dumps({"key": session_id, "values": values}, separators=(",", ":")))
+        return "\n".join(lines) + "\n" if lines else ""
+
+    async def flush(self):
+        """Append the current state of every dirty session to the active segment"""
+        if not self.enabled or not self.dirty:
+            return
+
+        started = time.perf_counter()
+        session_ids, self.dirty = self.dirty, set()
+        # Encode on the loop (consistent view of the mappings); write in a thread
+        data = self._encode_dirty(session_ids)
+        async with self._write_lock:
+            path = os.path.join(self.directory, segment_name(self.segment))
+            await asyncio.to_thread(self._append, path, data)
+            self.segment_bytes += len(data)
+
+        self.stats["flushes"] += 1
+        self.stats["sessions_written"] += len(session_ids)
+        self.stats["bytes_written"] += len(data)
+        self.stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    @staticmethod
+    def _append(path: str, data: str):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def _snapshot(self):
+        """Seal the active segment and compact it into the snapshot in a subprocess"""
+        async with self._write_lock:
+            sealed = self.segment
+            self.segment += 1
+            self.segment_bytes = 0
+
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "services.session_persistence", "compact", self.directory, str(sealed),
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            logger.error(f"[Persistence] Snapshot compaction failed: {stderr.decode(errors='replace')[-500:]}")
+            return
+        self.stats["snapshots"] += 1
+        logger.info(f"[Persistence] Snapshot written through segment {sealed} in {time.perf_counter() - started:.1f}s")
+
+    def get_stats(self) -> Dict:
+        if not self.enabled:
+            return {"enabled": False}
+        return {
+            **self.stats,
+            "enabled": True,
+            "directory": self.directory,
+            "dirty_sessions": len(self.dirty),
+            "pending_sessions": len(self.pending),
+            "active_segment": self.segment,
+            "active_segment_bytes": self.segment_bytes
+        }
+
+
+# Global session persistence instance
+session_persistence = SessionPersistence(session_store)
+
+
+if __name__ == "__main__":
+    # python -m services.session_persistence compact <dir> <up_to_segment>
+    if len(sys.argv) == 4 and sys.argv[1] == "compact":
+        compact(sys.argv[2], int(sys.argv[3]))
+    else:
+        print("Usage: python -m services.session_persistence compact <dir> <up_to_segment>")
+        sys.exit(1)
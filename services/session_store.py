@@ -0,0 +1,394 @@
+"""
+Pluggable Session Store
+
+Per-session state (conversation history, SalesIQ conversation IDs, state
+machine sessions, per-conversation metrics and the token budget ledger) goes
+through one store, so several worker processes or replicas can share it.
+
+Backends (SESSION_STORE_BACKEND):
+- memory: plain per-process dicts - no serialization, single worker only (default)
+- sqlite: one SQLite file in WAL mode, shared by every worker on the host
+- redis:  any Redis-protocol server (Redis, Valkey, KeyDB or a local stand-in);
+          needs the optional `redis` package
+
+With the memory backend, store.mapping() returns an ordinary dict, so the
+single-process path behaves exactly as before. External backends return a
+StoreMapping proxy: values are JSON-encoded with a per-namespace Codec and
+loaded on access. Objects read during a unit of work are kept in an identity
+map (repeated reads return the same object, so in-place mutation like
+`conversations[sid].append(...)` works) and written back when the unit of
+work ends, if they changed:
+
+    with session_store.unit_of_work():
+        conversations[session_id].append({"role": "user", "content": text})
+    # ← history written back here
+
+Outside a unit of work, reads are always fresh and only assignments and
+deletions are persisted. Tasks started during a request inherit its unit of
+work; once it has been flushed they no longer see it and go to the store
+directly, so code that can run after the request (background summaries,
+finished streams) must assign what it changes.
+
+Shared backends also provide what the per-session coordinator needs across
+processes: leases (a session lock with an expiry, so a crashed worker cannot
+hold it forever) and an expiring key/value cache for webhook replies.
+
+Configuration:
+- SESSION_STORE_BACKEND: memory | sqlite | redis (default memory)
+- SESSION_STORE_PATH: SQLite file (default data/sessions.db)
+- SESSION_STORE_REDIS_URL: Redis URL (default redis://localhost:6379/0)
+- SESSION_STORE_PREFIX: Key prefix for the redis backend (default chatbot)
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, MutableMapping, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sessions.db")
+
+
+class Codec(NamedTuple):
+    """Converts stored objects to and from JSON-compatible values"""
+    encode: Callable[[Any], Any]
+    decode: Callable[[Any], Any]
+
+
+# Values that are already JSON-compatible (lists of message dicts, strings)
+JSON_CODEC = Codec(lambda value: value, lambda value: value)
+
+
+class MemoryBackend:
+    """Marker backend - mappings are plain dicts owned by their module"""
+    name = "memory"
+    shared = False
+
+
+class SQLiteBackend:
+    """Namespaced key/value table in a SQLite (WAL) file"""
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_kv ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_leases ("
+            "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._cache_writes = 0
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM session_kv WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, namespace: str, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO session_kv (namespace, key, value, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                (namespace, key, value, time.time())
+            )
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM session_kv WHERE namespace = ? AND key = ?", (namespace, key)
+            ).rowcount > 0
+
+    def exists(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM session_kv WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone() is not None
+
+    def keys(self, namespace: str) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT key FROM session_kv WHERE namespace = ?", (namespace,)
+            ).fetchall()]
+
+    def count(self, namespace: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM session_kv WHERE namespace = ?", (namespace,)
+            ).fetchone()[0]
+
+    def clear(self, namespace: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM session_kv WHERE namespace = ?", (namespace,))
+
+    def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """Take the lease unless another owner holds an unexpired one"""
+        now = time.time()
+        with self._lock:
+            return self._conn.execute(
+                "INSERT INTO session_leases (key, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE session_leases.expires_at < ? OR session_leases.owner = excluded.owner",
+                (key, owner, now + ttl, now)
+            ).rowcount == 1
+
+    def release_lease(self, key: str, owner: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM session_leases WHERE key = ? AND owner = ?", (key, owner))
+
+    def cache_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM session_cache WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def cache_set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO session_cache (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                (key, value, now + ttl)
+            )
+            self._cache_writes += 1
+            if self._cache_writes % 100 == 0:
+                self._conn.execute("DELETE FROM session_cache WHERE expires_at < ?", (now,))
+
+
+class RedisBackend:
+    """One Redis hash per namespace (works with any Redis-protocol server)"""
+    name = "redis"
+    shared = True
+
+    # Delete the lease only if this owner still holds it
+    RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url: str, prefix: str):
+        self.client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=2.0)
+        self.prefix = prefix
+        self.client.ping()
+
+    def _hash(self, namespace: str) -> str:
+        return f"{self.prefix}:{namespace}"
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        return self.client.hget(self._hash(namespace), key)
+
+    def set(self, namespace: str, key: str, value: str):
+        self.client.hset(self._hash(namespace), key, value)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        return self.client.hdel(self._hash(namespace), key) > 0
+
+    def exists(self, namespace: str, key: str) -> bool:
+        return bool(self.client.hexists(self._hash(namespace), key))
+
+    def keys(self, namespace: str) -> List[str]:
+        return list(self.client.hkeys(self._hash(namespace)))
+
+    def count(self, namespace: str) -> int:
+        return self.client.hlen(self._hash(namespace))
+
+    def clear(self, namespace: str):
+        self.client.delete(self._hash(namespace))
+
+    def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        return bool(self.client.set(f"{self.prefix}:lease:{key}", owner, nx=True, px=int(ttl * 1000)))
+
+    def release_lease(self, key: str, owner: str):
+        self.client.eval(self.RELEASE_SCRIPT, 1, f"{self.prefix}:lease:{key}", owner)
+
+    def cache_get(self, key: str) -> Optional[str]:
+        return self.client.get(f"{self.prefix}:cache:{key}")
+
+    def cache_set(self, key: str, value: str, ttl: float):
+        self.client.set(f"{self.prefix}:cache:{key}", value, px=int(ttl * 1000))
+
+
+class UnitOfWork:
+    """Identity map of objects loaded from the store during one request"""
+
+    def __init__(self):
+        # (namespace, key) → (mapping, object, raw JSON at load time)
+        self.loaded: Dict[Tuple[str, str], Tuple["StoreMapping", Any, Optional[str]]] = {}
+        self.closed = False
+
+    def flush(self):
+        for (namespace, key), (mapping, value, raw) in list(self.loaded.items()):
+            encoded = mapping._encode(value)
+            if encoded != raw:
+                mapping.backend.set(namespace, key, encoded)
+                self.loaded[(namespace, key)] = (mapping, value, encoded)
+
+
+_unit_of_work: ContextVar[Optional[UnitOfWork]] = ContextVar("session_store_unit_of_work", default=None)
+
+
+def _current_unit_of_work() -> Optional[UnitOfWork]:
+    """The open unit of work of this context (a flushed one left in a task's copied context is ignored)"""
+    uow = _unit_of_work.get()
+    return None if uow is None or uow.closed else uow
+
+
+class StoreMapping(MutableMapping):
+    """Dict-like proxy over one namespace of a shared backend"""
+
+    def __init__(self, backend, namespace: str, codec: Codec):
+        self.backend = backend
+        self.namespace = namespace
+        self.codec = codec
+
+    def _encode(self, value: Any) -> str:
+        return json.dumps(self.codec.encode(value), separators=(",", ":"))
+
+    def __getitem__(self, key: str) -> Any:
+        uow = _current_unit_of_work()
+        if uow is not None and (self.namespace, key) in uow.loaded:
+            return uow.loaded[(self.namespace, key)][1]
+
+        raw = self.backend.get(self.namespace, key)
+        if raw is None:
+            raise KeyError(key)
+        value = self.codec.decode(json.loads(raw))
+        if uow is not None:
+            uow.loaded[(self.namespace, key)] = (self, value, raw)
+        return value
+
+    def __setitem__(self, key: str, value: Any):
+        encoded = self._encode(value)
+        self.backend.set(self.namespace, key, encoded)
+        uow = _current_unit_of_work()
+        if uow is not None:
+            uow.loaded[(self.namespace, key)] = (self, value, encoded)
+
+    def __delitem__(self, key: str):
+        uow = _current_unit_of_work()
+        if uow is not None:
+            uow.loaded.pop((self.namespace, key), None)
+        if not self.backend.delete(self.namespace, key):
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        uow = _current_unit_of_work()
+        if uow is not None and (self.namespace, key) in uow.loaded:
+            return True
+        return isinstance(key, str) and self.backend.exists(self.namespace, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.backend.keys(self.namespace))
+
+    def __len__(self) -> int:
+        return self.backend.count(self.namespace)
+
+    def clear(self):
+        uow = _current_unit_of_work()
+        if uow is not None:
+            for loaded_key in [k for k in uow.loaded if k[0] == self.namespace]:
+                del uow.loaded[loaded_key]
+        self.backend.clear(self.namespace)
+
+
+class SessionStore:
+    """Creates the configured backend and hands out per-namespace mappings"""
+
+    def __init__(self):
+        self.backend_name = os.getenv("SESSION_STORE_BACKEND", "memory").lower()
+        self.namespaces: List[str] = []
+        # namespace → (mapping, codec), for snapshotting the memory backend
+        self.mappings: Dict[str, Tuple[MutableMapping, Codec]] = {}
+        self.backend = MemoryBackend()
+
+        if self.backend_name == "sqlite":
+            path = os.getenv("SESSION_STORE_PATH", DEFAULT_DB_PATH)
+            try:
+                self.backend = SQLiteBackend(path)
+                logger.info(f"SessionStore initialized (sqlite: {path})")
+            except sqlite3.Error as e:
+                logger.error(f"[Session Store] Could not open {path} - using in-memory store: {e}")
+        elif self.backend_name == "redis":
+            url = os.getenv("SESSION_STORE_REDIS_URL", "redis://localhost:6379/0")
+            if not REDIS_AVAILABLE:
+                logger.error("[Session Store] redis package not installed - using in-memory store")
+            else:
+                try:
+                    self.backend = RedisBackend(url, os.getenv("SESSION_STORE_PREFIX", "chatbot"))
+                    logger.info(f"SessionStore initialized (redis: {url})")
+                except Exception as e:
+                    logger.error(f"[Session Store] Could not connect to {url} - using in-memory store: {e}")
+        if self.backend.name == "memory":
+            logger.info("SessionStore initialized (memory - single worker only)")
+
+    @property
+    def shared(self) -> bool:
+        """Whether several worker processes can share this store"""
+        return self.backend.shared
+
+    def mapping(self, namespace: str, codec: Codec = JSON_CODEC,
+                factory: Callable[[], MutableMapping] = dict) -> MutableMapping:
+        """Mapping for one kind of per-session state
+
+        Args:
+            namespace: Store namespace, e.g. "conversations"
+            codec: Converts values to/from JSON for shared backends
+            factory: In-memory container used by the memory backend
+        """
+        self.namespaces.append(namespace)
+        mapping = StoreMapping(self.backend, namespace, codec) if self.backend.shared else factory()
+        self.mappings[namespace] = (mapping, codec)
+        return mapping
+
+    @contextmanager
+    def unit_of_work(self):
+        """Write back every object read or assigned in this block when it ends
+
+        Nested blocks join the outer unit of work.
+        """
+        if not self.backend.shared or _current_unit_of_work() is not None:
+            yield
+            return
+
+        uow = UnitOfWork()
+        token = _unit_of_work.set(uow)
+        try:
+            yield
+        finally:
+            _unit_of_work.reset(token)
+            uow.closed = True
+            uow.flush()
+
+    def get_stats(self) -> Dict:
+        stats = {"backend": self.backend.name, "shared": self.shared}
+        if self.backend.shared:
+            stats["entries"] = {namespace: self.backend.count(namespace) for namespace in self.namespaces}
+        return stats
+
+
+# Global session store instance
+session_store = SessionStore()
@@ -0,0 +1,158 @@
+"""
+Speculative Response Generation
+
+Starts LLM response generation at the same time as unified classification,
+so the two LLM latencies overlap instead of adding up. If classification
+(or any handler) decides the turn does not need a generated reply, the
+speculative generation is cancelled and its result discarded.
+
+Tracks:
+- How often speculation is used vs wasted (and why)
+- How much latency the overlap saved per turn
+- p50/p95 webhook latency for speculative vs sequential turns
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import defaultdict, deque
+from typing import Awaitable, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Number of recent latency samples kept per mode for percentile calculation
+LATENCY_SAMPLE_SIZE = 1000
+
+
+def _percentile(samples, pct: float) -> float:
+    """Nearest-rank percentile of a sequence of floats"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class SpeculativeGeneration:
+    """A generation task started before we know whether we need it"""
+
+    def __init__(self, tracker: "SpeculationTracker", coro: Awaitable[Tuple[str, int]], category: str):
+        self.tracker = tracker
+        self.category = category
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        self.saved_seconds = 0.0
+        self.settled = False
+        self.task = asyncio.ensure_future(coro)
+        self.task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task):
+        self.finished_at = time.perf_counter()
+        # Retrieve the exception so discarded tasks don't log "never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    async def result(self) -> Tuple[str, int]:
+        """Await the speculative result and record how much latency it saved"""
+        awaited_at = time.perf_counter()
+        response = await self.task
+        # Work that ran before we needed it is latency the visitor didn't wait for
+        self.saved_seconds = max(0.0, min(self.finished_at or awaited_at, awaited_at) - self.started_at)
+        self.settled = True
+        self.tracker._record_used(self.saved_seconds)
+        return response
+
+    def discard(self, reason: str):
+        """Cancel the generation - the turn was answered without it"""
+        if self.settled:
+            return
+        self.settled = True
+        wasted_tokens = 0
+        if self.task.done():
+            if not self.task.cancelled() and self.task.exception() is None:
+                wasted_tokens = self.task.result()[1]
+        else:
+            self.task.cancel()
+        self.tracker._record_wasted(reason, wasted_tokens)
+        logger.info(f"[Speculation] Discarded speculative generation - reason: {reason}")
+
+
+class SpeculationTracker:
+    """Starts speculative generations and aggregates their outcome metrics"""
+
+    def __init__(self):
+        self.enabled = os.getenv("LLM_SPECULATIVE_GENERATION", "false").lower() in ("1", "true", "yes")
+        self.started = 0
+        self.used = 0
+        self.wasted = 0
+        self.wasted_by_reason: Dict[str, int] = defaultdict(int)
+        self.wasted_tokens = 0
+        self.total_saved_seconds = 0.0
+        self.latency_samples: Dict[str, Deque[float]] = {
+            "speculative": deque(maxlen=LATENCY_SAMPLE_SIZE),
+            "speculative_without_overlap": deque(maxlen=LATENCY_SAMPLE_SIZE),
+            "sequential": deque(maxlen=LATENCY_SAMPLE_SIZE)
+        }
+
+        logger.info(f"SpeculationTracker initialized (enabled: {self.enabled})")
+
+    def start(self, coro: Awaitable[Tuple[str, int]], category: str) -> SpeculativeGeneration:
+        """Start a speculative generation for this turn"""
+        self.started += 1
+        return SpeculativeGeneration(self, coro, category)
+
+    def _record_used(self, saved_seconds: float):
+        self.used += 1
+        self.total_saved_seconds += saved_seconds
+
+    def _record_wasted(self, reason: str, tokens: int):
+        self.wasted += 1
+        self.wasted_by_reason[reason] += 1
+        self.wasted_tokens += tokens
+
+    def record_latency(self, elapsed_seconds: float, saved_seconds: Optional[float] = None):
+        """Record webhook latency for a turn that reached the LLM path
+
+        Args:
+            elapsed_seconds: Actual webhook latency
+            saved_seconds: Overlap saved by speculation (None for sequential turns)
+        """
+        if saved_seconds is None:
+            self.latency_samples["sequential"].append(elapsed_seconds)
+        else:
+            self.latency_samples["speculative"].append(elapsed_seconds)
+            self.latency_samples["speculative_without_overlap"].append(elapsed_seconds + saved_seconds)
+
+    def get_stats(self) -> Dict:
+        """Get speculation effectiveness metrics"""
+        latency = {}
+        for mode, samples in self.latency_samples.items():
+            latency[mode] = {
+                "samples": len(samples),
+                "p50_seconds": round(_percentile(samples, 50), 3),
+                "p95_seconds": round(_percentile(samples, 95), 3)
+            }
+
+        settled = self.used + self.wasted
+        return {
+            "enabled": self.enabled,
+            "started": self.started,
+            "used": self.used,
+            "wasted": self.wasted,
+            "waste_rate": round((self.wasted / settled * 100) if settled > 0 else 0.0, 2),
+            "wasted_by_reason": dict(self.wasted_by_reason),
+            "wasted_tokens": self.wasted_tokens,
+            "avg_saved_seconds": round((self.total_saved_seconds / self.used) if self.used > 0 else 0.0, 3),
+            "latency": latency,
+            "p50_saved_seconds": round(
+                latency["speculative_without_overlap"]["p50_seconds"] - latency["speculative"]["p50_seconds"], 3
+            ),
+            "p95_saved_seconds": round(
+                latency["speculative_without_overlap"]["p95_seconds"] - latency["speculative"]["p95_seconds"], 3
+            )
+        }
+
+
+# Global speculation tracker instance
+speculation_tracker = SpeculationTracker()
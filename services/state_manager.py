@@ -5,14 +5,20 @@ Manages conversation states and transitions for chatbot interactions.
 Replaces fragile string-based state tracking with proper state machine.
 """
 
+import os
 import logging
 from datetime import datetime, timedelta
 from enum import Enum
 from typing import Dict, Optional, List
 from dataclasses import dataclass, field
 
+from services.session_store import Codec, session_store
+
 logger = logging.getLogger(__name__)
 
+# Most recent state transitions kept per session (older ones are dropped)
+MAX_STATE_HISTORY = int(os.getenv("STATE_HISTORY_MAX_TRANSITIONS", "20"))
+
 
 class ConversationState(Enum):
     """Possible states in a conversation"""
@@ -77,7 +83,35 @@ class ConversationSession:
             "to": new_state.value,
             "trigger": trigger.value
         })
+        if len(self.state_history) > MAX_STATE_HISTORY:
+            del self.state_history[:-MAX_STATE_HISTORY]
         logger.info(f"[State] {self.session_id}: {old_state.value} -> {new_state.value} (trigger: {trigger.value})")
+    
+    def to_dict(self) -> Dict:
+        """JSON-compatible form for shared session stores"""
+        return {
+            "session_id": self.session_id,
+            "state": self.state.value,
+            "category": self.category,
+            "created_at": self.created_at.isoformat(),
+            "last_activity": self.last_activity.isoformat(),
+            "message_count": self.message_count,
+            "troubleshooting_attempts": self.troubleshooting_attempts,
+            "escalation_attempts": self.escalation_attempts,
+            "user_info": self.user_info,
+            "state_history": self.state_history
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ConversationSession":
+        return cls(
+            **{
+                **data,
+                "state": ConversationState(data["state"]),
+                "created_at": datetime.fromisoformat(data["created_at"]),
+                "last_activity": datetime.fromisoformat(data["last_activity"])
+            }
+        )
 
 
 class StateManager:
@@ -120,7 +154,10 @@ class StateManager:
     }
     
     def __init__(self):
-        self.sessions: Dict[str, ConversationSession] = {}
+        self.sessions: Dict[str, ConversationSession] = session_store.mapping(
+            "state_sessions",
+            Codec(ConversationSession.to_dict, ConversationSession.from_dict)
+        )
         logger.info("StateManager initialized")
     
     def create_session(self, session_id: str, category: str = "other") -> ConversationSession:
@@ -253,6 +290,10 @@ class StateManager:
         if stale_sessions:
             logger.info(f"[State] Cleaned up {len(stale_sessions)} stale sessions")
     
+    def remove_session(self, session_id: str):
+        """Forget a session entirely (expired or torn down)"""
+        self.sessions.pop(session_id, None)
+    
     def end_session(self, session_id: str, final_state: ConversationState):
         """End a session and move to final state"""
         session = self.sessions.get(session_id)
@@ -0,0 +1,198 @@
+"""
+Per-Session Token Budget Ledger
+
+Single ledger of LLM tokens spent per conversation, shared by the
+classifier, the response generator and history summarization. Entries are
+released when the session ends and are LRU-bounded, so abandoned sessions
+cannot grow the ledger without limit.
+
+The budget is enforced by degrading to cheaper paths as a session spends it:
+
+    NORMAL             full behaviour
+    SHORT_CONTEXT      history compacted to a much smaller token budget
+    NO_CLASSIFICATION  skip the LLM classification call (fast path / rules only)
+    EXHAUSTED          no more LLM calls - reply with a canned escalation
+
+Configuration:
+- LLM_MAX_TOKENS_PER_CHAT: Token budget per conversation (default 100000)
+- LLM_BUDGET_SHORT_CONTEXT_AT: Share of budget spent before shortening context (default 0.6)
+- LLM_BUDGET_NO_CLASSIFICATION_AT: Share of budget spent before skipping classification (default 0.8)
+- LLM_BUDGET_SHORT_CONTEXT_TOKENS: History token budget once context is shortened (default 1000)
+"""
+
+import os
+import time
+import logging
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Dict, Optional
+
+from services.session_store import Codec, session_store
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on tracked sessions (LRU eviction)
+MAX_TRACKED_SESSIONS = 10_000
+
+
+class BudgetLevel(Enum):
+    """How far a session has degraded to stay within its token budget"""
+    NORMAL = 0
+    SHORT_CONTEXT = 1
+    NO_CLASSIFICATION = 2
+    EXHAUSTED = 3
+
+
+@dataclass
+class SessionBudget:
+    """Tokens spent by one session, by caller"""
+    used: int = 0
+    by_source: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    last_updated: float = field(default_factory=time.time)
+
+    def to_dict(self) -> Dict:
+        """JSON-compatible form for shared session stores"""
+        return {"used": self.used, "by_source": dict(self.by_source), "last_updated": self.last_updated}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SessionBudget":
+        return cls(
+            used=data["used"],
+            by_source=defaultdict(int, data.get("by_source", {})),
+            last_updated=data.get("last_updated", time.time())
+        )
+
+
+class TokenBudgetLedger:
+    """Tracks and enforces per-session token budgets"""
+
+    def __init__(self):
+        self.max_tokens_per_session = int(os.getenv("LLM_MAX_TOKENS_PER_CHAT", "100000"))
+        self.short_context_at = float(os.getenv("LLM_BUDGET_SHORT_CONTEXT_AT", "0.6"))
+        self.no_classification_at = float(os.getenv("LLM_BUDGET_NO_CLASSIFICATION_AT", "0.8"))
+        self.short_context_tokens = int(os.getenv("LLM_BUDGET_SHORT_CONTEXT_TOKENS", "1000"))
+        # OrderedDict (LRU) in memory; shared stores drop entries on release instead
+        self.sessions: "OrderedDict[str, SessionBudget]" = session_store.mapping(
+            "token_budget",
+            Codec(SessionBudget.to_dict, SessionBudget.from_dict),
+            factory=OrderedDict
+        )
+        self.degraded_turns: Dict[str, int] = defaultdict(int)
+        self.stats = {"tokens_recorded": 0, "released": 0, "evicted": 0, "sessions_exhausted": 0}
+
+        logger.info(
+            f"TokenBudgetLedger initialized (budget: {self.max_tokens_per_session:,} tokens/session, "
+            f"short context at {self.short_context_at:.0%}, no classification at {self.no_classification_at:.0%})"
+        )
+
+    def record(self, session_id: Optional[str], tokens: int, source: str) -> BudgetLevel:
+        """
+        Add tokens spent on behalf of a session.
+
+        Args:
+            session_id: Session identifier (ignored if missing/unknown)
+            tokens: Prompt + completion tokens
+            source: Caller, e.g. "classifier", "generator", "summary"
+
+        Returns:
+            The session's budget level after this spend
+        """
+        if not session_id or session_id == "unknown" or tokens <= 0:
+            return BudgetLevel.NORMAL
+
+        entry = self.sessions.get(session_id)
+        lru = isinstance(self.sessions, OrderedDict)
+        if entry is None:
+            entry = self.sessions[session_id] = SessionBudget()
+            while lru and len(self.sessions) > MAX_TRACKED_SESSIONS:
+                self.sessions.popitem(last=False)
+                self.stats["evicted"] += 1
+        elif lru:
+            self.sessions.move_to_end(session_id)
+
+        previous = self._level_for(entry.used)
+        entry.used += tokens
+        entry.by_source[source] += tokens
+        entry.last_updated = time.time()
+        if not lru:
+            # Explicit read-modify-write: the summary task and finished streams record
+            # after the request's unit of work has been flushed
+            self.sessions[session_id] = entry
+        self.stats["tokens_recorded"] += tokens
+
+        level = self._level_for(entry.used)
+        if level != previous:
+            logger.warning(
+                f"[Token Budget] Session {session_id} at {entry.used:,}/{self.max_tokens_per_session:,} tokens "
+                f"- degrading to {level.name}"
+            )
+            if level == BudgetLevel.EXHAUSTED:
+                self.stats["sessions_exhausted"] += 1
+        return level
+
+    def _level_for(self, used: int) -> BudgetLevel:
+        if self.max_tokens_per_session <= 0:
+            return BudgetLevel.NORMAL
+        spent = used / self.max_tokens_per_session
+        if spent >= 1.0:
+            return BudgetLevel.EXHAUSTED
+        if spent >= self.no_classification_at:
+            return BudgetLevel.NO_CLASSIFICATION
+        if spent >= self.short_context_at:
+            return BudgetLevel.SHORT_CONTEXT
+        return BudgetLevel.NORMAL
+
+    def level(self, session_id: Optional[str]) -> BudgetLevel:
+        """Current budget level of a session"""
+        entry = self.sessions.get(session_id) if session_id else None
+        return self._level_for(entry.used) if entry else BudgetLevel.NORMAL
+
+    def used(self, session_id: Optional[str]) -> int:
+        entry = self.sessions.get(session_id) if session_id else None
+        return entry.used if entry else 0
+
+    def history_token_budget(self, session_id: Optional[str]) -> Optional[int]:
+        """History token budget override for this session (None = use the default)"""
+        if self.level(session_id).value >= BudgetLevel.SHORT_CONTEXT.value:
+            return self.short_context_tokens
+        return None
+
+    def allows_classification(self, session_id: Optional[str]) -> bool:
+        return self.level(session_id).value < BudgetLevel.NO_CLASSIFICATION.value
+
+    def is_exhausted(self, session_id: Optional[str]) -> bool:
+        return self.level(session_id) == BudgetLevel.EXHAUSTED
+
+    def record_degraded_turn(self, level: BudgetLevel):
+        """Count a turn that took a cheaper path because of its budget"""
+        self.degraded_turns[level.name] += 1
+
+    def release(self, session_id: str):
+        """Drop a session's entry when the conversation ends"""
+        if self.sessions.pop(session_id, None) is not None:
+            self.stats["released"] += 1
+
+    def get_stats(self) -> Dict:
+        """Get ledger state for /metrics"""
+        sessions_by_level: Dict[str, int] = defaultdict(int)
+        tokens_by_source: Dict[str, int] = defaultdict(int)
+        for entry in self.sessions.values():
+            sessions_by_level[self._level_for(entry.used).name] += 1
+            for source, tokens in entry.by_source.items():
+                tokens_by_source[source] += tokens
+
+        top = sorted(self.sessions.items(), key=lambda item: item[1].used, reverse=True)[:5]
+        return {
+            **self.stats,
+            "max_tokens_per_session": self.max_tokens_per_session,
+            "tracked_sessions": len(self.sessions),
+            "sessions_by_level": dict(sessions_by_level),
+            "tokens_by_source": dict(tokens_by_source),
+            "degraded_turns": dict(self.degraded_turns),
+            "top_sessions": [{"session_id": sid, "tokens": entry.used} for sid, entry in top]
+        }
+
+
+# Global token budget ledger instance
+token_budget = TokenBudgetLedger()
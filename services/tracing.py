@@ -0,0 +1,405 @@
+"""
+Request Tracing
+
+Nested timing spans for every request, correlated with the request ID that
+already tags each log line, so a slow turn can be broken down (router,
+handler checks, classification, generation, Zoho calls) without adding log
+lines.
+
+- request_id_var / session_id_var live here so services can read the
+  request context; bind_session() sets the session on both the log context
+  and the current trace.
+- tracer.trace(endpoint) opens a trace for one request (HTTP middleware);
+  tracer.span(name, **attrs) opens a child of the current span. Both are
+  context variables, so spans opened in tasks the request spawns
+  (speculative generation, deadline-bounded stages) land in the same trace.
+- Outside a trace span() returns a shared no-op, so instrumented code costs
+  one ContextVar lookup in background jobs or with tracing disabled.
+- Finished traces are appended as one JSON line to TRACE_FILE (rotated by
+  size) by a writer thread - the request only puts the trace on a bounded
+  queue, and serialization, file writes and rotation happen off the event
+  loop (a full queue drops the trace, counted) - kept in memory when slower
+  than TRACE_SLOW_MS for /debug/traces,
+  and - with TRACE_OTLP_ENDPOINT set - batched to an OpenTelemetry collector
+  as OTLP/HTTP JSON (the trace ID is the request ID's 32 hex digits).
+
+Configuration:
+- TRACING_ENABLED: Record request traces (default true)
+- TRACE_FILE: Rotating JSONL file, empty to disable (default data/traces.jsonl in the repo)
+- TRACE_FILE_MAX_BYTES: Rotate the file at this size (default 10485760)
+- TRACE_FILE_BACKUPS: Rotated files kept (default 3)
+- TRACE_LOG_MIN_MS: Only write traces at least this slow to the file (default 0)
+- TRACE_SLOW_MS: Traces kept for /debug/traces are at least this slow (default 1000)
+- TRACE_SLOW_KEEP: Slow traces kept in memory (default 50)
+- TRACE_MAX_SPANS: Spans recorded per trace, the rest are counted (default 200)
+- TRACE_OTLP_ENDPOINT: OTLP/HTTP collector base URL, e.g. http://otel-collector:4318 (default unset)
+- TRACE_OTLP_INTERVAL_SECONDS: How often batched traces are exported (default 5)
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import asyncio
+import logging
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+DEFAULT_TRACE_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "traces.jsonl")
+
+# Queued traces waiting for the writer thread, beyond which traces are dropped
+TRACE_QUEUE_SIZE = 10_000
+
+# Request context (also read by the log formatter)
+request_id_var: ContextVar[str] = ContextVar('request_id', default='no-request-id')
+session_id_var: ContextVar[str] = ContextVar('session_id', default='no-session-id')
+
+
+class Span:
+    """One timed operation; times are milliseconds since the trace started"""
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attrs", "start_ms", "end_ms", "error", "_token")
+
+    def __init__(self, trace: "Trace", span_id: int, parent_id: int, name: str, attrs: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start_ms = 0.0
+        self.end_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value: Any):
+        self.attrs[key] = value
+
+    def __enter__(self):
+        self.start_ms = self.trace.elapsed_ms()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ms = self.trace.elapsed_ms()
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        _current_span.reset(self._token)
+        return False
+
+    def to_dict(self) -> Dict:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ms": round(self.start_ms, 3),
+            "duration_ms": round((self.end_ms if self.end_ms is not None else self.start_ms) - self.start_ms, 3),
+            "attrs": self.attrs,
+            "error": self.error
+        }
+
+
+class _NoopSpan:
+    """Returned outside a trace - every operation does nothing"""
+    __slots__ = ()
+
+    def set(self, key: str, value: Any):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """All spans recorded for one request"""
+
+    def __init__(self, request_id: str, endpoint: str, max_spans: int):
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.session_id: Optional[str] = None
+        self.started_at_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self.spans: List[Span] = []
+        self.dropped_spans = 0
+        self.max_spans = max_spans
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._started) * 1000
+
+    def open(self, name: str, attrs: Dict[str, Any]):
+        # Work still running after the response (e.g. discarded speculation) isn't recorded
+        if self.duration_ms is not None:
+            return NOOP_SPAN
+        if len(self.spans) >= self.max_spans:
+            self.dropped_spans += 1
+            return NOOP_SPAN
+        parent = _current_span.get()
+        span = Span(self, len(self.spans) + 1, parent.span_id if parent is not None else 0, name, attrs)
+        self.spans.append(span)
+        return span
+
+    def to_dict(self) -> Dict:
+        return {
+            "request_id": self.request_id,
+            "endpoint": self.endpoint,
+            "session_id": self.session_id,
+            "started_at": self.started_at_ns / 1e9,
+            "duration_ms": round(self.duration_ms or 0.0, 3),
+            "error": self.error,
+            "dropped_spans": self.dropped_spans,
+            "spans": [span.to_dict() for span in self.spans]
+        }
+
+    def to_otlp_spans(self) -> List[Dict]:
+        """Spans in the OTLP JSON encoding, under a root span for the request"""
+        trace_id = self.request_id.replace("-", "").rjust(32, "0")[-32:]
+
+        def otlp_span(span_id: int, parent_id: Optional[int], name: str, start_ms: float,
+                      end_ms: float, attrs: Dict, error: Optional[str]) -> Dict:
+            entry = {
+                "traceId": trace_id,
+                "spanId": f"{span_id:016x}",
+                "name": name,
+                "kind": 1,
+                "startTimeUnixNano": str(self.started_at_ns + int(start_ms * 1e6)),
+                "endTimeUnixNano": str(self.started_at_ns + int(end_ms * 1e6)),
+                "attributes": [{"key": key, "value": {"stringValue": str(value)}} for key, value in attrs.items()],
+                "status": {"code": 2, "message": error} if error else {"code": 1}
+            }
+            if parent_id is not None:
+                entry["parentSpanId"] = f"{parent_id:016x}"
+            return entry
+
+        # Span IDs are per-trace indexes; the root takes the first ID past the children
+        root_id = len(self.spans) + 1
+        spans = [otlp_span(root_id, None, self.endpoint, 0.0, self.duration_ms or 0.0,
+                           {"request_id": self.request_id, "session_id": self.session_id}, self.error)]
+        for span in self.spans:
+            spans.append(otlp_span(span.span_id, span.parent_id or root_id, span.name, span.start_ms,
+                                   span.end_ms if span.end_ms is not None else span.start_ms,
+                                   span.attrs, span.error))
+        return spans
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+
+
+class TraceFormatter(logging.Formatter):
+    """Serializes the record's trace as one JSON line (runs on the writer thread)"""
+
+    def __init__(self, stats: Dict[str, int]):
+        super().__init__()
+        self.stats = stats
+
+    def format(self, record):
+        self.stats["written"] += 1
+        return json.dumps(record.trace.to_dict(), default=str)
+
+
+class TraceQueueHandler(QueueHandler):
+    """Hands finished traces to the writer thread as-is (no formatting on the caller's thread)"""
+
+    def __init__(self, trace_queue: queue.SimpleQueue, max_size: int):
+        super().__init__(trace_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+class Tracer:
+    """Opens request traces and spans, and ships finished traces"""
+
+    def __init__(self):
+        self.enabled = os.getenv("TRACING_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.log_min_ms = float(os.getenv("TRACE_LOG_MIN_MS", "0"))
+        self.slow_ms = float(os.getenv("TRACE_SLOW_MS", "1000"))
+        self.max_spans = int(os.getenv("TRACE_MAX_SPANS", "200"))
+        self.otlp_endpoint = os.getenv("TRACE_OTLP_ENDPOINT", "").rstrip("/")
+        self.otlp_interval = float(os.getenv("TRACE_OTLP_INTERVAL_SECONDS", "5"))
+        self.slow_traces: Deque[Trace] = deque(maxlen=int(os.getenv("TRACE_SLOW_KEEP", "50")))
+        self._otlp_batch: List[Trace] = []
+        self._worker: Optional[asyncio.Task] = None
+        self.stats = {"traces": 0, "slow_traces": 0, "written": 0, "exported": 0, "export_errors": 0,
+                      "dropped_spans": 0}
+
+        self._file_logger: Optional[logging.Logger] = None
+        self._file_queue: Optional[TraceQueueHandler] = None
+        self._file_writer: Optional[QueueListener] = None
+        trace_file = os.getenv("TRACE_FILE", DEFAULT_TRACE_FILE)
+        if self.enabled and trace_file:
+            try:
+                os.makedirs(os.path.dirname(trace_file) or ".", exist_ok=True)
+                handler = RotatingFileHandler(
+                    trace_file,
+                    maxBytes=int(os.getenv("TRACE_FILE_MAX_BYTES", "10485760")),
+                    backupCount=int(os.getenv("TRACE_FILE_BACKUPS", "3")),
+                    encoding="utf-8"
+                )
+                handler.setFormatter(TraceFormatter(self.stats))
+                trace_queue: queue.SimpleQueue = queue.SimpleQueue()
+                self._file_queue = TraceQueueHandler(trace_queue, TRACE_QUEUE_SIZE)
+                self._file_logger = logging.getLogger("chatbot.traces")
+                self._file_logger.propagate = False
+                self._file_logger.setLevel(logging.INFO)
+                self._file_logger.handlers = [self._file_queue]
+                self._file_writer = QueueListener(trace_queue, handler)
+                self._file_writer.start()
+                atexit.register(self.close_file)
+            except OSError as e:
+                logger.error(f"[Tracing] Could not open {trace_file}: {e} - traces will not be written")
+        if self.otlp_endpoint and not HTTPX_AVAILABLE:
+            logger.warning("httpx not installed - OTLP trace export disabled. Run: pip install httpx")
+            self.otlp_endpoint = ""
+
+        logger.info(f"Tracer initialized (enabled: {self.enabled}, slow: {self.slow_ms:.0f}ms, "
+                    f"file: {trace_file if self._file_logger else 'off'}, otlp: {self.otlp_endpoint or 'off'})")
+
+    @contextmanager
+    def trace(self, endpoint: str):
+        """Record the enclosed request as one trace (keyed by the current request ID)"""
+        if not self.enabled:
+            yield None
+            return
+        trace = Trace(request_id_var.get(), endpoint, self.max_spans)
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(None)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.error = type(e).__name__
+            raise
+        finally:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            trace.duration_ms = trace.elapsed_ms()
+            self._finish(trace)
+
+    def span(self, name: str, **attrs):
+        """`with tracer.span("router.classify"):` - a no-op outside a trace"""
+        trace = _current_trace.get()
+        if trace is None:
+            return NOOP_SPAN
+        return trace.open(name, attrs)
+
+    @staticmethod
+    def current() -> Optional[Trace]:
+        return _current_trace.get()
+
+    def _finish(self, trace: Trace):
+        self.stats["traces"] += 1
+        self.stats["dropped_spans"] += trace.dropped_spans
+        if trace.duration_ms >= self.slow_ms:
+            self.slow_traces.append(trace)
+            self.stats["slow_traces"] += 1
+        if self._file_logger is not None and trace.duration_ms >= self.log_min_ms:
+            # Serialized and written by the writer thread
+            self._file_logger.info("trace", extra={"trace": trace})
+        if self.otlp_endpoint:
+            self._otlp_batch.append(trace)
+
+    def get_slow_traces(self, limit: Optional[int] = None) -> List[Dict]:
+        """Slow traces kept for /debug/traces, newest first"""
+        traces = list(self.slow_traces)[::-1]
+        return [trace.to_dict() for trace in traces[:limit]]
+
+    def start(self):
+        """Start the OTLP export loop (call from the running event loop)"""
+        if self.otlp_endpoint and self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+            logger.info(f"[Tracing] Exporting traces to {self.otlp_endpoint} every {self.otlp_interval:.0f}s")
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+            await self._export()
+        self.close_file()
+
+    def close_file(self):
+        """Write out queued traces and stop the writer thread"""
+        if self._file_writer is not None:
+            self._file_writer.stop()
+            self._file_writer = None
+            self._file_logger.handlers = []
+            self._file_logger = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.otlp_interval)
+            await self._export()
+
+    async def _export(self):
+        if not self._otlp_batch:
+            return
+        batch, self._otlp_batch = self._otlp_batch, []
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "llm-chatbot"}}]},
+                "scopeSpans": [{
+                    "scope": {"name": "services.tracing"},
+                    "spans": [span for trace in batch for span in trace.to_otlp_spans()]
+                }]
+            }]
+        }
+        try:
+            async with httpx.AsyncClient(timeout=10) as client:
+                response = await client.post(f"{self.otlp_endpoint}/v1/traces", json=body)
+                response.raise_for_status()
+            self.stats["exported"] += len(batch)
+        except Exception as e:
+            self.stats["export_errors"] += 1
+            logger.warning(f"[Tracing] OTLP export of {len(batch)} traces failed: {e}")
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "slow_threshold_ms": self.slow_ms,
+            "slow_traces_kept": len(self.slow_traces),
+            "otlp_endpoint": self.otlp_endpoint or None,
+            "otlp_pending": len(self._otlp_batch),
+            "file_queued": self._file_queue.queue.qsize() if self._file_queue else 0,
+            "file_dropped": self._file_queue.dropped if self._file_queue else 0
+        }
+
+
+def bind_session(session_id: str):
+    """Tag the current log context and trace with the session ID"""
+    session_id_var.set(session_id)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.session_id = session_id
+
+
+# Global tracer instance
+tracer = Tracer()
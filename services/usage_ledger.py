@@ -0,0 +1,189 @@
+"""
+LLM Usage Ledger
+
+Every completion (generator, classifier, history summary) is recorded here
+with its input, cached-input and output tokens and priced per model, in
+place of the flat GPT-4o-mini rate metrics used to apply to total tokens.
+
+- Usage is aggregated per (model, caller, category, handler). The handler is
+  the registry handler that routed the turn to the LLM ("none" for calls
+  made before or without a handler match).
+- Cost = uncached input × input price + cached input × cached price +
+  output × output price, from the price table (USD per 1M tokens). Calls to
+  models missing from the table are counted as unpriced.
+- Each record also feeds the Prometheus LLM call/token/cost counters, and the
+  last LLM_LEDGER_RECENT records are kept for /stats.
+
+Configuration:
+- LLM_PRICE_TABLE: JSON overriding/adding model prices, e.g.
+  {"google/gemini-2.5-flash": {"input": 0.30, "cached_input": 0.075, "output": 2.50}}
+- LLM_LEDGER_RECENT: Recent call records kept (default 50)
+"""
+
+import os
+import json
+import time
+import logging
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from typing import Deque, Dict, Optional, Tuple
+
+from services.prometheus_exporter import prometheus_exporter
+
+logger = logging.getLogger(__name__)
+
+# USD per 1M tokens
+DEFAULT_PRICES: Dict[str, Dict[str, float]] = {
+    "google/gemini-2.5-flash-lite": {"input": 0.10, "cached_input": 0.025, "output": 0.40},
+    "google/gemini-2.5-flash": {"input": 0.30, "cached_input": 0.075, "output": 2.50},
+    "openai/gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+}
+
+# Handler that routed the current turn to the LLM (set by the handler registry)
+llm_handler_var: ContextVar[str] = ContextVar("llm_handler", default="none")
+
+
+def load_price_table() -> Dict[str, Dict[str, float]]:
+    prices = {model: dict(rates) for model, rates in DEFAULT_PRICES.items()}
+    raw = os.getenv("LLM_PRICE_TABLE", "").strip()
+    if raw:
+        try:
+            for model, rates in json.loads(raw).items():
+                prices.setdefault(model, {}).update({key: float(value) for key, value in rates.items()})
+        except (ValueError, AttributeError) as e:
+            logger.error(f"[Ledger] Invalid LLM_PRICE_TABLE, using default prices: {e}")
+    return prices
+
+
+@dataclass
+class UsageTotals:
+    """Token and cost totals for one (model, caller, category, handler)"""
+    calls: int = 0
+    # Calls that reused a cached prompt prefix
+    cache_hits: int = 0
+    input_tokens: int = 0
+    cached_input_tokens: int = 0
+    output_tokens: int = 0
+    cost_usd: float = 0.0
+
+    def add(self, other: "UsageTotals"):
+        self.calls += other.calls
+        self.cache_hits += other.cache_hits
+        self.input_tokens += other.input_tokens
+        self.cached_input_tokens += other.cached_input_tokens
+        self.output_tokens += other.output_tokens
+        self.cost_usd += other.cost_usd
+
+    def to_dict(self) -> Dict:
+        data = asdict(self)
+        data["cost_usd"] = round(self.cost_usd, 6)
+        return data
+
+
+class UsageLedger:
+    """Per-call LLM usage, priced per model"""
+
+    def __init__(self):
+        self.prices = load_price_table()
+        self.totals: Dict[Tuple[str, str, str, str], UsageTotals] = {}
+        self.recent: Deque[Dict] = deque(maxlen=int(os.getenv("LLM_LEDGER_RECENT", "50")))
+        self.unpriced_calls = 0
+        self._unpriced_models = set()
+
+        logger.info(f"UsageLedger initialized ({len(self.prices)} priced models)")
+
+    def price(self, model: str, input_tokens: int, cached_input_tokens: int, output_tokens: int) -> Optional[float]:
+        """Cost in USD, or None if the model has no price"""
+        rates = self.prices.get(model)
+        if rates is None:
+            return None
+        input_rate = rates.get("input", 0.0)
+        return (
+            (input_tokens - cached_input_tokens) * input_rate
+            + cached_input_tokens * rates.get("cached_input", input_rate)
+            + output_tokens * rates.get("output", 0.0)
+        ) / 1_000_000
+
+    def record(self, model: str, caller: str, category: Optional[str], usage) -> UsageTotals:
+        """Record one completion from its OpenAI-style usage object (None if not reported)"""
+        category = category or "none"
+        handler = llm_handler_var.get()
+        entry = UsageTotals(calls=1)
+        if usage:
+            details = getattr(usage, "prompt_tokens_details", None)
+            entry.input_tokens = usage.prompt_tokens
+            entry.cached_input_tokens = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+            entry.output_tokens = usage.completion_tokens
+            entry.cache_hits = 1 if entry.cached_input_tokens else 0
+
+        cost = self.price(model, entry.input_tokens, entry.cached_input_tokens, entry.output_tokens)
+        if cost is None:
+            self.unpriced_calls += 1
+            if model not in self._unpriced_models:
+                self._unpriced_models.add(model)
+                logger.warning(f"[Ledger] No price for model {model} - add it to LLM_PRICE_TABLE")
+        else:
+            entry.cost_usd = cost
+
+        key = (model, caller, category, handler)
+        totals = self.totals.get(key)
+        if totals is None:
+            totals = self.totals[key] = UsageTotals()
+        totals.add(entry)
+        self.recent.append({"timestamp": time.time(), "model": model, "caller": caller, "category": category,
+                            "handler": handler, **entry.to_dict()})
+        prometheus_exporter.record_llm_call(model, caller, category, entry.input_tokens,
+                                            entry.cached_input_tokens, entry.output_tokens, entry.cost_usd)
+        return entry
+
+    def total(self, caller: Optional[str] = None) -> UsageTotals:
+        """Totals across all calls (or one caller's calls)"""
+        result = UsageTotals()
+        for (_, key_caller, _, _), totals in self.totals.items():
+            if caller is None or key_caller == caller:
+                result.add(totals)
+        return result
+
+    def breakdown(self, field: str) -> Dict[str, Dict]:
+        """Totals grouped by model, caller, category or handler"""
+        index = ("model", "caller", "category", "handler").index(field)
+        grouped: Dict[str, UsageTotals] = {}
+        for key, totals in self.totals.items():
+            grouped.setdefault(key[index], UsageTotals()).add(totals)
+        return {name: totals.to_dict() for name, totals in sorted(grouped.items())}
+
+    def get_cache_stats(self, caller: str) -> Dict:
+        """Prompt-prefix cache effectiveness for one caller"""
+        totals = self.total(caller)
+        return {
+            "calls": totals.calls,
+            "cache_hits": totals.cache_hits,
+            "prompt_tokens": totals.input_tokens,
+            "cached_prompt_tokens": totals.cached_input_tokens,
+            "uncached_prompt_tokens": totals.input_tokens - totals.cached_input_tokens,
+            "cached_token_ratio": round(
+                (totals.cached_input_tokens / totals.input_tokens * 100) if totals.input_tokens > 0 else 0.0, 2
+            )
+        }
+
+    def reset(self):
+        self.totals.clear()
+        self.recent.clear()
+        self.unpriced_calls = 0
+
+    def get_stats(self) -> Dict:
+        return {
+            "totals": self.total().to_dict(),
+            "by_model": self.breakdown("model"),
+            "by_caller": self.breakdown("caller"),
+            "by_category": self.breakdown("category"),
+            "by_handler": self.breakdown("handler"),
+            "unpriced_calls": self.unpriced_calls,
+            "prices_per_million_tokens": self.prices,
+            "recent_calls": list(self.recent)
+        }
+
+
+# Global usage ledger instance
+usage_ledger = UsageLedger()
@@ -0,0 +1,132 @@
+"""Test the alert pipeline: per-type aggregation, threshold, token bucket and async summaries"""
+
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["ERROR_ALERT_WEBHOOK"] = "http://alerts.invalid/hook"
+os.environ["ALERT_THRESHOLD"] = "3"
+os.environ["ALERT_FLUSH_SECONDS"] = "0.05"
+os.environ["ALERT_BURST"] = "2"
+os.environ["ALERT_RATE_PER_MINUTE"] = "60"
+os.environ["ALERT_SAMPLE_CONTEXTS"] = "2"
+os.environ["ALERT_MAX_TYPES"] = "3"
+
+from services.alerting import AlertAggregator, TokenBucket
+from services.prometheus_exporter import prometheus_exporter
+from services.tracing import request_id_var
+
+
+def make_aggregator():
+    aggregator = AlertAggregator()
+    aggregator.sent = []
+    aggregator.fail = False
+
+    async def post(summary):
+        if aggregator.fail:
+            raise ConnectionError("webhook down")
+        aggregator.sent.append(summary)
+
+    aggregator._post = post
+    return aggregator
+
+
+# Token bucket: burst, then refill at the configured rate
+bucket = TokenBucket(rate=1.0, capacity=2)
+now = bucket.updated
+assert bucket.take(now) and bucket.take(now) and not bucket.take(now)
+assert not bucket.take(now + 0.5)
+assert bucket.take(now + 1.6) and not bucket.take(now + 1.6)
+print('✓ Token bucket allows a burst and refills over time')
+
+# Errors are buffered by type; only types at the threshold are due
+aggregator = make_aggregator()
+request_id_var.set("req-1")
+for n in range(4):
+    aggregator.record("webhook_error", f"timeout {n}", {"session_id": f"s{n}"})
+aggregator.record("reset_error", "boom")
+assert [entry.error_type for entry in aggregator.due()] == ["webhook_error"]
+entry = aggregator.pending["webhook_error"]
+assert entry.count == 4 and entry.message == "timeout 3"
+assert len(entry.samples) == 2 and entry.samples[0]["context"] == {"session_id": "s0"}
+assert entry.samples[0]["request_id"] == "req-1"
+assert entry.first_seen <= entry.last_seen
+print('✓ Errors aggregate by type with counts, first/last seen and sample contexts')
+
+# One deduplicated summary per flush; types below the threshold stay buffered
+assert asyncio.run(aggregator.flush()) == 1
+assert len(aggregator.sent) == 1
+summary = aggregator.sent[0]
+assert summary["severity"] == "ERROR" and summary["total_errors"] == 4
+assert [alert["error_type"] for alert in summary["alerts"]] == ["webhook_error"]
+assert summary["alerts"][0]["count"] == 4 and len(summary["alerts"][0]["samples"]) == 2
+assert list(aggregator.pending) == ["reset_error"]
+assert asyncio.run(aggregator.flush()) == 0 and len(aggregator.sent) == 1
+print('✓ Flush sends one summary of due types and keeps the rest buffered')
+
+# Critical alerts are due immediately and mark the summary critical
+aggregator.record("llm_down", "all providers failed", critical=True)
+assert asyncio.run(aggregator.flush()) == 1
+assert aggregator.sent[-1]["severity"] == "CRITICAL"
+print('✓ Critical alerts skip the threshold')
+
+# The token bucket caps outbound alerts; rate-limited errors merge into the next summary
+aggregator.bucket = TokenBucket(rate=0.0, capacity=1)
+aggregator.bucket.tokens = 0
+for _ in range(3):
+    aggregator.record("zoho_error", "502")
+assert asyncio.run(aggregator.flush()) == 0
+for _ in range(2):
+    aggregator.record("zoho_error", "503")
+assert aggregator.stats["rate_limited"] == 1 and aggregator.pending["zoho_error"].count == 5
+aggregator.bucket.tokens = 1
+assert asyncio.run(aggregator.flush()) == 1
+assert aggregator.sent[-1]["alerts"][0]["count"] == 5 and aggregator.sent[-1]["alerts"][0]["message"] == "503"
+print('✓ Rate-limited alerts are held and merged into the next summary')
+
+# A failed POST puts the aggregate back, merged with errors recorded meanwhile
+aggregator.bucket = TokenBucket(rate=0.0, capacity=5)
+aggregator.fail = True
+for _ in range(3):
+    aggregator.record("db_error", "locked")
+assert asyncio.run(aggregator.flush()) == 0
+aggregator.record("db_error", "locked again")
+aggregator.fail = False
+assert aggregator.stats["send_failures"] == 1 and aggregator.pending["db_error"].count == 4
+assert asyncio.run(aggregator.flush()) == 1 and aggregator.sent[-1]["alerts"][0]["count"] == 4
+print('✓ Failed sends are retried on the next flush')
+
+# Distinct types are capped
+aggregator = make_aggregator()
+for n in range(5):
+    aggregator.record(f"type_{n}", "x")
+assert len(aggregator.pending) == 3 and aggregator.stats["overflow"] == 2
+print('✓ Buffered error types are capped')
+
+# Background loop flushes on its own; stop() flushes what is left
+async def run_loop(aggregator):
+    aggregator.start()
+    for _ in range(3):
+        aggregator.record("loop_error", "x")
+    await asyncio.sleep(0.15)
+    sent_by_loop = len(aggregator.sent)
+    aggregator.record("late_error", "y", critical=True)
+    await aggregator.stop()
+    return sent_by_loop
+
+aggregator = make_aggregator()
+assert asyncio.run(run_loop(aggregator)) == 1
+assert [alert["error_type"] for alert in aggregator.sent[-1]["alerts"]] == ["late_error"]
+stats = aggregator.get_stats()
+assert stats["alerts_sent"] == 2 and stats["alerted_types"] == 2 and stats["buffered_types"] == 0
+assert stats["webhook_configured"]
+print('✓ Flush loop sends in the background and stop() flushes the remainder')
+
+# Every error is counted in Prometheus
+text = prometheus_exporter.render()
+assert 'chatbot_errors_total{error_type="loop_error"} 3' in text
+print('✓ Errors are exported as chatbot_errors_total')
+
+print('\n✓ All tests passed!')
@@ -0,0 +1,72 @@
+"""Test the compact conversation history keeps the list-of-dicts behaviour callers rely on"""
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.conversation_history import (
+    ConversationHistory, HistoryFlag, HistoryView, openai_messages, salesiq_past_messages
+)
+from services.history_compactor import HistoryCompactor, SessionSummary
+
+history = ConversationHistory()
+history.add("user", "my server is slow")
+history.add("assistant", "Let's check disk space.")
+history.append({"role": "user", "content": "it says 2 GB free"})
+assert len(history) == 3
+assert history[-1].get("role") == "user" and history[1]["content"] == "Let's check disk space."
+assert history == [
+    {"role": "user", "content": "my server is slow"},
+    {"role": "assistant", "content": "Let's check disk space."},
+    {"role": "user", "content": "it says 2 GB free"},
+]
+assert not hasattr(history[0], "__dict__")
+print('✓ Slotted turns read like {"role", "content"} dicts')
+
+history.set_flag(HistoryFlag.AWAITING_CALLBACK_DETAILS)
+assert history.has_flag(HistoryFlag.AWAITING_CALLBACK_DETAILS) and len(history) == 3
+restored = ConversationHistory.from_dict(json.loads(json.dumps(history.to_dict())))
+assert restored == history and restored.has_flag(HistoryFlag.AWAITING_CALLBACK_DETAILS)
+history.add("assistant", "That's low.")
+assert not history.has_flag(HistoryFlag.AWAITING_CALLBACK_DETAILS)
+print('✓ Flags round-trip through the codec and clear on the next turn')
+
+legacy = ConversationHistory.from_dict([
+    {"role": "user", "content": "call me back"},
+    {"role": "assistant", "content": "Please provide your phone number."},
+    {"role": "system", "content": "WAITING_FOR_CALLBACK_DETAILS"},
+])
+assert len(legacy) == 2 and legacy.has_flag(HistoryFlag.AWAITING_CALLBACK_DETAILS)
+print('✓ Saved list-of-dict histories load, marker message becomes a flag')
+
+recent = history[-2:]
+assert isinstance(recent, HistoryView) and recent.turns is history.turns
+assert [turn.content for turn in recent] == ["it says 2 GB free", "That's low."]
+assert recent[1:][0].content == "That's low." and len(history[10:]) == 0
+assert list(openai_messages(recent)) == [
+    {"role": "user", "content": "it says 2 GB free"},
+    {"role": "assistant", "content": "That's low."},
+]
+past = list(salesiq_past_messages(history, now=1000.0))
+assert [m["sender_type"] for m in past] == ["visitor", "bot", "visitor", "bot"]
+assert past[0]["time"] == 980_000 and past[-1]["time"] == 995_000
+print('✓ Slices are views; OpenAI and SalesIQ formats are produced from them')
+
+capped = ConversationHistory(max_messages=4)
+for n in range(6):
+    capped.add("user" if n % 2 == 0 else "assistant", f"message {n}")
+assert [turn.content for turn in capped] == ["message 2", "message 3", "message 4", "message 5"]
+assert capped.dropped == 2
+assert ConversationHistory.from_dict(capped.to_dict()).dropped == 2
+
+# Summary positions count dropped messages, so the verbatim tail is still right
+compactor = HistoryCompactor()
+compactor.summaries["s1"] = SessionSummary(text="Earlier: printer issue", covered=3)
+summary, recent = compactor.compact("s1", capped, token_budget=0)
+assert summary == "Earlier: printer issue"
+assert [turn.content for turn in recent] == ["message 3", "message 4", "message 5"]
+print('✓ Capped history drops the oldest turns and the compactor accounts for them')
+
+print('\n✓ All tests passed!')
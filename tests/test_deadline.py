@@ -0,0 +1,64 @@
+"""Test deadlines propagate to stages, cancel slow work and count misses per stage"""
+
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.deadline import DeadlineExceeded, DeadlineTracker, canned_reply
+
+tracker = DeadlineTracker()
+tracker.budgets["webhook"] = 0.2
+cancelled = []
+
+
+async def slow_llm_call(seconds):
+    try:
+        await asyncio.sleep(seconds)
+        return "reply"
+    except asyncio.CancelledError:
+        cancelled.append(seconds)
+        raise
+
+
+async def nested_stage():
+    # Downstream code sees the deadline through the context variable
+    return await tracker.run("generation", slow_llm_call(1.0))
+
+
+async def main():
+    assert await tracker.run("generation", slow_llm_call(0.01)) == "reply"
+    print('✓ No deadline outside a request')
+
+    with tracker.start("webhook"):
+        assert await tracker.run("classification", slow_llm_call(0.05)) == "reply"
+        assert 0 < tracker.remaining() < 0.2
+        try:
+            await nested_stage()
+            raise AssertionError("deadline should have been exceeded")
+        except DeadlineExceeded as e:
+            assert e.stage == "generation"
+        assert cancelled == [1.0]
+        print('✓ Slow stage cancelled when the budget runs out')
+
+        try:
+            tracker.check("handlers")
+            raise AssertionError("deadline should have been exceeded")
+        except DeadlineExceeded:
+            pass
+
+    assert tracker.remaining() is None
+    stats = tracker.get_stats()
+    assert stats["misses_by_stage"] == {"generation": 1, "handlers": 1}, stats
+    assert stats["misses_by_endpoint"] == {"webhook": 2}, stats
+    print('✓ Misses counted per stage and endpoint')
+
+
+asyncio.run(main())
+
+assert "QuickBooks" in canned_reply("quickbooks")
+assert canned_reply("unknown-category") == canned_reply("other")
+print('✓ Canned replies per category')
+
+print('\n✓ All tests passed!')
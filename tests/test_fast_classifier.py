@@ -0,0 +1,73 @@
+"""Test the fast-path classifier trains, round-trips and gates on confidence"""
+
+import os
+import json
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.fast_classifier import FastClassifierModel, FastPathClassifier, load_decision_log
+
+EXAMPLES = [
+    ("thanks it works now", "RESOLVED", "BOT_CAN_HANDLE", "OTHER"),
+    ("great that fixed it", "RESOLVED", "BOT_CAN_HANDLE", "OTHER"),
+    ("still not working", "UNRESOLVED", "BOT_CAN_HANDLE", "QUESTION"),
+    ("same error again", "UNRESOLVED", "BOT_CAN_HANDLE", "QUESTION"),
+    ("connect me with an agent", "UNRESOLVED", "NEEDS_HUMAN", "TRANSFER"),
+    ("please call me back", "UNRESOLVED", "NEEDS_HUMAN", "CALLBACK"),
+]
+
+training = [
+    {"message": m, "last_bot_message": "Did that work?", "resolution": r, "escalation": e, "intent": i}
+    for m, r, e, i in EXAMPLES
+] * 20
+
+model = FastClassifierModel.train(training)
+print('✓ Model trained')
+
+for message, resolution, escalation, intent in EXAMPLES:
+    prediction = model.predict(message, "Did that work?")
+    assert prediction["resolution"][0] == resolution, (message, prediction)
+    assert prediction["escalation"][0] == escalation, (message, prediction)
+    assert prediction["intent"][0] == intent, (message, prediction)
+    print(f'  "{message}" → {prediction["resolution"][0]} / {prediction["escalation"][0]} / {prediction["intent"][0]}')
+
+with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, "fast_classifier.npz")
+    model.save(path)
+    loaded = FastClassifierModel.load(path)
+    assert loaded.predict("thanks it works now") == model.predict("thanks it works now")
+    print('✓ Model saved and loaded')
+
+runtime = FastPathClassifier()
+runtime.model = model
+runtime.shadow_rate = 0.0
+runtime.threshold = 1.01  # Nothing can clear this - every turn falls back to the LLM
+assert not runtime.should_absorb(runtime.predict("thanks it works now", []))
+runtime.threshold = 0.0
+assert runtime.should_absorb(runtime.predict("thanks it works now", []))
+assert runtime.get_stats()["absorbed"] == 1
+print('✓ Confidence gating works')
+
+with tempfile.TemporaryDirectory() as tmp:
+    log_path = os.path.join(tmp, "decisions", "decision_log.jsonl")
+    os.environ["FAST_CLASSIFIER_DECISION_LOG"] = log_path
+    try:
+        logging_runtime = FastPathClassifier()
+    finally:
+        del os.environ["FAST_CLASSIFIER_DECISION_LOG"]
+    assert logging_runtime.get_stats()["decision_log"]
+    llm_decisions = {"resolution": ("RESOLVED", 95), "escalation": ("BOT_CAN_HANDLE", 90), "intent": ("OTHER", 80)}
+    logging_runtime.record_llm_decision("thanks it works now", [], llm_decisions)
+    logging_runtime.record_llm_decision("still broken", [{"role": "assistant", "content": "Try a restart"}], llm_decisions)
+    logging_runtime.close_decision_log()
+    with open(log_path, encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert [line["message"] for line in lines] == ["thanks it works now", "still broken"]
+    assert lines[1]["last_bot_message"] == "Try a restart"
+    assert lines[0]["resolution"] == {"decision": "RESOLVED", "confidence": 95}
+    assert load_decision_log([log_path])[0]["message"] == "thanks it works now"
+    print('✓ Decisions are written to the decision log by the writer thread')
+
+print('\n✓ All tests passed!')
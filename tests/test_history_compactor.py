@@ -0,0 +1,120 @@
+"""Test history compaction: token budget, background summaries, incremental folding and bookkeeping"""
+
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["LLM_HISTORY_TOKEN_BUDGET"] = "100"
+os.environ["LLM_HISTORY_KEEP_TURNS"] = "2"
+
+from services.conversation_history import ConversationHistory
+from services.history_compactor import HistoryCompactor, count_history_tokens
+from services.token_budget import token_budget
+
+
+class FakeSummaryClient:
+    """Chat client that summarizes by listing the messages it was asked to fold in"""
+
+    def __init__(self):
+        self.prompts = []
+        self.fail = False
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, **kwargs):
+        if self.fail:
+            raise ConnectionError("summary model down")
+        prompt = messages[0]["content"]
+        self.prompts.append(prompt)
+        folded = [line for line in prompt.splitlines() if line.startswith(("User: ", "Bot: "))]
+        usage = SimpleNamespace(prompt_tokens=40, completion_tokens=10, prompt_tokens_details=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"summary of {len(folded)}"))],
+                               usage=usage)
+
+
+def make_history(count, start=0, max_messages=None):
+    history = ConversationHistory(max_messages=max_messages)
+    for n in range(start, start + count):
+        history.add("user" if n % 2 == 0 else "assistant", f"message {n} " + "about the server " * 8)
+    return history
+
+
+async def compact_and_wait(compactor, session_id, history, **kwargs):
+    result = compactor.compact(session_id, history, **kwargs)
+    pending = compactor._pending.get(session_id)
+    if pending is not None:
+        await pending
+    return result
+
+
+compactor = HistoryCompactor()
+client = compactor._client = FakeSummaryClient()
+
+# Within the budget, history is sent verbatim and nothing is summarized
+short = make_history(2)
+assert count_history_tokens(short) <= 100
+assert asyncio.run(compact_and_wait(compactor, "s1", short)) == (None, short)
+long = make_history(10)
+assert compactor.compact(None, long) == (None, long) and compactor.compact("unknown", long) == (None, long)
+assert client.prompts == []
+print('✓ Short histories and histories without a session are sent verbatim')
+
+# Over the budget, the first turn still sends everything while a summary is built in the background
+history = make_history(10)
+summary, recent = asyncio.run(compact_and_wait(compactor, "s1", history))
+assert summary is None and len(recent) == 10
+assert compactor.summaries["s1"].covered == 6 and compactor.summaries["s1"].text == "summary of 6"
+assert "(none yet)" in client.prompts[0]
+assert token_budget.used("s1") == 50 and compactor.stats["summaries_built"] == 1
+print('✓ Aged-out messages are summarized off the reply path and the spend is recorded')
+
+# Later turns send the summary plus the last KEEP_TURNS turns
+summary, recent = asyncio.run(compact_and_wait(compactor, "s1", history))
+assert summary == "summary of 6" and [turn.content.split()[1] for turn in recent] == ["6", "7", "8", "9"]
+assert compactor.stats["compacted_turns"] == 1 and compactor.stats["tokens_saved"] > 0
+assert len(client.prompts) == 1  # Already covered - no new summary call
+print('✓ Compacted turns send the cached summary and the recent turns')
+
+# New messages are folded in incrementally: only the newly aged-out ones are sent
+for n in range(10, 12):
+    history.add("user" if n % 2 == 0 else "assistant", f"message {n} " + "about the server " * 8)
+summary, recent = asyncio.run(compact_and_wait(compactor, "s1", history))
+assert summary == "summary of 6" and len(recent) == 6  # Summary still catching up - nothing dropped
+assert "CURRENT SUMMARY:\nsummary of 6" in client.prompts[-1]
+assert "message 6 " in client.prompts[-1] and "message 5 " not in client.prompts[-1]
+assert compactor.summaries["s1"].covered == 8 and compactor.summaries["s1"].text == "summary of 2"
+print('✓ Summaries are extended with only the newly aged-out messages')
+
+# Positions survive the history cap dropping the oldest messages
+capped = make_history(12, max_messages=8)
+assert capped.dropped == 4
+summary, recent = asyncio.run(compact_and_wait(compactor, "s2", capped))
+assert compactor.summaries["s2"].covered == 8  # 4 dropped + 4 aged out of the 8 kept
+summary, recent = compactor.compact("s2", capped)
+assert summary is not None and [turn.content.split()[1] for turn in recent] == ["8", "9", "10", "11"]
+print('✓ Summary positions account for messages dropped by the history cap')
+
+# A reset history invalidates the cached summary
+restarted = make_history(3)
+summary, recent = asyncio.run(compact_and_wait(compactor, "s2", restarted))
+assert summary is None and len(recent) == 3 and "s2" not in compactor.summaries
+print('✓ A summary that covers more than the history is discarded')
+
+# Failed summary calls keep the history verbatim and are counted
+client.fail = True
+summary, recent = asyncio.run(compact_and_wait(compactor, "s3", make_history(10)))
+assert summary is None and len(recent) == 10 and "s3" not in compactor.summaries
+assert compactor.stats["summary_failures"] == 1
+print('✓ Summary failures never drop messages')
+
+# Without a running loop nothing is scheduled; clear() drops the summary
+assert compactor.compact("s4", long) == (None, long) and "s4" not in compactor._pending
+compactor.clear("s1")
+assert "s1" not in compactor.summaries
+stats = compactor.get_stats()
+assert stats["cached_summaries"] == 0 and stats["pending_updates"] == 0 and stats["summaries_built"] == 3
+print('✓ Sync callers skip scheduling and clear() drops the cached summary')
+
+print('\n✓ All tests passed!')
@@ -0,0 +1,101 @@
+"""Test KB retrieval: prompt splitting, BM25 ranking, history/category blending and the saved index"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["KB_RETRIEVAL_TOP_K"] = "2"
+
+from services.kb_index import (CORE_KB_NOTE, INDEX_PATH, PROMPT_PATH, KBIndex, KBRetriever,
+                               prompt_hash, split_prompt, tokenize)
+
+PROMPT = """You are AceBuddy.
+
+COMPLETE KB KNOWLEDGE - TOP 30 ISSUES
+
+**QuickBooks Error -6177:**
+1. Open the company file folder
+2. Rename the .ND file and reopen QuickBooks
+
+**Printer Not Showing:**
+Enable printer redirection in the RDP client and reconnect.
+
+**Password Reset:**
+Reset the password from the SelfCare portal.
+
+**Password Reset:**
+If SelfCare is not set up, contact support to reset the password.
+
+**Support Contacts:**
+Phone 1-888-415-5240
+
+CRITICAL RULES:
+- Never invent steps.
+"""
+
+assert tokenize("QuickBooks Error -6177!") == ["quickbooks", "error", "6177"]
+
+# The KB block is split into articles; everything else (and the contacts) stays in the core prompt
+core, articles = split_prompt(PROMPT)
+assert [a.article_id for a in articles] == ["quickbooks-error-6177", "printer-not-showing",
+                                           "password-reset", "password-reset-2"]
+assert articles[0].body.startswith("1. Open the company file folder")
+assert core.startswith("You are AceBuddy.") and CORE_KB_NOTE in core
+assert "1-888-415-5240" in core and "Never invent steps." in core
+assert "Rename the .ND file" not in core
+assert split_prompt("No KB here") == ("No KB here", [])
+print('✓ The prompt is split into core rules and addressable KB articles')
+
+# BM25 ranks the matching article first and drops articles with no overlap
+index = KBIndex.build(articles, prompt_hash(PROMPT))
+ranked = index.search([("quickbooks error 6177 again", 1.0)], top_k=4)
+assert ranked[0][0].article_id == "quickbooks-error-6177" and len(ranked) == 1
+assert index.search([("completely unrelated words", 1.0)]) == []
+ranked = index.search([("reset my password", 1.0)], top_k=4)
+assert {a.article_id for a, _ in ranked[:2]} == {"password-reset", "password-reset-2"}
+print('✓ BM25 ranks relevant articles first and returns nothing for unrelated queries')
+
+# Saved indexes round-trip (weights are stored sparse and rounded)
+path = os.path.join(tempfile.mkdtemp(), "kb_index.json")
+index.save(path)
+loaded = KBIndex.load(path)
+assert loaded.source_hash == index.source_hash and loaded.vocabulary == index.vocabulary
+assert [a for a, _ in loaded.search([("printer redirection", 1.0)])] == [a for a, _ in index.search([("printer redirection", 1.0)])]
+assert abs(float((loaded.weights - index.weights).max())) < 1e-4
+print('✓ The index survives a save/load round trip')
+
+# The retriever blends recent user turns and the router category into the query
+prompt_path = os.path.join(tempfile.mkdtemp(), "prompt.txt")
+with open(prompt_path, "w", encoding="utf-8") as f:
+    f.write(PROMPT)
+retriever = KBRetriever(prompt_path=prompt_path, index_path=path)
+assert retriever.enabled and retriever.core_prompt == core
+history = [{"role": "user", "content": "QuickBooks shows error 6177"},
+           {"role": "assistant", "content": "Let's fix that. Open the company file folder."}]
+assert [a.article_id for a in retriever.retrieve("done", history)] == ["quickbooks-error-6177"]
+assert [a.article_id for a in retriever.retrieve("it still fails", category="printing")] == ["printer-not-showing"]
+context = retriever.build_context("printer missing")
+assert context.startswith("RELEVANT KB ARTICLES:") and "**Printer Not Showing:**" in context
+assert retriever.build_context("hello there") is None
+assert retriever.stats["empty_retrievals"] == 1 and retriever.get_stats()["articles_indexed"] == 4
+print('✓ Short follow-ups retrieve the article from earlier user turns and the category')
+
+# A stale saved index is rebuilt in memory; a prompt without a KB block disables retrieval
+with open(prompt_path, "a", encoding="utf-8") as f:
+    f.write("- Be concise.\n")
+stale = KBRetriever(prompt_path=prompt_path, index_path=path)
+assert stale.enabled and stale.index.source_hash != index.source_hash
+with open(prompt_path, "w", encoding="utf-8") as f:
+    f.write("You are AceBuddy.")
+disabled = KBRetriever(prompt_path=prompt_path, index_path=path)
+assert not disabled.enabled and disabled.retrieve("printer") == [] and disabled.core_prompt is None
+print('✓ Stale indexes are rebuilt and a prompt without KB articles falls back to the full prompt')
+
+# The committed index matches the shipped prompt (rebuild with build_kb_index.py)
+with open(PROMPT_PATH, "r", encoding="utf-8") as f:
+    assert KBIndex.load(INDEX_PATH).source_hash == prompt_hash(f.read())
+print('✓ config/prompts/kb_index.json is up to date with the expert prompt')
+
+print('\n✓ All tests passed!')
@@ -0,0 +1,71 @@
+"""Test the shared LLM concurrency limiter: cap, waiting count, peak and release on errors"""
+
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.llm_client import LLMConcurrencyLimiter, get_api_key
+
+
+async def call(limiter, delay, fail=False):
+    async with limiter:
+        await asyncio.sleep(delay)
+        if fail:
+            raise ConnectionError("upstream reset")
+
+
+async def burst(limiter):
+    tasks = [asyncio.create_task(call(limiter, 0.05)) for _ in range(5)]
+    await asyncio.sleep(0.01)
+    during = limiter.get_stats()
+    await asyncio.gather(*tasks)
+    return during
+
+limiter = LLMConcurrencyLimiter(2)
+during = asyncio.run(burst(limiter))
+assert during["in_flight"] == 2 and during["waiting"] == 3
+stats = limiter.get_stats()
+assert stats == {"max_concurrency": 2, "in_flight": 0, "waiting": 0, "peak_in_flight": 2}
+print('✓ At most max_concurrency calls run at once; the rest wait for a slot')
+
+
+async def failing(limiter):
+    try:
+        await call(limiter, 0, fail=True)
+    except ConnectionError:
+        pass
+    # The slot was released - another call gets through immediately
+    await asyncio.wait_for(call(limiter, 0), timeout=1)
+
+limiter = LLMConcurrencyLimiter(1)
+asyncio.run(failing(limiter))
+assert limiter.in_flight == 0
+print('✓ A failed call releases its slot')
+
+
+async def cancelled(limiter):
+    holder = asyncio.create_task(call(limiter, 1.0))
+    waiter = asyncio.create_task(call(limiter, 0))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    await asyncio.sleep(0)
+    holder.cancel()
+    await asyncio.gather(holder, waiter, return_exceptions=True)
+
+limiter = LLMConcurrencyLimiter(1)
+asyncio.run(cancelled(limiter))
+assert limiter.in_flight == 0 and limiter.waiting == 0
+print('✓ Cancelled callers neither hold a slot nor stay counted as waiting')
+
+assert LLMConcurrencyLimiter(0).max_concurrency == 1
+os.environ.pop("OPENROUTER_API_KEY", None)
+try:
+    get_api_key()
+    assert False, "missing key should raise"
+except ValueError:
+    pass
+print('✓ Concurrency is at least 1 and a missing API key is reported')
+
+print('\n✓ All tests passed!')
@@ -0,0 +1,61 @@
+"""Test the queue-backed JSON log pipeline: request context, lazy args, sampling, bounded queue"""
+
+import io
+import os
+import sys
+import json
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["LOG_FORMAT"] = "json"
+os.environ["LOG_SAMPLING"] = "chatty=0,bad-entry"
+
+from services.log_pipeline import LogPipeline, SamplingFilter, parse_sampling
+from services.tracing import bind_session, request_id_var
+
+assert parse_sampling("a.b=0.1, c=2,oops") == ({"a.b": 0.1, "c": 1.0}, ["oops"])
+sampler = SamplingFilter({"services": 0.0})
+assert sampler.rate_for("services.handler_registry") == 0.0 and sampler.rate_for("llm_chatbot") is None
+print('✓ Sampling rates parse and apply to child loggers')
+
+output = io.StringIO()
+pipeline = LogPipeline()
+pipeline.configure(stream=output)
+logger = logging.getLogger("llm_chatbot")
+
+request_id_var.set("req-1")
+bind_session("session-1")
+payload = {"visitor": {"email": "a@example.com"}}
+logger.info("[SalesIQ] Full request payload: %s", payload)
+payload["visitor"]["email"] = "changed@example.com"  # Rendered when logged, not when written
+logger.debug("[SalesIQ] not emitted: %s", payload)
+for _ in range(5):
+    logging.getLogger("chatty.handler").info("noisy")
+logging.getLogger("chatty").warning("kept")
+try:
+    1 / 0
+except ZeroDivisionError:
+    logger.exception("[SalesIQ] Handler failed")
+pipeline.stop()
+
+records = [json.loads(line) for line in output.getvalue().splitlines()]
+messages = [record["msg"] for record in records]
+first = records[messages.index("[SalesIQ] Full request payload: {'visitor': {'email': 'a@example.com'}}")]
+assert first["request_id"] == "req-1" and first["session_id"] == "session-1"
+assert first["logger"] == "llm_chatbot" and first["level"] == "INFO"
+assert not any("not emitted" in m for m in messages)
+print('✓ Records are JSON lines with request/session IDs, rendered when logged')
+
+assert "noisy" not in messages and "kept" in messages and pipeline.sampling.sampled_out == 5
+assert "Ignoring invalid LOG_SAMPLING entries: ['bad-entry']" in "\n".join(messages)
+failure = next(record for record in records if record["msg"] == "[SalesIQ] Handler failed")
+assert "ZeroDivisionError" in failure["exc"]
+print('✓ Chatty loggers are sampled, warnings kept, tracebacks included')
+
+pipeline.handler.max_size = 0
+logger.info("dropped")
+assert pipeline.handler.dropped == 1
+print('✓ A full queue drops records instead of blocking')
+
+print('\n✓ All tests passed!')
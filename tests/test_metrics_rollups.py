@@ -0,0 +1,44 @@
+"""Test MetricsCollector keeps O(1) totals and rolling 1h/24h windows"""
+
+import os
+import sys
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.metrics import MetricsCollector, RollupRing
+
+metrics = MetricsCollector()
+metrics.start_conversation("s1", "printing", router_matched=True)
+metrics.start_conversation("s2", "quickbooks")
+metrics.record_message("s1", is_llm_call=True, tokens_used=300)
+metrics.conversations["s1"].started_at -= timedelta(seconds=90)
+metrics.end_conversation("s1", "resolved")
+metrics.end_conversation("s1", "abandoned")
+
+summary = metrics.get_summary()
+assert summary["overview"]["active_conversations"] == 1
+assert summary["overview"]["scope"] == "worker" and summary["overview"]["worker_pid"] == os.getpid()
+assert summary["resolution"]["resolved"] == 1 and summary["resolution"]["abandoned"] == 0
+assert 89 < summary["performance"]["avg_resolution_time_seconds"] < 92
+assert "s1" not in metrics.conversations
+print('✓ Ended conversations are folded into totals and dropped')
+
+for key in ("last_1h", "last_24h"):
+    window = summary["windows"][key]
+    assert window["started_conversations"] == 2 and window["resolved"] == 1, key
+    assert window["llm_tokens"] == 300 and window["categories"] == {"printing": 1, "quickbooks": 1}
+    assert window["automation_rate"] == 100.0
+print('✓ Rolling windows include this minute/hour')
+
+ring = RollupRing(60, 60)
+now = 1_700_000_000.0
+ring.current(now - 3 * 3600).started += 5
+assert ring.window(now, 3600).started == 0
+ring.current(now - 59 * 60).started += 2
+ring.current(now).started += 1  # Same slot as three hours ago - recycled
+assert ring.window(now, 3600).started == 3
+assert len(ring.buckets) == 60
+print('✓ Old buckets age out of the window and their slots are recycled')
+
+print('\n✓ All tests passed!')
@@ -0,0 +1,112 @@
+"""Test the outbox dedupes on idempotency keys, retries failures and survives restarts"""
+
+import os
+import sys
+import asyncio
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.outbox as outbox_module
+from services.outbox import Outbox
+from services.tracing import NOOP_SPAN, request_id_var, tracer
+
+outbox_module.RETRY_BASE_DELAY = 0  # Retry immediately in tests
+outbox_module.POLL_INTERVAL_SECONDS = 0.05
+
+calls = []
+
+
+async def flaky_transfer(visitor_id, attempts_before_success=0):
+    calls.append(visitor_id)
+    if calls.count(visitor_id) <= attempts_before_success:
+        return {"success": False, "error": "http_error", "status_code": 503}
+    return {"success": True, "visitor_id": visitor_id}
+
+
+async def rejected_ticket(**kwargs):
+    return {"success": False, "error": "http_error", "status_code": 422}
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "outbox.db")
+
+        box = Outbox(db_path)
+        box.register("salesiq.transfer", flaky_transfer)
+        box.register("desk.support_ticket", rejected_ticket)
+
+        assert box.enqueue("salesiq.transfer", {"visitor_id": "v1", "attempts_before_success": 2}, "transfer:v1") is not None
+        assert box.enqueue("salesiq.transfer", {"visitor_id": "v1"}, "transfer:v1") is None
+        box.enqueue("desk.support_ticket", {"user_name": "pending"}, "ticket:v2")
+        print('✓ Duplicate idempotency key ignored')
+
+        # Jobs persist before the worker runs - a fresh instance sees them
+        restarted = Outbox(db_path)
+        assert restarted.get_stats()["queue_depth"] == 2
+        print('✓ Queued jobs survive a restart')
+
+        failures = []
+        box.start(on_failure=failures.append)
+        for _ in range(100):
+            if box.get_stats()["queue_depth"] == 0:
+                break
+            await asyncio.sleep(0.05)
+        await box.stop()
+
+        stats = box.get_stats()
+        assert calls == ["v1", "v1", "v1"], calls
+        assert stats["jobs_by_status"] == {"done": 1, "failed": 1}, stats
+        assert stats["counters"]["retried"] == 2
+        assert stats["recent_failures"][0]["job_type"] == "desk.support_ticket"
+        assert stats["recent_failures"][0]["attempts"] == 1
+        print('✓ Retryable failures retried, non-retryable failures recorded')
+
+        assert len(failures) == 1 and failures[0]["job_type"] == "desk.support_ticket"
+        assert failures[0]["payload"] == {"user_name": "pending"} and failures[0]["attempts"] == 1
+        print('✓ Permanent failures reach the on_failure callback')
+
+        # A failed job does not block its key - the visitor's retry is queued again
+        assert box.enqueue("desk.support_ticket", {"user_name": "retry"}, "ticket:v2") is not None
+        assert box.enqueue("salesiq.transfer", {"visitor_id": "v1"}, "transfer:v1") is None
+        assert box.get_stats()["jobs_by_status"] == {"done": 1, "pending": 1}
+        print('✓ Failed jobs can be retried with the same idempotency key')
+
+        # Jobs run in a trace keyed by the request that queued them, so their Zoho spans are kept
+        traced = []
+
+        async def traced_close(session_id):
+            with tracer.span("zoho.request", service="SalesIQ") as span:
+                traced.append((tracer.current(), span))
+            return {"success": True}
+
+        box.register("salesiq.close_chat", traced_close)
+        request_id_var.set("00000000-0000-0000-0000-00000000beef")
+        box.enqueue("salesiq.close_chat", {"session_id": "s1"}, "close:s1")
+        request_id_var.set("no-request-id")
+        box.start()
+        for _ in range(100):
+            if traced:
+                break
+            await asyncio.sleep(0.05)
+        await box.stop()
+        trace, span = traced[0]
+        assert span is not NOOP_SPAN and trace.endpoint == "outbox salesiq.close_chat"
+        assert trace.request_id == "00000000-0000-0000-0000-00000000beef" and trace.duration_ms is not None
+        assert [s.name for s in trace.spans] == ["zoho.request"]
+        print('✓ Outbox jobs are traced under the originating request ID')
+
+        # Outbox files created before request IDs were stored are migrated on open
+        legacy_path = os.path.join(tmp, "legacy.db")
+        legacy = sqlite3.connect(legacy_path)
+        legacy.executescript(outbox_module.SCHEMA.replace(",\n    request_id TEXT", ""))
+        legacy.close()
+        migrated = Outbox(legacy_path)
+        migrated.register("salesiq.close_chat", traced_close)
+        assert migrated.enqueue("salesiq.close_chat", {"session_id": "s2"}, "close:s2") is not None
+        print('✓ Older outbox files gain the request_id column')
+
+
+asyncio.run(main())
+print('\n✓ All tests passed!')
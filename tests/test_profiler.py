@@ -0,0 +1,85 @@
+"""Test the on-demand profiler: token guard, collapsed thread/task stacks, cProfile replay"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["PROFILER_TOKEN"] = "secret"
+os.environ["PROFILER_SAMPLE_HZ"] = "200"
+
+from services.profiler import Profiler, ProfilerBusy
+
+profiler = Profiler()
+assert profiler.authorize("secret")
+assert not profiler.authorize("wrong") and not profiler.authorize(None)
+print('✓ Profiles need the configured token')
+
+
+def spin_cpu(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+async def wait_for_zoho():
+    await asyncio.sleep(5)
+
+
+async def handle_turn():
+    await wait_for_zoho()
+
+
+async def sampling_run():
+    stop = threading.Event()
+    worker = threading.Thread(target=spin_cpu, args=(stop,), name="busy-worker")
+    worker.start()
+    turn = asyncio.create_task(handle_turn())
+    try:
+        collapsed = await profiler.sample(0.3)
+    finally:
+        stop.set()
+        worker.join()
+        turn.cancel()
+    return collapsed
+
+collapsed = asyncio.run(sampling_run())
+lines = collapsed.splitlines()
+assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+thread_lines = [line for line in lines if line.startswith("thread:busy-worker;")]
+assert thread_lines and "spin_cpu (test_profiler.py:" in thread_lines[0]
+task_lines = [line for line in lines if line.startswith("task:handle_turn")]
+assert task_lines and ";wait_for_zoho (test_profiler.py:" in task_lines[0]
+assert not any("profiler-sampler" in line for line in lines)
+print('✓ Sampling collapses thread stacks and asyncio await chains')
+
+
+def parse_tickets(count: int) -> int:
+    return sum(int(str(n)) for n in range(count))
+
+
+async def replayed_turn():
+    await asyncio.sleep(0)
+    return parse_tickets(20_000)
+
+
+async def cprofile_run():
+    blocker = asyncio.create_task(profiler.sample(0.2))
+    await asyncio.sleep(0.01)
+    try:
+        await profiler.profile_call(replayed_turn)
+        raise AssertionError("profile ran concurrently")
+    except ProfilerBusy:
+        pass
+    await blocker
+    return await profiler.profile_call(replayed_turn, sort="tottime", limit=10)
+
+result, report = asyncio.run(cprofile_run())
+assert result == sum(range(20_000))
+assert "parse_tickets" in report and "tottime" in report
+assert profiler.get_stats()["cprofile_runs"] == 1 and profiler.get_stats()["sampling_runs"] == 2
+print('✓ cProfile replay returns per-function totals, one profile at a time')
+
+print('\n✓ All tests passed!')
@@ -0,0 +1,50 @@
+"""Test the Prometheus exposition: cumulative histogram buckets, counters, gauges"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.prometheus_exporter import Histogram, PrometheusExporter
+
+histogram = Histogram("demo_seconds", "Demo latency", ("stage",), buckets=(0.1, 1.0))
+for value in (0.05, 0.1, 0.5, 3.0):
+    histogram.observe(value, "router")
+lines = histogram.render()
+assert 'demo_seconds_bucket{stage="router",le="0.1"} 2' in lines  # le is inclusive
+assert 'demo_seconds_bucket{stage="router",le="1.0"} 3' in lines
+assert 'demo_seconds_bucket{stage="router",le="+Inf"} 4' in lines
+assert 'demo_seconds_count{stage="router"} 4' in lines
+assert 'demo_seconds_sum{stage="router"} 3.65' in lines
+print('✓ Histogram buckets are cumulative with +Inf, sum and count')
+
+exporter = PrometheusExporter()
+exporter.observe_request("webhook", 0.2)
+with exporter.time_stage("handlers"):
+    pass
+exporter.record_llm_call("gemini-2.0-flash", "generator", "printing", 120, 100, 30, 0.25)
+exporter.record_llm_call("gemini-2.0-flash", "generator", "printing", 120, 100, 30, 0.25)
+exporter.record_llm_call("gemini-2.0-flash", "classifier", None)
+exporter.register_gauge("demo_live_sessions", "Live sessions", lambda: 7)
+exporter.register_gauge("demo_jobs", "Jobs by status", lambda: {("pending",): 2, ("failed",): 1}, ("status",))
+exporter.register_gauge("demo_broken", "Raises at scrape time", lambda: 1 / 0)
+
+text = exporter.render()
+assert text.endswith("\n")
+assert 'chatbot_request_duration_seconds_count{endpoint="webhook"} 1' in text
+assert 'chatbot_stage_duration_seconds_bucket{stage="handlers",le="0.001"} 1' in text
+assert ('chatbot_llm_calls_total{model="gemini-2.0-flash",kind="generator",category="printing"} 2'
+        in text)
+assert ('chatbot_llm_tokens_total{model="gemini-2.0-flash",kind="generator",category="printing",'
+        'direction="input"} 240' in text)
+assert 'direction="cached_input"} 200' in text and 'direction="output"} 60' in text
+assert 'chatbot_llm_cost_usd_total{model="gemini-2.0-flash",kind="generator",category="printing"} 0.5' in text
+assert 'chatbot_llm_calls_total{model="gemini-2.0-flash",kind="classifier",category="none"} 1' in text
+print('✓ Request/stage histograms and LLM call/token/cost counters are rendered')
+
+assert "# TYPE demo_live_sessions gauge\ndemo_live_sessions 7\n" in text
+assert 'demo_jobs{status="failed"} 1' in text and 'demo_jobs{status="pending"} 2' in text
+assert "demo_broken" not in text
+print('✓ Gauges are read at scrape time and a failing callback is skipped')
+
+print('\n✓ All tests passed!')
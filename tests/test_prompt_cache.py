@@ -0,0 +1,51 @@
+"""Test the generator's cacheable prompt prefix: identical across turns, per-turn context after it"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.gemini_generator import CATEGORY_HINTS, GeminiResponseGenerator
+
+SYSTEM_PROMPT = "You are AceBuddy. " * 50
+HISTORY = [{"role": "user", "content": "QuickBooks froze"}, {"role": "assistant", "content": "Which version?"}]
+
+
+def build(cache_enabled, message, category="other", kb_context=None):
+    generator = SimpleNamespace(prompt_cache_enabled=cache_enabled)
+    return GeminiResponseGenerator._build_messages(generator, message, HISTORY, SYSTEM_PROMPT, category,
+                                                   "prompt-cache-1", kb_context)
+
+
+# With caching, the expert prompt is its own system message with a cache_control block
+first = build(True, "It says error 6177", "quickbooks", "RELEVANT KB ARTICLES: QuickBooks -6177")
+prefix = first[0]
+assert prefix["role"] == "system" and prefix["content"] == [
+    {"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}
+]
+assert first[1] == {"role": "system", "content": "RELEVANT KB ARTICLES: QuickBooks -6177"}
+assert first[2] == {"role": "system", "content": f"[CATEGORY: QUICKBOOKS] {CATEGORY_HINTS['quickbooks']}"}
+assert [m["content"] for m in first[3:]] == ["QuickBooks froze", "Which version?", "It says error 6177"]
+print('✓ The expert prompt is sent as a cache_control prefix ahead of per-turn context')
+
+# The cached prefix does not change with the category, KB articles or message
+second = build(True, "My printer is missing", "printing", "RELEVANT KB ARTICLES: Printer")
+assert second[0] == prefix and second[1:3] != first[1:3]
+plain_turn = build(True, "hello")
+assert plain_turn[0] == prefix and [m["role"] for m in plain_turn] == ["system", "user", "assistant", "user"]
+print('✓ The prefix is identical across turns and categories')
+
+# Without caching everything is folded into one plain system message
+uncached = build(False, "It says error 6177", "quickbooks", "RELEVANT KB ARTICLES: QuickBooks -6177")
+assert uncached[0]["content"] == (f"{SYSTEM_PROMPT}\n\nRELEVANT KB ARTICLES: QuickBooks -6177\n\n"
+                                  f"[CATEGORY: QUICKBOOKS] {CATEGORY_HINTS['quickbooks']}")
+assert len(uncached) == 4
+print('✓ GEMINI_PROMPT_CACHE=false sends a single combined system message')
+
+# Token estimates read the text out of the structured prefix
+assert GeminiResponseGenerator._estimate_tokens(None, first) == (len(SYSTEM_PROMPT) + len("It says error 6177")) // 4
+assert GeminiResponseGenerator._estimate_tokens(None, uncached) == (len(uncached[0]["content"]) + len("It says error 6177")) // 4
+print('✓ Token estimates work for both prompt layouts')
+
+print('\n✓ All tests passed!')
@@ -0,0 +1,86 @@
+"""Test streamed generation: deltas, interrupted streams, and cleanup when the consumer stops early"""
+
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.gemini_generator import FALLBACK_RESPONSE, ResponseStream
+from services.llm_client import llm_limiter
+from services.token_budget import token_budget
+
+
+def chunk(text=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=text))] if text is not None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class FakeUpstream:
+    """Async iterator of chunks; raises after `fail_after` chunks, sleeps `delay` between them"""
+
+    def __init__(self, chunks, fail_after=None, delay=0.0):
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.delay = delay
+
+    async def __aiter__(self):
+        for n, item in enumerate(self.chunks):
+            if n == self.fail_after:
+                raise ConnectionError("upstream reset")
+            await asyncio.sleep(self.delay)
+            yield item
+
+
+def make_stream(upstream, session_id):
+    async def create(**kwargs):
+        return upstream
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    generator = SimpleNamespace(async_client=client, model_name="test/model", _estimate_tokens=lambda messages: 50)
+    return ResponseStream(generator, [{"role": "user", "content": "hi"}], 0.3, 100, session_id, "other")
+
+
+async def collect(stream):
+    return [delta async for delta in stream]
+
+
+usage = SimpleNamespace(prompt_tokens=30, completion_tokens=12, prompt_tokens_details=None)
+chunks = [chunk("Restart "), chunk("QuickBooks."), chunk(usage=usage)]
+
+stream = make_stream(FakeUpstream(chunks), "stream-1")
+assert asyncio.run(collect(stream)) == ["Restart ", "QuickBooks."]
+assert stream.text == "Restart QuickBooks." and stream.tokens_used == 42
+assert not stream.failed and not stream.interrupted
+assert token_budget.used("stream-1") == 42 and llm_limiter.in_flight == 0
+print('✓ Deltas are yielded and usage recorded when the stream completes')
+
+stream = make_stream(FakeUpstream(chunks, fail_after=1), "stream-2")
+assert asyncio.run(collect(stream)) == ["Restart "]
+assert stream.failed and stream.interrupted and stream.text == "Restart"
+assert llm_limiter.in_flight == 0
+print('✓ A stream that breaks after some text is marked interrupted with the partial text')
+
+stream = make_stream(FakeUpstream(chunks, fail_after=0), "stream-3")
+assert asyncio.run(collect(stream)) == [FALLBACK_RESPONSE]
+assert stream.failed and not stream.interrupted
+print('✓ A stream that fails before any text yields the fallback reply')
+
+
+async def cancelled_consumer():
+    stream = make_stream(FakeUpstream(chunks, delay=0.05), "stream-4")
+    task = asyncio.create_task(collect(stream))
+    await asyncio.sleep(0.07)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return stream
+
+stream = asyncio.run(cancelled_consumer())
+assert stream.text == "Restart" and stream.tokens_used == 50  # No usage chunk yet - estimated
+assert token_budget.used("stream-4") == 50 and llm_limiter.in_flight == 0
+print('✓ Cancelling the consumer releases the LLM slot and still records usage')
+
+print('\n✓ All tests passed!')
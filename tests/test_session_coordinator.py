@@ -0,0 +1,123 @@
+"""Test per-session locks serialize turns, clean up, and that retries hit the reply cache"""
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.deadline import DeadlineExceeded, deadline_tracker
+from services.session_coordinator import ReplyCache, SessionLockMap
+from services.session_store import SQLiteBackend
+
+locks = SessionLockMap()
+events = []
+
+
+async def turn(session_id, name):
+    async with locks.hold(session_id):
+        events.append(f"{name}:start")
+        await asyncio.sleep(0.01)
+        events.append(f"{name}:end")
+
+
+async def main():
+    await asyncio.gather(turn("s1", "a"), turn("s1", "b"), turn("s2", "c"))
+    # Same session never interleaves; the other session runs alongside
+    assert events.index("a:end") < events.index("b:start"), events
+    assert events.index("c:start") < events.index("a:end"), events
+    assert locks.get_stats()["active_sessions"] == 0
+    assert locks.get_stats()["contended"] == 1
+    print('✓ Turns for one session are serialized and locks are released')
+
+
+asyncio.run(main())
+
+cache = ReplyCache()
+cache.enabled = True
+fingerprint = cache.fingerprint(1700000000000, "my server is down")
+assert fingerprint == cache.fingerprint(1700000000000, "my server is down")
+assert fingerprint != cache.fingerprint(1700000001000, "my server is down")
+assert cache.get("s1", fingerprint) is None
+cache.store("s1", fingerprint, b'{"action": "reply"}')
+assert cache.get("s1", fingerprint) == b'{"action": "reply"}'
+assert cache.get("s2", fingerprint) is None
+cache.ttl = -1
+assert cache.get("s1", fingerprint) is None
+print('✓ Redelivered message returns the cached reply until it expires')
+
+# Without a delivery ID/time, repeating the same text is a new turn
+cache.ttl = 120
+assert cache.fingerprint(None, "yes") is None and cache.fingerprint("", "yes") is None
+cache.store("s1", None, b'{"action": "reply"}')
+assert cache.get("s1", None) is None and cache.stats["stored"] == 1
+print('✓ Messages without a delivery ID are never de-duplicated')
+
+# Two workers sharing a SQLite store: leases serialize the session across processes
+with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, "sessions.db")
+    worker_a = SessionLockMap(SQLiteBackend(path))
+    worker_b = SessionLockMap(SQLiteBackend(path))
+    shared_events = []
+
+    async def worker_turn(locks, name):
+        async with locks.hold("s1"):
+            shared_events.append(f"{name}:start")
+            await asyncio.sleep(0.1)
+            shared_events.append(f"{name}:end")
+
+    async def cross_worker():
+        await asyncio.gather(worker_turn(worker_a, "a"), worker_turn(worker_b, "b"))
+
+    asyncio.run(cross_worker())
+    first, second = shared_events[0][0], shared_events[2][0]
+    assert shared_events == [f"{first}:start", f"{first}:end", f"{second}:start", f"{second}:end"], shared_events
+    assert worker_a.stats["lease_waits"] + worker_b.stats["lease_waits"] == 1
+    print('✓ Session leases serialize turns across workers')
+
+    # A lease left by a crashed worker expires
+    backend = SQLiteBackend(path)
+    assert backend.acquire_lease("session:s2", "crashed", ttl=0.05)
+    assert not backend.acquire_lease("session:s2", "other", ttl=1)
+    time.sleep(0.06)
+    assert backend.acquire_lease("session:s2", "other", ttl=1)
+    backend.release_lease("session:s2", "crashed")  # Not the owner any more - no effect
+    assert not backend.acquire_lease("session:s2", "third", ttl=1)
+    print('✓ Expired leases can be taken over, and only the owner releases')
+
+    # Waiting for a dead worker's lease gives up when the request's deadline runs out
+    assert backend.acquire_lease("session:s3", "crashed", ttl=60)
+    deadline_tracker.budgets["webhook"] = 0.2
+
+    async def stuck_turn():
+        with deadline_tracker.start("webhook"):
+            async with worker_b.hold("s3"):
+                raise AssertionError("lease should not be acquired")
+
+    started = time.monotonic()
+    try:
+        asyncio.run(stuck_turn())
+        raise AssertionError("DeadlineExceeded expected")
+    except DeadlineExceeded as e:
+        assert e.stage == "session_lock"
+    assert 0.2 <= time.monotonic() - started < 1.0
+    assert worker_b.stats["lease_timeouts"] == 1 and not worker_b.is_active("s3")
+    assert deadline_tracker.misses_by_stage["session_lock"] == 1
+    print('✓ Lease waits are bounded by the request deadline')
+
+    # A retry delivered to the other worker gets the reply the first one cached
+    cache_a = ReplyCache(SQLiteBackend(path))
+    cache_b = ReplyCache(SQLiteBackend(path))
+    cache_a.enabled = cache_b.enabled = True
+    fingerprint = cache_a.fingerprint("msg-1", "my server is down")
+    cache_a.store("s1", fingerprint, b'{"action": "reply"}')
+    assert cache_b.get("s1", fingerprint) == b'{"action": "reply"}'
+    cache_b.ttl = 0.05
+    cache_b.store("s1", "other", b'{}')
+    time.sleep(0.06)
+    assert cache_a.get("s1", "other") is None
+    print('✓ Reply cache is shared between workers and entries expire')
+
+print('\n✓ All tests passed!')
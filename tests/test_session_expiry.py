@@ -0,0 +1,56 @@
+"""Test idle sessions expire in deadline order and are torn down once"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.session_store import SessionStore
+from services.session_expiry import SessionExpiry
+from services.metrics import MetricsCollector
+
+torn_down = []
+busy = set()
+expiry = SessionExpiry(SessionStore())
+expiry.idle_timeout = 60
+expiry._teardown = torn_down.append
+expiry._is_busy = lambda session_id: session_id in busy
+
+now = time.time()
+for session_id in ("s1", "s2", "s3"):
+    expiry.touch(session_id)
+expiry.touch("unknown")
+assert expiry.get_stats()["scheduled_sessions"] == 3
+
+assert expiry.expire_due(now + 30) == 0
+print('✓ Nothing expires before the idle timeout')
+
+# s2 is active again just before its deadline, s3 has a turn in flight
+expiry.last_activity["s2"] = now + 50
+busy.add("s3")
+assert expiry.expire_due(now + 61) == 1
+assert torn_down == ["s1"] and "s1" not in expiry.last_activity
+assert expiry.stats["rescheduled"] == 1 and expiry.stats["deferred_busy"] == 1
+print('✓ Idle session torn down; active one rescheduled; busy one deferred')
+
+busy.clear()
+assert expiry.expire_due(now + 61 + expiry.check_interval) == 1
+assert expiry.expire_due(now + 111) == 1
+assert torn_down == ["s1", "s3", "s2"]
+assert expiry.get_stats()["scheduled_sessions"] == 0 and not expiry._heap
+print('✓ Deferred and rescheduled sessions expire at their new deadlines')
+
+expiry.schedule_existing(["r1", "r2"])
+assert expiry.expire_due(time.time() + 61) == 2
+print('✓ Sessions restored after a restart get a full idle window')
+
+metrics = MetricsCollector()
+metrics.start_conversation("m1", "printing")
+metrics.end_conversation("m1", "resolved")
+metrics.end_conversation("m1", "abandoned")
+assert metrics.resolution_counts == {"resolved": 1}
+assert "m1" not in metrics.conversations
+print('✓ Expiring an ended conversation does not count it again')
+
+print('\n✓ All tests passed!')
@@ -0,0 +1,82 @@
+"""Test in-memory sessions survive a restart through the write-behind log and snapshot"""
+
+import os
+import sys
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.session_store import Codec, SessionStore, JSON_CODEC
+from services.session_persistence import SessionPersistence, compact, list_segments, segment_name
+from services.state_manager import ConversationSession, ConversationState
+
+
+def build(directory):
+    store = SessionStore()
+    conversations = store.mapping("conversations", JSON_CODEC)
+    sessions = store.mapping("state_sessions", Codec(ConversationSession.to_dict, ConversationSession.from_dict))
+    persistence = SessionPersistence(store, directory)
+    persistence.enabled = True
+    return persistence, conversations, sessions
+
+
+async def flush(persistence):
+    persistence._write_lock = asyncio.Lock()
+    await persistence.flush()
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    persistence, conversations, sessions = build(tmp)
+    persistence.rehydrate()
+    conversations["s1"] = [{"role": "user", "content": "my server is slow"}]
+    sessions["s1"] = ConversationSession("s1", state=ConversationState.TROUBLESHOOTING, category="performance")
+    conversations["s2"] = [{"role": "user", "content": "printer offline"}]
+    persistence.mark_dirty("s1")
+    persistence.mark_dirty("s2")
+    asyncio.run(flush(persistence))
+    assert not persistence.dirty
+
+    # s2 is reset and s1 gets another turn in a later flush - the last line wins
+    del conversations["s2"]
+    conversations["s1"].append({"role": "assistant", "content": "Let's check disk space."})
+    persistence.mark_dirty("s1")
+    persistence.mark_dirty("s2")
+    asyncio.run(flush(persistence))
+
+    restored, restored_conversations, restored_sessions = build(tmp)
+    assert restored.rehydrate() == 1
+    assert restored_conversations == {}
+    print('✓ Restart only indexes saved sessions')
+
+    restored.ensure_loaded("s1")
+    assert len(restored_conversations["s1"]) == 2
+    assert restored_sessions["s1"].state == ConversationState.TROUBLESHOOTING
+    assert "s2" not in restored_conversations
+    print('✓ Sessions decode on first use; latest line wins and deleted sessions stay deleted')
+
+    # New process appends to a fresh segment, then everything is compacted into the snapshot
+    assert restored.segment == 2
+    restored_conversations["s3"] = [{"role": "user", "content": "quickbooks error"}]
+    restored.mark_dirty("s3")
+    asyncio.run(flush(restored))
+    compact(tmp, restored.segment)
+    assert list_segments(tmp) == []
+
+    # A crash mid-write leaves a torn last line, which is skipped
+    with open(os.path.join(tmp, segment_name(3)), "w", encoding="utf-8") as f:
+        f.write('{"key":"s4","values":{"conversations":[{"role":"us')
+
+    after_compaction, compacted_conversations, _ = build(tmp)
+    assert after_compaction.rehydrate() == 2
+    after_compaction.load_all()
+    assert set(compacted_conversations) == {"s1", "s3"}
+    assert after_compaction.segment == 4
+    print('✓ Compacted snapshot restores every live session; torn writes are ignored')
+
+shared = SessionStore()
+shared.backend.shared = True
+assert not SessionPersistence(shared, tempfile.gettempdir()).enabled
+print('✓ Persistence is off for shared (already durable) stores')
+
+print('\n✓ All tests passed!')
@@ -0,0 +1,84 @@
+"""Test the SQLite session store shares state between workers and writes back mutations"""
+
+import os
+import sys
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.session_store import Codec, SessionStore, SQLiteBackend, StoreMapping, JSON_CODEC
+from services.state_manager import ConversationSession, ConversationState
+from services.metrics import ConversationMetric
+from services.token_budget import SessionBudget, TokenBudgetLedger
+
+with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, "sessions.db")
+
+    # Two "workers" with their own connection to the same file
+    worker_a = SessionStore()
+    worker_a.backend = SQLiteBackend(path)
+    worker_b = SessionStore()
+    worker_b.backend = SQLiteBackend(path)
+    conversations_a = worker_a.mapping("conversations")
+    conversations_b = worker_b.mapping("conversations")
+    assert isinstance(conversations_a, StoreMapping)
+
+    with worker_a.unit_of_work():
+        conversations_a["s1"] = []
+        conversations_a["s1"].append({"role": "user", "content": "my server is slow"})
+        history = conversations_a["s1"]
+        history.append({"role": "assistant", "content": "Let's check disk space."})
+    assert len(conversations_b["s1"]) == 2
+    print('✓ In-place mutations written back at the end of the unit of work')
+
+    with worker_b.unit_of_work():
+        conversations_b["s1"].append({"role": "user", "content": "still slow"})
+        del conversations_b["s1"]
+    assert "s1" not in conversations_a
+    assert len(conversations_a) == 0
+    print('✓ Deleted sessions are not resurrected by the write-back')
+
+    codecs = {
+        "state": (Codec(ConversationSession.to_dict, ConversationSession.from_dict),
+                  ConversationSession("s2", state=ConversationState.TROUBLESHOOTING, user_info={"name": "Sam"})),
+        "metrics": (Codec(ConversationMetric.to_dict, ConversationMetric.from_dict),
+                    ConversationMetric("s2", "quickbooks", started_at=ConversationSession("x").created_at)),
+        "budget": (Codec(SessionBudget.to_dict, SessionBudget.from_dict), SessionBudget(used=120)),
+    }
+    for namespace, (codec, value) in codecs.items():
+        worker_a.mapping(namespace, codec)["s2"] = value
+        assert worker_b.mapping(namespace, codec)["s2"] == value, namespace
+    print('✓ State, metrics and token budget entries round-trip through the store')
+
+    # Work that outlives the request (background summary, finished stream) must still persist
+    budget_store = SessionStore()
+    budget_store.backend = SQLiteBackend(path)
+    budget_a = budget_store.mapping("token_budget", Codec(SessionBudget.to_dict, SessionBudget.from_dict))
+    ledger = TokenBudgetLedger()
+    ledger.sessions = budget_a
+
+    async def request_turn():
+        with budget_store.unit_of_work():
+            ledger.record("s3", 100, "generator")
+            return asyncio.get_running_loop().create_task(background_summary())
+
+    async def background_summary():
+        await asyncio.sleep(0.01)  # Runs after the request's unit of work was flushed
+        ledger.record("s3", 50, "summary")
+
+    async def main():
+        await (await request_turn())
+
+    asyncio.run(main())
+    assert worker_b.mapping("token_budget", Codec(SessionBudget.to_dict, SessionBudget.from_dict))["s3"].used == 150
+    ledger.record("s3", 25, "generator")
+    assert budget_a["s3"].used == 175 and budget_a["s3"].by_source["summary"] == 50
+    print('✓ Token spend recorded outside a unit of work is written to the shared store')
+
+memory = SessionStore()
+assert memory.mapping("conversations", JSON_CODEC) == {}
+assert type(memory.mapping("conversations")) is dict
+print('✓ Memory backend hands out plain dicts')
+
+print('\n✓ All tests passed!')
@@ -0,0 +1,79 @@
+"""Test speculative generation: overlap savings, discarded generations and latency percentiles"""
+
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.speculation import SpeculationTracker, _percentile
+
+
+async def generate(delay: float, tokens: int = 120):
+    await asyncio.sleep(delay)
+    return "Restart QuickBooks.", tokens
+
+
+async def classify_then_use(tracker):
+    """Generation (50ms) overlaps classification (80ms) - the whole generation time is saved"""
+    speculative = tracker.start(generate(0.05), "quickbooks")
+    await asyncio.sleep(0.08)
+    return await speculative.result(), speculative
+
+
+async def classify_then_discard(tracker, finish_first: bool):
+    speculative = tracker.start(generate(0.01 if finish_first else 1.0, tokens=90), "printing")
+    await asyncio.sleep(0.03)
+    speculative.discard("handler_matched")
+    speculative.discard("handler_matched")  # Settling twice is a no-op
+    await asyncio.sleep(0)
+    return speculative
+
+
+tracker = SpeculationTracker()
+(text, tokens), speculative = asyncio.run(classify_then_use(tracker))
+assert (text, tokens) == ("Restart QuickBooks.", 120)
+assert 0.04 <= speculative.saved_seconds < 0.08
+assert tracker.used == 1 and tracker.total_saved_seconds == speculative.saved_seconds
+speculative.discard("late")  # Already used - not counted as wasted
+assert tracker.wasted == 0
+print('✓ A used speculation records the generation time that overlapped classification')
+
+speculative = asyncio.run(classify_then_discard(tracker, finish_first=False))
+assert speculative.task.cancelled()
+speculative = asyncio.run(classify_then_discard(tracker, finish_first=True))
+assert not speculative.task.cancelled()
+assert tracker.wasted == 2 and tracker.wasted_by_reason == {"handler_matched": 2}
+assert tracker.wasted_tokens == 90  # Only the generation that finished spent tokens
+print('✓ Discarded speculations are cancelled and their wasted tokens counted')
+
+
+async def failing():
+    raise ConnectionError("upstream reset")
+
+
+async def discard_failed(tracker):
+    speculative = tracker.start(failing(), "other")
+    await asyncio.sleep(0)
+    speculative.discard("resolved")
+
+asyncio.run(discard_failed(tracker))
+assert tracker.wasted_by_reason["resolved"] == 1 and tracker.wasted_tokens == 90
+print('✓ A failed speculation is discarded without raising')
+
+# Percentiles: nearest rank
+assert _percentile([], 50) == 0.0
+assert _percentile([3.0, 1.0, 2.0, 4.0], 50) == 2.0 and _percentile([3.0, 1.0, 2.0, 4.0], 95) == 4.0
+
+tracker = SpeculationTracker()
+for elapsed in (1.0, 1.2, 1.4):
+    tracker.record_latency(elapsed, saved_seconds=0.5)
+tracker.record_latency(2.0)
+stats = tracker.get_stats()
+assert stats["latency"]["speculative"] == {"samples": 3, "p50_seconds": 1.2, "p95_seconds": 1.4}
+assert stats["latency"]["speculative_without_overlap"]["p50_seconds"] == 1.7
+assert stats["latency"]["sequential"]["samples"] == 1
+assert stats["p50_saved_seconds"] == 0.5 and stats["waste_rate"] == 0.0
+print('✓ Latency percentiles compare speculative turns with and without the overlap')
+
+print('\n✓ All tests passed!')
@@ -0,0 +1,69 @@
+"""Test the per-session token budget: degrade ladder, per-source spend, release and LRU bound"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["LLM_MAX_TOKENS_PER_CHAT"] = "1000"
+os.environ["LLM_BUDGET_SHORT_CONTEXT_AT"] = "0.6"
+os.environ["LLM_BUDGET_NO_CLASSIFICATION_AT"] = "0.8"
+os.environ["LLM_BUDGET_SHORT_CONTEXT_TOKENS"] = "200"
+
+import services.token_budget as token_budget_module
+from services.token_budget import BudgetLevel, TokenBudgetLedger
+
+ledger = TokenBudgetLedger()
+
+# The ladder: normal → short context → no classification → exhausted
+assert ledger.record("s1", 500, "generator") == BudgetLevel.NORMAL
+assert ledger.history_token_budget("s1") is None and ledger.allows_classification("s1")
+assert ledger.record("s1", 100, "classifier") == BudgetLevel.SHORT_CONTEXT
+assert ledger.history_token_budget("s1") == 200 and ledger.allows_classification("s1")
+assert ledger.record("s1", 250, "summary") == BudgetLevel.NO_CLASSIFICATION
+assert not ledger.allows_classification("s1") and not ledger.is_exhausted("s1")
+assert ledger.record("s1", 150, "generator") == BudgetLevel.EXHAUSTED
+assert ledger.is_exhausted("s1") and ledger.used("s1") == 1000
+assert ledger.stats["sessions_exhausted"] == 1
+print('✓ Sessions degrade step by step as they spend their budget')
+
+# Spend is tracked per caller
+stats = ledger.get_stats()
+assert stats["tokens_by_source"] == {"generator": 650, "classifier": 100, "summary": 250}
+assert stats["sessions_by_level"] == {"EXHAUSTED": 1}
+assert stats["top_sessions"] == [{"session_id": "s1", "tokens": 1000}]
+print('✓ Tokens are attributed to the classifier, generator and summaries')
+
+# Missing sessions and non-positive spend are ignored
+assert ledger.record(None, 100, "generator") == BudgetLevel.NORMAL
+assert ledger.record("unknown", 100, "generator") == BudgetLevel.NORMAL
+assert ledger.record("s2", 0, "generator") == BudgetLevel.NORMAL
+assert ledger.used("s2") == 0 and ledger.level("never-seen") == BudgetLevel.NORMAL
+assert ledger.get_stats()["tracked_sessions"] == 1
+print('✓ Unknown sessions and empty spends are not tracked')
+
+# Ending a conversation releases its entry
+ledger.release("s1")
+ledger.release("s1")
+assert ledger.used("s1") == 0 and ledger.level("s1") == BudgetLevel.NORMAL
+assert ledger.stats["released"] == 1
+print('✓ Released sessions start over with a fresh budget')
+
+# A zero budget disables enforcement
+os.environ["LLM_MAX_TOKENS_PER_CHAT"] = "0"
+unlimited = TokenBudgetLedger()
+assert unlimited.record("s3", 10 ** 9, "generator") == BudgetLevel.NORMAL
+assert not unlimited.is_exhausted("s3")
+print('✓ LLM_MAX_TOKENS_PER_CHAT=0 turns the budget off')
+
+# The in-memory ledger is LRU-bounded
+token_budget_module.MAX_TRACKED_SESSIONS = 3
+lru = TokenBudgetLedger()
+for n in range(4):
+    lru.record(f"lru-{n}", 10, "generator")
+    if n == 2:
+        lru.record("lru-0", 10, "generator")  # Touch lru-0 so lru-1 is the oldest
+assert list(lru.sessions) == ["lru-2", "lru-0", "lru-3"] and lru.stats["evicted"] == 1
+print('✓ The least recently used session is evicted past MAX_TRACKED_SESSIONS')
+
+print('\n✓ All tests passed!')
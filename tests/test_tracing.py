@@ -0,0 +1,98 @@
+"""Test request traces: nested spans, spans from spawned tasks, slow-trace ring, JSONL file, OTLP shape"""
+
+import os
+import sys
+import json
+import asyncio
+import contextvars
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+trace_file = os.path.join(tempfile.mkdtemp(), "traces.jsonl")
+os.environ["TRACE_FILE"] = trace_file
+os.environ["TRACE_SLOW_MS"] = "20"
+os.environ["TRACE_SLOW_KEEP"] = "2"
+
+from services.tracing import NOOP_SPAN, Tracer, bind_session, request_id_var, session_id_var
+
+tracer = Tracer()
+assert tracer.span("outside") is NOOP_SPAN
+print('✓ Spans outside a trace are no-ops')
+
+
+async def handle(request_id: str, delay: float):
+    request_id_var.set(request_id)
+    with tracer.trace("POST /webhook/salesiq") as trace:
+        bind_session(f"session-{request_id[-1]}")
+        with tracer.span("router.classify") as span:
+            span.set("category", "printing")
+        with tracer.span("stage.generation"):
+            # Spans opened in a task the request spawns join its trace
+            await asyncio.create_task(generate(delay))
+    return trace
+
+
+async def generate(delay: float):
+    with tracer.span("generate_response"):
+        await asyncio.sleep(delay)
+
+
+async def main():
+    return await asyncio.gather(handle("00000000-0000-0000-0000-000000000001", 0.0),
+                                handle("00000000-0000-0000-0000-000000000002", 0.05))
+
+# Run in a fresh copy of the context so values bound by earlier tests don't matter
+context = contextvars.copy_context()
+session_before = context.run(session_id_var.get)
+fast, slow = context.run(asyncio.run, main())
+assert context.run(session_id_var.get) == session_before  # bind_session stays inside each request
+assert [span.name for span in slow.spans] == ["router.classify", "stage.generation", "generate_response"]
+router, stage, generation = slow.spans
+assert router.parent_id == 0 and stage.parent_id == 0 and generation.parent_id == stage.span_id
+assert router.attrs == {"category": "printing"}
+assert generation.end_ms - generation.start_ms >= 50
+assert slow.session_id == "session-2" and fast.session_id == "session-1"
+assert len(fast.spans) == 3  # Concurrent requests don't mix spans
+print('✓ Nested spans, including spans from spawned tasks, land in their own trace')
+
+asyncio.run(tracer.stop())  # Writes out the queued traces
+assert tracer.stats["traces"] == 2 and [t["request_id"][-1] for t in tracer.get_slow_traces()] == ["2"]
+with open(trace_file) as f:
+    lines = [json.loads(line) for line in f]
+assert len(lines) == 2 and {line["request_id"][-1] for line in lines} == {"1", "2"}
+assert lines[0]["spans"][0]["name"] == "router.classify"
+print('✓ Slow traces are kept for /debug/traces and every trace is written as JSONL')
+
+otlp = slow.to_otlp_spans()
+root = otlp[0]
+assert root["traceId"] == "00000000000000000000000000000002" and "parentSpanId" not in root
+assert all(span["traceId"] == root["traceId"] for span in otlp)
+assert otlp[1]["parentSpanId"] == root["spanId"] and otlp[3]["parentSpanId"] == otlp[2]["spanId"]
+assert int(otlp[3]["endTimeUnixNano"]) > int(otlp[3]["startTimeUnixNano"])
+print('✓ OTLP spans share the request ID as trace ID under a root span')
+
+
+# Work that outlives the request (a streamed turn) records into a trace of its own
+async def streamed_turn():
+    with tracer.trace("POST /chat/stream turn") as trace:
+        bind_session("session-3")
+        with tracer.span("generate_response"):
+            await asyncio.sleep(0.03)
+    return trace
+
+
+async def stream_request():
+    request_id_var.set("00000000-0000-0000-0000-000000000003")
+    with tracer.trace("POST /chat/stream") as request_trace:
+        turn = asyncio.create_task(streamed_turn())
+    # The handler has returned and its trace is closed; the turn is still running
+    return request_trace, await turn
+
+request_trace, turn_trace = asyncio.run(stream_request())
+assert request_trace.spans == [] and turn_trace.endpoint == "POST /chat/stream turn"
+assert turn_trace.request_id == request_trace.request_id and turn_trace.session_id == "session-3"
+assert [span.name for span in turn_trace.spans] == ["generate_response"] and turn_trace.duration_ms >= 30
+print('✓ A turn that outlives its request is traced under the same request ID')
+
+print('\n✓ All tests passed!')
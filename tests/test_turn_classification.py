@@ -0,0 +1,86 @@
+"""Test per-turn classification: one classify_unified call per turn, shared with handlers"""
+
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["FAST_CLASSIFIER_ENABLED"] = "false"  # Every turn goes to the (fake) LLM classifier
+
+from services.gemini_classifier import ClassificationResult, TurnClassification
+from services.handlers.escalation_handlers import AgentRequestHandler
+from services.token_budget import token_budget
+
+
+class FakeClassifier:
+    """Stands in for GeminiClassifier, counting unified calls"""
+
+    def __init__(self, intent="TRANSFER", confidence=85):
+        self.calls = 0
+        self.intent = intent
+        self.confidence = confidence
+
+    def results(self):
+        self.calls += 1
+        return {
+            "resolution": ClassificationResult("UNRESOLVED", 80, "still broken", ""),
+            "escalation": ClassificationResult("NEEDS_HUMAN", 90, "asked for a person", ""),
+            "intent": ClassificationResult(self.intent, self.confidence, "asked for a person", "")
+        }
+
+    async def classify_unified_async(self, message, history, session_id):
+        return self.results()
+
+    def classify_unified(self, message, history, session_id):
+        return self.results()
+
+
+# The turn is classified once; every later read comes from memory
+classifier = FakeClassifier()
+turn = TurnClassification("connect me to an agent", [], "turn-1", classifier)
+assert not turn.is_computed
+results = asyncio.run(turn.ensure_async())
+assert asyncio.run(turn.ensure_async()) is results
+assert turn.resolution.decision == "UNRESOLVED" and turn.escalation.decision == "NEEDS_HUMAN"
+assert turn.intent.decision == "TRANSFER" and classifier.calls == 1 and turn.source == "llm"
+print('✓ classify_unified runs once per turn and its results are cached')
+
+# Handlers read the intent from the turn instead of classifying again
+handler = AgentRequestHandler()
+assert handler.can_handle("connect me to an agent", {"classification": turn, "session_id": "turn-1"})
+assert classifier.calls == 1
+unsure = TurnClassification("hmm", [], "turn-2", FakeClassifier(confidence=40))
+assert not handler.can_handle("hmm", {"classification": unsure})
+print('✓ AgentRequestHandler reuses the turn classification')
+
+# Results decided elsewhere (e.g. a conversation restart) skip the classifier
+classifier = FakeClassifier()
+forced = TurnClassification("new question", [], "turn-3", classifier)
+forced.set_results({head: ClassificationResult("UNCERTAIN", 0, "forced", "") for head in ("resolution", "escalation", "intent")})
+assert forced.is_computed and forced.intent.decision == "UNCERTAIN" and classifier.calls == 0
+print('✓ Forced results are used as-is')
+
+# Sync callers only classify if nothing is cached yet
+classifier = FakeClassifier()
+sync_turn = TurnClassification("agent please", [], "turn-4", classifier)
+assert sync_turn.intent.decision == "TRANSFER" and sync_turn.escalation.confidence == 90
+assert classifier.calls == 1
+print('✓ The blocking variant classifies at most once')
+
+# Without a classifier every head is neutral
+blind = TurnClassification("agent please", [], "turn-5")
+assert blind.intent.decision == "OTHER" and blind.resolution.decision == "UNCERTAIN"
+assert blind.intent.confidence == 0
+print('✓ Missing classifier gives neutral results')
+
+# Sessions that spent most of their budget skip the LLM call
+classifier = FakeClassifier()
+token_budget.record("turn-6", int(token_budget.max_tokens_per_session * token_budget.no_classification_at), "generator")
+budget_turn = TurnClassification("agent please", [], "turn-6", classifier)
+assert asyncio.run(budget_turn.ensure_async())["intent"].decision == "OTHER"
+assert budget_turn.source == "budget_skipped" and classifier.calls == 0
+token_budget.release("turn-6")
+print('✓ Budget-degraded sessions skip classification')
+
+print('\n✓ All tests passed!')
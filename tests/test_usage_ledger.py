@@ -0,0 +1,60 @@
+"""Test the LLM usage ledger: per-model pricing, cached-token split, tags and cache stats"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["LLM_PRICE_TABLE"] = '{"test/model": {"input": 1.0, "cached_input": 0.25, "output": 4.0}}'
+
+from services.usage_ledger import UsageLedger, llm_handler_var
+from services.prometheus_exporter import prometheus_exporter
+
+
+def usage(prompt: int, completion: int, cached: int = 0):
+    return SimpleNamespace(prompt_tokens=prompt, completion_tokens=completion,
+                           prompt_tokens_details=SimpleNamespace(cached_tokens=cached))
+
+
+ledger = UsageLedger()
+assert ledger.prices["test/model"]["output"] == 4.0 and "google/gemini-2.5-flash-lite" in ledger.prices
+print('✓ LLM_PRICE_TABLE extends the default price table')
+
+entry = ledger.record("test/model", "generator", "printing", usage(1_000_000, 500_000, cached=600_000))
+# 400k uncached × $1 + 600k cached × $0.25 + 500k output × $4 per 1M
+assert abs(entry.cost_usd - 2.55) < 1e-9 and entry.cache_hits == 1
+ledger.record("test/model", "classifier", None, usage(2_000, 100))
+llm_handler_var.set("CallbackHandler")
+ledger.record("test/model", "generator", "printing", usage(1_000, 200))
+print('✓ Calls are priced with the cached-input rate for cached tokens')
+
+stats = ledger.get_stats()
+assert stats["totals"]["calls"] == 3
+assert stats["totals"]["input_tokens"] == 1_003_000 and stats["totals"]["output_tokens"] == 500_300
+assert stats["by_caller"]["classifier"]["calls"] == 1 and stats["by_category"]["none"]["calls"] == 1
+assert stats["by_handler"] == {
+    "CallbackHandler": {"calls": 1, "cache_hits": 0, "input_tokens": 1000, "cached_input_tokens": 0,
+                        "output_tokens": 200, "cost_usd": 0.0018},
+    "none": stats["by_handler"]["none"]
+}
+assert stats["recent_calls"][-1]["handler"] == "CallbackHandler"
+print('✓ Usage is tagged with model, caller, category and handler')
+
+cache = ledger.get_cache_stats("generator")
+assert cache["calls"] == 2 and cache["cache_hits"] == 1 and cache["cached_prompt_tokens"] == 600_000
+assert cache["uncached_prompt_tokens"] == 401_000
+print('✓ Prompt cache stats come from the ledger')
+
+ledger.record("unknown/model", "summary", None, usage(10, 10))
+assert ledger.unpriced_calls == 1 and ledger.total("summary").cost_usd == 0.0
+text = prometheus_exporter.render()
+assert 'chatbot_llm_tokens_total{model="test/model",kind="generator",category="printing",direction="cached_input"} 600000' in text
+assert 'chatbot_llm_cost_usd_total{model="test/model",kind="classifier",category="none"}' in text
+print('✓ Unpriced models are counted and every call reaches the Prometheus counters')
+
+ledger.reset()
+assert ledger.total().calls == 0 and not ledger.recent
+print('✓ Reset clears the ledger')
+
+print('\n✓ All tests passed!')
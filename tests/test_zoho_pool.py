@@ -0,0 +1,97 @@
+"""Test the pooled async Zoho transport: per-domain clients, retries, backoff and Retry-After"""
+
+import os
+import sys
+import time
+import asyncio
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import zoho_api_simple
+from zoho_api_simple import MAX_RETRIES, MAX_RETRY_DELAY, ZohoHTTPPool, backoff_delay
+
+# Backoff: exponential with jitter, capped, and Retry-After wins when numeric
+for attempt, ceiling in ((1, 1), (2, 2), (3, 4), (6, MAX_RETRY_DELAY)):
+    for _ in range(20):
+        assert ceiling / 2 <= backoff_delay(attempt) <= ceiling
+assert backoff_delay(1, "3") == 3.0
+assert backoff_delay(1, "120") == MAX_RETRY_DELAY
+assert 0.5 <= backoff_delay(1, "Wed, 21 Oct 2026 07:28:00 GMT") <= 1  # HTTP dates fall back to backoff
+print('✓ Backoff grows exponentially with jitter, capped, and honors numeric Retry-After')
+
+zoho_api_simple.RETRY_DELAY = 0.01  # Keep the retry tests fast
+
+
+def make_pool(handler):
+    """Pool whose salesiq.zoho.in client answers through `handler`"""
+    pool = ZohoHTTPPool()
+    pool._clients["https://salesiq.zoho.in"] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return pool
+
+
+def scripted(*responses):
+    """Handler replaying `responses` (status codes, (status, headers) pairs or exceptions) in order"""
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        step = responses[min(len(calls), len(responses)) - 1]
+        if isinstance(step, Exception):
+            raise step
+        status, headers = step if isinstance(step, tuple) else (step, {})
+        return httpx.Response(status, headers=headers, json={"ok": status < 400})
+    return handler, calls
+
+
+URL = "https://salesiq.zoho.in/api/v2/portal/conversations"
+
+# One client per origin, reused across calls
+pool = ZohoHTTPPool()
+first = pool.get_client(URL)
+assert pool.get_client("https://salesiq.zoho.in/other/path") is first
+assert pool.get_client("https://desk.zoho.in/api/v1/tickets") is not first
+asyncio.run(pool.aclose())
+assert pool._clients == {} and first.is_closed
+print('✓ Clients are pooled per Zoho domain and closed on shutdown')
+
+
+async def timed(pool):
+    started = time.monotonic()
+    response, error = await pool.request_with_retries("POST", URL, "SalesIQ", json={"a": 1})
+    await pool.aclose()
+    return response, error, time.monotonic() - started
+
+# 429/503 are retried, sleeping for Retry-After
+handler, calls = scripted((429, {"Retry-After": "0.05"}), 503, 200)
+response, error, elapsed = asyncio.run(timed(make_pool(handler)))
+assert error is None and response.status_code == 200 and len(calls) == 3
+assert elapsed >= 0.05
+print('✓ 429 and 503 responses are retried, waiting for Retry-After')
+
+# Non-retryable errors come straight back; retryable ones are returned after the last attempt
+handler, calls = scripted(400)
+response, error = asyncio.run(make_pool(handler).request_with_retries("GET", URL, "SalesIQ"))
+assert response.status_code == 400 and error is None and len(calls) == 1
+
+handler, calls = scripted(503)
+response, error = asyncio.run(make_pool(handler).request_with_retries("GET", URL, "SalesIQ"))
+assert response.status_code == 503 and len(calls) == MAX_RETRIES
+print('✓ Other statuses are not retried and the final transient response is returned')
+
+# Transport failures are retried, then reported as retryable error dicts
+handler, calls = scripted(httpx.ConnectError("refused"), 200)
+response, error = asyncio.run(make_pool(handler).request_with_retries("GET", URL, "SalesIQ"))
+assert response.status_code == 200 and len(calls) == 2
+
+handler, calls = scripted(httpx.ReadTimeout("slow"))
+response, error = asyncio.run(make_pool(handler).request_with_retries("GET", URL, "SalesIQ"))
+assert response is None and error["error"] == "timeout" and error["retryable"] and len(calls) == MAX_RETRIES
+
+handler, calls = scripted(httpx.ConnectError("refused"))
+response, error = asyncio.run(make_pool(handler).request_with_retries("GET", URL, "SalesIQ"))
+assert response is None and error["error"] == "connection_error" and error["details"] == "refused"
+print('✓ Timeouts and connection errors are retried, then returned as retryable errors')
+
+print('\n✓ All tests passed!')
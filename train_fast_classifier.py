@@ -0,0 +1,95 @@
+"""
+Train the local fast-path turn classifier.
+
+Training data is the LLM decision log (enable with
+FAST_CLASSIFIER_DECISION_LOG=logs/classifier_decisions.jsonl) or any
+labelled transcript JSONL with the same fields:
+
+    {"message": "thanks it works now", "last_bot_message": "Did that fix it?",
+     "resolution": "RESOLVED", "escalation": "BOT_CAN_HANDLE", "intent": "OTHER"}
+
+Usage:
+    python train_fast_classifier.py logs/classifier_decisions.jsonl
+    python train_fast_classifier.py logs/*.jsonl --holdout 0.2 --threshold 0.9
+"""
+
+import sys
+import random
+import argparse
+
+from services.fast_classifier import (
+    DEFAULT_MODEL_PATH,
+    HEADS,
+    FastClassifierModel,
+    load_decision_log
+)
+
+
+def evaluate(model: FastClassifierModel, examples, threshold: float):
+    """Per-head accuracy, plus how many turns clear the threshold and how accurate those are"""
+    correct = {head: 0 for head in HEADS}
+    labelled = {head: 0 for head in HEADS}
+    confident = 0
+    confident_correct = 0
+
+    for example in examples:
+        prediction = model.predict(example["message"], example.get("last_bot_message", ""))
+        all_correct = True
+        for head, (label, _) in prediction.items():
+            if head in example:
+                labelled[head] += 1
+                if label == example[head]:
+                    correct[head] += 1
+                else:
+                    all_correct = False
+        if all(prob >= threshold for _, prob in prediction.values()):
+            confident += 1
+            confident_correct += int(all_correct)
+
+    print(f"\n  Holdout examples: {len(examples)}")
+    for head in HEADS:
+        accuracy = (correct[head] / labelled[head] * 100) if labelled[head] else 0.0
+        print(f"  {head:<12} accuracy: {accuracy:5.1f}%  ({labelled[head]} labelled)")
+    absorb_rate = (confident / len(examples) * 100) if examples else 0.0
+    agreement = (confident_correct / confident * 100) if confident else 0.0
+    print(f"  Absorbed at threshold {threshold}: {absorb_rate:.1f}% of turns, {agreement:.1f}% agree with LLM")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the fast-path classifier from LLM decision logs")
+    parser.add_argument("logs", nargs="+", help="Decision log / labelled transcript JSONL files")
+    parser.add_argument("--output", default=DEFAULT_MODEL_PATH, help="Model output path (.npz)")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--learning-rate", type=float, default=2.0)
+    parser.add_argument("--min-confidence", type=float, default=70,
+                        help="Ignore LLM decisions below this confidence")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of examples held out for evaluation")
+    parser.add_argument("--threshold", type=float, default=0.9, help="Confidence threshold to report absorb rate at")
+    args = parser.parse_args()
+
+    examples = load_decision_log(args.logs, min_confidence=args.min_confidence)
+    if len(examples) < 20:
+        print(f"[ERROR] Only {len(examples)} usable examples - collect more decisions first")
+        sys.exit(1)
+
+    random.Random(13).shuffle(examples)
+    holdout_size = int(len(examples) * args.holdout)
+    holdout, train = examples[:holdout_size], examples[holdout_size:]
+
+    print("=" * 60)
+    print("TRAINING FAST-PATH CLASSIFIER")
+    print("=" * 60)
+    print(f"  Training examples: {len(train)}")
+
+    if holdout:
+        model = FastClassifierModel.train(train, epochs=args.epochs, learning_rate=args.learning_rate)
+        evaluate(model, holdout, args.threshold)
+
+    # Final model uses every example
+    model = FastClassifierModel.train(examples, epochs=args.epochs, learning_rate=args.learning_rate)
+    model.save(args.output)
+    print(f"\n  Saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,138 @@
 """
 Simple Zoho API Integration - Working Version
+
+Every call has a blocking variant (requests) and an async variant
+(`*_async`, httpx) with the same return-dict contract. The async variants
+share one keep-alive connection pool per Zoho domain and back off without
+blocking the event loop, so the webhook can await them while other
+sessions keep being served.
 """
 
 import os
+import random
+import asyncio
 import logging
 import time
 from typing import Dict, Optional, Any, Tuple
+from urllib.parse import urlsplit
+
+from services.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+    logger.warning("httpx not installed - async Zoho calls will run the blocking client in a thread. Run: pip install httpx")
+
 # Configuration constants
 API_TIMEOUT = 10  # seconds
 MAX_RETRIES = 3
 RETRY_DELAY = 1  # seconds
+MAX_RETRY_DELAY = 8  # seconds - cap for exponential backoff
+RETRYABLE_STATUS_CODES = (429, 503)
+
+# Connection pool limits per Zoho domain
+POOL_MAX_CONNECTIONS = int(os.getenv("ZOHO_POOL_MAX_CONNECTIONS", "20"))
+POOL_MAX_KEEPALIVE = int(os.getenv("ZOHO_POOL_MAX_KEEPALIVE", "10"))
+POOL_KEEPALIVE_EXPIRY = 60  # seconds
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Exponential backoff with jitter for retry `attempt` (1-based)
+
+    Honors a numeric Retry-After header (capped at MAX_RETRY_DELAY).
+    """
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_RETRY_DELAY)
+        except ValueError:
+            pass
+    ceiling = min(MAX_RETRY_DELAY, RETRY_DELAY * (2 ** (attempt - 1)))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+class ZohoHTTPPool:
+    """One persistent httpx.AsyncClient (keep-alive pool) per Zoho domain"""
+    
+    def __init__(self):
+        self._clients: Dict[str, "httpx.AsyncClient"] = {}
+    
+    def get_client(self, url: str) -> "httpx.AsyncClient":
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        client = self._clients.get(origin)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=API_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+                ),
+            )
+            self._clients[origin] = client
+            logger.info(f"Zoho: Opened connection pool for {origin}")
+        return client
+    
+    async def request_with_retries(self, method: str, url: str, service: str,
+                                   **kwargs) -> Tuple[Optional["httpx.Response"], Optional[Dict]]:
+        """Send a request, retrying timeouts, connection errors and 429/503 with backoff
+
+        Returns:
+            (response, None) once a final response arrives, or
+            (None, error_dict) if the transport kept failing
+        """
+        with tracer.span("zoho.request", service=service, method=method) as span:
+            response, error = await self._send(method, url, service, span, **kwargs)
+            span.set("status", response.status_code if response is not None else error.get("error"))
+            return response, error
+    
+    async def _send(self, method: str, url: str, service: str, span,
+                    **kwargs) -> Tuple[Optional["httpx.Response"], Optional[Dict]]:
+        client = self.get_client(url)
+        for attempt in range(1, MAX_RETRIES + 1):
+            span.set("attempts", attempt)
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.TimeoutException:
+                if attempt < MAX_RETRIES:
+                    delay = backoff_delay(attempt)
+                    logger.warning(f"{service}: Timeout, retrying in {delay:.1f}s (attempt {attempt}/{MAX_RETRIES})")
+                    await asyncio.sleep(delay)
+                    continue
+                logger.error(f"{service}: Request timeout after {MAX_RETRIES} attempts")
+                return None, {"success": False, "error": "timeout", "details": f"Request timed out after {API_TIMEOUT}s", "retryable": True}
+            except httpx.TransportError as e:
+                if attempt < MAX_RETRIES:
+                    delay = backoff_delay(attempt)
+                    logger.warning(f"{service}: Connection error, retrying in {delay:.1f}s (attempt {attempt}/{MAX_RETRIES})")
+                    await asyncio.sleep(delay)
+                    continue
+                logger.error(f"{service}: Connection error: {str(e)}")
+                return None, {"success": False, "error": "connection_error", "details": str(e), "retryable": True}
+            
+            if response.status_code in RETRYABLE_STATUS_CODES and attempt < MAX_RETRIES:
+                delay = backoff_delay(attempt, response.headers.get("Retry-After"))
+                logger.warning(f"{service}: Transient error {response.status_code}, retrying in {delay:.1f}s (attempt {attempt}/{MAX_RETRIES})")
+                await asyncio.sleep(delay)
+                continue
+            return response, None
+        
+        # Should not reach here, but safety fallback
+        return None, {"success": False, "error": "max_retries_exceeded", "details": "All retry attempts failed", "retryable": False}
+    
+    async def aclose(self):
+        """Close all pooled connections (call on application shutdown)"""
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+# Shared pool for all async Zoho calls
+zoho_http_pool = ZohoHTTPPool()
 
 
 class ZohoSalesIQAPI:
@@ -55,21 +175,113 @@ class ZohoSalesIQAPI:
             past_messages: Optional list of message dicts in SalesIQ format for message-by-message history
         """
         
+        request, early_result = self._build_chat_session_request(
+            visitor_id, conversation_history, app_id, department_id, visitor_info, custom_wait_time, past_messages
+        )
+        if early_result is not None:
+            return early_result
+        endpoint, payload, headers = request
+        
+        import requests
+        
+        # Retry logic for transient failures
+        for attempt in range(1, MAX_RETRIES + 1):
+            try:
+                response = requests.post(endpoint, json=payload, headers=headers, timeout=API_TIMEOUT)
+                if response.status_code in RETRYABLE_STATUS_CODES and attempt < MAX_RETRIES:
+                    retry_delay = backoff_delay(attempt, response.headers.get("Retry-After"))
+                    logger.warning(f"SalesIQ: Transient error {response.status_code}, retrying in {retry_delay:.1f}s (attempt {attempt}/{MAX_RETRIES})")
+                    time.sleep(retry_delay)
+                    continue
+                return self._chat_session_result(endpoint, response.status_code, response.text, response.json)
+                    
+            except requests.exceptions.Timeout:
+                if attempt < MAX_RETRIES:
+                    logger.warning(f"SalesIQ: Timeout, retrying (attempt {attempt}/{MAX_RETRIES})")
+                    time.sleep(backoff_delay(attempt))
+                    continue
+                logger.error(f"SalesIQ: Request timeout after {MAX_RETRIES} attempts")
+                return {"success": False, "error": "timeout", "details": f"Request timed out after {API_TIMEOUT}s", "retryable": True}
+                
+            except requests.exceptions.ConnectionError as e:
+                if attempt < MAX_RETRIES:
+                    logger.warning(f"SalesIQ: Connection error, retrying (attempt {attempt}/{MAX_RETRIES})")
+                    time.sleep(backoff_delay(attempt))
+                    continue
+                logger.error(f"SalesIQ: Connection error: {str(e)}")
+                return {"success": False, "error": "connection_error", "details": str(e), "retryable": True}
+                
+            except Exception as e:
+                logger.error(f"SalesIQ: Unexpected error: {str(e)}", exc_info=True)
+                return {"success": False, "error": "exception", "details": str(e), "retryable": False}
+        
+        # Should not reach here, but safety fallback
+        return {"success": False, "error": "max_retries_exceeded", "details": "All retry attempts failed", "retryable": False}
+    
+    async def create_chat_session_async(
+        self,
+        visitor_id: str,
+        conversation_history: str,
+        app_id: str | None = None,
+        department_id: str | None = None,
+        visitor_info: Dict | None = None,
+        custom_wait_time: int | None = None,
+        past_messages: list | None = None,
+    ) -> Dict:
+        """Non-blocking variant of create_chat_session (same arguments and return dict)"""
+        if not HTTPX_AVAILABLE:
+            return await asyncio.to_thread(
+                self.create_chat_session, visitor_id, conversation_history, app_id,
+                department_id, visitor_info, custom_wait_time, past_messages
+            )
+        
+        request, early_result = self._build_chat_session_request(
+            visitor_id, conversation_history, app_id, department_id, visitor_info, custom_wait_time, past_messages
+        )
+        if early_result is not None:
+            return early_result
+        endpoint, payload, headers = request
+        
+        try:
+            response, error = await zoho_http_pool.request_with_retries(
+                "POST", endpoint, "SalesIQ", json=payload, headers=headers
+            )
+            if error:
+                return error
+            return self._chat_session_result(endpoint, response.status_code, response.text, response.json)
+        except Exception as e:
+            logger.error(f"SalesIQ: Unexpected error: {str(e)}", exc_info=True)
+            return {"success": False, "error": "exception", "details": str(e), "retryable": False}
+    
+    def _build_chat_session_request(
+        self,
+        visitor_id: str,
+        conversation_history: str,
+        app_id: str | None,
+        department_id: str | None,
+        visitor_info: Dict | None,
+        custom_wait_time: int | None,
+        past_messages: list | None,
+    ) -> Tuple[Optional[Tuple[str, Dict, Dict]], Optional[Dict]]:
+        """Build the Visitor API request for a chat transfer
+        
+        Returns:
+            ((endpoint, payload, headers), None), or (None, result) when the
+            call must not be made (API disabled, bot preview visitor)
+        """
         if not self.enabled:
             logger.info(f"SalesIQ: API disabled - simulating transfer for {visitor_id}")
-            return {"success": True, "simulated": True, "message": "Transfer simulated"}
+            return None, {"success": True, "simulated": True, "message": "Transfer simulated"}
         
         # Reject bot preview IDs - they cannot be transferred
         if str(visitor_id).startswith("botpreview_"):
             logger.warning(f"SalesIQ: Cannot transfer bot preview session {visitor_id}. Need real visitor ID from actual chat widget.")
-            return {
+            return None, {
                 "success": False,
                 "error": "invalid_visitor_id",
                 "details": "Bot preview sessions cannot be transferred. This is a SalesIQ limitation. Test with real visitor ID only."
             }
         
-        import requests
-        
         headers = {
             "Authorization": f"Zoho-oauthtoken {self.access_token}",
             "Content-Type": "application/json"
@@ -116,53 +328,24 @@ class ZohoSalesIQAPI:
         logger.info(
             f"SalesIQ: Payload - app_id={effective_app_id}, dept={effective_department_id}, visitor_user_id={visitor_user_id}, visitor_email={visitor_email}"
         )
+        return (endpoint, payload, headers), None
+    
+    def _chat_session_result(self, endpoint: str, status_code: int, body: str, parse_json) -> Dict:
+        """Map a final Visitor API response to the result dict"""
+        logger.info(f"SalesIQ: Response Status: {status_code}")
+        logger.info(f"SalesIQ: Response Body: {body[:500]}")
         
-        # Retry logic for transient failures
-        for attempt in range(1, MAX_RETRIES + 1):
+        if status_code in [200, 201]:
             try:
-                response = requests.post(endpoint, json=payload, headers=headers, timeout=API_TIMEOUT)
-                logger.info(f"SalesIQ: Response Status: {response.status_code}")
-                logger.info(f"SalesIQ: Response Body: {response.text[:500]}")
-                
-                if response.status_code in [200, 201]:
-                    try:
-                        data = response.json()
-                    except Exception:
-                        data = {"raw": response.text}
-                    return {"success": True, "endpoint": endpoint, "data": data}
-                elif response.status_code in [429, 503]:  # Rate limit or service unavailable
-                    if attempt < MAX_RETRIES:
-                        retry_delay = RETRY_DELAY * attempt
-                        logger.warning(f"SalesIQ: Transient error {response.status_code}, retrying in {retry_delay}s (attempt {attempt}/{MAX_RETRIES})")
-                        time.sleep(retry_delay)
-                        continue
-                    return {"success": False, "error": f"{response.status_code}", "details": response.text, "retryable": True}
-                else:
-                    # Non-retryable HTTP error
-                    return {"success": False, "error": f"{response.status_code}", "details": response.text, "retryable": False}
-                    
-            except requests.exceptions.Timeout:
-                if attempt < MAX_RETRIES:
-                    logger.warning(f"SalesIQ: Timeout, retrying (attempt {attempt}/{MAX_RETRIES})")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"SalesIQ: Request timeout after {MAX_RETRIES} attempts")
-                return {"success": False, "error": "timeout", "details": f"Request timed out after {API_TIMEOUT}s", "retryable": True}
-                
-            except requests.exceptions.ConnectionError as e:
-                if attempt < MAX_RETRIES:
-                    logger.warning(f"SalesIQ: Connection error, retrying (attempt {attempt}/{MAX_RETRIES})")
-                    time.sleep(RETRY_DELAY)
-                    continue
-                logger.error(f"SalesIQ: Connection error: {str(e)}")
-                return {"success": False, "error": "connection_error", "details": str(e), "retryable": True}
-                
-            except Exception as e:
-                logger.error(f"SalesIQ: Unexpected error: {str(e)}", exc_info=True)
-                return {"success": False, "error": "exception", "details": str(e), "retryable": False}
-        
-        # Should not reach here, but safety fallback
-        return {"success": False, "error": "max_retries_exceeded", "details": "All retry attempts failed", "retryable": False}
+                data = parse_json()
+            except Exception:
+                data = {"raw": body}
+            return {"success": True, "endpoint": endpoint, "data": data}
+        elif status_code in RETRYABLE_STATUS_CODES:  # Rate limit or service unavailable, retries used up
+            return {"success": False, "error": f"{status_code}", "details": body, "retryable": True}
+        else:
+            # Non-retryable HTTP error
+            return {"success": False, "error": f"{status_code}", "details": body, "retryable": False}
     
     def close_chat(self, session_id: str, reason: str = "resolved") -> Dict:
         """Log chat closure"""
@@ -173,6 +356,10 @@ class ZohoSalesIQAPI:
             "success": True,
             "message": f"Chat {session_id} closure logged"
         }
+    
+    async def close_chat_async(self, session_id: str, reason: str = "resolved") -> Dict:
+        """Async variant of close_chat (closure is only logged - no network call)"""
+        return self.close_chat(session_id, reason)
 
 
 class ZohoDeskAPI:
@@ -258,6 +445,37 @@ class ZohoDeskAPI:
             logger.error("Desk: Unexpected error fetching departments: %s", str(e), exc_info=True)
             return None
 
+    async def _get_default_department_id_async(self) -> Optional[str]:
+        """Non-blocking variant of _get_default_department_id (caches the result)"""
+        if self.default_department_id:
+            return str(self.default_department_id)
+        
+        endpoint = f"{self.base_url}/departments"
+        logger.info(f"Desk: GET {endpoint}")
+        
+        try:
+            resp, error = await zoho_http_pool.request_with_retries("GET", endpoint, "Desk", headers=self._headers())
+            if error:
+                logger.error("Desk: Failed to fetch departments: %s", error.get("details"))
+                return None
+            if resp.status_code >= 400:
+                logger.error("Desk: Failed to fetch departments: HTTP %s - %s", resp.status_code, resp.text or "")
+                return None
+            items = self._parse_data_list(resp.json())
+            if not items:
+                logger.error("Desk: No departments returned from %s", endpoint)
+                return None
+            dept_id = items[0].get("id") if isinstance(items[0], dict) else None
+            if dept_id:
+                logger.info("Desk: Using default departmentId=%s", dept_id)
+                self.default_department_id = str(dept_id)
+                return self.default_department_id
+            return None
+            
+        except Exception as e:
+            logger.error("Desk: Unexpected error fetching departments: %s", str(e), exc_info=True)
+            return None
+
     def _find_contact_id_by_email(self, email: str) -> Optional[str]:
         # If DESK_CONTACT_ID is set, use it directly
         if self.default_contact_id:
@@ -300,18 +518,139 @@ class ZohoDeskAPI:
             return {"success": True, "simulated": True, "call_id": "CALL-SIM-001"}
         
         import requests
-        from datetime import datetime, timezone
 
         department_id = str(desk_department_id).strip() if desk_department_id else None
         if not department_id:
             department_id = self._get_default_department_id()
 
+        request, early_result = self._build_callback_request(
+            department_id, visitor_email, visitor_name, conversation_history, preferred_time, phone
+        )
+        if early_result is not None:
+            return early_result
+        endpoint, payload, headers = request
+        
+        # Retry logic for transient failures
+        for attempt in range(1, MAX_RETRIES + 1):
+            try:
+                response = requests.post(endpoint, json=payload, headers=headers, timeout=API_TIMEOUT)
+                response.raise_for_status()
+                result = response.json()
+                logger.info(f"Desk: Callback call created - ID: {result.get('id')}")
+                return {"success": True, "call_id": result.get("id"), "web_url": result.get("webUrl")}
+                
+            except requests.exceptions.Timeout:
+                if attempt < MAX_RETRIES:
+                    retry_delay = backoff_delay(attempt)
+                    logger.warning(f"Desk: Timeout, retrying in {retry_delay:.1f}s (attempt {attempt}/{MAX_RETRIES})")
+                    time.sleep(retry_delay)
+                    continue
+                logger.error(f"Desk: Request timeout after {MAX_RETRIES} attempts")
+                return {"success": False, "error": "timeout", "details": f"Request timed out after {API_TIMEOUT}s", "retryable": True}
+                
+            except requests.exceptions.HTTPError as e:
+                status_code = e.response.status_code if hasattr(e, 'response') else None
+                
+                # Retry on transient errors
+                if status_code in RETRYABLE_STATUS_CODES and attempt < MAX_RETRIES:
+                    retry_delay = backoff_delay(attempt, e.response.headers.get("Retry-After"))
+                    logger.warning(f"Desk: HTTP {status_code}, retrying in {retry_delay:.1f}s (attempt {attempt}/{MAX_RETRIES})")
+                    time.sleep(retry_delay)
+                    continue
+                
+                error_detail = e.response.text if hasattr(e, 'response') else str(e)
+                return self._callback_http_error(status_code, error_detail)
+                
+            except requests.exceptions.ConnectionError as e:
+                if attempt < MAX_RETRIES:
+                    retry_delay = backoff_delay(attempt)
+                    logger.warning(f"Desk: Connection error, retrying in {retry_delay:.1f}s (attempt {attempt}/{MAX_RETRIES})")
+                    time.sleep(retry_delay)
+                    continue
+                logger.error(f"Desk: Connection error: {str(e)}")
+                return {"success": False, "error": "connection_error", "details": str(e), "retryable": True}
+                
+            except Exception as e:
+                logger.error(f"Desk: Unexpected error creating callback: {str(e)}", exc_info=True)
+                return {"success": False, "error": "exception", "details": str(e), "retryable": False}
+        
+        # Should not reach here, but safety fallback
+        return {"success": False, "error": "max_retries_exceeded", "details": "All retry attempts failed", "retryable": False}
+    
+    async def create_callback_ticket_async(
+        self,
+        visitor_email: str,
+        visitor_name: str,
+        conversation_history: str,
+        preferred_time: Optional[str] = None,
+        phone: Optional[str] = None,
+        desk_department_id: Optional[str] = None,
+    ) -> Dict:
+        """Non-blocking variant of create_callback_ticket (same arguments and return dict)"""
+        if not HTTPX_AVAILABLE:
+            return await asyncio.to_thread(
+                self.create_callback_ticket, visitor_email, visitor_name, conversation_history,
+                preferred_time, phone, desk_department_id
+            )
+        
+        if not self.enabled:
+            logger.info(f"Desk: Callback call creation simulated for {visitor_email}")
+            return {"success": True, "simulated": True, "call_id": "CALL-SIM-001"}
+        
+        department_id = str(desk_department_id).strip() if desk_department_id else None
+        if not department_id:
+            department_id = await self._get_default_department_id_async()
+        
+        request, early_result = self._build_callback_request(
+            department_id, visitor_email, visitor_name, conversation_history, preferred_time, phone
+        )
+        if early_result is not None:
+            return early_result
+        endpoint, payload, headers = request
+        
+        try:
+            response, error = await zoho_http_pool.request_with_retries(
+                "POST", endpoint, "Desk", json=payload, headers=headers
+            )
+            if error:
+                return error
+            if response.status_code >= 400:
+                return self._callback_http_error(response.status_code, response.text)
+            result = response.json()
+            logger.info(f"Desk: Callback call created - ID: {result.get('id')}")
+            return {"success": True, "call_id": result.get("id"), "web_url": result.get("webUrl")}
+        except Exception as e:
+            logger.error(f"Desk: Unexpected error creating callback: {str(e)}", exc_info=True)
+            return {"success": False, "error": "exception", "details": str(e), "retryable": False}
+    
+    def _callback_http_error(self, status_code: Optional[int], error_detail: str) -> Dict:
+        """Result dict for a final HTTP error from POST /calls"""
+        logger.error(f"Desk: HTTP Error creating callback - {status_code}: {error_detail}")
+        return {"success": False, "error": f"HTTP {status_code}", "details": error_detail, "retryable": status_code in RETRYABLE_STATUS_CODES}
+    
+    def _build_callback_request(
+        self,
+        department_id: Optional[str],
+        visitor_email: str,
+        visitor_name: str,
+        conversation_history: str,
+        preferred_time: Optional[str] = None,
+        phone: Optional[str] = None,
+    ) -> Tuple[Optional[Tuple[str, Dict, Dict]], Optional[Dict]]:
+        """Build the POST /calls request for a callback
+        
+        Returns:
+            ((endpoint, payload, headers), None), or (None, error_result)
+            when required Desk fields are missing
+        """
+        from datetime import datetime, timezone
+        
         contact_id = self._find_contact_id_by_email(visitor_email)
         if not contact_id:
             contact_id = self._create_contact(visitor_email, visitor_name, phone=phone)
 
         if not department_id:
-            return {
+            return None, {
                 "success": False,
                 "error": "missing_department_id",
                 "details": "Desk departmentId is required. Set DESK_DEPARTMENT_ID environment variable.",
@@ -358,55 +697,11 @@ class ZohoDeskAPI:
         logger.info(f"Desk: Token length: {len(self.access_token)}, OrgId: {self.org_id}")
         logger.error(f"Desk: FULL PAYLOAD BEING SENT: {payload}")
         logger.error(f"Desk: HEADERS: {headers}")
-        
-        # Retry logic for transient failures
-        for attempt in range(1, MAX_RETRIES + 1):
-            try:
-                response = requests.post(endpoint, json=payload, headers=headers, timeout=API_TIMEOUT)
-                response.raise_for_status()
-                result = response.json()
-                logger.info(f"Desk: Callback call created - ID: {result.get('id')}")
-                return {"success": True, "call_id": result.get("id"), "web_url": result.get("webUrl")}
-                
-            except requests.exceptions.Timeout:
-                if attempt < MAX_RETRIES:
-                    retry_delay = RETRY_DELAY * attempt
-                    logger.warning(f"Desk: Timeout, retrying in {retry_delay}s (attempt {attempt}/{MAX_RETRIES})")
-                    time.sleep(retry_delay)
-                    continue
-                logger.error(f"Desk: Request timeout after {MAX_RETRIES} attempts")
-                return {"success": False, "error": "timeout", "details": f"Request timed out after {API_TIMEOUT}s", "retryable": True}
-                
-            except requests.exceptions.HTTPError as e:
-                status_code = e.response.status_code if hasattr(e, 'response') else None
-                error_detail = e.response.text if hasattr(e, 'response') else str(e)
-                
-                # Retry on transient errors
-                if status_code in [429, 503] and attempt < MAX_RETRIES:
-                    retry_delay = RETRY_DELAY * attempt
-                    logger.warning(f"Desk: HTTP {status_code}, retrying in {retry_delay}s (attempt {attempt}/{MAX_RETRIES})")
-                    time.sleep(retry_delay)
-                    continue
-                
-                logger.error(f"Desk: HTTP Error creating callback - {status_code}: {error_detail}")
-                return {"success": False, "error": f"HTTP {status_code}", "details": error_detail, "retryable": status_code in [429, 503]}
-                
-            except requests.exceptions.ConnectionError as e:
-                if attempt < MAX_RETRIES:
-                    retry_delay = RETRY_DELAY * attempt
-                    logger.warning(f"Desk: Connection error, retrying in {retry_delay}s (attempt {attempt}/{MAX_RETRIES})")
-                    time.sleep(retry_delay)
-                    continue
-                logger.error(f"Desk: Connection error: {str(e)}")
-                return {"success": False, "error": "connection_error", "details": str(e), "retryable": True}
-                
-            except Exception as e:
-                logger.error(f"Desk: Unexpected error creating callback: {str(e)}", exc_info=True)
-                return {"success": False, "error": "exception", "details": str(e), "retryable": False}
-        
-        # Should not reach here, but safety fallback
-        return {"success": False, "error": "max_retries_exceeded", "details": "All retry attempts failed", "retryable": False}
+        return (endpoint, payload, headers), None
     
     def create_support_ticket(self, *args, **kwargs):
         logger.info("Desk: Support ticket creation simulated")
-        return {"success": True, "simulated": True, "ticket_number": "TK-SIM-001"}
\ No newline at end of file
+        return {"success": True, "simulated": True, "ticket_number": "TK-SIM-001"}
+    
+    async def create_support_ticket_async(self, *args, **kwargs):
+        return self.create_support_ticket(*args, **kwargs)
\ No newline at end of file